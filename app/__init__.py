@@ -1,8 +1,9 @@
 # Flask application factory
 
 from flask import Flask
-from config import UPLOAD_FOLDER, UPLOAD_SUBDIRS
+from config import UPLOAD_FOLDER, UPLOAD_SUBDIRS, PROFILER_CONTINUOUS
 import os
+import time
 from app.extensions import db, socketio, login_manager
 
 try:
@@ -11,8 +12,17 @@ except Exception:
     load_dotenv = None
 
 
+def _startup_phase(phases, name, started):
+    # Record how long a startup phase took; returns the start of the next one
+    now = time.perf_counter()
+    phases.append((name, (now - started) * 1000))
+    return now
+
+
 def create_app(config=None, init_db=True):
     # Create and configure Flask application
+    boot_started = time.perf_counter()
+    phases = []
     # Get the root directory (where run.py is located)
     root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     if load_dotenv:
@@ -72,10 +82,28 @@ def create_app(config=None, init_db=True):
     flask_app.config.setdefault('REMEMBER_COOKIE_SAMESITE', 'Lax')
     flask_app.config.setdefault('REMEMBER_COOKIE_SECURE', False)
     
+    started = _startup_phase(phases, 'config', boot_started)
+
     # Initialize extensions
     db.init_app(flask_app)
-    socketio.init_app(flask_app)
+    from app.functions.logs import init_logging
+    init_logging()
+    from app.functions.serialization import init_app as init_serialization
+    from app.functions.transports import server_options as transport_options, init_app as init_transports
+    socketio.init_app(flask_app, **init_serialization(flask_app), **transport_options())
+    init_transports(socketio)
     login_manager.init_app(flask_app)
+    from app.functions.metrics import init_app as init_metrics
+    init_metrics(flask_app, socketio)
+    from app.functions.admission import init_app as init_admission
+    init_admission(flask_app, socketio)
+    from app.functions.outbox import init_app as init_outbox
+    init_outbox(flask_app)
+    from app.functions.jobs import init_app as init_jobs
+    init_jobs(flask_app)
+    if PROFILER_CONTINUOUS:
+        from app.functions.profiler import start_continuous_profiler
+        start_continuous_profiler()
 
     # Return JSON 401 for XHR/API requests when not authenticated
     from flask import request, jsonify, redirect, url_for
@@ -98,6 +126,8 @@ def create_app(config=None, init_db=True):
         folder_path = os.path.join(upload_dir, subdir)
         os.makedirs(folder_path, exist_ok=True)
     
+    started = _startup_phase(phases, 'extensions', started)
+
     # Register blueprints
     from app.routes import auth_bp, main_bp, api_bp, spa_bp
     flask_app.register_blueprint(auth_bp)
@@ -106,34 +136,45 @@ def create_app(config=None, init_db=True):
     # IMPORTANT: SPA catch-all must be registered last
     flask_app.register_blueprint(spa_bp)
     
+    started = _startup_phase(phases, 'blueprints', started)
+
     # Import socket handlers
     import app.sockets  # noqa
+    started = _startup_phase(phases, 'sockets', started)
     
     # Create database tables and seed if needed
     if init_db:
         with flask_app.app_context():
             _init_database(flask_app)
+            started = _startup_phase(phases, 'schema', started)
             _setup_admin_user()
+            started = _startup_phase(phases, 'admin', started)
     
     # Set up login manager
     @login_manager.user_loader
     def load_user(user_id):
-        from app.models import User
-        return User.query.get(int(user_id))
-    
+        from app.functions import load_cached_user
+        return load_cached_user(user_id)
+
+    report = ' | '.join(f"{name} {ms:.1f}ms" for name, ms in phases)
+    print(f"[STARTUP] {report} | total {(time.perf_counter() - boot_started) * 1000:.1f}ms")
     return flask_app
 
 def _init_database(flask_app):
-    # Initialize database tables
-    from sqlalchemy import inspect, text
-    from app.models import (
-        User, Room, Channel, Member, Message, MessageReaction,
-        ReadMessage, StickerPack, Sticker, UserMusic, AuthThrottle,
-        Role, MemberRole, RoleMentionPermission, Friendship, FriendRequest
-    )
-    from app.functions import seed_roles_for_existing_rooms
-    from app.migrations import migrate
-    
+    # Create tables and apply migrations, unless schema_migrations says the DB
+    # is already at the latest version (the common case on every worker boot)
+    from app.migrations import migrate, get_current_version, LATEST_VERSION
+
+    try:
+        with db.engine.connect() as conn:
+            current = get_current_version(conn)
+            conn.commit()
+    except Exception as e:
+        print(f"Ошибка при чтении версии схемы БД: {e}")
+        current = 0
+    if current >= LATEST_VERSION:
+        return
+
     db_file = 'thecomboxmsgr.db'
     db_exists = os.path.exists(db_file)
     
@@ -152,66 +193,6 @@ def _init_database(flask_app):
     # Update schema (migrations)
     try:
         migrate(db.engine)
-
-        # Ensure default role system data exists for all rooms
-        try:
-            seed_roles_for_existing_rooms()
-        except Exception:
-            pass
-
-        # Update message table
-        if 'message' in inspect(db.engine).get_table_names():
-            columns = [col['name'] for col in inspect(db.engine).get_columns('message')]
-            if 'edited_at' not in columns:
-                try:
-                    with db.engine.connect() as conn:
-                        conn.execute(text('ALTER TABLE message ADD COLUMN edited_at DATETIME'))
-                        conn.commit()
-                except:
-                    pass
-
-        # Update user table auth hardening columns
-        if 'user' in inspect(db.engine).get_table_names():
-            columns = [col['name'] for col in inspect(db.engine).get_columns('user')]
-            user_column_migrations = [
-                ('failed_login_attempts', 'ALTER TABLE user ADD COLUMN failed_login_attempts INTEGER NOT NULL DEFAULT 0'),
-                ('lockout_until', 'ALTER TABLE user ADD COLUMN lockout_until DATETIME'),
-                ('last_login_at', 'ALTER TABLE user ADD COLUMN last_login_at DATETIME'),
-                ('last_login_ip', 'ALTER TABLE user ADD COLUMN last_login_ip VARCHAR(64)'),
-            ]
-            for column_name, ddl in user_column_migrations:
-                if column_name not in columns:
-                    try:
-                        with db.engine.connect() as conn:
-                            conn.execute(text(ddl))
-                            conn.commit()
-                    except Exception:
-                        pass
-        
-        # Create new tables if needed
-        for table_class in [
-            MessageReaction, ReadMessage, StickerPack, Sticker, AuthThrottle,
-            Role, MemberRole, RoleMentionPermission,
-            Friendship, FriendRequest
-        ]:
-            table_name = table_class.__tablename__
-            if table_name not in inspect(db.engine).get_table_names():
-                try:
-                    table_class.__table__.create(db.engine)
-                except:
-                    pass
-        
-        # Add invite_token column if missing
-        if 'room' in inspect(db.engine).get_table_names():
-            columns = [col['name'] for col in inspect(db.engine).get_columns('room')]
-            if 'invite_token' not in columns:
-                try:
-                    with db.engine.connect() as conn:
-                        conn.execute(text('ALTER TABLE room ADD COLUMN invite_token VARCHAR(100)'))
-                        conn.commit()
-                except:
-                    pass
-    
     except Exception as e:
         print(f"Ошибка при обновлении схемы БД: {e}")
         import traceback
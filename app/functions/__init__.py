@@ -4,16 +4,73 @@ from app.functions.files import (
     allowed_file, is_image_file, is_music_file, is_video_file,
     save_uploaded_file, resize_image
 )
+from app.functions.images import ImageValidationError
 from app.functions.roles import (
     normalize_role_tag, ensure_default_roles, ensure_user_default_roles,
-    seed_roles_for_existing_rooms, get_user_role_ids, can_user_mention_role,
-    ROLE_PERMISSION_KEYS, parse_role_permissions, get_user_permissions, user_has_room_permission
+    get_user_role_ids, can_user_mention_role,
+    ROLE_PERMISSION_KEYS, parse_role_permissions, get_user_permissions, user_has_room_permission,
+    get_user_permissions_for_rooms
+)
+from app.functions.uploads_gc import run_gc_batch, get_gc_stats, release_unreferenced_uploads
+from app.functions.storage import (
+    check_upload_quota, remaining_quota_bytes, charge_upload, release_upload, top_consumers
+)
+from app.functions.passwords import (
+    PasswordHasherBusy, hash_password, verify_password, verify_dummy_password,
+    verify_and_upgrade_password, get_hasher_stats
+)
+from app.functions.user_cache import (
+    CachedUser, load_cached_user, invalidate_cached_user, get_user_cache_stats
+)
+from app.functions.auth_throttle import (
+    check_ip_lockout, register_ip_failed_attempt, reset_ip_throttle, flush_auth_throttle
+)
+from app.functions.ip_bans import (
+    is_ip_banned, add_ip_ban, remove_user_ip_bans, invalidate_ip_bans, list_banned_ips
+)
+from app.functions.reactions import (
+    toggle_message_reaction, reaction_delta_payload, remove_user_reactions, MAX_BATCH_TOGGLES
+)
+from app.functions.jobs import enqueue_job, job_payload, resume_unfinished_jobs, resume_jobs_once
+from app.functions.purges import (
+    delete_message_rows, start_user_message_purge, start_room_deletion, start_account_deletion
+)
+from app.functions.outbox import enqueue_emit, start_dispatcher, wake_dispatcher, dispatch_outbox_batch, get_outbox_stats
+from app.functions.metrics import render_metrics, metrics_scrape_allowed, socket_event_metrics
+from app.functions.query_budget import query_budget, assert_max_queries, QueryBudgetExceeded
+from app.functions.logs import get_logger, init_logging, get_log_stats
+from app.functions.profiler import run_profile, ProfilerBusy, list_profiles, profile_dir, start_continuous_profiler
+from app.functions.serialization import RawJSON, EventBatch, FastJSONProvider, fast_json_enabled, msgpack_enabled
+from app.functions.transports import connection_memory, deflate_state_bytes, inflate_state_bytes
+from app.functions.admission import (
+    admit_connection, defer_presence, flush_deferred_presence, presence_writes_deferred, shed_non_essential,
+    shedding_level, get_admission_stats, cancel_deferred_presence
 )
 
 __all__ = [
     'allowed_file', 'is_image_file', 'is_music_file', 'is_video_file',
-    'save_uploaded_file', 'resize_image',
+    'save_uploaded_file', 'resize_image', 'ImageValidationError',
     'normalize_role_tag', 'ensure_default_roles', 'ensure_user_default_roles',
-    'seed_roles_for_existing_rooms', 'get_user_role_ids', 'can_user_mention_role',
-    'ROLE_PERMISSION_KEYS', 'parse_role_permissions', 'get_user_permissions', 'user_has_room_permission'
+    'get_user_role_ids', 'can_user_mention_role',
+    'ROLE_PERMISSION_KEYS', 'parse_role_permissions', 'get_user_permissions', 'user_has_room_permission',
+    'get_user_permissions_for_rooms',
+    'run_gc_batch', 'get_gc_stats', 'release_unreferenced_uploads',
+    'check_upload_quota', 'remaining_quota_bytes', 'charge_upload', 'release_upload', 'top_consumers',
+    'PasswordHasherBusy', 'hash_password', 'verify_password', 'verify_dummy_password',
+    'verify_and_upgrade_password', 'get_hasher_stats',
+    'CachedUser', 'load_cached_user', 'invalidate_cached_user', 'get_user_cache_stats',
+    'check_ip_lockout', 'register_ip_failed_attempt', 'reset_ip_throttle', 'flush_auth_throttle',
+    'is_ip_banned', 'add_ip_ban', 'remove_user_ip_bans', 'invalidate_ip_bans', 'list_banned_ips',
+    'toggle_message_reaction', 'reaction_delta_payload', 'remove_user_reactions', 'MAX_BATCH_TOGGLES',
+    'enqueue_job', 'job_payload', 'resume_unfinished_jobs', 'resume_jobs_once',
+    'delete_message_rows', 'start_user_message_purge', 'start_room_deletion', 'start_account_deletion',
+    'enqueue_emit', 'start_dispatcher', 'wake_dispatcher', 'dispatch_outbox_batch', 'get_outbox_stats',
+    'render_metrics', 'metrics_scrape_allowed', 'socket_event_metrics',
+    'query_budget', 'assert_max_queries', 'QueryBudgetExceeded',
+    'get_logger', 'init_logging', 'get_log_stats',
+    'run_profile', 'ProfilerBusy', 'list_profiles', 'profile_dir', 'start_continuous_profiler',
+    'RawJSON', 'EventBatch', 'FastJSONProvider', 'fast_json_enabled', 'msgpack_enabled',
+    'connection_memory', 'deflate_state_bytes', 'inflate_state_bytes',
+    'admit_connection', 'defer_presence', 'flush_deferred_presence', 'presence_writes_deferred', 'shed_non_essential',
+    'shedding_level', 'get_admission_stats', 'cancel_deferred_presence'
 ]
@@ -0,0 +1,273 @@
+# Connection admission control and overload shedding
+#
+# A saturated worker kept accepting Socket.IO connections. Every connect
+# commits the user's presence and fans presence_updated out to all of their
+# channels, so a reconnect storm after a hiccup deepened the overload that
+# caused it. A monitor task now samples three load signals every
+# ADMISSION_SAMPLE_SECONDS:
+#
+#   loop_lag_ms    how late the monitor's own sleep wakes up (event-loop lag)
+#   db_pool_usage  checked-out connections / pool capacity (size + overflow)
+#   queue_depth    password hashes waiting plus outbox rows not yet emitted
+#
+# Each signal has three thresholds (ADMISSION_*), one per shedding level:
+#
+#   1 degraded   non-essential events (presence, read status, job progress)
+#                are dropped, and connect/disconnect skip the presence fan-out
+#   2 deferring  new connections are accepted, but their presence write is
+#                deferred and applied in bulk once the level drops to 1
+#   3 rejecting  new connections are refused with a jittered retry_after
+#
+# The level rises as soon as any signal crosses a threshold. It steps down
+# one level at a time, only after the signals have stayed lower for
+# ADMISSION_COOLDOWN_SECONDS, so it does not flap at a boundary. The current
+# level and signals are exported as metrics and by get_admission_stats().
+
+import functools
+import random
+import threading
+import time
+from app.functions.logs import get_logger
+from app.functions.metrics import counter, gauge
+from config import (
+    ADMISSION_CONTROL, ADMISSION_SAMPLE_SECONDS, ADMISSION_LOOP_LAG_MS, ADMISSION_DB_POOL_USAGE,
+    ADMISSION_QUEUE_DEPTH, ADMISSION_COOLDOWN_SECONDS, ADMISSION_RETRY_AFTER_SECONDS
+)
+
+log = get_logger('admission')
+
+NORMAL, DEGRADED, DEFERRING, REJECTING = 0, 1, 2, 3
+LEVEL_NAMES = ('normal', 'degraded', 'deferring', 'rejecting')
+# Emits that clients can live without for a while; dropped from DEGRADED up
+NON_ESSENTIAL_EVENTS = frozenset(('presence_updated', 'read_status_updated', 'job_progress'))
+THRESHOLDS = {
+    'loop_lag_ms': ADMISSION_LOOP_LAG_MS,
+    'db_pool_usage': ADMISSION_DB_POOL_USAGE,
+    'queue_depth': ADMISSION_QUEUE_DEPTH,
+}
+
+SHEDDING_LEVEL = gauge(
+    'boxchat_shedding_level', 'Overload shedding level (0 normal, 1 degraded, 2 deferring, 3 rejecting)'
+)
+ADMISSION_SIGNALS = gauge('boxchat_admission_signal', 'Load signals read by admission control', ('signal',))
+SHED_EVENTS = counter('boxchat_shed_events_total', 'Non-essential Socket.IO emits dropped while shedding', ('event',))
+SHED_CONNECTIONS = counter(
+    'boxchat_shed_connections_total', 'Socket.IO connections whose setup was deferred or that were rejected',
+    ('action',)
+)
+
+_lock = threading.Lock()
+_state = {'level': NORMAL, 'changed_at': time.time(), 'signals': {}, 'reasons': [], 'lower_since': None}
+_deferred = {}  # user_id -> (presence_status, last_seen), applied by flush_deferred_presence()
+_monitor_started = False
+_app = None
+_socketio = None
+
+
+def level_for(signals):
+    # (level, [signal names at that level]) for one sample
+    level, reasons = NORMAL, []
+    for name, value in signals.items():
+        reached = NORMAL
+        for n, threshold in enumerate(THRESHOLDS.get(name, ())[:REJECTING], start=1):
+            if threshold and value >= threshold:
+                reached = n
+        if reached > level:
+            level, reasons = reached, [name]
+        elif reached and reached == level:
+            reasons.append(name)
+    return level, reasons
+
+
+def update(signals, now=None):
+    # Feed one sample; returns the level in force afterwards
+    now = time.monotonic() if now is None else now
+    target, reasons = level_for(signals)
+    with _lock:
+        previous = _state['level']
+        level = previous
+        if target >= previous:
+            level = target
+            _state['lower_since'] = None
+        elif _state['lower_since'] is None:
+            _state['lower_since'] = now
+        elif now - _state['lower_since'] >= ADMISSION_COOLDOWN_SECONDS:
+            level = previous - 1
+            _state['lower_since'] = now if level > target else None
+        _state['signals'] = dict(signals)
+        if level != previous:
+            _state['level'] = level
+            _state['changed_at'] = time.time()
+            _state['reasons'] = reasons if level > previous else []
+    SHEDDING_LEVEL.set(level)
+    for name, value in signals.items():
+        ADMISSION_SIGNALS.set(value, signal=name)
+    if level != previous:
+        logger = log.warning if level > previous else log.info
+        logger('admission.level_changed', shedding=LEVEL_NAMES[level], previous=LEVEL_NAMES[previous],
+               reasons=reasons, **{k: round(v, 3) for k, v in signals.items()})
+    return level
+
+
+def shedding_level():
+    return _state['level'] if ADMISSION_CONTROL else NORMAL
+
+
+def shed_non_essential():
+    return shedding_level() >= DEGRADED
+
+
+def presence_writes_deferred():
+    return shedding_level() >= DEFERRING
+
+
+def admit_connection():
+    # 'accept' or 'defer' for a new Socket.IO connection; raises ConnectionRefusedError when rejecting
+    _ensure_monitor()
+    level = shedding_level()
+    if level >= REJECTING:
+        from flask_socketio import ConnectionRefusedError
+        SHED_CONNECTIONS.inc(action='rejected')
+        retry_after = round(ADMISSION_RETRY_AFTER_SECONDS * (1 + random.random()), 1)
+        raise ConnectionRefusedError('server busy', {'retry_after': retry_after})
+    if level >= DEFERRING:
+        SHED_CONNECTIONS.inc(action='deferred')
+        return 'defer'
+    return 'accept'
+
+
+def defer_presence(user_id, presence_status, last_seen=None):
+    # Record a presence change to apply once the load drops
+    with _lock:
+        _deferred[user_id] = (presence_status, last_seen)
+
+
+def cancel_deferred_presence(user_id):
+    # Drop a pending change before writing presence directly, so an older deferred
+    # status (say 'online') cannot overwrite the newer one (say 'offline') later
+    with _lock:
+        _deferred.pop(user_id, None)
+
+
+def flush_deferred_presence():
+    # Apply deferred presence changes in one bulk UPDATE; needs an app context
+    from sqlalchemy import update as sql_update
+    from app.extensions import db
+    from app.models import User
+    from app.functions.user_cache import invalidate_cached_user
+
+    with _lock:
+        pending = dict(_deferred)
+        _deferred.clear()
+    if not pending:
+        return 0
+    try:
+        db.session.execute(sql_update(User), [
+            {'id': user_id, 'presence_status': status, 'last_seen': last_seen}
+            for user_id, (status, last_seen) in pending.items()
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        with _lock:
+            for user_id, change in pending.items():
+                _deferred.setdefault(user_id, change)
+        raise
+    for user_id in pending:  # bulk UPDATEs skip the mapper events that drop cached users
+        invalidate_cached_user(user_id)
+    log.info('admission.presence_flushed', users=len(pending))
+    return len(pending)
+
+
+def _db_pool_usage():
+    from app.extensions import db
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return 0.0  # NullPool/StaticPool: nothing to wait for
+    capacity = pool.size() + max(0, getattr(pool, '_max_overflow', 0))
+    return pool.checkedout() / capacity if capacity > 0 else 0.0
+
+
+def _queue_depth():
+    # This worker's outbox backlog, capped by the rows really pending: another
+    # process may have delivered some of them, which the in-memory stats never see
+    from app.functions.passwords import get_hasher_stats
+    from app.functions.outbox import outbox_backlog
+    from app.models import SocketOutbox
+    backlog = outbox_backlog()
+    if backlog:
+        backlog = min(backlog, SocketOutbox.query.count())
+    return get_hasher_stats()['queued'] + backlog
+
+
+def sample_signals(app, loop_lag_seconds):
+    with app.app_context():
+        return {
+            'loop_lag_ms': loop_lag_seconds * 1000,
+            'db_pool_usage': _db_pool_usage(),
+            'queue_depth': float(_queue_depth()),
+        }
+
+
+def _monitor_loop(app, socketio):
+    interval = max(0.05, ADMISSION_SAMPLE_SECONDS)
+    while True:
+        started = time.perf_counter()
+        socketio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        try:
+            level = update(sample_signals(app, lag))
+            if level <= DEGRADED and _deferred:
+                with app.app_context():
+                    flush_deferred_presence()
+        except Exception as e:
+            log.error('admission.sample_failed', error=str(e))
+
+
+def get_admission_stats():
+    with _lock:
+        state = dict(_state)
+        deferred = len(_deferred)
+    return {
+        'enabled': ADMISSION_CONTROL,
+        'level': state['level'],
+        'level_name': LEVEL_NAMES[state['level']],
+        'changed_at': state['changed_at'],
+        'reasons': state['reasons'],
+        'signals': state['signals'],
+        'thresholds': THRESHOLDS,
+        'deferred_presence': deferred,
+    }
+
+
+def _ensure_monitor():
+    # Started by the first connection, so a process that only builds the app (scripts,
+    # seeding) never samples, and the time spent booting is not read as loop lag.
+    # Tests drive the level through update() instead.
+    global _monitor_started
+    with _lock:
+        if _monitor_started or _app is None or _app.testing:
+            return
+        _monitor_started = True
+    _socketio.start_background_task(_monitor_loop, _app, _socketio)
+
+
+def init_app(flask_app, socketio):
+    # Drop non-essential emits while shedding; the load monitor starts with the first connection
+    global _app, _socketio
+    if not ADMISSION_CONTROL:
+        return
+    _app, _socketio = flask_app, socketio
+    server = socketio.server
+    if server is not None and not getattr(server, '_admission_wrapped', False):
+        emit = server.emit
+
+        @functools.wraps(emit)
+        def shedding_emit(event_name, *args, **kwargs):
+            if event_name in NON_ESSENTIAL_EVENTS and _state['level'] >= DEGRADED:
+                SHED_EVENTS.inc(event=event_name)
+                return None
+            return emit(event_name, *args, **kwargs)
+
+        server.emit = shedding_emit
+        server._admission_wrapped = True
@@ -0,0 +1,259 @@
+# Per-IP auth throttling in memory with write-behind persistence
+#
+# Each login attempt used to SELECT and COMMIT an AuthThrottle row, so a
+# credential-stuffing burst turned into a write storm on SQLite. Failures are
+# now counted in an in-memory sliding window and lockouts are checked from
+# memory; a background task flushes changed IPs to auth_throttle every
+# AUTH_THROTTLE_FLUSH_SECONDS in one transaction. The same flush pulls in
+# lockouts recorded by other workers, and the store is warmed from the table
+# on first use, so lockouts survive restarts and are shared between
+# processes (with at most one flush interval of delay).
+#
+# Failure counts are shared the same way: a flush adds this worker's new
+# failures to the row (failed_attempts + delta, restarted once the row's last
+# attempt has left the window) instead of overwriting it, and reads the
+# merged count back, so N workers still lock an IP after
+# MAX_FAILED_IP_ATTEMPTS in total. IPs with unflushed changes or an active
+# lockout are never evicted to keep the store bounded.
+
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import case, or_
+from sqlalchemy.dialects.sqlite import insert
+from app.extensions import db, socketio
+from app.models import AuthThrottle
+from app.functions.logs import get_logger
+from config import AUTH_THROTTLE_FLUSH_SECONDS, AUTH_THROTTLE_MAX_IPS
+
+log = get_logger('auth')
+
+MAX_FAILED_IP_ATTEMPTS = 15
+IP_LOCKOUT_MINUTES = 30
+ATTEMPT_WINDOW_MINUTES = 15
+
+
+class _IpState:
+    __slots__ = ('failures', 'lockout_until', 'last_attempt_at', 'dirty', 'reset', 'unflushed', 'restart')
+
+    def __init__(self):
+        self.failures = deque()  # this worker's failures plus those merged from the table
+        self.lockout_until = None
+        self.last_attempt_at = None
+        self.dirty = False
+        self.reset = False  # a successful login cleared this IP since the last flush
+        self.unflushed = 0  # failures counted here since the last flush
+        self.restart = False  # the shared count starts over (lockout or reset since the last flush)
+
+
+_states = {}
+_lock = threading.Lock()
+_warmed = False
+_flusher_started = False
+
+
+def _window():
+    return timedelta(minutes=ATTEMPT_WINDOW_MINUTES)
+
+
+def _expire_failures(state, now):
+    cutoff = now - _window()
+    while state.failures and state.failures[0] <= cutoff:
+        state.failures.popleft()
+
+
+def _is_locked(state, now):
+    return bool(state.lockout_until and state.lockout_until > now)
+
+
+def _is_idle(state, now):
+    _expire_failures(state, now)
+    return not state.failures and not _is_locked(state, now) and not state.dirty
+
+
+def _evict_idle(now):
+    # Drop IPs with nothing left to remember
+    for ip in [ip for ip, st in _states.items() if _is_idle(st, now)]:
+        del _states[ip]
+
+
+def _make_room(now):
+    # Keep the store bounded; under a wide IP-rotating attack the oldest entries go
+    # first, but never one with unflushed failures or an active lockout
+    _evict_idle(now)
+    excess = len(_states) - int(AUTH_THROTTLE_MAX_IPS * 0.9)
+    if len(_states) < AUTH_THROTTLE_MAX_IPS or excess <= 0:
+        return
+    for ip in [ip for ip, st in _states.items() if not st.dirty and not _is_locked(st, now)][:excess]:
+        del _states[ip]
+
+
+def _warm_up():
+    # Load active lockouts and recent failure counts persisted by earlier runs
+    global _warmed
+    if _warmed:
+        return
+    _warmed = True
+    now = datetime.utcnow()
+    rows = AuthThrottle.query.filter(
+        (AuthThrottle.lockout_until > now) | (AuthThrottle.last_attempt_at > now - _window())
+    ).all()
+    with _lock:
+        for row in rows:
+            state = _states.setdefault(row.ip_address, _IpState())
+            if row.lockout_until and row.lockout_until > now:
+                state.lockout_until = row.lockout_until
+            if row.last_attempt_at and row.last_attempt_at > now - _window():
+                state.failures.extend([row.last_attempt_at] * int(row.failed_attempts or 0))
+                state.last_attempt_at = row.last_attempt_at
+
+
+def _ensure_flusher():
+    global _flusher_started
+    if _flusher_started or AUTH_THROTTLE_FLUSH_SECONDS <= 0:
+        return
+    _flusher_started = True
+    from flask import current_app
+    socketio.start_background_task(_flush_loop, current_app._get_current_object())
+
+
+def _flush_loop(app):
+    while True:
+        socketio.sleep(AUTH_THROTTLE_FLUSH_SECONDS)
+        with app.app_context():
+            try:
+                flush_auth_throttle()
+            except Exception as e:
+                db.session.rollback()
+                log.error('auth_throttle.flush_failed', error=str(e))
+
+
+def check_ip_lockout(ip, now):
+    # Remaining lockout in minutes, or None; served from memory
+    _warm_up()
+    with _lock:
+        state = _states.get(ip)
+        lockout_until = state.lockout_until if state else None
+    if lockout_until and lockout_until > now:
+        remaining_seconds = int((lockout_until - now).total_seconds())
+        return max(1, (remaining_seconds + 59) // 60)
+    return None
+
+
+def register_ip_failed_attempt(ip, now):
+    _warm_up()
+    with _lock:
+        state = _states.get(ip)
+        if state is None:
+            if len(_states) >= AUTH_THROTTLE_MAX_IPS:
+                _make_room(now)
+            state = _states[ip] = _IpState()
+        _expire_failures(state, now)
+        state.failures.append(now)
+        state.last_attempt_at = now
+        state.unflushed += 1
+        if len(state.failures) >= MAX_FAILED_IP_ATTEMPTS:
+            state.lockout_until = now + timedelta(minutes=IP_LOCKOUT_MINUTES)
+            state.failures.clear()
+            state.unflushed = 0
+            state.restart = True
+        state.dirty = True
+    _ensure_flusher()
+
+
+def reset_ip_throttle(ip, now):
+    with _lock:
+        state = _states.get(ip)
+        if state is None:
+            return
+        state.failures.clear()
+        state.lockout_until = None
+        state.last_attempt_at = now
+        state.unflushed = 0
+        state.dirty = True
+        state.reset = True
+        state.restart = True
+    _ensure_flusher()
+
+
+def _upsert_row(ip, delta, restart, reset, lockout_until, last_attempt_at, cutoff):
+    # Add this worker's failures to the shared row; a restart (lockout or reset) starts the count over
+    stmt = insert(AuthThrottle).values(
+        ip_address=ip, failed_attempts=delta, lockout_until=lockout_until, last_attempt_at=last_attempt_at
+    )
+    row, new = AuthThrottle, stmt.excluded
+    values = {}
+    if restart:
+        values['failed_attempts'] = new.failed_attempts
+    else:
+        values['failed_attempts'] = case(
+            (or_(row.last_attempt_at.is_(None), row.last_attempt_at <= cutoff), new.failed_attempts),
+            else_=row.failed_attempts + new.failed_attempts,
+        )
+    # Only a reset clears a lockout; otherwise keep the later of ours and the persisted one
+    if reset:
+        values['lockout_until'] = new.lockout_until
+    elif lockout_until:
+        values['lockout_until'] = case(
+            (or_(row.lockout_until.is_(None), row.lockout_until < new.lockout_until), new.lockout_until),
+            else_=row.lockout_until,
+        )
+    if last_attempt_at:
+        values['last_attempt_at'] = case(
+            (or_(row.last_attempt_at.is_(None), row.last_attempt_at < new.last_attempt_at), new.last_attempt_at),
+            else_=row.last_attempt_at,
+        )
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['ip_address'], set_=values))
+
+
+def flush_auth_throttle():
+    # Add changed IPs' new failures to auth_throttle in one transaction and merge
+    # the counts and lockouts of other workers back. Returns the number of rows written.
+    now = datetime.utcnow()
+    cutoff = now - _window()
+    with _lock:
+        pending = {}
+        for ip, state in _states.items():
+            if state.dirty:
+                _expire_failures(state, now)
+                pending[ip] = (state.unflushed, state.restart, state.reset, state.lockout_until, state.last_attempt_at)
+                state.dirty = False
+                state.reset = False
+                state.restart = False
+                state.unflushed = 0
+
+    for ip, (delta, restart, reset, lockout_until, last_attempt_at) in pending.items():
+        _upsert_row(ip, delta, restart, reset, lockout_until, last_attempt_at, cutoff)
+
+    shared = AuthThrottle.query.filter(
+        (AuthThrottle.lockout_until > now)
+        | ((AuthThrottle.last_attempt_at > cutoff) & (AuthThrottle.failed_attempts > 0))
+    ).all()
+    shared = [(row.ip_address, row.lockout_until, row.failed_attempts, row.last_attempt_at) for row in shared]
+    db.session.commit()
+
+    with _lock:
+        for ip, lockout_until, failed_attempts, last_attempt_at in shared:
+            state = _states.get(ip)
+            if state is None:
+                state = _states[ip] = _IpState()
+            if lockout_until and lockout_until > now:
+                if not state.lockout_until or lockout_until > state.lockout_until:
+                    state.lockout_until = lockout_until
+            if last_attempt_at and last_attempt_at > cutoff:
+                # Failures seen by other workers count here too (not flushed back: they are theirs)
+                _expire_failures(state, now)
+                known = len(state.failures) - state.unflushed
+                if failed_attempts > known:
+                    state.failures = deque(sorted(
+                        list(state.failures) + [last_attempt_at] * (failed_attempts - known)
+                    ))
+                if len(state.failures) >= MAX_FAILED_IP_ATTEMPTS and not _is_locked(state, now):
+                    # Over the limit across workers: lock here and share it with the next flush
+                    state.lockout_until = now + timedelta(minutes=IP_LOCKOUT_MINUTES)
+                    state.failures.clear()
+                    state.unflushed = 0
+                    state.restart = True
+                    state.dirty = True
+        _evict_idle(now)
+    return len(pending)
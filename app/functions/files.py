@@ -1,11 +1,30 @@
-
 # File handling functions
 
 import os
 import uuid
 from werkzeug.utils import secure_filename
-from PIL import Image
-from config import ALLOWED_EXTENSIONS, IMAGE_EXTENSIONS, MUSIC_EXTENSIONS, VIDEO_EXTENSIONS
+from app.functions.logs import get_logger
+from config import ALLOWED_EXTENSIONS, IMAGE_EXTENSIONS, MUSIC_EXTENSIONS, VIDEO_EXTENSIONS, IMAGE_MAX_PIXELS
+from app.functions.images import (
+    ImageValidationError, inspect_image_stream, inspect_image_file, strip_image_metadata, can_decode_inline,
+    run_image_job
+)
+
+log = get_logger('uploads')
+
+_pil_image = None
+
+
+def _get_pil_image():
+    # Pillow is only needed for the few uploads that get decoded, so import it
+    # on first use instead of in every worker at boot
+    global _pil_image
+    if _pil_image is None:
+        from PIL import Image
+        # Pillow's own bomb guard, in case something decodes an image we did not inspect
+        Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS or None
+        _pil_image = Image
+    return _pil_image
 
 
 def allowed_file(filename):
@@ -28,6 +47,16 @@ def is_video_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
 
 
+def _make_sticker(filepath):
+    # Make square 256x256 thumbnail (decodes pixels)
+    Image = _get_pil_image()
+    img = Image.open(filepath)
+    size = min(img.size)
+    img = img.crop((0, 0, size, size))
+    img.thumbnail((256, 256), Image.Resampling.LANCZOS)
+    img.save(filepath)
+
+
 def save_uploaded_file(file, subfolder='files', upload_folder='uploads'):
     
     # Save uploaded file to subfolder with UUID prefix
@@ -37,42 +66,67 @@ def save_uploaded_file(file, subfolder='files', upload_folder='uploads'):
     #   upload_folder: base upload folder path (default 'uploads')
     # Returns:
     #   str: URL path to saved file, or None if failed
+    # Raises:
+    #   ImageValidationError: image extension with non-image content, oversized dimensions
+    #   or a container too malformed to strip metadata from
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
         filepath = os.path.join(upload_folder, subfolder, unique_filename)
+
+        # Validate images from their headers before anything touches the disk
+        image_info = None
+        if is_image_file(file.filename):
+            image_info = inspect_image_stream(file.stream, filename.rsplit('.', 1)[-1])
         
         # Ensure directory exists
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
         
         file.save(filepath)
-        
-        # Process stickers: make square thumbnail
-        if subfolder == 'stickers' and is_image_file(file.filename):
+
+        if image_info:
             try:
-                img = Image.open(filepath)
-                size = min(img.size)
-                img = img.crop((0, 0, size, size))
-                img.thumbnail((256, 256), Image.Resampling.LANCZOS)
-                img.save(filepath)
+                strip_image_metadata(filepath, image_info['format'])
             except Exception as e:
-                print(f"Error processing sticker: {e}")
+                os.remove(filepath)
+                log.warning('upload.strip_metadata_failed', path=filepath, error=str(e))
+                raise ImageValidationError('image file is malformed') from e
+        
+        # Process stickers: make square thumbnail
+        if subfolder == 'stickers' and image_info:
+            if can_decode_inline(image_info):
+                try:
+                    _make_sticker(filepath)
+                except Exception as e:
+                    log.warning('upload.sticker_failed', path=filepath, error=str(e))
+            else:
+                run_image_job(_make_sticker, filepath)
         
         return f"/uploads/{subfolder}/{unique_filename}"
     
     return None
 
 
+def _resize_in_place(filepath, max_size):
+    Image = _get_pil_image()
+    img = Image.open(filepath)
+    img.thumbnail(max_size, Image.Resampling.LANCZOS)
+    img.save(filepath)
+
+
 def resize_image(filepath, max_size=(32, 32)):
     #Resize image to fit within max_size while maintaining aspect ratio
+    #Large images are resized by the background image pipeline instead of inline
     #Args:
     #    filepath: path to image file
     #    max_size: tuple of (width, height)
     
     try:
-        img = Image.open(filepath)
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
-        img.save(filepath)
+        info = inspect_image_file(filepath)
+        if can_decode_inline(info):
+            _resize_in_place(filepath, max_size)
+        else:
+            run_image_job(_resize_in_place, filepath, max_size)
     except Exception as e:
-        print(f"Error resizing image: {e}")
+        log.warning('upload.resize_failed', path=filepath, error=str(e))
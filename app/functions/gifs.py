@@ -0,0 +1,305 @@
+# GIF picker backend: Giphy provider, local stub provider and response cache
+#
+# Every picker open used to block a worker on a Giphy round trip. Responses
+# are now cached per (endpoint, q, offset, limit, rating) with a TTL; identical
+# concurrent queries share one upstream call (single flight), and when Giphy
+# fails the last known result is served for up to GIF_CACHE_STALE_SECONDS.
+# Trending results are the same for every user, so they hit the cache almost
+# always. The process is not monkey-patched, so under eventlet the upstream
+# call runs in a native thread (eventlet.tpool) and followers wait on a green
+# event; otherwise the blocking round trip would freeze the hub.
+
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    GIF_PROVIDER, GIF_CACHE_TRENDING_TTL_SECONDS, GIF_CACHE_SEARCH_TTL_SECONDS,
+    GIF_CACHE_STALE_SECONDS, GIF_CACHE_MAX_ENTRIES
+)
+
+ENDPOINT_TRENDING = 'trending'
+ENDPOINT_SEARCH = 'search'
+# How long a follower waits for the in-flight leader before giving up
+COALESCE_WAIT_SECONDS = 15
+
+
+class GifProviderError(RuntimeError):
+    pass
+
+
+def _get_giphy_key():
+    try:
+        from config import GIPHY_API_KEY
+    except Exception:
+        GIPHY_API_KEY = ''
+    return os.environ.get('GIPHY_API_KEY') or (GIPHY_API_KEY or '')
+
+
+def _serialize_giphy_item(g):
+    try:
+        gid = str(getattr(g, 'id', '') or '')
+        title = str(getattr(g, 'title', '') or '')
+        images = getattr(g, 'images', None)
+        original = getattr(images, 'original', None) if images else None
+        fixed = getattr(images, 'fixed_width_small', None) if images else None
+        preview = getattr(images, 'preview_gif', None) if images else None
+        url = getattr(original, 'url', None) if original else None
+        prev = (
+            (getattr(fixed, 'url', None) if fixed else None)
+            or (getattr(preview, 'url', None) if preview else None)
+            or url
+        )
+        if not url or not prev:
+            return None
+        return {
+            'id': gid,
+            'url': str(url),
+            'preview': str(prev),
+            'title': title,
+        }
+    except Exception:
+        return None
+
+
+def _giphy_call_with_optional_offset(api_instance, method_name: str, api_key: str, *, limit: int, offset: int, rating: str, q: str | None = None):
+    method = getattr(api_instance, method_name)
+    try:
+        sig = inspect.signature(method)
+        params = sig.parameters
+        kwargs = {'limit': limit, 'rating': rating}
+        if 'offset' in params:
+            kwargs['offset'] = offset
+        if q is not None and 'q' in params:
+            kwargs['q'] = q
+        # Some generated clients include q as positional 2nd arg (search)
+        if q is not None:
+            try:
+                return method(api_key, q, **kwargs)
+            except TypeError:
+                return method(api_key, **kwargs)
+        return method(api_key, **kwargs)
+    except TypeError:
+        pass
+
+    # Fallback for older giphy-client versions: call through SDK ApiClient
+    path = '/gifs/trending' if method_name == 'gifs_trending_get' else '/gifs/search'
+    query_params = [('api_key', api_key), ('limit', int(limit)), ('rating', rating), ('offset', int(offset))]
+    if q is not None:
+        query_params.append(('q', q))
+
+    # response_type varies between versions; try common ones.
+    for response_type in ('InlineResponse200', 'object', None):
+        try:
+            return api_instance.api_client.call_api(
+                path,
+                'GET',
+                query_params=query_params,
+                response_type=response_type,
+                auth_settings=[],
+                _return_http_data_only=True,
+            )
+        except Exception:
+            continue
+
+    raise RuntimeError('Giphy SDK call failed')
+
+
+class GiphyProvider:
+    # Upstream Giphy API through giphy_client
+
+    name = 'giphy'
+
+    def is_configured(self):
+        return bool(_get_giphy_key())
+
+    def fetch(self, endpoint, q, offset, limit, rating):
+        import giphy_client
+
+        api_instance = giphy_client.DefaultApi()
+        method_name = 'gifs_trending_get' if endpoint == ENDPOINT_TRENDING else 'gifs_search_get'
+        res = _giphy_call_with_optional_offset(
+            api_instance, method_name, _get_giphy_key(),
+            limit=limit, offset=offset, rating=rating, q=q,
+        )
+        items = []
+        for g in (getattr(res, 'data', None) or []):
+            mapped = _serialize_giphy_item(g)
+            if mapped:
+                items.append(mapped)
+        pagination = getattr(res, 'pagination', None)
+        total = getattr(pagination, 'total_count', None) if pagination else None
+        count = getattr(pagination, 'count', None) if pagination else None
+        return {'gifs': items, 'total': total, 'count': count if isinstance(count, int) else len(items)}
+
+
+class StubGifProvider:
+    # Deterministic offline provider for development and tests; never touches the network
+
+    name = 'stub'
+
+    def __init__(self, total=200, delay=0.0):
+        self.total = int(total)
+        self.delay = float(delay)
+        self.calls = 0
+        self.fail = False
+
+    def is_configured(self):
+        return True
+
+    def fetch(self, endpoint, q, offset, limit, rating):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise GifProviderError('stub provider is set to fail')
+        tag = 'trending' if endpoint == ENDPOINT_TRENDING else f"search-{q}"
+        end = min(self.total, offset + limit)
+        items = [
+            {
+                'id': f"{tag}-{i}",
+                'url': f"https://media.giphy.com/media/stub/{tag}-{i}.gif",
+                'preview': f"https://media.giphy.com/media/stub/{tag}-{i}-preview.gif",
+                'title': f"{tag} #{i}",
+            }
+            for i in range(offset, end)
+        ]
+        return {'gifs': items, 'total': self.total, 'count': len(items)}
+
+
+def _use_tpool():
+    from app.extensions import socketio
+    return getattr(socketio, 'async_mode', None) == 'eventlet' and socketio.server is not None
+
+
+def _create_event():
+    # An event followers can wait on without blocking the hub under eventlet
+    if _use_tpool():
+        from app.extensions import socketio
+        return socketio.server.eio.create_event()
+    return threading.Event()
+
+
+def _call_upstream(func, *args):
+    if _use_tpool():
+        from eventlet import tpool
+        return tpool.execute(func, *args)
+    return func(*args)
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = _create_event()
+        self.value = None
+        self.error = None
+
+
+class GifCache:
+    # TTL cache with single-flight coalescing and stale-on-error fallback
+
+    def __init__(self, provider, trending_ttl=GIF_CACHE_TRENDING_TTL_SECONDS,
+                 search_ttl=GIF_CACHE_SEARCH_TTL_SECONDS, stale_seconds=GIF_CACHE_STALE_SECONDS,
+                 max_entries=GIF_CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.provider = provider
+        self.ttl = {ENDPOINT_TRENDING: trending_ttl, ENDPOINT_SEARCH: search_ttl}
+        self.stale_seconds = stale_seconds
+        self.max_entries = max(1, int(max_entries))
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (value, fetched_at)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'coalesced': 0, 'stale': 0, 'error': 0}
+
+    @staticmethod
+    def make_key(endpoint, q, offset, limit, rating):
+        return (endpoint, (q or '').strip().lower(), int(offset), int(limit), rating or '')
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if not entry:
+            return None, None
+        value, fetched_at = entry
+        return value, now - fetched_at
+
+    def _store(self, key, value, now):
+        self._entries[key] = (value, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, endpoint, q=None, offset=0, limit=24, rating='pg-13'):
+        # Returns (result, cache_status) where status is hit/miss/coalesced/stale.
+        # Raises the upstream error only when there is nothing cached to fall back to.
+        key = self.make_key(endpoint, q, offset, limit, rating)
+        ttl = self.ttl.get(endpoint, 0)
+        with self._lock:
+            now = self.clock()
+            value, age = self._lookup(key, now)
+            if value is not None and age < ttl:
+                self._entries.move_to_end(key)
+                self.stats['hit'] += 1
+                return value, 'hit'
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[key] = flight
+
+        if not leader:
+            flight.done.wait(COALESCE_WAIT_SECONDS)
+            if flight.value is not None:
+                with self._lock:
+                    self.stats['coalesced'] += 1
+                return flight.value, 'coalesced'
+            return self._fallback(key, flight.error or GifProviderError('upstream request timed out'))
+
+        try:
+            result = _call_upstream(self.provider.fetch, endpoint, q, int(offset), int(limit), rating)
+            flight.value = result
+            with self._lock:
+                self._store(key, result, self.clock())
+                self.stats['miss'] += 1
+            return result, 'miss'
+        except Exception as e:
+            flight.error = e
+            return self._fallback(key, e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _fallback(self, key, error):
+        with self._lock:
+            value, age = self._lookup(key, self.clock())
+            if value is not None and age < self.stale_seconds:
+                self.stats['stale'] += 1
+                return value, 'stale'
+            self.stats['error'] += 1
+        raise error
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _build_provider():
+    if GIF_PROVIDER == 'stub':
+        return StubGifProvider()
+    return GiphyProvider()
+
+
+def get_gif_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GifCache(_build_provider())
+    return _cache
+
+
+def set_gif_cache(cache):
+    # Swap the process-wide cache (tests, alternative providers)
+    global _cache
+    with _cache_lock:
+        _cache = cache
@@ -0,0 +1,310 @@
+# Image upload validation and metadata stripping without decoding pixels
+#
+# Uploads used to be trusted by extension only and stickers were fully decoded
+# by Pillow on the request thread, so a small compressed "decompression bomb"
+# could stall the worker. Everything here works on container headers only:
+# magic bytes identify the format, dimensions come from the header (PNG IHDR,
+# GIF screen descriptor, JPEG SOFn, WebP VP8/VP8L/VP8X), and metadata is removed
+# by copying the container chunk by chunk in fixed-size pieces. Pixel decoding
+# (sticker thumbnails, icon resizes) of large images is handed to a background
+# job that runs Pillow in a native thread.
+
+import os
+import struct
+import tempfile
+from app.functions.logs import get_logger
+from config import IMAGE_MAX_PIXELS, IMAGE_INLINE_DECODE_MAX_PIXELS
+
+log = get_logger('images')
+
+COPY_CHUNK_SIZE = 64 * 1024
+HEADER_PEEK_SIZE = 32
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Extension -> container format
+IMAGE_FORMATS_BY_EXTENSION = {
+    'png': 'png',
+    'jpg': 'jpeg',
+    'jpeg': 'jpeg',
+    'gif': 'gif',
+    'webp': 'webp',
+}
+# Ancillary chunks that only carry metadata
+PNG_METADATA_CHUNKS = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+WEBP_METADATA_CHUNKS = {b'EXIF', b'XMP '}
+# JPEG: APP1 (Exif/XMP), APP12 (Ducky), APP13 (IPTC/Photoshop), COM
+JPEG_METADATA_MARKERS = {0xE1, 0xEC, 0xED, 0xFE}
+# Start-of-frame markers that carry image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageValidationError(ValueError):
+    # Raised when an upload claims to be an image but its content does not match
+    pass
+
+
+def sniff_image_format(head: bytes):
+    # Identify container format from magic bytes
+    if head.startswith(PNG_SIGNATURE):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if len(head) >= 12 and head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ImageValidationError('truncated image header')
+    return data
+
+
+def _png_dimensions(stream):
+    stream.seek(8)
+    length, chunk_type = struct.unpack('>I4s', _read_exact(stream, 8))
+    if chunk_type != b'IHDR' or length < 8:
+        raise ImageValidationError('invalid PNG header')
+    return struct.unpack('>II', _read_exact(stream, 8))
+
+
+def _gif_dimensions(stream):
+    stream.seek(6)
+    return struct.unpack('<HH', _read_exact(stream, 4))
+
+
+def _jpeg_dimensions(stream):
+    # Walk marker segments (seeking over their payloads) until a SOFn marker
+    stream.seek(2)
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            raise ImageValidationError('JPEG has no frame header')
+        if byte != b'\xff':
+            continue
+        marker = stream.read(1)
+        while marker == b'\xff':
+            marker = stream.read(1)
+        if not marker:
+            raise ImageValidationError('JPEG has no frame header')
+        code = marker[0]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        if code in (0xD9, 0xDA):
+            raise ImageValidationError('JPEG has no frame header')
+        (length,) = struct.unpack('>H', _read_exact(stream, 2))
+        if length < 2:
+            raise ImageValidationError('invalid JPEG segment')
+        if code in JPEG_SOF_MARKERS:
+            _precision, height, width = struct.unpack('>BHH', _read_exact(stream, 5))
+            return width, height
+        stream.seek(length - 2, os.SEEK_CUR)
+
+
+def _webp_dimensions(stream):
+    stream.seek(12)
+    chunk_type, _size = struct.unpack('<4sI', _read_exact(stream, 8))
+    if chunk_type == b'VP8X':
+        data = _read_exact(stream, 10)
+        width = 1 + int.from_bytes(data[4:7], 'little')
+        height = 1 + int.from_bytes(data[7:10], 'little')
+        return width, height
+    if chunk_type == b'VP8L':
+        data = _read_exact(stream, 5)
+        if data[0] != 0x2F:
+            raise ImageValidationError('invalid WebP lossless header')
+        bits = int.from_bytes(data[1:5], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk_type == b'VP8 ':
+        data = _read_exact(stream, 10)
+        if data[3:6] != b'\x9d\x01\x2a':
+            raise ImageValidationError('invalid WebP lossy header')
+        width, height = struct.unpack('<HH', data[6:10])
+        return width & 0x3FFF, height & 0x3FFF
+    raise ImageValidationError('unsupported WebP layout')
+
+
+_DIMENSION_READERS = {
+    'png': _png_dimensions,
+    'gif': _gif_dimensions,
+    'jpeg': _jpeg_dimensions,
+    'webp': _webp_dimensions,
+}
+
+
+def inspect_image_stream(stream, extension=None):
+    # Validate a seekable stream as an image using headers only.
+    # Args:
+    #   stream: seekable binary stream (FileStorage.stream or open file)
+    #   extension: declared file extension, must match the sniffed format
+    # Returns:
+    #   dict with format, width, height, pixels; raises ImageValidationError
+    start = stream.tell()
+    try:
+        stream.seek(0)
+        fmt = sniff_image_format(stream.read(HEADER_PEEK_SIZE))
+        if not fmt:
+            raise ImageValidationError('file content is not a supported image')
+        expected = IMAGE_FORMATS_BY_EXTENSION.get((extension or '').lower())
+        if expected and expected != fmt:
+            raise ImageValidationError('image content does not match file extension')
+        try:
+            width, height = _DIMENSION_READERS[fmt](stream)
+        except struct.error:
+            raise ImageValidationError('truncated image header')
+    finally:
+        stream.seek(start)
+
+    if width <= 0 or height <= 0:
+        raise ImageValidationError('invalid image dimensions')
+    pixels = int(width) * int(height)
+    if IMAGE_MAX_PIXELS and pixels > IMAGE_MAX_PIXELS:
+        raise ImageValidationError('image dimensions are too large')
+    return {'format': fmt, 'width': int(width), 'height': int(height), 'pixels': pixels}
+
+
+def inspect_image_file(path, extension=None):
+    with open(path, 'rb') as f:
+        return inspect_image_stream(f, extension)
+
+
+def can_decode_inline(info):
+    # Small images may be decoded on the request thread; larger ones go to the background
+    return bool(info) and info['pixels'] <= IMAGE_INLINE_DECODE_MAX_PIXELS
+
+
+def _copy_bytes(src, dst, size):
+    remaining = size
+    while remaining > 0:
+        chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise ImageValidationError('truncated image data')
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+def _copy_rest(src, dst):
+    while True:
+        chunk = src.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return
+        dst.write(chunk)
+
+
+def _strip_png(src, dst):
+    dst.write(_read_exact(src, 8))
+    while True:
+        header = src.read(8)
+        if not header:
+            return
+        if len(header) != 8:
+            raise ImageValidationError('truncated PNG chunk')
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type in PNG_METADATA_CHUNKS:
+            src.seek(length + 4, os.SEEK_CUR)  # payload + CRC
+            continue
+        dst.write(header)
+        _copy_bytes(src, dst, length + 4)
+        if chunk_type == b'IEND':
+            return
+
+
+def _strip_jpeg(src, dst):
+    dst.write(_read_exact(src, 2))  # SOI
+    while True:
+        marker = src.read(2)
+        if len(marker) != 2 or marker[0] != 0xFF:
+            raise ImageValidationError('invalid JPEG segment')
+        while marker[1] == 0xFF:  # fill bytes before a marker
+            marker = b'\xff' + _read_exact(src, 1)
+        code = marker[1]
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            dst.write(marker)
+            continue
+        if code == 0xDA:
+            # Start of scan: entropy-coded data follows, copy the rest verbatim
+            dst.write(marker)
+            _copy_rest(src, dst)
+            return
+        if code == 0xD9:
+            dst.write(marker)
+            return
+        length_bytes = _read_exact(src, 2)
+        (length,) = struct.unpack('>H', length_bytes)
+        if code in JPEG_METADATA_MARKERS:
+            src.seek(length - 2, os.SEEK_CUR)
+            continue
+        dst.write(marker + length_bytes)
+        _copy_bytes(src, dst, length - 2)
+
+
+def _strip_webp(src, dst, total_size):
+    src.seek(12)
+    kept = []  # (chunk_type, offset, size) of chunks to keep
+    offset = 12
+    while offset + 8 <= total_size:
+        src.seek(offset)
+        chunk_type, size = struct.unpack('<4sI', _read_exact(src, 8))
+        padded = size + (size & 1)
+        if chunk_type not in WEBP_METADATA_CHUNKS:
+            kept.append((chunk_type, offset, padded))
+        offset += 8 + padded
+    body_size = 4 + sum(8 + padded for _t, _o, padded in kept)
+    dst.write(b'RIFF' + struct.pack('<I', body_size) + b'WEBP')
+    for chunk_type, chunk_offset, padded in kept:
+        src.seek(chunk_offset)
+        header = _read_exact(src, 8)
+        if chunk_type == b'VP8X':
+            flags = _read_exact(src, 1)[0] & ~0x0C  # clear EXIF (0x08) and XMP (0x04) flags
+            dst.write(header + bytes([flags]))
+            _copy_bytes(src, dst, padded - 1)
+        else:
+            dst.write(header)
+            _copy_bytes(src, dst, padded)
+
+
+def strip_image_metadata(path, fmt):
+    # Rewrite the file without EXIF/XMP/IPTC/text metadata in a bounded-memory pass.
+    # GIF has no standard metadata carrier worth stripping and is left untouched.
+    # Returns True if the file was rewritten.
+    if fmt not in ('png', 'jpeg', 'webp'):
+        return False
+    folder = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.strip-', dir=folder)
+    try:
+        with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            if fmt == 'png':
+                _strip_png(src, dst)
+            elif fmt == 'jpeg':
+                _strip_jpeg(src, dst)
+            else:
+                _strip_webp(src, dst, os.path.getsize(path))
+        os.replace(tmp_path, path)
+        return True
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def run_image_job(func, *args):
+    # Background image pipeline: decode in a native thread so neither the request
+    # thread nor the eventlet hub is blocked by Pillow
+    from app.extensions import socketio
+
+    def _job():
+        try:
+            if socketio.async_mode == 'eventlet':
+                from eventlet import tpool
+                tpool.execute(func, *args)
+            else:
+                func(*args)
+        except Exception as e:
+            log.error('image_job.failed', job=getattr(func, '__name__', str(func)), error=str(e))
+
+    socketio.start_background_task(_job)
@@ -0,0 +1,145 @@
+# IP bans backed by the ip_ban table and an in-memory prefix trie
+#
+# Login and register used to load every banned user and split their
+# comma-separated banned_ips on each request. Bans now live in an indexed
+# table of normalized networks (single addresses are /32 or /128), and each
+# worker keeps a binary prefix trie of them, so a lookup costs at most 32/128
+# steps regardless of how many bans exist. The trie is rebuilt after a ban or
+# unban in this worker and every IP_BAN_CACHE_TTL_SECONDS to pick up changes
+# from other workers. user.banned_ips is kept in sync for older tooling.
+
+import ipaddress
+import threading
+import time
+from app.extensions import db
+from app.models import IpBan, User
+from config import IP_BAN_CACHE_TTL_SECONDS
+
+
+def normalize_network(value):
+    # "1.2.3.4" -> "1.2.3.4/32", "10.1.2.3/8" -> "10.0.0.0/8"; None if invalid
+    try:
+        return str(ipaddress.ip_network(str(value or '').strip(), strict=False))
+    except ValueError:
+        return None
+
+
+class IpPrefixTrie:
+    # Binary trie over address bits; a node marked terminal bans everything below it
+
+    def __init__(self):
+        self._roots = {4: [None, None, False], 6: [None, None, False]}
+        self.size = 0
+
+    def add(self, network):
+        net = ipaddress.ip_network(network, strict=False)
+        node = self._roots[net.version]
+        bits = int(net.network_address)
+        width = net.max_prefixlen
+        for i in range(net.prefixlen):
+            if node[2]:
+                return  # already covered by a shorter prefix
+            bit = (bits >> (width - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+        self.size += 1
+
+    def contains(self, ip):
+        try:
+            addr = ipaddress.ip_address(str(ip or '').strip())
+        except ValueError:
+            return False
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        node = self._roots[addr.version]
+        bits = int(addr)
+        width = addr.max_prefixlen
+        for i in range(width):
+            if node[2]:
+                return True
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+
+_trie = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def invalidate_ip_bans():
+    # Drop the cached trie; call after committing a ban change
+    global _trie
+    with _lock:
+        _trie = None
+
+
+def _get_trie():
+    global _trie, _loaded_at
+    trie = _trie
+    if trie is not None and time.monotonic() - _loaded_at < IP_BAN_CACHE_TTL_SECONDS:
+        return trie
+    with _lock:
+        if _trie is not None and _trie is not trie:
+            return _trie  # another request rebuilt it meanwhile
+        fresh = IpPrefixTrie()
+        for (network,) in db.session.query(IpBan.network).distinct().all():
+            try:
+                fresh.add(network)
+            except ValueError:
+                continue
+        _trie = fresh
+        _loaded_at = time.monotonic()
+        return fresh
+
+
+def is_ip_banned(ip):
+    if not ip:
+        return False
+    return _get_trie().contains(ip)
+
+
+def _sync_banned_ips_column(user):
+    networks = [
+        row[0] for row in db.session.query(IpBan.network).filter_by(user_id=user.id).order_by(IpBan.id).all()
+    ]
+    # Single addresses are stored without the host prefix, as before
+    user.banned_ips = ','.join(
+        n.split('/')[0] if n.endswith('/32') or n.endswith('/128') else n for n in networks
+    )
+
+
+def add_ip_ban(user, value):
+    # Record a banned address or CIDR range for a user (caller commits, then invalidates)
+    network = normalize_network(value)
+    if not network:
+        return None
+    if not IpBan.query.filter_by(network=network, user_id=user.id).first():
+        db.session.add(IpBan(network=network, user_id=user.id))
+        db.session.flush()
+    _sync_banned_ips_column(user)
+    return network
+
+
+def remove_user_ip_bans(user):
+    # Lift every IP ban recorded for a user (caller commits, then invalidates)
+    IpBan.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+    user.banned_ips = ''
+
+
+def list_banned_ips():
+    # {network: [{username, user_id, reason, banned_at}, ...]} for the admin panel
+    rows = db.session.query(IpBan.network, User).join(User, User.id == IpBan.user_id).order_by(IpBan.network).all()
+    banned = {}
+    for network, user in rows:
+        key = network.split('/')[0] if network.endswith('/32') or network.endswith('/128') else network
+        banned.setdefault(key, []).append({
+            'username': user.username,
+            'user_id': user.id,
+            'reason': user.ban_reason,
+            'banned_at': user.banned_at.isoformat() if user.banned_at else None
+        })
+    return banned
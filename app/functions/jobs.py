@@ -0,0 +1,207 @@
+# Tracked background jobs that work through large deletes in bounded chunks
+#
+# Bulk moderation used to run as one unbounded DELETE inside the request,
+# holding SQLite's write lock for seconds while every send_message waited.
+# A job is now a background_job row plus a registered step function. The
+# runner calls the step repeatedly; each call handles at most JOB_CHUNK_SIZE
+# rows, and its changes commit together with the job's cursor and progress,
+# so a chunk is one short transaction and an interrupted job can resume where
+# it stopped. Between chunks the runner yields for JOB_CHUNK_PAUSE_SECONDS so
+# queued writers get the lock. The requester is kept informed over Socket.IO
+# with `job_progress` events.
+#
+# A worker runs a job only after claiming its row (claimed_by/claimed_at) in a
+# conditional UPDATE, and refreshes the claim with every chunk. Each worker
+# resumes unfinished jobs with its first request or connection; a job whose
+# claim has not moved for JOB_CLAIM_TIMEOUT_SECONDS belongs to a dead worker
+# and is taken over, while a live claim makes the other workers skip the job.
+
+import json
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import text, or_
+from app.extensions import db, socketio
+from app.models import BackgroundJob
+from app.functions.logs import get_logger
+from config import JOB_CHUNK_SIZE, JOB_CHUNK_PAUSE_SECONDS, JOB_CLAIM_TIMEOUT_SECONDS
+
+log = get_logger('jobs')
+
+FINISHED_STATUSES = ('done', 'failed')
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_handlers = {}  # kind -> (step, finish)
+_lock = threading.Lock()
+_running = set()  # job ids this process is running right now
+_resumed = False
+
+
+def job_handler(kind, finish=None):
+    # Register step(job, params, limit) -> rows processed (0 when there is nothing left).
+    # finish(job, params) runs once after the job is marked done.
+    def register(step):
+        _handlers[kind] = (step, finish)
+        return step
+    return register
+
+
+def phased_step(*phases):
+    # Build a step that runs phase(job, params, limit) -> rows processed, moving
+    # to the next phase (with a fresh cursor) when the current one returns 0
+    def step(job, params, limit):
+        while job.phase < len(phases):
+            processed = phases[job.phase](job, params, limit)
+            if processed:
+                job.progress += processed
+                return processed
+            job.phase += 1
+            job.cursor = 0
+        return 0
+    return step
+
+
+def job_payload(job):
+    return {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'phase': job.phase,
+        'progress': job.progress,
+        'total': job.total,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _emit_progress(job):
+    if not job.created_by_id:
+        return
+    try:
+        socketio.emit('job_progress', job_payload(job), room=f"user_{job.created_by_id}")
+    except Exception:
+        pass
+
+
+def enqueue_job(kind, params, created_by_id=None, total=None):
+    # Record a job and start working on it in the background; returns the job row
+    if kind not in _handlers:
+        raise ValueError(f'unknown job kind: {kind}')
+    job = BackgroundJob(
+        kind=kind,
+        status='queued',
+        params_json=json.dumps(params),
+        created_by_id=created_by_id,
+        total=total,
+    )
+    db.session.add(job)
+    db.session.commit()
+    _start(job.id)
+    return job
+
+
+def _start(job_id):
+    from flask import current_app
+    socketio.start_background_task(_run_job, current_app._get_current_object(), job_id)
+
+
+def _claim(job_id, now):
+    # Take the job unless another live worker holds it; True when this worker may run it
+    stale = now - timedelta(seconds=JOB_CLAIM_TIMEOUT_SECONDS)
+    claimed = db.session.execute(text(
+        "UPDATE background_job SET status = 'running', claimed_by = :me, claimed_at = :now, "
+        "started_at = COALESCE(started_at, :now) "
+        "WHERE id = :id AND status IN ('queued', 'running') "
+        "AND (claimed_by IS NULL OR claimed_by = :me OR claimed_at <= :stale)"
+    ), {'me': WORKER_ID, 'now': now, 'stale': stale, 'id': job_id}).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def _run_job(app, job_id):
+    with _lock:
+        if job_id in _running:
+            return
+        _running.add(job_id)
+    try:
+        _run_claimed_job(app, job_id)
+    finally:
+        with _lock:
+            _running.discard(job_id)
+
+
+def _run_claimed_job(app, job_id):
+    with app.app_context():
+        if not _claim(job_id, datetime.utcnow()):
+            return
+        job = db.session.get(BackgroundJob, job_id)
+        if job is None or job.kind not in _handlers:
+            return
+        step, finish = _handlers[job.kind]
+        params = json.loads(job.params_json or '{}')
+        _emit_progress(job)
+
+        try:
+            while step(job, params, max(1, JOB_CHUNK_SIZE)):
+                job.claimed_at = datetime.utcnow()
+                db.session.commit()
+                _emit_progress(job)
+                socketio.sleep(JOB_CHUNK_PAUSE_SECONDS)
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            if finish:
+                finish(job, params)
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(BackgroundJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)[:1000]
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            log.error('job.failed', kind=job.kind, job_id=job.id, error=str(e))
+        _emit_progress(job)
+
+
+def resume_unfinished_jobs():
+    # Start the queued or running jobs no live worker holds; returns how many
+    stale = datetime.utcnow() - timedelta(seconds=JOB_CLAIM_TIMEOUT_SECONDS)
+    jobs = BackgroundJob.query.filter(
+        BackgroundJob.status.in_(('queued', 'running')),
+        or_(
+            BackgroundJob.claimed_by.is_(None),
+            BackgroundJob.claimed_by == WORKER_ID,
+            BackgroundJob.claimed_at <= stale,
+        ),
+    ).all()
+    jobs = [job for job in jobs if job.kind in _handlers]
+    for job in jobs:
+        _start(job.id)
+    return len(jobs)
+
+
+def resume_jobs_once():
+    # Called by the first request or Socket.IO connection of each worker
+    global _resumed
+    if _resumed:
+        return
+    with _lock:
+        if _resumed:
+            return
+        _resumed = True
+    try:
+        resumed = resume_unfinished_jobs()
+        if resumed:
+            log.info('jobs.resumed', jobs=resumed)
+    except Exception as e:
+        db.session.rollback()
+        log.error('jobs.resume_failed', error=str(e))
+
+
+def init_app(flask_app):
+    # Interrupted purges resume in whichever workers serve traffic (gunicorn never runs run.py)
+    flask_app.before_request(resume_jobs_once)
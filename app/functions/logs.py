@@ -0,0 +1,181 @@
+# Structured, queue-backed logging
+#
+# Hot paths used print() to stderr. send_message wrote the full notification
+# payload once per recipient, and connect/join wrote a line per socket. Those
+# writes are synchronous on the eventlet hub thread, so at large fan-out they
+# were a visible share of per-message latency. Code now logs through
+# get_logger(name), which returns a thin wrapper over the stdlib logger
+# "boxchat.<name>":
+#
+#   log.info('room.left', user_id=..., room_id=...)   # event name + fields
+#   log.sampled('send_message.notify', user_id=...)   # debug, kept at LOG_DEBUG_SAMPLE_RATE
+#
+# A disabled level costs one isEnabledFor() check: nothing is formatted and
+# no record is built. Enabled records are put on a bounded in-memory queue
+# (never blocking; when it is full the record is dropped and counted). A
+# listener thread formats them as JSON lines (or text, LOG_FORMAT) and writes
+# them to LOG_FILE or stderr. Levels come from LOG_LEVEL and LOG_LEVELS in
+# config.json.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_DEBUG_SAMPLE_RATE
+
+ROOT_LOGGER = 'boxchat'
+
+_lock = threading.Lock()
+_queue = None
+_listener = None
+_dropped = 0
+
+
+def _timestamp(record):
+    return datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class JsonLineFormatter(logging.Formatter):
+    # {"ts", "level", "logger", "event", **fields} on one line
+    def format(self, record):
+        entry = {
+            'ts': _timestamp(record),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    # "ts LEVEL logger event key=value ..." for reading in a terminal
+    def format(self, record):
+        parts = [_timestamp(record), record.levelname, record.name, record.getMessage()]
+        fields = getattr(record, 'fields', None)
+        if fields:
+            parts.extend(f'{key}={value}' for key, value in fields.items())
+        line = ' '.join(str(part) for part in parts)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Hands records to the listener untouched (formatting happens off the hot path)
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _lock:
+                _dropped += 1
+
+
+class StructuredLogger:
+    __slots__ = ('_logger',)
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(name)
+
+    def enabled(self, level=logging.DEBUG):
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, event, fields, exc_info=None):
+        # makeRecord + handle skips the stack walk logger.log() does for every call
+        if exc_info is True:
+            exc_info = sys.exc_info()
+        self._logger.handle(self._logger.makeRecord(
+            self._logger.name, level, '', 0, event, (), exc_info, extra={'fields': fields}
+        ))
+
+    def debug(self, event, **fields):
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        if self._logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        if self._logger.isEnabledFor(logging.WARNING):
+            self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        if self._logger.isEnabledFor(logging.ERROR):
+            self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        # error with the traceback of the exception being handled
+        if self._logger.isEnabledFor(logging.ERROR):
+            self._log(logging.ERROR, event, fields, exc_info=True)
+
+    def sampled(self, event, **fields):
+        # Debug event emitted on every message or connection: only a LOG_DEBUG_SAMPLE_RATE share is kept
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        if LOG_DEBUG_SAMPLE_RATE < 1 and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return
+        fields['sample_rate'] = LOG_DEBUG_SAMPLE_RATE
+        self._log(logging.DEBUG, event, fields)
+
+
+def get_logger(name):
+    return StructuredLogger(name if name.startswith(ROOT_LOGGER) else f'{ROOT_LOGGER}.{name}')
+
+
+def _level(value):
+    level = logging.getLevelName(str(value).upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def init_logging():
+    # Route boxchat.* records through the queue to the configured output (idempotent)
+    global _queue, _listener
+    with _lock:
+        if _listener is not None:
+            return
+        if LOG_FILE:
+            target = logging.handlers.WatchedFileHandler(LOG_FILE, encoding='utf-8')
+        else:
+            target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JsonLineFormatter())
+
+        _queue = queue.Queue(maxsize=max(1, LOG_QUEUE_SIZE))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers[:] = [_DroppingQueueHandler(_queue)]
+        root.setLevel(_level(LOG_LEVEL))
+        root.propagate = False
+        for name, level in LOG_LEVELS.items():
+            logging.getLogger(name if name.startswith(ROOT_LOGGER) else f'{ROOT_LOGGER}.{name}').setLevel(_level(level))
+
+        _listener = logging.handlers.QueueListener(_queue, target)
+        _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    # Flush queued records and stop the listener thread
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_log_stats():
+    with _lock:
+        dropped = _dropped
+    return {'queued': _queue.qsize() if _queue is not None else 0, 'dropped': dropped}
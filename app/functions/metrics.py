@@ -0,0 +1,363 @@
+# In-process metrics registry exposed in Prometheus text format
+#
+# Until now the only observability was print() calls. Requests, Socket.IO
+# handlers and SQL statements now feed a small registry of counters, gauges
+# and histograms, and GET /metrics renders it for Prometheus. Recording an
+# observation only updates a few in-memory numbers under a lock. Queue
+# depths, connected sockets and rooms are not tracked on every change; they
+# are read by collectors when /metrics is scraped.
+#
+# Per request (route template) and per socket event, we record: latency, the
+# number of SQL statements and their total time. Every emit is counted by
+# event name, whether it went out directly or through the outbox dispatcher.
+#
+# The per-request statement scope is kept even with metrics disabled: it
+# feeds @query_budget (app.functions.query_budget) and the slow-query log,
+# which logs any statement slower than SLOW_QUERY_MS together with the
+# route or socket event that issued it.
+
+import functools
+import hmac
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.functions.logs import get_logger
+from config import METRICS_ENABLED, METRICS_TOKEN, SLOW_QUERY_MS
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+log = get_logger('db')
+
+_registry = {}  # name -> metric, in registration order
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_labels_text(self.labelnames, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="' + _number(float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels_text(self.labelnames, key)} {count}')
+        return lines
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+def counter(name, help_text, labelnames=()):
+    return _register(Counter, name, help_text, labelnames)
+
+
+def gauge(name, help_text, labelnames=()):
+    return _register(Gauge, name, help_text, labelnames)
+
+
+def histogram(name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+
+def register_collector(func):
+    # func() runs on every scrape, before rendering; use it to refresh gauges
+    _collectors.append(func)
+    return func
+
+
+def render_metrics():
+    for collect in list(_collectors):
+        try:
+            collect()
+        except Exception as e:
+            log.error('metrics.collector_failed', collector=getattr(collect, '__name__', str(collect)), error=str(e))
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+HTTP_DURATION = histogram('boxchat_http_request_duration_seconds', 'HTTP request latency', ('method', 'route'))
+HTTP_REQUESTS = counter('boxchat_http_requests_total', 'HTTP requests', ('method', 'route', 'status'))
+HTTP_DB_QUERIES = histogram('boxchat_http_request_db_queries', 'SQL statements per HTTP request', ('route',),
+                            buckets=QUERY_COUNT_BUCKETS)
+HTTP_DB_SECONDS = counter('boxchat_http_request_db_seconds_total', 'Time spent in SQL per route', ('route',))
+SOCKET_DURATION = histogram('boxchat_socketio_event_duration_seconds', 'Socket.IO handler latency', ('event',))
+SOCKET_EVENTS = counter('boxchat_socketio_events_total', 'Socket.IO events handled', ('event', 'outcome'))
+SOCKET_DB_QUERIES = histogram('boxchat_socketio_event_db_queries', 'SQL statements per Socket.IO event', ('event',),
+                              buckets=QUERY_COUNT_BUCKETS)
+SOCKET_DB_SECONDS = counter('boxchat_socketio_event_db_seconds_total', 'Time spent in SQL per Socket.IO event', ('event',))
+SOCKET_EMITS = counter('boxchat_socketio_emits_total', 'Socket.IO emits by event name', ('event',))
+DB_QUERIES = counter('boxchat_db_queries_total', 'SQL statements executed', ('context',))
+DB_SECONDS = counter('boxchat_db_query_seconds_total', 'Time spent executing SQL', ('context',))
+DB_SLOW_QUERIES = counter('boxchat_db_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS', ('origin',))
+
+
+def _begin_db_scope(origin):
+    g._metrics_db = [0, 0.0, origin]
+
+
+def _end_db_scope():
+    queries, seconds, _origin = g.pop('_metrics_db', None) or [0, 0.0, None]
+    return queries, seconds
+
+
+def db_scope_queries():
+    # SQL statements issued so far by the current request or socket event (None outside one)
+    scope = g.get('_metrics_db') if has_app_context() else None
+    return scope[0] if scope is not None else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _cursor_execute_failed(exception_context):
+    conn = exception_context.connection
+    started = conn.info.get('_metrics_started') if conn is not None else None
+    if started:
+        started.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('_metrics_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    scope = g.get('_metrics_db') if has_app_context() else None
+    if scope is not None:
+        scope[0] += 1
+        scope[1] += elapsed
+        context_name = 'request'
+    else:
+        context_name = 'background'
+    if SLOW_QUERY_MS and elapsed * 1000.0 >= SLOW_QUERY_MS:
+        origin = scope[2] if scope is not None else 'background'
+        DB_SLOW_QUERIES.inc(origin=origin)
+        log.warning('slow_query', ms=round(elapsed * 1000.0, 1), origin=origin,
+                    statement=' '.join(statement.split())[:500])
+    if METRICS_ENABLED:
+        DB_QUERIES.inc(context=context_name)
+        DB_SECONDS.inc(elapsed, context=context_name)
+
+
+def _route_label():
+    rule = getattr(request, 'url_rule', None)
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def metrics_scrape_allowed():
+    # Bearer METRICS_TOKEN when one is configured, otherwise loopback clients only
+    if METRICS_TOKEN:
+        header = request.headers.get('Authorization', '')
+        supplied = header[7:] if header.startswith('Bearer ') else ''
+        return hmac.compare_digest(supplied.encode('utf-8'), METRICS_TOKEN.encode('utf-8'))
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+
+def init_app(flask_app, socketio):
+    # Hook the per-request SQL scope, request timing and emit counting into an app
+    @flask_app.before_request
+    def _metrics_request_started():
+        g._metrics_started = time.perf_counter()
+        _begin_db_scope(f'{request.method} {_route_label()}')
+
+    @flask_app.after_request
+    def _metrics_request_finished(response):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return response
+        queries, seconds = _end_db_scope()
+        if not METRICS_ENABLED:
+            return response
+        route = _route_label()
+        HTTP_DURATION.observe(time.perf_counter() - started, method=request.method, route=route)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+        HTTP_DB_QUERIES.observe(queries, route=route)
+        HTTP_DB_SECONDS.inc(seconds, route=route)
+        return response
+
+    if not METRICS_ENABLED:
+        return
+
+    server = socketio.server
+    if server is not None and not getattr(server, '_metrics_wrapped', False):
+        emit = server.emit
+
+        @functools.wraps(emit)
+        def counted_emit(event_name, *args, **kwargs):
+            SOCKET_EMITS.inc(event=event_name)
+            return emit(event_name, *args, **kwargs)
+
+        server.emit = counted_emit
+        server._metrics_wrapped = True
+
+
+def socket_event_metrics(event_name):
+    # Decorator for Socket.IO handlers (place under @socketio.on): latency, outcome and SQL per event
+    def decorator(handler):
+        params = inspect.signature(handler).parameters.values()
+        takes_varargs = any(p.kind == p.VAR_POSITIONAL for p in params)
+        max_args = None if takes_varargs else len(params)
+
+        @functools.wraps(handler)
+        def wrapper(*args):
+            started = time.perf_counter()
+            _begin_db_scope(f'socket:{event_name}')
+            outcome = 'error'
+            try:
+                result = handler(*args[:max_args])
+                outcome = 'ok'
+                return result
+            finally:
+                queries, seconds = _end_db_scope()
+                if METRICS_ENABLED:
+                    SOCKET_DURATION.observe(time.perf_counter() - started, event=event_name)
+                    SOCKET_EVENTS.inc(event=event_name, outcome=outcome)
+                    SOCKET_DB_QUERIES.observe(queries, event=event_name)
+                    SOCKET_DB_SECONDS.inc(seconds, event=event_name)
+        return wrapper
+    return decorator
+
+
+CONNECTED_SOCKETS = gauge('boxchat_socketio_connected_sockets', 'Connected Socket.IO clients')
+SOCKET_ROOMS = gauge('boxchat_socketio_rooms', 'Socket.IO rooms with at least one member (excluding per-sid rooms)')
+QUEUE_DEPTH = gauge('boxchat_queue_depth', 'Items waiting in internal queues', ('queue',))
+LOG_DROPPED = gauge('boxchat_log_records_dropped', 'Log records dropped because the log queue was full')
+
+
+@register_collector
+def _collect_socket_state():
+    from app.extensions import socketio
+    server = socketio.server
+    rooms = server.manager.rooms.get('/', {}) if server is not None else {}
+    sids = rooms.get(None, {})
+    CONNECTED_SOCKETS.set(len(sids))
+    SOCKET_ROOMS.set(sum(1 for name, members in rooms.items() if name is not None and name not in sids and members))
+
+
+@register_collector
+def _collect_queues():
+    from app.functions.passwords import get_hasher_stats
+    from app.functions.outbox import get_outbox_stats
+    from app.functions.logs import get_log_stats
+    from app.models import BackgroundJob
+    from app.extensions import db
+
+    hasher = get_hasher_stats()
+    QUEUE_DEPTH.set(hasher['queued'], queue='password_hasher')
+    outbox = get_outbox_stats()
+    QUEUE_DEPTH.set(outbox['pending'], queue='socket_outbox')
+    logs = get_log_stats()
+    QUEUE_DEPTH.set(logs['queued'], queue='log')
+    LOG_DROPPED.set(logs['dropped'])
+    jobs = dict(
+        db.session.query(BackgroundJob.status, db.func.count(BackgroundJob.id))
+        .filter(BackgroundJob.status.in_(('queued', 'running')))
+        .group_by(BackgroundJob.status)
+        .all()
+    )
+    QUEUE_DEPTH.set(jobs.get('queued', 0), queue='background_jobs_queued')
+    QUEUE_DEPTH.set(jobs.get('running', 0), queue='background_jobs_running')
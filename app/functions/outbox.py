@@ -0,0 +1,261 @@
+# Transactional outbox for Socket.IO events
+#
+# Handlers used to commit and then call socketio.emit. If the process died in
+# between, clients never heard about the change, and a retried request re-ran
+# the whole handler. Events that describe a committed change are now written
+# to socket_outbox by enqueue_emit() in the same transaction as the change, so
+# they exist if and only if the change does. After the commit, this process's
+# dispatcher is woken (it is started by the first request or connection). It
+# claims the oldest pending rows in batches, emits them in id order and
+# deletes them, all off the request thread.
+#
+# Without a Socket.IO message queue an emit only reaches the clients of the
+# process that makes it, so each row records its origin (DISPATCHER_ID) and
+# only that process claims it, in commit order. The one cross-process path is
+# crash recovery: a claim older than SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS is
+# taken over, and so are rows of another origin that have waited that long
+# (their process is gone), so they are delivered again (at-least-once). With
+# a message queue every process reaches every client, so any dispatcher may
+# claim any row, and only one holds a claim at a time to keep commit order.
+# The dispatcher polls every SOCKET_OUTBOX_POLL_SECONDS; a poll that finds
+# nothing to claim is a single read, not a write transaction. The stored
+# payload text is emitted as-is (RawJSON), so JSON clients get it without a
+# decode/encode round trip.
+#
+# receive_message is micro-batched. Within a claimed batch, consecutive
+# receive_message rows for one channel are sent as one receive_messages frame
+# (EventBatch), up to SOCKET_BATCH_MAX_MESSAGES. Any other event first flushes
+# the pending runs, so order with other events is kept. Clients that did not
+# ask for batches get the single events in the same order. The window adapts
+# to the rate: a wake-up less than SOCKET_BATCH_WINDOW_MS after the last
+# message dispatch means a burst, and the dispatcher waits out the window so
+# the burst is claimed in one go. At lower rates nothing waits, and each
+# message goes out on its own.
+
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from app.extensions import db, socketio
+from app.models import SocketOutbox
+from app.functions.logs import get_logger
+from app.functions.serialization import EventBatch, RawJSON, dumps, loads, wire_manager_active
+from config import (
+    SOCKET_OUTBOX_BATCH_SIZE, SOCKET_OUTBOX_POLL_SECONDS, SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS,
+    SOCKET_BATCH_WINDOW_MS, SOCKET_BATCH_MAX_MESSAGES
+)
+
+log = get_logger('outbox')
+
+DISPATCHER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_lock = threading.Lock()
+_app = None
+_wake = None
+_started = False
+_stats = {'enqueued': 0, 'dispatched': 0, 'batches': 0, 'errors': 0, 'frames': 0, 'coalesced': 0}
+_last_message_dispatch = 0.0  # time.monotonic() of the last batch that carried receive_message rows
+
+BATCHED_EVENTS = {'receive_message': 'receive_messages'}
+
+
+def enqueue_emit(event_name, payload, room=None):
+    # Queue an event in the current transaction; it is emitted after the commit
+    db.session.add(SocketOutbox(
+        event=event_name,
+        room=str(room) if room is not None else None,
+        payload_json=dumps(payload),
+        origin=DISPATCHER_ID,
+        created_at=datetime.utcnow(),
+    ))
+    # Counted into _stats only once the transaction commits
+    info = db.session.info
+    info['socket_outbox_pending'] = info.get('socket_outbox_pending', 0) + 1
+
+
+def start_dispatcher():
+    # Started by the first request or Socket.IO connection, so a process that only
+    # builds the app (scripts, seeding) leaves the rows to the serving workers
+    global _started, _wake
+    if _started:
+        return
+    with _lock:
+        if _started or _app is None or socketio.server is None:
+            return
+        _started = True
+        _wake = socketio.server.eio.create_event()
+    socketio.start_background_task(_dispatch_loop, _app)
+
+
+def wake_dispatcher():
+    if _wake is not None:
+        _wake.set()
+
+
+def init_app(flask_app):
+    # Remember the app for the dispatcher; it polls for rows from other processes
+    # too, so it runs whether or not this worker ever enqueues
+    global _app
+    _app = flask_app
+    flask_app.before_request(start_dispatcher)
+
+
+def _has_message_queue():
+    # A pub/sub client manager relays emits to the clients of every process
+    from socketio import PubSubManager
+    return socketio.server is not None and isinstance(socketio.server.manager, PubSubManager)
+
+
+# Rows this dispatcher may claim: unclaimed, its own, or held by a claim that went stale
+_CLAIMABLE = '(claimed_by IS NULL OR claimed_by = :me OR claimed_at <= :stale)'
+# Without a message queue: only rows written here, or left behind by a process that is gone
+_LOCAL_SCOPE = ' AND (origin = :me OR created_at <= :stale)'
+# Order guard: no fresh claim by another dispatcher on rows of the same scope
+_SHARED_GUARD = (
+    'NOT EXISTS (SELECT 1 FROM socket_outbox AS held WHERE held.claimed_by != :me '
+    'AND held.claimed_at > :stale)'
+)
+_LOCAL_GUARD = (
+    'NOT EXISTS (SELECT 1 FROM socket_outbox AS held WHERE held.claimed_by != :me '
+    'AND held.claimed_at > :stale AND held.origin = socket_outbox.origin)'
+)
+
+
+def _claim_batch(now):
+    stale = now - timedelta(seconds=SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS)
+    shared = _has_message_queue()
+    candidates = 'SELECT id FROM socket_outbox WHERE ' + _CLAIMABLE + ('' if shared else _LOCAL_SCOPE)
+    params = {'me': DISPATCHER_ID, 'now': now, 'n': max(1, SOCKET_OUTBOX_BATCH_SIZE), 'stale': stale}
+    # A read first: an idle poll must not take SQLite's write lock
+    if db.session.execute(text(candidates + ' LIMIT 1'), params).first() is None:
+        db.session.rollback()
+        return []
+    db.session.execute(text(
+        'UPDATE socket_outbox SET claimed_by = :me, claimed_at = :now '
+        'WHERE id IN (' + candidates + ' ORDER BY id LIMIT :n) '
+        'AND ' + (_SHARED_GUARD if shared else _LOCAL_GUARD)
+    ), params)
+    db.session.commit()
+    return (
+        SocketOutbox.query.filter_by(claimed_by=DISPATCHER_ID)
+        .order_by(SocketOutbox.id)
+        .limit(max(1, SOCKET_OUTBOX_BATCH_SIZE))
+        .all()
+    )
+
+
+def _payload(row):
+    # Stored text as-is for WireManager; the stock manager needs the decoded value
+    return RawJSON(row.payload_json) if wire_manager_active() else loads(row.payload_json)
+
+
+def _run_frame(room, run):
+    event = run[0].event
+    if len(run) == 1:
+        return event, _payload(run[0]), room, 1
+    return BATCHED_EVENTS[event], EventBatch(event, [RawJSON(row.payload_json) for row in run]), room, len(run)
+
+
+def _frames(rows):
+    # [(event, payload, room, row count)] in emit order, with batchable rows merged per room
+    frames = []
+    runs = {}
+
+    def flush():
+        for room, run in runs.items():
+            frames.append(_run_frame(room, run))
+        runs.clear()
+
+    batching = SOCKET_BATCH_WINDOW_MS > 0 and wire_manager_active()
+    for row in rows:
+        if batching and row.event in BATCHED_EVENTS and row.room is not None:
+            run = runs.setdefault(row.room, [])
+            run.append(row)
+            if len(run) >= max(1, SOCKET_BATCH_MAX_MESSAGES):
+                frames.append(_run_frame(row.room, runs.pop(row.room)))
+        else:
+            flush()
+            frames.append((row.event, _payload(row), row.room, 1))
+    flush()
+    return frames
+
+
+def dispatch_outbox_batch():
+    # Emit and delete one claimed batch; returns the number of events sent
+    global _last_message_dispatch
+    rows = _claim_batch(datetime.utcnow())
+    if not rows:
+        return 0
+    frames = _frames(rows)
+    carried_messages = any(row.event in BATCHED_EVENTS for row in rows)
+    for event_name, payload, room, count in frames:
+        try:
+            socketio.emit(event_name, payload, room=room)
+        except Exception as e:
+            with _lock:
+                _stats['errors'] += 1
+            log.error('outbox.emit_failed', event=event_name, room=room, rows=count, error=str(e))
+    SocketOutbox.query.filter(SocketOutbox.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+    db.session.commit()
+    with _lock:
+        _stats['dispatched'] += len(rows)
+        _stats['batches'] += 1
+        _stats['frames'] += len(frames)
+        _stats['coalesced'] += sum(count for _, _, _, count in frames if count > 1)
+    if carried_messages:
+        _last_message_dispatch = time.monotonic()
+    return len(rows)
+
+
+def _hold_for_batch_window():
+    # A wake-up inside the window of the last message dispatch is a burst: let it accumulate
+    if SOCKET_BATCH_WINDOW_MS <= 0:
+        return
+    remaining = _last_message_dispatch + SOCKET_BATCH_WINDOW_MS / 1000.0 - time.monotonic()
+    if remaining > 0:
+        socketio.sleep(remaining)
+
+
+def _dispatch_loop(app):
+    while True:
+        with app.app_context():
+            try:
+                while dispatch_outbox_batch():
+                    socketio.sleep(0)
+            except Exception:
+                db.session.rollback()
+                log.exception('outbox.dispatch_failed')
+        _wake.wait(SOCKET_OUTBOX_POLL_SECONDS)
+        _wake.clear()
+        _hold_for_batch_window()
+
+
+def outbox_backlog():
+    # Rows this process enqueued that no dispatcher has emitted yet (no query; for load signals)
+    with _lock:
+        return max(0, _stats['enqueued'] - _stats['dispatched'])
+
+
+def get_outbox_stats():
+    with _lock:
+        stats = dict(_stats)
+    stats['pending'] = SocketOutbox.query.count()
+    return stats
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    pending = session.info.pop('socket_outbox_pending', 0)
+    if pending:
+        with _lock:
+            _stats['enqueued'] += pending
+        wake_dispatcher()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('socket_outbox_pending', None)
@@ -0,0 +1,165 @@
+# Password hashing off the event loop with a bounded worker pool
+#
+# scrypt is deliberately expensive; run inline it blocks the eventlet hub and
+# every Socket.IO connection of the process with it. Hashing and verification
+# run in native threads instead (eventlet.tpool under eventlet, a thread pool
+# otherwise), at most PASSWORD_HASH_WORKERS at a time. When more than
+# PASSWORD_HASH_MAX_QUEUE requests are already waiting, new ones are refused
+# with PasswordHasherBusy, which the routes turn into 503 + Retry-After.
+# Hashes made with older cost parameters are upgraded on the next login.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from config import PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+
+RETRY_AFTER_SECONDS = 2
+
+
+class PasswordHasherBusy(RuntimeError):
+    # Raised when the hashing queue is full
+    retry_after = RETRY_AFTER_SECONDS
+
+
+_lock = threading.Lock()
+_executor = None
+_green_slots = None
+_stats = {
+    'active': 0,
+    'in_flight': 0,
+    'completed': 0,
+    'rejected': 0,
+    'rehashed': 0,
+    'max_queue_seen': 0,
+    'wait_ms_total': 0.0,
+    'run_ms_total': 0.0,
+}
+
+
+def _use_tpool():
+    from app.extensions import socketio
+    return getattr(socketio, 'async_mode', None) == 'eventlet'
+
+
+def _get_green_slots():
+    global _green_slots
+    if _green_slots is None:
+        from eventlet.semaphore import Semaphore
+        _green_slots = Semaphore(max(1, PASSWORD_HASH_WORKERS))
+    return _green_slots
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(1, PASSWORD_HASH_WORKERS), thread_name_prefix='pwhash'
+                )
+    return _executor
+
+
+def _timed(func, args, queued_at):
+    started = time.perf_counter()
+    with _lock:
+        _stats['active'] += 1
+        _stats['wait_ms_total'] += (started - queued_at) * 1000
+    try:
+        return func(*args)
+    finally:
+        with _lock:
+            _stats['active'] -= 1
+            _stats['completed'] += 1
+            _stats['run_ms_total'] += (time.perf_counter() - started) * 1000
+
+
+def _run(func, *args):
+    with _lock:
+        queued = _stats['in_flight'] - _stats['active']
+        if queued >= PASSWORD_HASH_MAX_QUEUE:
+            _stats['rejected'] += 1
+            raise PasswordHasherBusy('password hashing queue is full')
+        _stats['in_flight'] += 1
+        _stats['max_queue_seen'] = max(_stats['max_queue_seen'], queued + 1)
+    queued_at = time.perf_counter()
+    try:
+        if _use_tpool():
+            from eventlet import tpool
+            with _get_green_slots():
+                return tpool.execute(_timed, func, args, queued_at)
+        return _get_executor().submit(_timed, func, args, queued_at).result()
+    finally:
+        with _lock:
+            _stats['in_flight'] -= 1
+
+
+def _normalized_method(method):
+    # Expand werkzeug's shorthand so stored hashes can be compared against it
+    name, *args = str(method or 'scrypt').split(':')
+    if name == 'scrypt':
+        n, r, p = (args + [None, None, None])[:3] if args else (2**15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    return str(method)
+
+
+_target_method = _normalized_method(PASSWORD_HASH_METHOD)
+_dummy_hash = None
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, _target_method)
+
+
+def verify_password(pwhash, password):
+    if not pwhash or password is None:
+        return False
+    return bool(_run(check_password_hash, pwhash, password))
+
+
+def verify_dummy_password(password):
+    # Spend the same time as a real check when the account does not exist
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password('not_the_real_password_123!')
+    verify_password(_dummy_hash, password or '')
+
+
+def needs_rehash(pwhash):
+    return bool(pwhash) and str(pwhash).split('$', 1)[0] != _target_method
+
+
+def verify_and_upgrade_password(user, password):
+    # Check a login password and re-hash it with the current cost parameters
+    # if the stored hash is outdated (caller commits)
+    if not verify_password(user.password, password):
+        return False
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        with _lock:
+            _stats['rehashed'] += 1
+    return True
+
+
+def get_hasher_stats():
+    with _lock:
+        stats = dict(_stats)
+    completed = stats['completed'] or 1
+    return {
+        'method': _target_method,
+        'workers': PASSWORD_HASH_WORKERS,
+        'max_queue': PASSWORD_HASH_MAX_QUEUE,
+        'active': stats['active'],
+        'queued': max(0, stats['in_flight'] - stats['active']),
+        'max_queue_seen': stats['max_queue_seen'],
+        'completed': stats['completed'],
+        'rejected': stats['rejected'],
+        'rehashed': stats['rehashed'],
+        'avg_wait_ms': round(stats['wait_ms_total'] / completed, 2),
+        'avg_run_ms': round(stats['run_ms_total'] / completed, 2),
+    }
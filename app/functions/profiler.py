@@ -0,0 +1,189 @@
+# Sampling profiler for live workers
+#
+# When a worker pins a CPU, restarting it under a profiler loses the state
+# that caused it. This sampler runs inside the worker instead. A native
+# thread (the app does not monkey-patch, so threading.Thread is a real OS
+# thread and keeps getting the GIL while the hub is busy) reads
+# sys._current_frames() at a fixed rate. The frame of the eventlet hub
+# thread is the greenlet running at that moment, so CPU time spent by
+# request, socket and background greenlets is attributed to their stacks.
+# Samples whose innermost frame is an idle wait (hub poll, condition wait,
+# sleep) are skipped unless include_idle is set.
+#
+# Output is the collapsed-stack format ("thread;outer;...;inner count" per
+# line) read by flamegraph.pl, speedscope and inferno.
+#
+# run_profile() serves the admin endpoint: one on-demand profile at a time,
+# and the request greenlet yields while the native thread samples.
+# With PROFILER_CONTINUOUS, a low-rate sampler writes one file per
+# PROFILER_WINDOW_SECONDS into PROFILER_DIR and keeps the newest
+# PROFILER_KEEP_FILES. That covers a hub stuck so hard it cannot serve the
+# endpoint.
+
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from app.functions.logs import get_logger
+from config import (
+    PROFILER_MAX_SECONDS, PROFILER_DEFAULT_HZ, PROFILER_CONTINUOUS_HZ, PROFILER_WINDOW_SECONDS,
+    PROFILER_DIR, PROFILER_KEEP_FILES
+)
+
+log = get_logger('profiler')
+
+MAX_HZ = 1000
+# Innermost Python frames that mean "blocked, not using CPU"
+IDLE_FUNCTIONS = frozenset(('wait', 'select', 'poll', 'sleep', 'accept', 'readinto', '_wait_for_tstate_lock'))
+PROFILE_SUFFIX = '.collapsed'
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_on_demand = threading.Lock()
+_labels = {}  # code object -> frame label
+_continuous_thread = None
+_continuous_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    # Raised when an on-demand profile is already running
+    pass
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(ROOT_DIR + os.sep):
+            path = os.path.relpath(path, ROOT_DIR)
+        else:
+            path = '/'.join(path.replace('\\', '/').split('/')[-2:])
+        label = f'{code.co_name} ({path}:{code.co_firstlineno})'
+        _labels[code] = label
+    return label
+
+
+class StackSampler:
+    def __init__(self, hz, include_idle=False):
+        self.interval = 1.0 / max(1.0, min(float(hz), MAX_HZ))
+        self.include_idle = include_idle
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+
+    def sample_once(self):
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if not self.include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                continue
+            parts = []
+            while frame is not None:
+                parts.append(_label(frame.f_code))
+                frame = frame.f_back
+            parts.append(names.get(ident, f'thread-{ident}'))
+            parts.reverse()
+            self.counts[';'.join(parts)] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        # Sample for `seconds`; meant for a native thread
+        self.started_at = time.time()
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            self.sample_once()
+            time.sleep(self.interval)
+        self.duration = time.perf_counter() - started
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.counts.items()))
+
+
+def _cooperative_sleep(seconds):
+    from app.extensions import socketio
+    socketio.sleep(seconds)
+
+
+def run_profile(seconds, hz=None, include_idle=False):
+    # Sample all threads for `seconds`; raises ProfilerBusy if another profile is running
+    seconds = max(0.1, min(float(seconds), PROFILER_MAX_SECONDS))
+    if not _on_demand.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        sampler = StackSampler(hz or PROFILER_DEFAULT_HZ, include_idle=include_idle)
+        thread = threading.Thread(target=sampler.run, args=(seconds,), name='profiler', daemon=True)
+        thread.start()
+        while thread.is_alive():
+            _cooperative_sleep(0.05)
+        log.info('profile.done', seconds=round(sampler.duration, 2), samples=sampler.samples,
+                 stacks=len(sampler.counts))
+        return sampler
+    finally:
+        _on_demand.release()
+
+
+def profile_dir():
+    return PROFILER_DIR if os.path.isabs(PROFILER_DIR) else os.path.join(ROOT_DIR, PROFILER_DIR)
+
+
+def list_profiles():
+    # Rolling profiles written by the continuous sampler, newest first
+    directory = profile_dir()
+    try:
+        names = [n for n in os.listdir(directory) if n.startswith('profile-') and n.endswith(PROFILE_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    entries = []
+    for name in names:
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        entries.append({'name': name, 'size': st.st_size, 'modified_at': datetime.utcfromtimestamp(st.st_mtime).isoformat()})
+    entries.sort(key=lambda e: e['modified_at'], reverse=True)
+    return entries
+
+
+def _write_profile(sampler):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.utcfromtimestamp(sampler.started_at).strftime('%Y%m%dT%H%M%SZ')
+    name = f'profile-{socket.gethostname()}-{os.getpid()}-{stamp}{PROFILE_SUFFIX}'
+    tmp_path = os.path.join(directory, name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(sampler.collapsed())
+    os.replace(tmp_path, os.path.join(directory, name))
+    for entry in list_profiles()[max(1, PROFILER_KEEP_FILES):]:
+        try:
+            os.remove(os.path.join(directory, entry['name']))
+        except OSError:
+            pass
+
+
+def _continuous_loop():
+    while True:
+        sampler = StackSampler(PROFILER_CONTINUOUS_HZ)
+        sampler.run(max(1.0, PROFILER_WINDOW_SECONDS))
+        try:
+            _write_profile(sampler)
+        except Exception as e:
+            log.error('profile.write_failed', error=str(e))
+
+
+def start_continuous_profiler():
+    # Start the low-rate rolling profiler thread (idempotent)
+    global _continuous_thread
+    with _continuous_lock:
+        if _continuous_thread is not None:
+            return
+        _continuous_thread = threading.Thread(target=_continuous_loop, name='profiler-continuous', daemon=True)
+        _continuous_thread.start()
+    log.info('profile.continuous_started', hz=PROFILER_CONTINUOUS_HZ, window_seconds=PROFILER_WINDOW_SECONDS,
+             directory=profile_dir())
@@ -0,0 +1,278 @@
+# Chunked, set-based purges run as background jobs
+#
+# Removing a user's messages from a room (ban with delete_messages, or the
+# admin "delete messages" action) walks the user's messages in id order, a
+# JOB_CHUNK_SIZE batch at a time, and deletes each batch with a few set-based
+# statements: reactions and reaction counters of the batch go first, read
+# markers pointing at a purged message move back to the newest surviving
+# message of the channel, and replies to purged messages lose their
+# reply_to_id. Rooms are told with `bulk_messages_deleted` once the job is done.
+#
+# Deleting a room or an account works the same way instead of cascading
+# through ORM relationships (which loaded every channel, message and member
+# into memory inside one transaction). The request only tombstones the row
+# (deleted_at) so it disappears from listings at once; the job then removes
+# dependent rows table by table in chunks and deletes the row itself last.
+#
+# Storage accounting follows in the same transactions: uploads of deleted
+# messages that nothing else references are credited back to their owners,
+# and the room and account cascades settle the stored_file rows charged to the
+# deleted owner (released, or detached when still in use elsewhere) and drop
+# its storage_usage counter.
+
+from datetime import datetime
+from sqlalchemy import func, or_
+from app.extensions import db, socketio
+from app.models import (
+    Message, MessageReaction, MessageReactionCount, ReadMessage, Channel, Room, Member, Role,
+    MemberRole, RoleMentionPermission, RoomBan, User, UserMusic, Friendship, FriendRequest, IpBan,
+    StoredFile, StorageUsage
+)
+from app.functions.jobs import job_handler, phased_step, enqueue_job
+from app.functions.reactions import _adjust_count
+from app.functions.storage import OWNER_USER, OWNER_ROOM
+from app.functions.uploads_gc import release_unreferenced_uploads
+
+PURGE_USER_MESSAGES = 'purge_user_messages'
+DELETE_ROOM = 'delete_room'
+DELETE_USER_ACCOUNT = 'delete_user_account'
+
+
+def delete_message_rows(message_ids):
+    # Delete a batch of messages and everything that points at them (caller commits)
+    if not message_ids:
+        return 0
+    ids = list(message_ids)
+    file_urls = [
+        row[0] for row in
+        db.session.query(Message.file_url).filter(Message.id.in_(ids), Message.file_url.isnot(None)).all()
+    ]
+    MessageReaction.query.filter(MessageReaction.message_id.in_(ids)).delete(synchronize_session=False)
+    MessageReactionCount.query.filter(MessageReactionCount.message_id.in_(ids)).delete(synchronize_session=False)
+
+    survivor = (
+        db.session.query(func.max(Message.id))
+        .filter(
+            Message.channel_id == ReadMessage.channel_id,
+            Message.id < ReadMessage.last_read_message_id,
+            Message.id.notin_(ids),
+        )
+        .scalar_subquery()
+    )
+    ReadMessage.query.filter(ReadMessage.last_read_message_id.in_(ids)).update(
+        {ReadMessage.last_read_message_id: survivor}, synchronize_session=False
+    )
+    Message.query.filter(Message.reply_to_id.in_(ids), Message.id.notin_(ids)).update(
+        {Message.reply_to_id: None}, synchronize_session=False
+    )
+    deleted = Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+    release_unreferenced_uploads(file_urls)
+    return deleted
+
+
+def _user_messages_query(user_id, room_id):
+    query = db.session.query(Message.id).filter(Message.user_id == user_id)
+    if room_id:
+        channel_ids = db.session.query(Channel.id).filter(Channel.room_id == room_id)
+        query = query.filter(Message.channel_id.in_(channel_ids))
+    return query
+
+
+def _notify_messages_purged(job, params):
+    for room_id in params.get('notify_room_ids') or []:
+        try:
+            socketio.emit('bulk_messages_deleted', {
+                'user_id': params['user_id'],
+                'room_id': room_id,
+                'deleted': job.progress,
+                'job_id': job.id,
+            }, room=str(room_id))
+        except Exception:
+            pass
+
+
+def _user_messages_phase(job, params, limit):
+    ids = [
+        row[0] for row in
+        _user_messages_query(params['user_id'], params.get('room_id'))
+        .filter(Message.id > job.cursor)
+        .order_by(Message.id)
+        .limit(limit)
+        .all()
+    ]
+    if not ids:
+        return 0
+    delete_message_rows(ids)
+    job.cursor = ids[-1]
+    return len(ids)
+
+
+job_handler(PURGE_USER_MESSAGES, finish=_notify_messages_purged)(phased_step(_user_messages_phase))
+
+
+def start_user_message_purge(user_id, room_id=None, created_by_id=None, notify_room_ids=None):
+    # Queue removal of a user's messages in one room (or everywhere when room_id is None)
+    total = _user_messages_query(user_id, room_id).count()
+    return enqueue_job(
+        PURGE_USER_MESSAGES,
+        {
+            'user_id': int(user_id),
+            'room_id': int(room_id) if room_id else None,
+            'notify_room_ids': sorted({int(r) for r in (notify_room_ids or ([room_id] if room_id else []))}),
+        },
+        created_by_id=created_by_id,
+        total=total,
+    )
+
+
+def _delete_chunk(model, condition, job, limit):
+    # Delete up to `limit` rows of model matching condition, in id order
+    ids = [
+        row[0] for row in
+        db.session.query(model.id).filter(condition, model.id > job.cursor).order_by(model.id).limit(limit).all()
+    ]
+    if not ids:
+        return 0
+    model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+    job.cursor = ids[-1]
+    return len(ids)
+
+
+def _settle_owned_uploads(column, owner_id, job, limit):
+    # Release a chunk of the uploads charged to a deleted owner; ones still in use
+    # elsewhere stay charged to their other owner only
+    rows = (
+        StoredFile.query.filter(column == owner_id, StoredFile.id > job.cursor)
+        .order_by(StoredFile.id)
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return 0
+    job.cursor = rows[-1].id
+    still_used = release_unreferenced_uploads([row.url for row in rows])
+    StoredFile.query.filter(StoredFile.url.in_(still_used), column == owner_id).update(
+        {column: None}, synchronize_session=False
+    )
+    return len(rows)
+
+
+def _delete_usage_counter(owner_type, owner_id):
+    StorageUsage.query.filter(
+        StorageUsage.owner_type == owner_type, StorageUsage.owner_id == owner_id
+    ).delete(synchronize_session=False)
+    return 0
+
+
+def _room_channel_ids(room_id):
+    return db.session.query(Channel.id).filter(Channel.room_id == room_id)
+
+
+def _room_messages_phase(job, params, limit):
+    ids = [
+        row[0] for row in
+        db.session.query(Message.id)
+        .filter(Message.channel_id.in_(_room_channel_ids(params['room_id'])), Message.id > job.cursor)
+        .order_by(Message.id)
+        .limit(limit)
+        .all()
+    ]
+    if not ids:
+        return 0
+    delete_message_rows(ids)
+    job.cursor = ids[-1]
+    return len(ids)
+
+
+def _delete_room_row(job, params, limit):
+    room_id = params['room_id']
+    Room.query.filter(Room.linked_chat_id == room_id).update({Room.linked_chat_id: None}, synchronize_session=False)
+    Room.query.filter(Room.id == room_id).delete(synchronize_session=False)
+    return 0
+
+
+_delete_room_step = phased_step(
+    lambda job, params, limit: _delete_chunk(Member, Member.room_id == params['room_id'], job, limit),
+    _room_messages_phase,
+    lambda job, params, limit: _delete_chunk(
+        ReadMessage, ReadMessage.channel_id.in_(_room_channel_ids(params['room_id'])), job, limit),
+    lambda job, params, limit: _delete_chunk(MemberRole, MemberRole.room_id == params['room_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(
+        RoleMentionPermission, RoleMentionPermission.room_id == params['room_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(Role, Role.room_id == params['room_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(RoomBan, RoomBan.room_id == params['room_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(Channel, Channel.room_id == params['room_id'], job, limit),
+    _delete_room_row,
+    lambda job, params, limit: _settle_owned_uploads(StoredFile.room_id, params['room_id'], job, limit),
+    lambda job, params, limit: _delete_usage_counter(OWNER_ROOM, params['room_id']),
+)
+job_handler(DELETE_ROOM)(_delete_room_step)
+
+
+def start_room_deletion(room, created_by_id=None):
+    # Tombstone a room now and remove its contents in the background (commits)
+    room.deleted_at = datetime.utcnow()
+    room.invite_token = None
+    room.is_public = False
+    db.session.commit()
+    return enqueue_job(DELETE_ROOM, {'room_id': room.id}, created_by_id=created_by_id)
+
+
+def _user_reactions_phase(job, params, limit):
+    # Delete a chunk of the user's reactions and credit the counters back
+    rows = (
+        db.session.query(MessageReaction.id, MessageReaction.message_id, MessageReaction.emoji)
+        .filter(MessageReaction.user_id == params['user_id'], MessageReaction.id > job.cursor)
+        .order_by(MessageReaction.id)
+        .limit(limit)
+        .all()
+    )
+    if not rows:
+        return 0
+    MessageReaction.query.filter(MessageReaction.id.in_([r[0] for r in rows])).delete(synchronize_session=False)
+    grouped = {}
+    for _id, message_id, emoji in rows:
+        grouped[(message_id, emoji)] = grouped.get((message_id, emoji), 0) + 1
+    for (message_id, emoji), n in grouped.items():
+        _adjust_count(message_id, emoji, -n)
+    job.cursor = rows[-1][0]
+    return len(rows)
+
+
+def _delete_user_row(job, params, limit):
+    from app.functions.user_cache import invalidate_cached_user
+    user_id = params['user_id']
+    User.query.filter(User.id == user_id).delete(synchronize_session=False)
+    invalidate_cached_user(user_id)
+    return 0
+
+
+_delete_user_step = phased_step(
+    lambda job, params, limit: _delete_chunk(Member, Member.user_id == params['user_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(MemberRole, MemberRole.user_id == params['user_id'], job, limit),
+    _user_reactions_phase,
+    _user_messages_phase,
+    lambda job, params, limit: _delete_chunk(ReadMessage, ReadMessage.user_id == params['user_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(UserMusic, UserMusic.user_id == params['user_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(
+        Friendship, or_(Friendship.user_low_id == params['user_id'], Friendship.user_high_id == params['user_id']),
+        job, limit),
+    lambda job, params, limit: _delete_chunk(
+        FriendRequest, or_(FriendRequest.from_user_id == params['user_id'], FriendRequest.to_user_id == params['user_id']),
+        job, limit),
+    lambda job, params, limit: _delete_chunk(RoomBan, RoomBan.user_id == params['user_id'], job, limit),
+    lambda job, params, limit: _delete_chunk(IpBan, IpBan.user_id == params['user_id'], job, limit),
+    _delete_user_row,
+    lambda job, params, limit: _settle_owned_uploads(StoredFile.user_id, params['user_id'], job, limit),
+    lambda job, params, limit: _delete_usage_counter(OWNER_USER, params['user_id']),
+)
+job_handler(DELETE_USER_ACCOUNT)(_delete_user_step)
+
+
+def start_account_deletion(user):
+    # Tombstone an account now (it can no longer log in or load) and remove its data in the background (commits)
+    user.deleted_at = datetime.utcnow()
+    user.password = ''
+    user.presence_status = 'offline'
+    db.session.commit()
+    return enqueue_job(DELETE_USER_ACCOUNT, {'user_id': user.id}, created_by_id=user.id)
@@ -0,0 +1,92 @@
+# Query-count budgets for endpoints and socket handlers
+#
+# N+1 patterns (one statement per room, member or message in a listing) crept
+# into several endpoints without anyone noticing, because the page still
+# rendered fine on a small database. Views now declare how many SQL
+# statements they may issue with @query_budget(n). The count comes from the
+# per-request statement scope kept by app.functions.metrics, so it covers
+# everything the view runs, including lazy loads. Going over budget raises
+# QueryBudgetExceeded when the app is in testing mode (or QUERY_BUDGET_ENFORCE
+# is set), so the test suite fails on the regression. In production it is
+# logged and counted instead.
+#
+# assert_max_queries() is the test-side helper: it counts every statement the
+# engine runs inside the block, e.g. around a test client call.
+
+import functools
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request
+from sqlalchemy import event
+from app.extensions import db
+from app.functions.logs import get_logger
+from app.functions.metrics import counter, db_scope_queries, _begin_db_scope, _end_db_scope
+from config import QUERY_BUDGET_ENFORCE
+
+log = get_logger('db')
+
+BUDGET_EXCEEDED = counter(
+    'boxchat_query_budget_exceeded_total', 'Views that issued more SQL statements than their budget', ('view',)
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, label, limit, used, statements=()):
+        message = f"{label} issued {used} SQL statements, budget is {limit}"
+        if statements:
+            message += ':\n' + '\n'.join(f'  {" ".join(s.split())[:200]}' for s in statements)
+        super().__init__(message)
+        self.label = label
+        self.limit = limit
+        self.used = used
+
+
+def _enforcing():
+    return QUERY_BUDGET_ENFORCE or current_app.testing
+
+
+def query_budget(limit):
+    # Decorator: fail (tests) or log (production) when the view issues more than `limit` statements
+    def decorator(view):
+        label = view.__name__
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            owns_scope = db_scope_queries() is None
+            if owns_scope:
+                origin = f'{request.method} {request.path}' if has_request_context() else label
+                _begin_db_scope(origin)
+            before = db_scope_queries()
+            try:
+                result = view(*args, **kwargs)
+            finally:
+                used = db_scope_queries() - before
+                if owns_scope:
+                    _end_db_scope()
+            if used > limit:
+                if _enforcing():
+                    raise QueryBudgetExceeded(label, limit, used)
+                BUDGET_EXCEEDED.inc(view=label)
+                log.warning('query_budget.exceeded', view=label, budget=limit, statements=used)
+            return result
+
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def assert_max_queries(limit, label='block'):
+    # Count every statement run inside the block and raise if there were more than `limit`
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'after_cursor_execute', _record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'after_cursor_execute', _record)
+    if len(statements) > limit:
+        raise QueryBudgetExceeded(label, limit, len(statements), statements)
@@ -0,0 +1,83 @@
+# Message reaction toggles with denormalized per-(message, emoji) counters
+#
+# A toggle used to re-select every reaction of the message and broadcast the
+# full emoji -> usernames map, which grows with the message's popularity. Now
+# a toggle is one indexed lookup plus one counter update, and clients receive
+# only the delta (emoji, user, action) together with the new count.
+
+from sqlalchemy import update, delete, func
+from app.extensions import db
+from app.models import MessageReaction, MessageReactionCount
+
+MAX_BATCH_TOGGLES = 50
+
+
+def _adjust_count(message_id, emoji, delta):
+    # Atomic increment; creates the counter row on first reaction and drops it at zero
+    result = db.session.execute(
+        update(MessageReactionCount)
+        .where(MessageReactionCount.message_id == message_id, MessageReactionCount.emoji == emoji)
+        .values(count=MessageReactionCount.count + int(delta))
+    )
+    if not result.rowcount:
+        if delta <= 0:
+            return 0
+        db.session.add(MessageReactionCount(message_id=message_id, emoji=emoji, count=int(delta)))
+        db.session.flush()
+        return int(delta)
+    count = db.session.query(MessageReactionCount.count).filter_by(message_id=message_id, emoji=emoji).scalar() or 0
+    if count <= 0:
+        db.session.execute(
+            delete(MessageReactionCount)
+            .where(MessageReactionCount.message_id == message_id, MessageReactionCount.emoji == emoji)
+        )
+        return 0
+    return int(count)
+
+
+def toggle_message_reaction(message_id, user_id, emoji, reaction_type='emoji'):
+    # Add or remove one user's reaction (caller commits)
+    # Returns (action, count) where count is the new total for this emoji
+    existing = MessageReaction.query.filter_by(
+        message_id=message_id,
+        user_id=user_id,
+        emoji=emoji
+    ).first()
+
+    if existing:
+        db.session.delete(existing)
+        db.session.flush()
+        return 'removed', _adjust_count(message_id, emoji, -1)
+
+    db.session.add(MessageReaction(
+        message_id=message_id,
+        user_id=user_id,
+        emoji=emoji,
+        reaction_type=reaction_type
+    ))
+    db.session.flush()
+    return 'added', _adjust_count(message_id, emoji, 1)
+
+
+def reaction_delta_payload(message_id, emoji, action, user, count):
+    # Socket payload for `reactions_updated`: only what changed
+    return {
+        'message_id': message_id,
+        'emoji': emoji,
+        'action': action,
+        'user': user.username,
+        'user_id': user.id,
+        'count': count,
+    }
+
+
+def remove_user_reactions(user_id):
+    # Delete all reactions of a user and credit the counters back (caller commits)
+    grouped = db.session.query(
+        MessageReaction.message_id, MessageReaction.emoji, func.count(MessageReaction.id)
+    ).filter(MessageReaction.user_id == user_id).group_by(
+        MessageReaction.message_id, MessageReaction.emoji
+    ).all()
+    MessageReaction.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    for message_id, emoji, n in grouped:
+        _adjust_count(message_id, emoji, -int(n))
@@ -77,17 +77,6 @@ def ensure_user_default_roles(user_id: int, room_id: int):
         _ensure_member_role_link(user_id, room_id, admin.id)
 
 
-def seed_roles_for_existing_rooms():
-    members = Member.query.all()
-    seen_room_ids = set()
-    for m in members:
-        if m.room_id not in seen_room_ids:
-            ensure_default_roles(m.room_id)
-            seen_room_ids.add(m.room_id)
-        ensure_user_default_roles(m.user_id, m.room_id)
-    db.session.commit()
-
-
 def get_user_role_ids(user_id: int, room_id: int):
     links = MemberRole.query.filter_by(user_id=user_id, room_id=room_id).all()
     return {link.role_id for link in links}
@@ -120,6 +109,27 @@ def get_user_permissions(user_id: int, room_id: int):
     return permissions
 
 
+def get_user_permissions_for_rooms(user_id: int, members):
+    # get_user_permissions for many rooms at once; members are the user's Member rows
+    permissions = {}
+    role_rooms = []
+    for member in members:
+        if member.role in ('owner', 'admin'):
+            permissions[member.room_id] = set(ROLE_PERMISSION_KEYS)
+        else:
+            permissions[member.room_id] = set()
+            role_rooms.append(member.room_id)
+    if role_rooms:
+        roles = (
+            Role.query.join(MemberRole, MemberRole.role_id == Role.id)
+            .filter(MemberRole.user_id == user_id, MemberRole.room_id.in_(role_rooms), Role.room_id == MemberRole.room_id)
+            .all()
+        )
+        for role in roles:
+            permissions[role.room_id] |= parse_role_permissions(role)
+    return permissions
+
+
 def user_has_room_permission(user_id: int, room_id: int, permission_key: str):
     if permission_key not in ROLE_PERMISSION_KEYS:
         return False
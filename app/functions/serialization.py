@@ -0,0 +1,347 @@
+# Wire serialization for REST responses and Socket.IO packets
+#
+# jsonify() and every Socket.IO emit went through stdlib json. Socket.IO
+# events such as message_notification and presence_updated were emitted once
+# per recipient room, so the same payload was encoded again for each one, and
+# the outbox dispatcher decoded each stored payload only to encode it again.
+#
+#   - REST: FastJSONProvider renders jsonify() with orjson (UTF-8, no \u
+#     escapes). Dates, decimals and other types keep Flask's conversions.
+#     Anything orjson rejects falls back to stdlib json.
+#   - Socket.IO: WirePacket encodes JSON packets with orjson. A client that
+#     connects with ?serializer=msgpack (socket.io-msgpack-parser on the JS
+#     side) gets binary msgpack packets, and its binary packets are decoded
+#     as msgpack. Other clients on the same server keep JSON.
+#   - WireManager encodes a broadcast at most once per wire format, and only
+#     when the first recipient that needs that format is found. An emit to a
+#     room with no connected clients, such as an offline user's personal room,
+#     costs nothing. Emitting to a list of rooms sends one packet per client.
+#   - RawJSON wraps payload text that is already encoded (outbox rows). JSON
+#     clients get it without a decode/encode round trip.
+#   - EventBatch carries several payloads of one event for one room. Clients
+#     that connect with ?batch=1 get them as one frame. Other clients get the
+#     usual single events, in the same order.
+#
+# orjson and msgpack are optional. Without orjson, REST and Socket.IO use
+# stdlib json. Without msgpack (or with SOCKET_MSGPACK off), every client gets
+# JSON and binary packets from ?serializer=msgpack clients are rejected.
+# WireManager replaces python-socketio internals (Server._send_packet and
+# _send_eio_packet, Manager.get_participants). If a python-socketio release
+# lacks any of them, the stock manager and packet class are used instead, and
+# the outbox emits decoded payloads one event at a time.
+
+import json
+import socketio
+from urllib.parse import parse_qs
+from engineio import packet as eio_packet
+from flask.json.provider import DefaultJSONProvider
+from socketio import Manager, packet as sio_packet
+from app.functions.logs import get_logger
+from app.functions.metrics import counter
+from config import FAST_JSON, SOCKET_MSGPACK
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+log = get_logger('serialization')
+
+_wire_manager_active = False
+
+CLIENT_OPTIONS_ENVIRON_KEY = 'boxchat.wire_options'
+DEFAULT_CLIENT_OPTIONS = ('json', False)  # (serializer, accepts batched frames)
+
+PACKETS_ENCODED = counter(
+    'boxchat_socket_packets_encoded_total', 'Socket.IO event packets encoded, once per broadcast and wire format',
+    ('serializer',)
+)
+BYTES_ENCODED = counter(
+    'boxchat_socket_encoded_bytes_total', 'Size of encoded Socket.IO event packets (each broadcast counted once)',
+    ('serializer',)
+)
+
+
+def fast_json_enabled():
+    return FAST_JSON and orjson is not None
+
+
+def msgpack_enabled():
+    return SOCKET_MSGPACK and msgpack is not None
+
+
+def _json_default(obj):
+    # Dates and times as ISO 8601, the way orjson writes them natively; anything else as str()
+    isoformat = getattr(obj, 'isoformat', None)
+    return isoformat() if callable(isoformat) else str(obj)
+
+
+def dumps(obj):
+    # Compact JSON text; unknown types are stringified (as json.dumps(default=str) did)
+    if fast_json_enabled():
+        try:
+            return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(s):
+    return orjson.loads(s) if fast_json_enabled() else json.loads(s)
+
+
+class RawJSON:
+    # Payload that is already JSON text; emitted as-is to JSON clients
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def value(self):
+        return loads(self.text)
+
+
+class EventBatch:
+    # Payloads (dicts or RawJSON) of `single_event` for one room, in order
+    __slots__ = ('single_event', 'items', 'key')
+
+    def __init__(self, single_event, items, key='messages'):
+        self.single_event = single_event
+        self.items = list(items)
+        self.key = key
+
+    def frame(self):
+        # {key: [payload, ...]}, joined as text when every payload is already encoded
+        if all(isinstance(item, RawJSON) for item in self.items):
+            return RawJSON(f'{{{json.dumps(self.key)}:[' + ','.join(item.text for item in self.items) + ']}')
+        return {self.key: [item.value() if isinstance(item, RawJSON) else item for item in self.items]}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # jsonify() and request.get_json() through orjson
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def _encode(self, obj):
+        # bytes, or None when orjson cannot encode the object (stdlib json takes over)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options())
+        except TypeError:
+            return None
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs:
+            encoded = self._encode(obj)
+            if encoded is not None:
+                return encoded.decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        encoded = self._encode(obj)
+        if encoded is None:
+            return super().response(obj)
+        return self._app.response_class(encoded + b'\n', mimetype=self.mimetype)
+
+
+class _SocketJSON:
+    # json-module interface used by python-socketio packets
+    @staticmethod
+    def dumps(obj, **kwargs):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            return json.dumps(obj, default=_json_default, separators=(',', ':'))
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
+class WirePacket(sio_packet.Packet):
+    # JSON text packets, plus msgpack for clients that negotiated it
+    _encoded_data = None
+
+    if fast_json_enabled():
+        json = _SocketJSON
+
+    def __init__(self, packet_type=sio_packet.EVENT, data=None, namespace=None, id=None, binary=None,
+                 encoded_packet=None):
+        # The base class walks the payload in Python looking for bytes before
+        # encoding it. orjson rejects bytes, so one successful orjson encode
+        # answers that question, and encode() reuses the text.
+        if binary is None and encoded_packet is None and data is not None and fast_json_enabled():
+            try:
+                self._encoded_data = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+                binary = False
+            except TypeError:
+                pass
+        super().__init__(packet_type, data, namespace, id, binary, encoded_packet)
+
+    def encode(self):
+        if self._encoded_data is None:
+            return super().encode()
+        encoded = str(self.packet_type)
+        if self.namespace is not None and self.namespace != '/':
+            encoded += self.namespace + ','
+        if self.id is not None:
+            encoded += str(self.id)
+        return encoded + self._encoded_data
+
+    def decode(self, encoded_packet):
+        # Top-level binary frames only come from msgpack clients: JSON clients
+        # send binary data as attachments, which never reach decode()
+        if not isinstance(encoded_packet, bytes):
+            return super().decode(encoded_packet)
+        if not msgpack_enabled():
+            raise ValueError('msgpack packets are not enabled')
+        decoded = msgpack.loads(encoded_packet)
+        self.packet_type = decoded['type']
+        self.data = decoded.get('data')
+        self.id = decoded.get('id')
+        self.namespace = decoded.get('nsp') or '/'
+        return 0
+
+    def encode_msgpack(self):
+        packet_type = self.packet_type
+        if packet_type == sio_packet.BINARY_EVENT:
+            packet_type = sio_packet.EVENT
+        elif packet_type == sio_packet.BINARY_ACK:
+            packet_type = sio_packet.ACK
+        encoded = {'type': packet_type, 'data': self.data, 'nsp': self.namespace or '/'}
+        if self.id is not None:
+            encoded['id'] = self.id
+        return msgpack.dumps(encoded, default=str)
+
+
+class WireManager(Manager):
+    # In-process client manager that encodes per wire format, not per recipient
+    def set_server(self, server):
+        super().set_server(server)
+        send_packet = server._send_packet
+
+        def _send_packet(eio_sid, pkt):
+            # Connect/ack/disconnect packets addressed to one client
+            if self.serializer(eio_sid) == 'msgpack':
+                server.eio.send(eio_sid, pkt.encode_msgpack())
+            else:
+                send_packet(eio_sid, pkt)
+
+        server._send_packet = _send_packet
+
+    def client_options(self, eio_sid):
+        # (serializer, accepts batched frames) from the handshake query, kept in the connection's environ
+        environ = self.server.environ.get(eio_sid)
+        if environ is None:
+            return DEFAULT_CLIENT_OPTIONS
+        options = environ.get(CLIENT_OPTIONS_ENVIRON_KEY)
+        if options is None:
+            query = parse_qs(environ.get('QUERY_STRING', ''))
+            options = (
+                'msgpack' if 'msgpack' in query.get('serializer', ()) and msgpack_enabled() else 'json',
+                query.get('batch', ('0',))[-1] == '1',
+            )
+            environ[CLIENT_OPTIONS_ENVIRON_KEY] = options
+        return options
+
+    def serializer(self, eio_sid):
+        return self.client_options(eio_sid)[0]
+
+    def _encode(self, fmt, event, data, namespace):
+        # Engine.IO packets for one broadcast in one wire format
+        if fmt == 'json' and len(data) == 1 and isinstance(data[0], RawJSON):
+            prefix = '2' if namespace in (None, '/') else f'2{namespace},'
+            encoded = [f'{prefix}[{json.dumps(event)},{data[0].text}]']
+        else:
+            data = [d.value() if isinstance(d, RawJSON) else d for d in data]
+            if fmt == 'msgpack':
+                # msgpack carries bytes natively: no binary check or JSON pre-encode needed
+                pkt = self.server.packet_class(sio_packet.EVENT, namespace=namespace, data=[event] + data, binary=False)
+                encoded = [pkt.encode_msgpack()]
+            else:
+                pkt = self.server.packet_class(sio_packet.EVENT, namespace=namespace, data=[event] + data)
+                encoded = pkt.encode()
+            if not isinstance(encoded, list):
+                encoded = [encoded]
+        PACKETS_ENCODED.inc(serializer=fmt)
+        BYTES_ENCODED.inc(sum(len(p) for p in encoded), serializer=fmt)
+        return [eio_packet.Packet(eio_packet.MESSAGE, p) for p in encoded]
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        if isinstance(data, RawJSON) and callback:
+            data = data.value()
+        if callback:
+            # every recipient gets its own ack id, so there is nothing to share
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, to=to,
+                                **kwargs)
+        room = to or room
+        if namespace not in self.rooms:
+            return
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        batch = data[0] if len(data) == 1 and isinstance(data[0], EventBatch) else None
+        encoded = {}
+        for sid, eio_sid in self.get_participants(namespace, room):
+            if sid in skip_sid:
+                continue
+            options = self.client_options(eio_sid)
+            key = options if batch is not None else options[0]
+            packets = encoded.get(key)
+            if packets is None:
+                fmt, batches = options
+                if batch is None:
+                    packets = self._encode(fmt, event, data, namespace)
+                elif batches:
+                    packets = self._encode(fmt, event, [batch.frame()], namespace)
+                else:
+                    packets = [p for item in batch.items for p in self._encode(fmt, batch.single_event, [item], namespace)]
+                encoded[key] = packets
+            for p in packets:
+                self.server._send_eio_packet(eio_sid, p)
+
+
+def wire_manager_supported():
+    # Whether this python-socketio still has the internals WireManager overrides
+    return (callable(getattr(socketio.Server, '_send_packet', None))
+            and callable(getattr(socketio.Server, '_send_eio_packet', None))
+            and callable(getattr(Manager, 'get_participants', None)))
+
+
+def wire_manager_active():
+    # True once init_app installed WireManager; RawJSON and EventBatch payloads need it
+    return _wire_manager_active
+
+
+def init_app(flask_app):
+    # Install the fast JSON provider; returns the Socket.IO server options to pass to init_app
+    global _wire_manager_active
+    if fast_json_enabled():
+        flask_app.json = FastJSONProvider(flask_app)
+    if not wire_manager_supported():
+        log.warning('serialization.wire_manager_unsupported', socketio_version=getattr(socketio, '__version__', None))
+        return {}
+    if SOCKET_MSGPACK and msgpack is None:
+        log.info('serialization.msgpack_unavailable')
+    _wire_manager_active = True
+    return {'client_manager': WireManager(), 'serializer': WirePacket}
@@ -0,0 +1,138 @@
+# Per-user and per-room storage accounting and quotas
+#
+# Usage is kept as running counters in `storage_usage`, so quota checks and
+# "top consumers" listings are single indexed lookups instead of walking the
+# upload tree. Every saved upload gets a `stored_file` row that remembers whom
+# it was charged to; removing the file credits the same owners back. Counter
+# updates only touch the session, so they commit in the caller's transaction.
+#
+# An upload is charged with one conditional UPDATE per owner
+# (bytes_used + n <= quota), so concurrent uploads cannot all pass a check
+# made on a stale read and overshoot the quota together. Counter rows are
+# created with INSERT ... ON CONFLICT DO NOTHING, so two first uploads by the
+# same owner do not collide on uq_storage_usage_owner.
+
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+from app.extensions import db
+from app.models import StorageUsage, StoredFile
+from config import STORAGE_QUOTA_USER_BYTES, STORAGE_QUOTA_ROOM_BYTES
+
+OWNER_USER = 'user'
+OWNER_ROOM = 'room'
+
+_QUOTA_ERRORS = {OWNER_USER: 'storage quota exceeded', OWNER_ROOM: 'room storage quota exceeded'}
+
+
+def _quota_for(owner_type):
+    limit = STORAGE_QUOTA_USER_BYTES if owner_type == OWNER_USER else STORAGE_QUOTA_ROOM_BYTES
+    return int(limit) if limit and int(limit) > 0 else None
+
+
+def _ensure_counter(owner_type, owner_id):
+    db.session.execute(
+        insert(StorageUsage)
+        .values(owner_type=owner_type, owner_id=int(owner_id), bytes_used=0, file_count=0,
+                updated_at=db.func.now())
+        .on_conflict_do_nothing(index_elements=['owner_type', 'owner_id'])
+    )
+
+
+def _add_usage(owner_type, owner_id, delta_bytes, delta_files, limit=None):
+    # Atomic increment, refused (False) when it would take bytes_used over limit
+    if owner_id is None:
+        return True
+    _ensure_counter(owner_type, owner_id)
+    query = update(StorageUsage).where(
+        StorageUsage.owner_type == owner_type, StorageUsage.owner_id == int(owner_id)
+    )
+    if limit is not None:
+        query = query.where(StorageUsage.bytes_used + int(delta_bytes) <= limit)
+    result = db.session.execute(query.values(
+        bytes_used=StorageUsage.bytes_used + int(delta_bytes),
+        file_count=StorageUsage.file_count + int(delta_files),
+        updated_at=db.func.now(),
+    ))
+    return bool(result.rowcount)
+
+
+def get_usage_bytes(owner_type, owner_id):
+    if owner_id is None:
+        return 0
+    row = db.session.query(StorageUsage.bytes_used).filter_by(
+        owner_type=owner_type, owner_id=int(owner_id)
+    ).first()
+    return int(row[0] or 0) if row else 0
+
+
+def remaining_quota_bytes(user_id, room_id=None):
+    # Smallest remaining allowance across the user and (optional) room quotas.
+    # Returns None when no quota applies.
+    remaining = None
+    for owner_type, owner_id in ((OWNER_USER, user_id), (OWNER_ROOM, room_id)):
+        limit = _quota_for(owner_type)
+        if owner_id is None or limit is None:
+            continue
+        left = max(0, limit - get_usage_bytes(owner_type, owner_id))
+        remaining = left if remaining is None else min(remaining, left)
+    return remaining
+
+
+def check_upload_quota(user_id, room_id, incoming_bytes):
+    # Validate an upload of incoming_bytes against user/room quotas (advisory:
+    # charge_upload() is what enforces them)
+    # Returns (ok, error_message)
+    for owner_type, owner_id in ((OWNER_USER, user_id), (OWNER_ROOM, room_id)):
+        limit = _quota_for(owner_type)
+        if owner_id is None or limit is None or incoming_bytes is None:
+            continue
+        if get_usage_bytes(owner_type, owner_id) + int(incoming_bytes) > limit:
+            return False, _QUOTA_ERRORS[owner_type]
+    return True, ''
+
+
+def charge_upload(url, size_bytes, user_id, room_id=None):
+    # Charge a freshly saved upload to its owners unless that exceeds a quota (caller commits)
+    # Returns (ok, error_message); nothing is charged when ok is False
+    if not url or not str(url).startswith('/uploads/'):
+        return True, ''
+    size_bytes = int(size_bytes or 0)
+    charged = []
+    for owner_type, owner_id in ((OWNER_USER, user_id), (OWNER_ROOM, room_id)):
+        if not _add_usage(owner_type, owner_id, size_bytes, 1, _quota_for(owner_type)):
+            for done_type, done_id in charged:
+                _add_usage(done_type, done_id, -size_bytes, -1)
+            return False, _QUOTA_ERRORS[owner_type]
+        charged.append((owner_type, owner_id))
+    db.session.add(StoredFile(url=url, user_id=user_id, room_id=room_id, size_bytes=size_bytes))
+    return True, ''
+
+
+def release_upload(url):
+    # Credit a removed upload back to its owners (caller commits)
+    if not url:
+        return 0
+    stored = StoredFile.query.filter_by(url=url).first()
+    if not stored:
+        return 0
+    size_bytes = int(stored.size_bytes or 0)
+    _add_usage(OWNER_USER, stored.user_id, -size_bytes, -1)
+    _add_usage(OWNER_ROOM, stored.room_id, -size_bytes, -1)
+    db.session.delete(stored)
+    return size_bytes
+
+
+def top_consumers(owner_type, limit=20):
+    rows = StorageUsage.query.filter(
+        StorageUsage.owner_type == owner_type,
+        StorageUsage.bytes_used > 0,
+    ).order_by(StorageUsage.bytes_used.desc()).limit(int(limit)).all()
+    return [
+        {
+            'owner_id': row.owner_id,
+            'bytes_used': int(row.bytes_used or 0),
+            'file_count': int(row.file_count or 0),
+            'quota_bytes': _quota_for(owner_type),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,230 @@
+# Orphaned upload garbage collector
+#
+# Files under uploads/ outlive the rows that point at them (deleted messages,
+# rooms, avatars, accounts). The GC walks the upload tree in sorted order, a
+# bounded batch at a time, and checks each batch against every column that
+# can reference an upload. The position in the tree is persisted in
+# `upload_gc_state`, so repeated runs continue where the previous one stopped
+# and a full pass never holds a long table scan or a long transaction.
+#
+# Each upload directory is listed and sorted once per pass, when the pass
+# enters it; the following batches page through that snapshot instead of
+# re-listing the directory. Files added meanwhile are seen by the next pass.
+
+import os
+import time
+from bisect import bisect_right
+from datetime import datetime
+from app.extensions import db
+from app.models import User, Room, Channel, Message, UserMusic, Sticker, UploadGcState
+from app.functions.storage import release_upload
+from app.functions.logs import get_logger
+from config import UPLOAD_SUBDIRS, UPLOAD_GC_BATCH_SIZE, UPLOAD_GC_MIN_AGE_SECONDS
+
+log = get_logger('uploads')
+
+GC_STATE_ID = 1
+DEFAULT_BATCH_SIZE = UPLOAD_GC_BATCH_SIZE
+# Files younger than this are skipped: upload_file returns a URL before the
+# message referencing it is sent.
+DEFAULT_MIN_AGE_SECONDS = UPLOAD_GC_MIN_AGE_SECONDS
+
+_listings = {}  # (upload_folder, subdir) -> sorted file names, for the directory the pass is in
+
+# Every (model, column) pair that can hold an /uploads/... URL
+UPLOAD_REFERENCES = (
+    (Message, Message.file_url),
+    (UserMusic, UserMusic.file_url),
+    (UserMusic, UserMusic.cover_url),
+    (Sticker, Sticker.file_url),
+    (User, User.avatar_url),
+    (Room, Room.avatar_url),
+    (Room, Room.banner_url),
+    (Channel, Channel.icon_image_url),
+)
+
+
+def gc_subdirs():
+    # Sticker uploads are saved to 'stickers', which is not part of UPLOAD_SUBDIRS
+    return sorted(set(UPLOAD_SUBDIRS.values()) | {'stickers'})
+
+
+def upload_url(subdir, filename):
+    return f"/uploads/{subdir}/{filename}"
+
+
+def get_gc_state():
+    state = db.session.get(UploadGcState, GC_STATE_ID)
+    if not state:
+        state = UploadGcState(
+            id=GC_STATE_ID,
+            cursor='',
+            passes_completed=0,
+            files_scanned=0,
+            files_reclaimed=0,
+            bytes_reclaimed=0,
+        )
+        db.session.add(state)
+        db.session.flush()
+    return state
+
+
+def _split_cursor(cursor):
+    if not cursor or '/' not in cursor:
+        return '', ''
+    subdir, name = cursor.split('/', 1)
+    return subdir, name
+
+
+def _listing(upload_folder, subdir, resume):
+    # Sorted file names in one upload directory; a pass resuming inside it
+    # (resume=True) reuses the snapshot taken when it entered the directory
+    key = (upload_folder, subdir)
+    names = _listings.get(key) if resume else None
+    if names is None:
+        folder = os.path.join(upload_folder, subdir)
+        names = sorted(
+            entry.name for entry in os.scandir(folder)
+            if entry.is_file(follow_symlinks=False)
+        )
+        _listings[key] = names
+    return names
+
+
+def _next_batch(upload_folder, cursor, batch_size):
+    # Return up to batch_size (subdir, filename) pairs after cursor, in tree order,
+    # and whether the end of the tree was reached.
+    cur_subdir, cur_name = _split_cursor(cursor)
+    batch = []
+    for subdir in gc_subdirs():
+        if subdir < cur_subdir:
+            continue
+        resume = subdir == cur_subdir and bool(cur_name)
+        try:
+            names = _listing(upload_folder, subdir, resume)
+        except FileNotFoundError:
+            continue
+        start = bisect_right(names, cur_name) if resume else 0
+        for name in names[start:]:
+            batch.append((subdir, name))
+            if len(batch) >= batch_size:
+                return batch, False
+        _listings.pop((upload_folder, subdir), None)  # done with this directory for this pass
+    return batch, True
+
+
+def _referenced_urls(urls):
+    # One indexed IN lookup per referencing column
+    referenced = set()
+    if not urls:
+        return referenced
+    for _model, column in UPLOAD_REFERENCES:
+        rows = db.session.query(column).filter(column.in_(urls)).all()
+        referenced.update(row[0] for row in rows if row[0])
+    return referenced
+
+
+def release_unreferenced_uploads(urls):
+    # Credit back the uploads in urls that no row references any more, e.g. after
+    # the messages using them were deleted (caller commits). Returns the urls that
+    # are still referenced.
+    urls = sorted({url for url in urls if url})
+    referenced = _referenced_urls(urls)
+    for url in urls:
+        if url not in referenced:
+            release_upload(url)
+    return referenced
+
+
+def run_gc_batch(upload_folder, batch_size=DEFAULT_BATCH_SIZE, dry_run=False,
+                 min_age_seconds=DEFAULT_MIN_AGE_SECONDS, cursor=None):
+    # Reconcile one batch of the upload tree against the database.
+    # Args:
+    #   upload_folder: absolute path of the uploads directory
+    #   batch_size: max number of files inspected in this call
+    #   dry_run: report orphans without deleting files or moving the persisted cursor
+    #   min_age_seconds: files modified more recently than this are never reclaimed
+    #   cursor: start position override (used by dry-run passes); defaults to the persisted one
+    # Returns:
+    #   dict report with scanned/orphaned/reclaimed counters and the next cursor
+    batch_size = max(1, int(batch_size or DEFAULT_BATCH_SIZE))
+    state = get_gc_state()
+    start_cursor = state.cursor if cursor is None else cursor
+    batch, reached_end = _next_batch(upload_folder, start_cursor, batch_size)
+
+    urls = [upload_url(subdir, name) for subdir, name in batch]
+    referenced = _referenced_urls(urls)
+
+    now = time.time()
+    orphaned = []
+    skipped_recent = 0
+    for (subdir, name), url in zip(batch, urls):
+        if url in referenced:
+            continue
+        path = os.path.join(upload_folder, subdir, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - st.st_mtime < min_age_seconds:
+            skipped_recent += 1
+            continue
+        orphaned.append({'url': url, 'path': path, 'bytes': int(st.st_size)})
+
+    reclaimed_files = 0
+    reclaimed_bytes = 0
+    if not dry_run:
+        for item in orphaned:
+            try:
+                os.remove(item['path'])
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                log.warning('upload_gc.remove_failed', path=item['path'], error=str(e))
+                continue
+            release_upload(item['url'])
+            reclaimed_files += 1
+            reclaimed_bytes += item['bytes']
+
+    next_cursor = '' if reached_end else f"{batch[-1][0]}/{batch[-1][1]}"
+
+    if not dry_run:
+        state.cursor = next_cursor
+        state.files_scanned = (state.files_scanned or 0) + len(batch)
+        state.files_reclaimed = (state.files_reclaimed or 0) + reclaimed_files
+        state.bytes_reclaimed = (state.bytes_reclaimed or 0) + reclaimed_bytes
+        state.last_run_at = datetime.utcnow()
+        if reached_end:
+            state.passes_completed = (state.passes_completed or 0) + 1
+            state.last_pass_completed_at = state.last_run_at
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+    return {
+        'dry_run': bool(dry_run),
+        'scanned': len(batch),
+        'skipped_recent': skipped_recent,
+        'orphaned': [{'url': o['url'], 'bytes': o['bytes']} for o in orphaned],
+        'orphaned_bytes': sum(o['bytes'] for o in orphaned),
+        'reclaimed_files': reclaimed_files,
+        'reclaimed_bytes': reclaimed_bytes,
+        'start_cursor': start_cursor,
+        'next_cursor': next_cursor,
+        'pass_completed': reached_end,
+    }
+
+
+def get_gc_stats():
+    state = get_gc_state()
+    stats = {
+        'cursor': state.cursor or '',
+        'passes_completed': int(state.passes_completed or 0),
+        'files_scanned': int(state.files_scanned or 0),
+        'files_reclaimed': int(state.files_reclaimed or 0),
+        'bytes_reclaimed': int(state.bytes_reclaimed or 0),
+        'last_run_at': state.last_run_at.isoformat() if state.last_run_at else None,
+        'last_pass_completed_at': state.last_pass_completed_at.isoformat() if state.last_pass_completed_at else None,
+    }
+    db.session.commit()
+    return stats
@@ -0,0 +1,148 @@
+# Short-TTL identity cache behind Flask-Login's user_loader
+#
+# load_user ran a User SELECT on every request and every Socket.IO event, and
+# because commits expire ORM instances, handlers re-selected the sender row
+# again whenever they read current_user after a commit. The loader now hands
+# Flask-Login a CachedUser built from a plain snapshot of the row's columns.
+# Reads are served from the snapshot; the first attribute write, relationship
+# access or password read loads the real row into the current session and
+# from then on the proxy delegates to it, so existing code that assigns to
+# current_user and commits keeps working. Any ORM update or delete of a User
+# drops its snapshot, both at flush and again after commit. At most
+# MAX_CACHED_USERS snapshots are kept; past that the least recently used go.
+
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app.extensions import db
+from app.models import User
+from config import USER_CACHE_TTL_SECONDS
+
+# Columns never kept in the snapshot; reading them loads the row
+UNCACHED_COLUMNS = {'password'}
+MAX_CACHED_USERS = 10000
+
+_cache = OrderedDict()  # user_id -> (snapshot, expires_at), least recently used first
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+class CachedUser(UserMixin):
+    # Detached stand-in for User; loads the ORM row only when needed
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_row', None)
+
+    def get_id(self):
+        return str(self._snapshot['id'])
+
+    def get_orm_user(self):
+        # The real User row, attached to the current session
+        row = self._row
+        if row is None:
+            row = db.session.get(User, self._snapshot['id'])
+            object.__setattr__(self, '_row', row)
+        return row
+
+    def __getattr__(self, name):
+        # Only called for names not found on the proxy itself
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self._row is None and name in self._snapshot:
+            return self._snapshot[name]
+        row = self.get_orm_user()
+        if row is None:
+            raise AttributeError(name)
+        return getattr(row, name)
+
+    def __setattr__(self, name, value):
+        row = self.get_orm_user()
+        if row is None:
+            raise AttributeError(name)
+        setattr(row, name, value)
+
+    def __repr__(self):
+        return f"<CachedUser {self._snapshot.get('id')} {self._snapshot.get('username')!r}>"
+
+
+def _snapshot_of(user):
+    return {
+        col.key: getattr(user, col.key)
+        for col in User.__table__.columns
+        if col.key not in UNCACHED_COLUMNS
+    }
+
+
+def _prune(now):
+    # Drop expired snapshots, then the least recently used until there is room for one more
+    for user_id in [uid for uid, (_s, expires_at) in _cache.items() if expires_at <= now]:
+        del _cache[user_id]
+    while len(_cache) >= MAX_CACHED_USERS:
+        _cache.popitem(last=False)
+
+
+def load_cached_user(user_id):
+    # Flask-Login user_loader: serve from cache, fall back to one SELECT
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry and entry[1] > now:
+            _stats['hits'] += 1
+            _cache.move_to_end(user_id)
+            return CachedUser(entry[0]) if not entry[0].get('deleted_at') else None
+        _stats['misses'] += 1
+
+    user = db.session.get(User, user_id)
+    if user is None or user.deleted_at:
+        return None
+    snapshot = _snapshot_of(user)
+    if USER_CACHE_TTL_SECONDS > 0:
+        with _lock:
+            _cache.pop(user_id, None)
+            if len(_cache) >= MAX_CACHED_USERS:
+                _prune(now)
+            _cache[user_id] = (snapshot, now + USER_CACHE_TTL_SECONDS)
+    return CachedUser(snapshot)
+
+
+def invalidate_cached_user(user_id):
+    with _lock:
+        if _cache.pop(int(user_id), None) is not None:
+            _stats['invalidations'] += 1
+
+
+def get_user_cache_stats():
+    with _lock:
+        return {'size': len(_cache), 'ttl_seconds': USER_CACHE_TTL_SECONDS, **_stats}
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    # Drop the snapshot now, and again after commit so a request that
+    # re-cached the old row between flush and commit cannot keep it
+    if target.id is None:
+        return
+    invalidate_cached_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('user_cache_invalidate', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop('user_cache_invalidate', ()):
+        invalidate_cached_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('user_cache_invalidate', None)
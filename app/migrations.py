@@ -1,5 +1,9 @@
+import json
 from sqlalchemy import inspect, text
 
+# Highest version migrate() knows about; startup skips schema work when the DB is at it
+LATEST_VERSION = 20
+
 
 def ensure_schema_migrations(conn):
     conn.execute(text('CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY NOT NULL)'))
@@ -156,4 +160,291 @@ def migrate(db_engine):
                     conn.execute(text('ALTER TABLE room_ban ADD COLUMN banned_until DATETIME'))
             set_version(conn, 8)
 
+        if current < 9:
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'upload_gc_state',
+                """CREATE TABLE upload_gc_state (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    cursor VARCHAR(500) NOT NULL DEFAULT '',
+                    passes_completed INTEGER NOT NULL DEFAULT 0,
+                    files_scanned INTEGER NOT NULL DEFAULT 0,
+                    files_reclaimed INTEGER NOT NULL DEFAULT 0,
+                    bytes_reclaimed BIGINT NOT NULL DEFAULT 0,
+                    last_run_at DATETIME,
+                    last_pass_completed_at DATETIME
+                )""",
+            )
+            # Indexes on every column that can reference a file under uploads/,
+            # so the GC reconciles a batch with index lookups instead of table scans.
+            upload_reference_columns = [
+                ('message', 'file_url'),
+                ('user_music', 'file_url'),
+                ('user_music', 'cover_url'),
+                ('sticker', 'file_url'),
+                ('user', 'avatar_url'),
+                ('room', 'avatar_url'),
+                ('room', 'banner_url'),
+                ('channel', 'icon_image_url'),
+            ]
+            for table, col in upload_reference_columns:
+                if _has_column(inspector, table, col):
+                    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{col} ON "{table}" ({col})'))
+            set_version(conn, 9)
+
+        if current < 10:
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'storage_usage',
+                """CREATE TABLE storage_usage (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    owner_type VARCHAR(10) NOT NULL,
+                    owner_id INTEGER NOT NULL,
+                    bytes_used BIGINT NOT NULL DEFAULT 0,
+                    file_count INTEGER NOT NULL DEFAULT 0,
+                    updated_at DATETIME NOT NULL,
+                    CONSTRAINT uq_storage_usage_owner UNIQUE (owner_type, owner_id)
+                )""",
+            )
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_storage_usage_type_bytes ON storage_usage (owner_type, bytes_used)'))
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'stored_file',
+                """CREATE TABLE stored_file (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    url VARCHAR(500) NOT NULL,
+                    user_id INTEGER,
+                    room_id INTEGER,
+                    size_bytes BIGINT NOT NULL DEFAULT 0,
+                    created_at DATETIME NOT NULL
+                )""",
+            )
+            conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_stored_file_url ON stored_file (url)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_stored_file_user_id ON stored_file (user_id)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_stored_file_room_id ON stored_file (room_id)'))
+            set_version(conn, 10)
+
+        if current < 11:
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'message_reaction_count',
+                """CREATE TABLE message_reaction_count (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    message_id INTEGER NOT NULL,
+                    emoji VARCHAR(50) NOT NULL,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    CONSTRAINT uq_message_reaction_count UNIQUE (message_id, emoji)
+                )""",
+            )
+            if 'message_reaction' in inspector.get_table_names():
+                conn.execute(text(
+                    'CREATE INDEX IF NOT EXISTS ix_message_reaction_lookup '
+                    'ON message_reaction (message_id, user_id, emoji)'
+                ))
+                # Backfill counters from existing reactions
+                conn.execute(text('DELETE FROM message_reaction_count'))
+                conn.execute(text(
+                    'INSERT INTO message_reaction_count (message_id, emoji, count) '
+                    'SELECT message_id, emoji, COUNT(*) FROM message_reaction GROUP BY message_id, emoji'
+                ))
+            set_version(conn, 11)
+
+        if current < 12:
+            import ipaddress
+
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'ip_ban',
+                """CREATE TABLE ip_ban (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    network VARCHAR(64) NOT NULL,
+                    user_id INTEGER,
+                    created_at DATETIME NOT NULL,
+                    CONSTRAINT uq_ip_ban_network_user UNIQUE (network, user_id)
+                )""",
+            )
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_ip_ban_network ON ip_ban (network)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_ip_ban_user_id ON ip_ban (user_id)'))
+            # Backfill from the legacy comma-separated user.banned_ips column
+            if _has_column(inspector, 'user', 'banned_ips'):
+                rows = conn.execute(text(
+                    "SELECT id, banned_ips FROM user WHERE is_banned = 1 AND banned_ips IS NOT NULL AND banned_ips != ''"
+                )).all()
+                for user_id, banned_ips in rows:
+                    for raw in str(banned_ips).split(','):
+                        try:
+                            network = str(ipaddress.ip_network(raw.strip(), strict=False))
+                        except ValueError:
+                            continue
+                        conn.execute(text(
+                            'INSERT OR IGNORE INTO ip_ban (network, user_id, created_at) '
+                            'VALUES (:network, :user_id, CURRENT_TIMESTAMP)'
+                        ), {'network': network, 'user_id': user_id})
+            set_version(conn, 12)
+
+        if current < 13:
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'legacy_import_state',
+                """CREATE TABLE legacy_import_state (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    source_path VARCHAR(500) NOT NULL DEFAULT '',
+                    last_rowid INTEGER NOT NULL DEFAULT 0,
+                    rows_imported INTEGER NOT NULL DEFAULT 0,
+                    rows_skipped INTEGER NOT NULL DEFAULT 0,
+                    started_at DATETIME,
+                    completed_at DATETIME
+                )""",
+            )
+            if 'user' in inspector.get_table_names():
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_user_username_lower ON user (lower(username))'))
+            set_version(conn, 13)
+
+        if current < 14:
+            # One-time default role seeding, set-based. Replaces the per-member
+            # role seeding pass that used to run over every member on every boot;
+            # rooms and members created later get their roles at creation time.
+            inspector = inspect(conn)
+            tables = set(inspector.get_table_names())
+            if {'member', 'role', 'member_role'} <= tables:
+                from app.functions.roles import ROLE_PERMISSION_KEYS
+                admin_permissions = json.dumps(list(ROLE_PERMISSION_KEYS))
+                for tag, permissions in (('everyone', '[]'), ('admin', admin_permissions)):
+                    conn.execute(text(
+                        "INSERT INTO role (room_id, name, mention_tag, is_system, can_be_mentioned_by_everyone, "
+                        "permissions_json, created_at) "
+                        "SELECT DISTINCT m.room_id, :tag, :tag, 1, 0, :permissions, CURRENT_TIMESTAMP FROM member m "
+                        "WHERE NOT EXISTS (SELECT 1 FROM role r WHERE r.room_id = m.room_id AND r.mention_tag = :tag)"
+                    ), {'tag': tag, 'permissions': permissions})
+                conn.execute(text(
+                    "UPDATE role SET permissions_json = :permissions "
+                    "WHERE mention_tag = 'admin' AND (permissions_json IS NULL OR permissions_json = '')"
+                ), {'permissions': admin_permissions})
+                for tag, member_filter in (('everyone', ''), ('admin', "AND m.role IN ('owner', 'admin')")):
+                    conn.execute(text(
+                        "INSERT INTO member_role (user_id, room_id, role_id, assigned_at) "
+                        "SELECT DISTINCT m.user_id, m.room_id, r.id, CURRENT_TIMESTAMP FROM member m "
+                        "JOIN role r ON r.id = (SELECT MIN(id) FROM role WHERE room_id = m.room_id AND mention_tag = :tag) "
+                        f"WHERE 1 = 1 {member_filter} AND NOT EXISTS ("
+                        "SELECT 1 FROM member_role mr WHERE mr.user_id = m.user_id AND mr.room_id = m.room_id "
+                        "AND mr.role_id = r.id)"
+                    ), {'tag': tag})
+            set_version(conn, 14)
+
+        if current < 15:
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'background_job',
+                """CREATE TABLE background_job (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    kind VARCHAR(40) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    params_json TEXT NOT NULL DEFAULT '{}',
+                    cursor INTEGER NOT NULL DEFAULT 0,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER,
+                    error TEXT,
+                    created_by_id INTEGER,
+                    created_at DATETIME NOT NULL,
+                    started_at DATETIME,
+                    finished_at DATETIME
+                )""",
+            )
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_background_job_kind ON background_job (kind)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_background_job_status ON background_job (status)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_background_job_created_by_id ON background_job (created_by_id)'))
+            # Keyset scans for chunked purges, and cleanup of rows pointing at purged messages
+            tables = set(inspector.get_table_names())
+            if 'message' in tables:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_message_user_id ON message (user_id, id)'))
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_message_reply_to_id ON message (reply_to_id)'))
+            if 'read_message' in tables:
+                conn.execute(text(
+                    'CREATE INDEX IF NOT EXISTS ix_read_message_last_read_message_id ON read_message (last_read_message_id)'
+                ))
+            set_version(conn, 15)
+
+        if current < 16:
+            # Tombstones for rooms/accounts deleted by background jobs, and the
+            # indexes those jobs scan by
+            inspector = inspect(conn)
+            tables = set(inspector.get_table_names())
+            if 'room' in tables and not _has_column(inspector, 'room', 'deleted_at'):
+                conn.execute(text('ALTER TABLE room ADD COLUMN deleted_at DATETIME'))
+            if 'user' in tables and not _has_column(inspector, 'user', 'deleted_at'):
+                conn.execute(text('ALTER TABLE user ADD COLUMN deleted_at DATETIME'))
+            if 'background_job' in tables and not _has_column(inspector, 'background_job', 'phase'):
+                conn.execute(text('ALTER TABLE background_job ADD COLUMN phase INTEGER NOT NULL DEFAULT 0'))
+            if 'member' in tables:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_member_user_id ON member (user_id)'))
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_member_room_id ON member (room_id)'))
+            if 'message_reaction' in tables:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_message_reaction_user_id ON message_reaction (user_id, id)'))
+            set_version(conn, 16)
+
+        if current < 17:
+            inspector = inspect(conn)
+            _create_table_if_missing(
+                inspector,
+                conn,
+                'socket_outbox',
+                """CREATE TABLE socket_outbox (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    event VARCHAR(60) NOT NULL,
+                    room VARCHAR(100),
+                    payload_json TEXT NOT NULL,
+                    created_at DATETIME NOT NULL,
+                    claimed_by VARCHAR(80),
+                    claimed_at DATETIME
+                )""",
+            )
+            set_version(conn, 17)
+
+        if current < 18:
+            # Channel history pages, unread counts and room listings filter by
+            # these columns; without indexes each of them scanned the table
+            inspector = inspect(conn)
+            tables = set(inspector.get_table_names())
+            if 'message' in tables:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_message_channel_id ON message (channel_id, id)'))
+            if 'read_message' in tables:
+                conn.execute(text(
+                    'CREATE INDEX IF NOT EXISTS ix_read_message_channel_id ON read_message (channel_id, user_id)'
+                ))
+            if 'channel' in tables:
+                conn.execute(text('CREATE INDEX IF NOT EXISTS ix_channel_room_id ON channel (room_id)'))
+            set_version(conn, 18)
+
+        if current < 19:
+            # Outbox rows remember the process that wrote them: without a message
+            # queue only that process can reach the clients an event is for
+            inspector = inspect(conn)
+            if 'socket_outbox' in inspector.get_table_names() and not _has_column(inspector, 'socket_outbox', 'origin'):
+                conn.execute(text('ALTER TABLE socket_outbox ADD COLUMN origin VARCHAR(80)'))
+            set_version(conn, 19)
+
+        if current < 20:
+            # Workers claim a background job before running it, so a job is resumed
+            # by exactly one worker after a restart
+            inspector = inspect(conn)
+            if 'background_job' in inspector.get_table_names():
+                if not _has_column(inspector, 'background_job', 'claimed_by'):
+                    conn.execute(text('ALTER TABLE background_job ADD COLUMN claimed_by VARCHAR(80)'))
+                if not _has_column(inspector, 'background_job', 'claimed_at'):
+                    conn.execute(text('ALTER TABLE background_job ADD COLUMN claimed_at DATETIME'))
+            set_version(conn, 20)
+
         conn.commit()
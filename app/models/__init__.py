@@ -1,12 +1,15 @@
 # Models package
 # Import all models here for convenience
 
-from app.models.user import User, UserMusic, AuthThrottle, Friendship, FriendRequest
+from app.models.user import User, UserMusic, AuthThrottle, IpBan, LegacyImportState, Friendship, FriendRequest
 from app.models.chat import Room, Channel, Member, RoomBan, Role, MemberRole, RoleMentionPermission
-from app.models.content import Message, MessageReaction, ReadMessage, StickerPack, Sticker
+from app.models.content import Message, MessageReaction, MessageReactionCount, ReadMessage, StickerPack, Sticker
+from app.models.storage import UploadGcState, StorageUsage, StoredFile
+from app.models.jobs import BackgroundJob, SocketOutbox
 
 __all__ = [
-    'User', 'UserMusic', 'AuthThrottle', 'Friendship', 'FriendRequest',
+    'User', 'UserMusic', 'AuthThrottle', 'IpBan', 'LegacyImportState', 'Friendship', 'FriendRequest',
     'Room', 'Channel', 'Member', 'RoomBan', 'Role', 'MemberRole', 'RoleMentionPermission',
-    'Message', 'MessageReaction', 'ReadMessage', 'StickerPack', 'Sticker'
+    'Message', 'MessageReaction', 'MessageReactionCount', 'ReadMessage', 'StickerPack', 'Sticker',
+    'UploadGcState', 'StorageUsage', 'StoredFile', 'BackgroundJob', 'SocketOutbox'
 ]
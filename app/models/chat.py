@@ -9,12 +9,14 @@ class Room(db.Model):
     is_public = db.Column(db.Boolean, default=False)
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     description = db.Column(db.String(500), nullable=True)
-    avatar_url = db.Column(db.String(300), nullable=True)
-    banner_url = db.Column(db.String(300), nullable=True)
+    avatar_url = db.Column(db.String(300), nullable=True, index=True)
+    banner_url = db.Column(db.String(300), nullable=True, index=True)
     invite_token = db.Column(db.String(100), nullable=True, unique=True)
     
     # For blogs: linked chat for comments (not implemented yet, but reserved for future use)
     linked_chat_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=True)
+    # Set when the room is being deleted by a background job; hidden everywhere from then on
+    deleted_at = db.Column(db.DateTime, nullable=True)
     
     # Relationships
     channels = db.relationship('Channel', backref='room', lazy=True, cascade='all, delete-orphan')
@@ -24,10 +26,10 @@ class Channel(db.Model):
     # Channel within a room
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
     description = db.Column(db.String(500), nullable=True)
     icon_emoji = db.Column(db.String(10), nullable=True)
-    icon_image_url = db.Column(db.String(300), nullable=True)
+    icon_image_url = db.Column(db.String(300), nullable=True, index=True)
     writer_role_ids_json = db.Column(db.Text, nullable=True)  # JSON array of role ids allowed to write
     
     # Relationships
@@ -36,8 +38,8 @@ class Channel(db.Model):
 class Member(db.Model):
     # Room membership
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    room_id = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id', ondelete='CASCADE'), nullable=False, index=True)
     role = db.Column(db.String(20), default='member')  # 'owner', 'admin', 'member'
     muted_until = db.Column(db.DateTime, nullable=True)
 
@@ -5,6 +5,12 @@ from app.extensions import db
 
 class Message(db.Model):
     # Chat message
+    __table_args__ = (
+        db.Index('ix_message_user_id', 'user_id', 'id'),
+        db.Index('ix_message_reply_to_id', 'reply_to_id'),
+        db.Index('ix_message_channel_id', 'channel_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -14,7 +20,7 @@ class Message(db.Model):
     
     # Message content type
     message_type = db.Column(db.String(20), default='text')  # 'text', 'image', 'file', 'music', 'sticker'
-    file_url = db.Column(db.String(500), nullable=True)
+    file_url = db.Column(db.String(500), nullable=True, index=True)
     file_name = db.Column(db.String(200), nullable=True)
     file_size = db.Column(db.Integer, nullable=True)
     # Reply target (self-referential FK to another message)
@@ -23,9 +29,15 @@ class Message(db.Model):
     # Relationships
     user = db.relationship('User', backref='messages')
     reactions = db.relationship('MessageReaction', backref='message', lazy=True, cascade='all, delete-orphan')
+    reaction_counts = db.relationship('MessageReactionCount', lazy=True, cascade='all, delete-orphan')
 
 class MessageReaction(db.Model):
     # Message reactions (emojis and stickers, stickers is not implemented yet)
+    __table_args__ = (
+        db.Index('ix_message_reaction_lookup', 'message_id', 'user_id', 'emoji'),
+        db.Index('ix_message_reaction_user_id', 'user_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -35,12 +47,28 @@ class MessageReaction(db.Model):
     # Relationships
     user = db.relationship('User', backref='reactions')
 
+class MessageReactionCount(db.Model):
+    # Denormalized number of reactions per (message, emoji), kept in step with MessageReaction
+    __tablename__ = 'message_reaction_count'
+    __table_args__ = (
+        db.UniqueConstraint('message_id', 'emoji', name='uq_message_reaction_count'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    emoji = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 class ReadMessage(db.Model):
     #Track read messages in channels
+    __table_args__ = (
+        db.Index('ix_read_message_channel_id', 'channel_id', 'user_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     channel_id = db.Column(db.Integer, db.ForeignKey('channel.id'), nullable=False)
-    last_read_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)
+    last_read_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True, index=True)
     last_read_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -63,7 +91,7 @@ class Sticker(db.Model):
     # Individual sticker
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    file_url = db.Column(db.String(500), nullable=False)
+    file_url = db.Column(db.String(500), nullable=False, index=True)
     pack_id = db.Column(db.Integer, db.ForeignKey('sticker_pack.id'), nullable=False)
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,36 @@
+# Background job and socket outbox models
+
+from app.extensions import db
+
+
+class BackgroundJob(db.Model):
+    # A long-running, chunked operation (bulk purges, cascades) and its progress
+    __tablename__ = 'background_job'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed
+    params_json = db.Column(db.Text, nullable=False, default='{}')
+    phase = db.Column(db.Integer, nullable=False, default=0)  # step of a multi-phase job
+    cursor = db.Column(db.Integer, nullable=False, default=0)  # last processed id, for resuming
+    progress = db.Column(db.Integer, nullable=False, default=0)  # rows processed so far
+    total = db.Column(db.Integer, nullable=True)  # rows expected, if known up front
+    error = db.Column(db.Text, nullable=True)
+    claimed_by = db.Column(db.String(80), nullable=True)  # worker running the job
+    claimed_at = db.Column(db.DateTime, nullable=True)  # refreshed after every chunk
+    created_by_id = db.Column(db.Integer, nullable=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class SocketOutbox(db.Model):
+    # A Socket.IO event written in the same transaction as the change it describes
+    __tablename__ = 'socket_outbox'
+    id = db.Column(db.Integer, primary_key=True)  # dispatch order
+    event = db.Column(db.String(60), nullable=False)
+    room = db.Column(db.String(100), nullable=True)  # None = broadcast
+    payload_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    origin = db.Column(db.String(80), nullable=True)  # dispatcher of the process that wrote the row
+    claimed_by = db.Column(db.String(80), nullable=True)  # dispatcher currently delivering the row
+    claimed_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,43 @@
+# Storage-related models: upload garbage collection state, storage accounting
+
+from app.extensions import db
+
+
+class UploadGcState(db.Model):
+    # Persisted cursor and counters of the incremental uploads GC (single row, id=1)
+    __tablename__ = 'upload_gc_state'
+    id = db.Column(db.Integer, primary_key=True)
+    cursor = db.Column(db.String(500), nullable=False, default='')  # '<subdir>/<filename>' of last scanned file
+    passes_completed = db.Column(db.Integer, nullable=False, default=0)
+    files_scanned = db.Column(db.Integer, nullable=False, default=0)
+    files_reclaimed = db.Column(db.Integer, nullable=False, default=0)
+    bytes_reclaimed = db.Column(db.BigInteger, nullable=False, default=0)
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_pass_completed_at = db.Column(db.DateTime, nullable=True)
+
+
+class StorageUsage(db.Model):
+    # Running byte counter per owner ('user' or 'room'), updated in the upload/delete transaction
+    __tablename__ = 'storage_usage'
+    id = db.Column(db.Integer, primary_key=True)
+    owner_type = db.Column(db.String(10), nullable=False)  # 'user', 'room'
+    owner_id = db.Column(db.Integer, nullable=False)
+    bytes_used = db.Column(db.BigInteger, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('owner_type', 'owner_id', name='uq_storage_usage_owner'),
+        db.Index('ix_storage_usage_type_bytes', 'owner_type', 'bytes_used'),
+    )
+
+
+class StoredFile(db.Model):
+    # Accounting record of one saved upload, so deletion knows whom to credit back
+    __tablename__ = 'stored_file'
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False, unique=True, index=True)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    room_id = db.Column(db.Integer, nullable=True, index=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
@@ -40,7 +40,7 @@ class User(UserMixin, db.Model):
     # Profile info
     bio = db.Column(db.String(300), default="")
     #avatar_url = db.Column(db.String(300), default="https://via.placeholder.com/50") # old placeholder avatar
-    avatar_url = db.Column(db.String(300))    
+    avatar_url = db.Column(db.String(300), index=True)
     birth_date = db.Column(db.String(20))
     
     # Privacy settings
@@ -65,11 +65,17 @@ class User(UserMixin, db.Model):
     lockout_until = db.Column(db.DateTime, nullable=True)
     last_login_at = db.Column(db.DateTime, nullable=True)
     last_login_ip = db.Column(db.String(64), nullable=True)
+
+    # Set when the account is being deleted by a background job
+    deleted_at = db.Column(db.DateTime, nullable=True)
     
     # Relationships
     music_tracks = db.relationship('UserMusic', backref='user', lazy=True, cascade='all, delete-orphan')
     memberships = db.relationship('Member', backref='user', lazy=True)
 
+# Logins and the legacy importer look usernames up case-insensitively
+db.Index('ix_user_username_lower', db.func.lower(User.username))
+
 
 class AuthThrottle(db.Model):
     # Tracks auth failures by client IP for lockout protection
@@ -79,12 +85,38 @@ class AuthThrottle(db.Model):
     lockout_until = db.Column(db.DateTime, nullable=True)
     last_attempt_at = db.Column(db.DateTime, nullable=True)
 
+class LegacyImportState(db.Model):
+    # Progress of tools/import_legacy_users.py (single row, id=1); once completed_at
+    # is set the login path no longer falls back to the legacy instance DB
+    __tablename__ = 'legacy_import_state'
+    id = db.Column(db.Integer, primary_key=True)
+    source_path = db.Column(db.String(500), nullable=False, default='')
+    last_rowid = db.Column(db.Integer, nullable=False, default=0)
+    rows_imported = db.Column(db.Integer, nullable=False, default=0)
+    rows_skipped = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+class IpBan(db.Model):
+    # Banned IP address or CIDR range, normalized to network form (e.g. "10.0.0.0/8", "1.2.3.4/32")
+    __tablename__ = 'ip_ban'
+    __table_args__ = (
+        db.UniqueConstraint('network', 'user_id', name='uq_ip_ban_network_user'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    network = db.Column(db.String(64), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    user = db.relationship('User', backref=db.backref('ip_bans', lazy=True, cascade='all, delete-orphan'))
+
 class UserMusic(db.Model):
     # User's music library
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     artist = db.Column(db.String(200), nullable=True)
-    file_url = db.Column(db.String(500), nullable=False)
-    cover_url = db.Column(db.String(500), nullable=True)
+    file_url = db.Column(db.String(500), nullable=False, index=True)
+    cover_url = db.Column(db.String(500), nullable=True, index=True)
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -2,108 +2,61 @@
 
 import os
 import re
-import inspect
 import json
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, send_from_directory, current_app
+from flask import Blueprint, Response, request, jsonify, render_template, redirect, url_for, flash, send_from_directory, current_app
 from flask_login import login_required, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime, timedelta
 from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import selectinload
 from app.extensions import db, socketio
 from app.models import (
     User, Room, Channel, Member, Message, UserMusic,
-    MessageReaction, ReadMessage, RoomBan, Role, MemberRole, RoleMentionPermission
+    MessageReaction, ReadMessage, RoomBan, Role, MemberRole, RoleMentionPermission, BackgroundJob
 )
 from app.functions import (
     save_uploaded_file, resize_image, is_image_file, is_music_file, is_video_file,
     normalize_role_tag, ensure_default_roles, ensure_user_default_roles, can_user_mention_role,
-    ROLE_PERMISSION_KEYS, parse_role_permissions, get_user_permissions, user_has_room_permission
+    ROLE_PERMISSION_KEYS, parse_role_permissions, get_user_permissions, user_has_room_permission,
+    get_user_permissions_for_rooms, query_budget,
+    run_gc_batch, get_gc_stats, release_unreferenced_uploads, remaining_quota_bytes, charge_upload, release_upload,
+    top_consumers, ImageValidationError, toggle_message_reaction, reaction_delta_payload,
+    MAX_BATCH_TOGGLES, PasswordHasherBusy, hash_password, verify_password,
+    get_hasher_stats, add_ip_ban, remove_user_ip_bans, invalidate_ip_bans, list_banned_ips,
+    start_user_message_purge, start_room_deletion, start_account_deletion, job_payload, enqueue_emit,
+    render_metrics, metrics_scrape_allowed, get_logger, run_profile, ProfilerBusy, list_profiles, profile_dir,
+    shed_non_essential, get_admission_stats
 )
+from app.functions.gifs import get_gif_cache, ENDPOINT_TRENDING as GIF_ENDPOINT_TRENDING, ENDPOINT_SEARCH as GIF_ENDPOINT_SEARCH
 from app.routes.spa import send_spa_index
+from config import METRICS_ENABLED
 from app.routes.api_friends import register_friends_routes
 from app.routes.api_search import register_search_routes
 
 api_bp = Blueprint('api', __name__)
+log = get_logger('api')
 
 register_friends_routes(api_bp)
 register_search_routes(api_bp)
 
-
-def _get_giphy_key():
-    try:
-        from config import GIPHY_API_KEY
-    except Exception:
-        GIPHY_API_KEY = ''
-    return os.environ.get('GIPHY_API_KEY') or (GIPHY_API_KEY or '')
+# Slack for multipart framing when comparing Content-Length against a quota
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
 
 
-def _serialize_giphy_item(g):
-    try:
-        gid = str(getattr(g, 'id', '') or '')
-        title = str(getattr(g, 'title', '') or '')
-        images = getattr(g, 'images', None)
-        original = getattr(images, 'original', None) if images else None
-        fixed = getattr(images, 'fixed_width_small', None) if images else None
-        preview = getattr(images, 'preview_gif', None) if images else None
-        url = getattr(original, 'url', None) if original else None
-        prev = (
-            (getattr(fixed, 'url', None) if fixed else None)
-            or (getattr(preview, 'url', None) if preview else None)
-            or url
-        )
-        if not url or not prev:
-            return None
-        return {
-            'id': gid,
-            'url': str(url),
-            'preview': str(prev),
-            'title': title,
-        }
-    except Exception:
-        return None
+@api_bp.errorhandler(RequestEntityTooLarge)
+def _upload_too_large(e):
+    return jsonify({'error': 'upload is too large or exceeds storage quota'}), 413
 
 
-def _giphy_call_with_optional_offset(api_instance, method_name: str, api_key: str, *, limit: int, offset: int, rating: str, q: str | None = None):
-    method = getattr(api_instance, method_name)
-    try:
-        sig = inspect.signature(method)
-        params = sig.parameters
-        kwargs = {'limit': limit, 'rating': rating}
-        if 'offset' in params:
-            kwargs['offset'] = offset
-        if q is not None and 'q' in params:
-            kwargs['q'] = q
-        # Some generated clients include q as positional 2nd arg (search)
-        if q is not None:
-            try:
-                return method(api_key, q, **kwargs)
-            except TypeError:
-                return method(api_key, **kwargs)
-        return method(api_key, **kwargs)
-    except TypeError:
-        pass
+@api_bp.errorhandler(ImageValidationError)
+def _invalid_image_upload(e):
+    return jsonify({'error': str(e)}), 400
 
-    # Fallback for older giphy-client versions: call through SDK ApiClient
-    path = '/gifs/trending' if method_name == 'gifs_trending_get' else '/gifs/search'
-    query_params = [('api_key', api_key), ('limit', int(limit)), ('rating', rating), ('offset', int(offset))]
-    if q is not None:
-        query_params.append(('q', q))
 
-    # response_type varies between versions; try common ones.
-    for response_type in ('InlineResponse200', 'object', None):
-        try:
-            return api_instance.api_client.call_api(
-                path,
-                'GET',
-                query_params=query_params,
-                response_type=response_type,
-                auth_settings=[],
-                _return_http_data_only=True,
-            )
-        except Exception:
-            continue
+@api_bp.errorhandler(PasswordHasherBusy)
+def _password_hasher_busy(e):
+    return jsonify({'error': 'server is busy, try again shortly'}), 503, {'Retry-After': str(e.retry_after)}
 
-    raise RuntimeError('Giphy SDK call failed')
 
 # Helper functions
 def get_role(user_id, room_id):
@@ -169,6 +122,58 @@ def get_upload_folder():
     return current_app.config.get('UPLOAD_FOLDER', 'uploads')
 
 
+def limit_upload_to_quota(room_id=None):
+    # Must run before request.files is touched: rejects on Content-Length and caps
+    # the body stream (chunked uploads included) at the remaining quota.
+    # Returns an error response or None.
+    remaining = remaining_quota_bytes(current_user.id, room_id)
+    if remaining is None:
+        return None
+    allowance = remaining + UPLOAD_FORM_OVERHEAD_BYTES
+    if request.content_length is not None and request.content_length > allowance:
+        return jsonify({'error': 'storage quota exceeded'}), 413
+    current_limit = request.max_content_length
+    request.max_content_length = allowance if current_limit is None else min(current_limit, allowance)
+    return None
+
+
+def save_file_with_quota(file, subfolder='files', room_id=None, resize_to=None):
+    # Save file, charge its size to current user (and room), roll back if over quota
+    # Returns (url, error_message)
+    filepath = save_file(file, subfolder)
+    if not filepath:
+        return None, None
+    abs_path = os.path.join(get_upload_folder(), subfolder, filepath.split('/')[-1])
+    if resize_to:
+        resize_image(abs_path, resize_to)
+    try:
+        size = os.path.getsize(abs_path)
+    except OSError:
+        return None, None
+    ok, error = charge_upload(filepath, size, current_user.id, room_id)
+    if not ok:
+        try:
+            os.remove(abs_path)
+        except OSError:
+            pass
+        return None, error
+    return filepath, None
+
+
+def remove_uploaded_file(url):
+    # Remove a local upload and credit its size back to the owners (caller commits)
+    if not url or not url.startswith('/uploads/'):
+        return
+    try:
+        filename = url[len('/uploads/'):].lstrip('/')
+        abs_path = os.path.join(get_upload_folder(), filename)
+        if os.path.exists(abs_path):
+            os.remove(abs_path)
+    except Exception:
+        pass
+    release_upload(url)
+
+
 def _wants_json():
     if request.is_json:
         return True
@@ -179,14 +184,16 @@ def _wants_json():
 
 
 def _emit_presence_update_for_user(user):
+    if shed_non_essential():
+        return
     memberships = Member.query.filter_by(user_id=user.id).all()
-    for m in memberships:
-        for ch in m.room.channels:
-            socketio.emit('presence_updated', {
-                'user_id': user.id,
-                'username': user.username,
-                'status': user.presence_status
-            }, room=str(ch.id), skip_sid=None)
+    channel_rooms = [str(ch.id) for m in memberships for ch in m.room.channels]
+    if channel_rooms:
+        socketio.emit('presence_updated', {
+            'user_id': user.id,
+            'username': user.username,
+            'status': user.presence_status
+        }, room=channel_rooms, skip_sid=None)
 
 # --- CHANNEL MANAGEMENT ---
 
@@ -216,6 +223,10 @@ def edit_channel(room_id, channel_id):
     channel = Channel.query.get_or_404(channel_id)
     if channel.room_id != room_id:
         return jsonify({'error': 'Неверный канал'}), 400
+
+    quota_response = limit_upload_to_quota(room_id)
+    if quota_response:
+        return quota_response
     
     channel.name = request.form.get('name', channel.name)
     channel.description = request.form.get('description', channel.description)
@@ -233,11 +244,11 @@ def edit_channel(room_id, channel_id):
     if 'icon_file' in request.files:
         file = request.files['icon_file']
         if file and file.filename:
-            filepath = save_file(file, 'channel_icons')
+            # Resize to 32x32
+            filepath, quota_error = save_file_with_quota(file, 'channel_icons', room_id=room_id, resize_to=(32, 32))
+            if quota_error:
+                return jsonify({'error': quota_error}), 413
             if filepath:
-                # Resize to 32x32
-                full_path = os.path.join(get_upload_folder(), 'channel_icons', filepath.split('/')[-1])
-                resize_image(full_path, (32, 32))
                 channel.icon_image_url = filepath
     
     db.session.commit()
@@ -277,8 +288,9 @@ def update_channel_permissions(room_id, channel_id):
     channel.writer_role_ids_json = json.dumps([int(r.id) for r in valid_roles])
     db.session.commit()
     try:
-        for m in Member.query.filter_by(room_id=room_id).all():
-            socketio.emit('room_state_refresh', {'room_id': room_id}, room=f"user_{m.user_id}")
+        member_rooms = [f"user_{m.user_id}" for m in Member.query.filter_by(room_id=room_id).all()]
+        if member_rooms:
+            socketio.emit('room_state_refresh', {'room_id': room_id}, room=member_rooms)
     except Exception:
         pass
     return jsonify({'success': True, 'writer_role_ids': json.loads(channel.writer_role_ids_json or '[]')})
@@ -292,6 +304,10 @@ def settings():
     if request.method == 'GET':
         return send_spa_index()
 
+    quota_response = limit_upload_to_quota()
+    if quota_response:
+        return quota_response
+
     current_user.bio = request.form.get('bio', current_user.bio)
     current_user.privacy_searchable = 'privacy_searchable' in request.form
     current_user.privacy_listable = 'privacy_listable' in request.form
@@ -307,7 +323,10 @@ def settings():
     if 'avatar_file' in request.files:
         file = request.files['avatar_file']
         if file and file.filename:
-            filepath = save_file(file, 'avatars')
+            filepath, quota_error = save_file_with_quota(file, 'avatars')
+            if quota_error:
+                db.session.rollback()
+                return jsonify({'error': quota_error}), 413
             if filepath:
                 current_user.avatar_url = filepath
 
@@ -372,6 +391,10 @@ def user_settings_api():
 @api_bp.route('/api/v1/user/avatar', methods=['POST'])
 @login_required
 def upload_user_avatar_api():
+    quota_response = limit_upload_to_quota()
+    if quota_response:
+        return quota_response
+
     if 'avatar' not in request.files:
         return jsonify({'error': 'avatar file is required'}), 400
 
@@ -379,7 +402,9 @@ def upload_user_avatar_api():
     if not file or not file.filename:
         return jsonify({'error': 'avatar file is required'}), 400
 
-    filepath = save_file(file, 'avatars')
+    filepath, quota_error = save_file_with_quota(file, 'avatars')
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
     if not filepath:
         return jsonify({'error': 'failed to save avatar'}), 500
 
@@ -392,14 +417,7 @@ def upload_user_avatar_api():
 def delete_user_avatar():
     # Delete user avatar
     if current_user.avatar_url and current_user.avatar_url != "https://placehold.co/50x50":
-        if current_user.avatar_url.startswith('/uploads/'):
-            try:
-                filename = current_user.avatar_url.lstrip('/uploads/').lstrip('/')
-                abs_path = os.path.join(get_upload_folder(), filename)
-                if os.path.exists(abs_path):
-                    os.remove(abs_path)
-            except:
-                pass
+        remove_uploaded_file(current_user.avatar_url)
         
         current_user.avatar_url = "https://placehold.co/50x50"
         db.session.commit()
@@ -417,39 +435,23 @@ def delete_user_account():
     if not password:
         return jsonify({'error': 'no password specified'}), 400
     
-    if not check_password_hash(current_user.password, password):
+    if not verify_password(current_user.password, password):
         return jsonify({'error': 'wrond password'}), 403
     
     user_id = current_user.id
     
     try:
-        # Delete user's music
-        UserMusic.query.filter_by(user_id=user_id).delete()        
-        # Delete reactions
-        MessageReaction.query.filter_by(user_id=user_id).delete()
-        # Delete read messages
-        ReadMessage.query.filter_by(user_id=user_id).delete()
-        # Delete memberships
-        Member.query.filter_by(user_id=user_id).delete()
-        # Delete messages
-        Message.query.filter_by(user_id=user_id).delete()
         # Delete avatar file
-        if current_user.avatar_url and current_user.avatar_url.startswith('/uploads/'):
-            try:
-                filename = current_user.avatar_url.lstrip('/uploads/').lstrip('/')
-                abs_path = os.path.join(get_upload_folder(), filename)
-                if os.path.exists(abs_path):
-                    os.remove(abs_path)
-            except:
-                pass
+        remove_uploaded_file(current_user.avatar_url)
         
-        # Delete account
+        # Tombstone the account (current_user is a cached proxy, use the real row);
+        # its messages, reactions, memberships etc. are removed by a background job
         from flask_login import logout_user
+        user = User.query.get(user_id)
         logout_user()
-        db.session.delete(current_user)
-        db.session.commit()
+        job = start_account_deletion(user)
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'job_id': job.id}), 202
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'error while deleting account {str(e)}'}), 500
@@ -468,12 +470,18 @@ def room_settings(room_id):
         return redirect(url_for('main.view_room', room_id=room_id))
     
     if request.method == 'POST':
+        quota_response = limit_upload_to_quota(room_id)
+        if quota_response:
+            return quota_response
+
         room.name = request.form.get('name', room.name)
         
         if 'avatar_file' in request.files:
             file = request.files['avatar_file']
             if file and file.filename:
-                filepath = save_file(file, 'room_avatars')
+                filepath, quota_error = save_file_with_quota(file, 'room_avatars', room_id=room_id)
+                if quota_error:
+                    flash(quota_error)
                 if filepath:
                     room.avatar_url = filepath
         
@@ -525,14 +533,7 @@ def delete_room_avatar(room_id):
         return jsonify({'error': 'no rights'}), 403
     
     if room.avatar_url:
-        if room.avatar_url.startswith('/uploads/'):
-            try:
-                filename = room.avatar_url.lstrip('/uploads/').lstrip('/')
-                abs_path = os.path.join(get_upload_folder(), filename)
-                if os.path.exists(abs_path):
-                    os.remove(abs_path)
-            except:
-                pass
+        remove_uploaded_file(room.avatar_url)
 
         room.avatar_url = None
         db.session.commit()
@@ -545,6 +546,15 @@ def delete_room_avatar(room_id):
 @login_required
 def upload_file():
     # Upload file (image, music, or document
+    # Optional ?room_id= charges the upload to the room quota as well
+    room_id = request.args.get('room_id', type=int)
+    if room_id is not None and not Member.query.filter_by(user_id=current_user.id, room_id=room_id).first():
+        return jsonify({'error': 'no access'}), 403
+
+    quota_response = limit_upload_to_quota(room_id)
+    if quota_response:
+        return quota_response
+
     if 'file' not in request.files:
         return jsonify({'error': 'no file'}), 400
     
@@ -553,20 +563,20 @@ def upload_file():
         return jsonify({'error': 'file not selected'}), 400
     # Save according to type with validation
     if is_image_file(file.filename):
-        filepath = save_file(file, 'files')
-        filetype = 'image'
+        subfolder, filetype = 'files', 'image'
     elif is_music_file(file.filename):
-        filepath = save_file(file, 'music')
-        filetype = 'music'
+        subfolder, filetype = 'music', 'music'
     elif is_video_file(file.filename):
-        filepath = save_file(file, 'videos')
-        filetype = 'video'
+        subfolder, filetype = 'videos', 'video'
     else:
-        filepath = save_file(file, 'files')
-        filetype = 'file'
+        subfolder, filetype = 'files', 'file'
+    filepath, quota_error = save_file_with_quota(file, subfolder, room_id=room_id)
 
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
     if not filepath:
         return jsonify({'error': 'error saving file'}), 500
+    db.session.commit()
 
     # Ensure filename is returned (basename of saved path)
     try:
@@ -585,6 +595,10 @@ def uploaded_file(filename):
 @login_required
 def add_music():
     # Add music to user library
+    quota_response = limit_upload_to_quota()
+    if quota_response:
+        return quota_response
+
     if 'music_file' not in request.files:
         return jsonify({'error': 'no file'}), 400
     
@@ -592,7 +606,9 @@ def add_music():
     if not file or not file.filename or not is_music_file(file.filename):
         return jsonify({'error': 'wrong music format'}), 400
     
-    filepath = save_file(file, 'music')
+    filepath, quota_error = save_file_with_quota(file, 'music')
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
     if not filepath:
         return jsonify({'error': 'upload error'}), 500
     
@@ -603,7 +619,11 @@ def add_music():
     if 'cover_file' in request.files:
         cover_file = request.files['cover_file']
         if cover_file and cover_file.filename:
-            cover_url = save_file(cover_file, 'avatars')
+            cover_url, quota_error = save_file_with_quota(cover_file, 'avatars')
+            if quota_error:
+                remove_uploaded_file(filepath)
+                db.session.commit()
+                return jsonify({'error': quota_error}), 413
     
     music = UserMusic(
         user_id=current_user.id,
@@ -644,13 +664,21 @@ def list_reactions():
     })
 
 
-@api_bp.route('/api/v1/gifs/trending', methods=['GET'])
-@login_required
-def gifs_trending():
-    api_key = _get_giphy_key()
-    if not api_key:
+def _gif_page_response(endpoint, q, offset, limit):
+    cache = get_gif_cache()
+    if not cache.provider.is_configured():
         return jsonify({'error': 'GIPHY_API_KEY is not configured'}), 500
+    result, cache_status = cache.get(endpoint, q=q, offset=offset, limit=limit, rating='pg-13')
+    next_offset = offset + (int(result['count']) if isinstance(result.get('count'), int) else len(result['gifs']))
+    response = jsonify({
+        'gifs': result['gifs'],
+        'pagination': {'offset': offset, 'limit': limit, 'total': result.get('total'), 'next_offset': next_offset},
+    })
+    response.headers['X-Cache'] = cache_status
+    return response
+
 
+def _gif_page_args():
     limit = request.args.get('limit', 24, type=int)
     offset = request.args.get('offset', 0, type=int)
     if limit < 1:
@@ -659,23 +687,15 @@ def gifs_trending():
         limit = 50
     if offset < 0:
         offset = 0
+    return limit, offset
 
+
+@api_bp.route('/api/v1/gifs/trending', methods=['GET'])
+@login_required
+def gifs_trending():
+    limit, offset = _gif_page_args()
     try:
-        import giphy_client
-        from giphy_client.rest import ApiException
-
-        api_instance = giphy_client.DefaultApi()
-        res = _giphy_call_with_optional_offset(api_instance, 'gifs_trending_get', api_key, limit=limit, offset=offset, rating='pg-13')
-        items = []
-        for g in (getattr(res, 'data', None) or []):
-            mapped = _serialize_giphy_item(g)
-            if mapped:
-                items.append(mapped)
-        pagination = getattr(res, 'pagination', None)
-        total = getattr(pagination, 'total_count', None) if pagination else None
-        count = getattr(pagination, 'count', None) if pagination else None
-        next_offset = offset + (int(count) if isinstance(count, int) else len(items))
-        return jsonify({'gifs': items, 'pagination': {'offset': offset, 'limit': limit, 'total': total, 'next_offset': next_offset}})
+        return _gif_page_response(GIF_ENDPOINT_TRENDING, None, offset, limit)
     except Exception as e:
         return jsonify({'error': f'Failed to load trending gifs: {str(e)}'}), 500
 
@@ -683,39 +703,13 @@ def gifs_trending():
 @api_bp.route('/api/v1/gifs/search', methods=['GET'])
 @login_required
 def gifs_search():
-    api_key = _get_giphy_key()
-    if not api_key:
-        return jsonify({'error': 'GIPHY_API_KEY is not configured'}), 500
-
     q = request.args.get('q', '', type=str).strip()
     if not q:
         return jsonify({'gifs': [], 'pagination': {'offset': 0, 'limit': 0, 'total': 0, 'next_offset': 0}})
 
-    limit = request.args.get('limit', 24, type=int)
-    offset = request.args.get('offset', 0, type=int)
-    if limit < 1:
-        limit = 1
-    if limit > 50:
-        limit = 50
-    if offset < 0:
-        offset = 0
-
+    limit, offset = _gif_page_args()
     try:
-        import giphy_client
-        from giphy_client.rest import ApiException
-
-        api_instance = giphy_client.DefaultApi()
-        res = _giphy_call_with_optional_offset(api_instance, 'gifs_search_get', api_key, limit=limit, offset=offset, rating='pg-13', q=q)
-        items = []
-        for g in (getattr(res, 'data', None) or []):
-            mapped = _serialize_giphy_item(g)
-            if mapped:
-                items.append(mapped)
-        pagination = getattr(res, 'pagination', None)
-        total = getattr(pagination, 'total_count', None) if pagination else None
-        count = getattr(pagination, 'count', None) if pagination else None
-        next_offset = offset + (int(count) if isinstance(count, int) else len(items))
-        return jsonify({'gifs': items, 'pagination': {'offset': offset, 'limit': limit, 'total': total, 'next_offset': next_offset}})
+        return _gif_page_response(GIF_ENDPOINT_SEARCH, q, offset, limit)
     except Exception as e:
         return jsonify({'error': f'Failed to search gifs: {str(e)}'}), 500
 
@@ -740,13 +734,16 @@ def delete_message(message_id):
         return jsonify({'error': 'no access'}), 403
     
     channel_id = message.channel_id
+    file_url = message.file_url
     db.session.delete(message)
-    db.session.commit()
-    
-    socketio.emit('message_deleted', {
+    if file_url:
+        # Credit the attachment back now, unless a forwarded copy still uses it
+        release_unreferenced_uploads([file_url])
+    enqueue_emit('message_deleted', {
         'message_id': message_id,
         'channel_id': channel_id
     }, room=str(channel_id))
+    db.session.commit()
     
     return jsonify({'success': True})
 
@@ -763,7 +760,7 @@ def edit_message(message_id):
     if new_content:
         message.content = new_content
         message.edited_at = datetime.utcnow()
-        db.session.commit()
+        db.session.flush()
     
     # Load reactions
     reactions_data = {}
@@ -781,7 +778,8 @@ def edit_message(message_id):
     }
 
     # Emit to channel room so all connected clients (except possibly the editor) receive update
-    socketio.emit('message_edited', payload, room=str(message.channel_id))
+    enqueue_emit('message_edited', payload, room=str(message.channel_id))
+    db.session.commit()
 
     # Return the payload along with success so the editing client can update immediately
     response = {'success': True}
@@ -818,9 +816,9 @@ def forward_message(message_id):
         file_size=message.file_size
     )
     db.session.add(new_msg)
-    db.session.commit()
+    db.session.flush()
     
-    socketio.emit('receive_message', {
+    enqueue_emit('receive_message', {
         'id': new_msg.id,
         'user_id': current_user.id,
         'username': current_user.username,
@@ -832,6 +830,7 @@ def forward_message(message_id):
         'file_name': new_msg.file_name,
         'file_size': new_msg.file_size
     }, room=str(target_channel_id))
+    db.session.commit()
     
     return jsonify({'success': True})
 
@@ -846,45 +845,63 @@ def toggle_reaction(message_id):
     if not emoji:
         return jsonify({'error': 'reaction not specified'}), 400
     
-    # Check if reaction already exists
-    existing = MessageReaction.query.filter_by(
-        message_id=message_id,
-        user_id=current_user.id,
-        emoji=emoji
-    ).first()
+    action, count = toggle_message_reaction(message_id, current_user.id, emoji, reaction_type)
+    enqueue_emit(
+        'reactions_updated',
+        reaction_delta_payload(message_id, emoji, action, current_user, count),
+        room=str(message.channel_id)
+    )
+    db.session.commit()
     
-    if existing:
-        db.session.delete(existing)
-        action = 'removed'
-    else:
-        reaction = MessageReaction(
-            message_id=message_id,
-            user_id=current_user.id,
-            emoji=emoji,
-            reaction_type=reaction_type
+    return jsonify({'success': True, 'action': action, 'emoji': emoji, 'count': count})
+
+
+@api_bp.route('/api/v1/reactions/batch', methods=['POST'])
+@login_required
+def toggle_reactions_batch():
+    # Apply several reaction toggles in one transaction
+    # Body: {"toggles": [{"message_id": 1, "emoji": "👍", "reaction_type": "emoji"}, ...]}
+    data = request.get_json(silent=True) or {}
+    toggles = data.get('toggles')
+    if not isinstance(toggles, list) or not toggles:
+        return jsonify({'error': 'toggles not specified'}), 400
+    if len(toggles) > MAX_BATCH_TOGGLES:
+        return jsonify({'error': f'too many toggles (max {MAX_BATCH_TOGGLES})'}), 400
+
+    message_ids = set()
+    for item in toggles:
+        try:
+            message_ids.add(int((item or {}).get('message_id')))
+        except (TypeError, ValueError, AttributeError):
+            continue
+    channels = dict(
+        db.session.query(Message.id, Message.channel_id).filter(Message.id.in_(message_ids)).all()
+    ) if message_ids else {}
+
+    results = []
+    for item in toggles:
+        item = item if isinstance(item, dict) else {}
+        emoji = item.get('emoji')
+        try:
+            message_id = int(item.get('message_id'))
+        except (TypeError, ValueError):
+            message_id = None
+        if not emoji or message_id is None:
+            results.append({'message_id': message_id, 'emoji': emoji, 'error': 'reaction not specified'})
+            continue
+        if message_id not in channels:
+            results.append({'message_id': message_id, 'emoji': emoji, 'error': 'message not found'})
+            continue
+        action, count = toggle_message_reaction(message_id, current_user.id, emoji, item.get('reaction_type', 'emoji'))
+        results.append({'message_id': message_id, 'emoji': emoji, 'action': action, 'count': count})
+        enqueue_emit(
+            'reactions_updated',
+            reaction_delta_payload(message_id, emoji, action, current_user, count),
+            room=str(channels[message_id])
         )
-        db.session.add(reaction)
-        action = 'added'
-    
     db.session.commit()
-    
-    # Get updated reactions
-    reactions = MessageReaction.query.filter_by(message_id=message_id).all()
-    reaction_data = {}
-    for r in reactions:
-        if r.emoji not in reaction_data:
-            reaction_data[r.emoji] = []
-        reaction_data[r.emoji].append(r.user.username)
-    
-    socketio.emit('reactions_updated', {
-        'message_id': message_id,
-        'reactions': reaction_data,
-        'action': action,
-        'emoji': emoji,
-        'user': current_user.username
-    }, room=str(message.channel_id))
-    
-    return jsonify({'success': True, 'action': action, 'reactions': reaction_data})
+
+    return jsonify({'success': True, 'results': results})
 
 # --- ROOM MANAGEMENT ---
 
@@ -899,13 +916,11 @@ def delete_room(room_id):
     if not has_room_permission(current_user.id, room, 'delete_server'):
         return jsonify({'error': 'no rights to delete the server'}), 403
     
-    # Delete all members first
-    Member.query.filter_by(room_id=room_id).delete()
-    # Delete room (cascade will delete channels and messages)
-    db.session.delete(room)
-    db.session.commit()
+    # Tombstone the room now; members, channels and messages are removed by a background job
+    enqueue_emit('server_removed', {'room_id': room_id}, room=str(room_id))
+    job = start_room_deletion(room, created_by_id=current_user.id)
     
-    return jsonify({'success': True})
+    return jsonify({'success': True, 'job_id': job.id}), 202
 
 @api_bp.route('/room/<int:room_id>/leave', methods=['POST'])
 @login_required
@@ -924,10 +939,10 @@ def leave_room(room_id):
     # Check if user is banned from this room
     room_ban = get_active_room_ban(current_user.id, room_id)
     if room_ban:
-        print(f"[LEAVE ROOM] User {current_user.id} attempted to leave while banned from room {room_id}")
+        log.info('room.leave_denied_banned', user_id=current_user.id, room_id=room_id)
         return jsonify({'error': 'you are banned from this server'}), 403
     
-    print(f"[LEAVE ROOM] User {current_user.id} left room {room_id}")
+    log.info('room.left', user_id=current_user.id, room_id=room_id)
     db.session.delete(member)
     db.session.commit()
     
@@ -999,22 +1014,25 @@ def join_room_by_invite(token):
 
 @api_bp.route('/channels/accessible')
 @login_required
+@query_budget(1)
 def get_accessible_channels():
     # Get list of accessible channels for forwarding
-    rooms = db.session.query(Room).join(Member).filter(
-        Member.user_id == current_user.id
-    ).all()
+    rows = db.session.query(
+        Channel.id, Channel.name, Room.id, Room.name, Room.type
+    ).join(Room, Room.id == Channel.room_id).join(Member, Member.room_id == Room.id).filter(
+        Member.user_id == current_user.id,
+        Room.deleted_at.is_(None)
+    ).order_by(Room.id, Channel.id).all()
     
     channels_list = []
-    for room in rooms:
-        for channel in room.channels:
-            channels_list.append({
-                'id': channel.id,
-                'name': channel.name,
-                'room_id': room.id,
-                'room_name': room.name,
-                'room_type': room.type
-            })
+    for channel_id, channel_name, room_id, room_name, room_type in rows:
+        channels_list.append({
+            'id': channel_id,
+            'name': channel_name,
+            'room_id': room_id,
+            'room_name': room_name,
+            'room_type': room_type
+        })
     
     return jsonify({'channels': channels_list})
 
@@ -1034,40 +1052,65 @@ def get_current_user():
         'is_superuser': current_user.is_superuser or False
     })
 
+@api_bp.route('/api/v1/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    # Progress of a background job (room/account deletion, message purge) started by this user
+    job = BackgroundJob.query.get_or_404(job_id)
+    if job.created_by_id != current_user.id and not current_user.is_superuser:
+        return jsonify({'error': 'no access'}), 403
+    return jsonify(job_payload(job))
+
 @api_bp.route('/api/v1/rooms', methods=['GET'])
 @login_required
+@query_budget(5)
 def get_user_rooms():
     # Get all rooms the user is member of - for desktop clients
+    # (a fixed number of queries for all rooms: memberships, roles, member counts, DM peers, channels)
     rooms_data = []
-    rooms = Room.query.join(Member).filter(Member.user_id == current_user.id).all()
-    
-    for room in rooms:
-        my_member = Member.query.filter_by(user_id=current_user.id, room_id=room.id).first()
-        perms = get_user_permissions(current_user.id, room.id)
-        room_name = room.name
-        if room.type == 'dm':
-            try:
-                other_member = next((m for m in room.members if int(m.user_id) != int(current_user.id)), None)
-                if other_member and other_member.user and other_member.user.username:
-                    room_name = other_member.user.username
-            except Exception:
-                room_name = room.name
+    memberships = db.session.query(Room, Member).join(Member, Member.room_id == Room.id).filter(
+        Member.user_id == current_user.id, Room.deleted_at.is_(None)
+    ).all()
+    room_ids = [room.id for room, _ in memberships]
+    permissions = get_user_permissions_for_rooms(current_user.id, [member for _, member in memberships])
+
+    member_counts = {}
+    dm_names = {}
+    channels_by_room = {}
+    if room_ids:
+        member_counts = dict(
+            db.session.query(Member.room_id, func.count(Member.id))
+            .filter(Member.room_id.in_(room_ids)).group_by(Member.room_id).all()
+        )
+        dm_ids = [room.id for room, _ in memberships if room.type == 'dm']
+        if dm_ids:
+            for room_id, username in db.session.query(Member.room_id, User.username).join(
+                User, User.id == Member.user_id
+            ).filter(Member.room_id.in_(dm_ids), Member.user_id != current_user.id).order_by(Member.id):
+                if username:
+                    dm_names.setdefault(room_id, username)
+        for channel in Channel.query.filter(Channel.room_id.in_(room_ids)).order_by(Channel.id):
+            channels_by_room.setdefault(channel.room_id, []).append(channel)
+
+    for room, my_member in memberships:
+        perms = permissions.get(room.id, set())
+        room_name = dm_names.get(room.id, room.name) if room.type == 'dm' else room.name
 
         room_dict = {
             'id': room.id,
             'name': room_name,
             'type': room.type,
-            'my_role': my_member.role if my_member else 'member',
+            'my_role': my_member.role or 'member',
             'my_permissions': sorted(list(perms)),
             'is_public': bool(room.is_public),
             'description': getattr(room, 'description', None) or '',
             'avatar_url': room.avatar_url,
             'banner_url': getattr(room, 'banner_url', None),
-            'member_count': len(room.members),
+            'member_count': member_counts.get(room.id, 0),
             'channels': []
         }
         
-        for channel in room.channels:
+        for channel in channels_by_room.get(room.id, []):
             channel_dict = {
                 'id': channel.id,
                 'name': channel.name,
@@ -1085,6 +1128,7 @@ def get_user_rooms():
 
 @api_bp.route('/api/v1/room/<int:room_id>/members', methods=['GET'])
 @login_required
+@query_budget(4)
 def get_room_members(room_id):
     # Members list for mentions/autocomplete in SPA
     room = Room.query.get_or_404(room_id)
@@ -1092,22 +1136,20 @@ def get_room_members(room_id):
     if not membership:
         return jsonify({'error': 'Access denied'}), 403
 
-    members = Member.query.filter_by(room_id=room_id).all()
+    members = db.session.query(Member, User).join(User, User.id == Member.user_id).filter(Member.room_id == room_id).all()
     role_links = MemberRole.query.filter_by(room_id=room_id).all()
     role_map = {}
     for link in role_links:
         role_map.setdefault(link.user_id, []).append(link.role_id)
     payload = []
-    for m in members:
-        if not m.user:
-            continue
+    for m, user in members:
         payload.append({
-            'id': m.user.id,
-            'username': m.user.username,
-            'avatar_url': m.user.avatar_url or 'https://placehold.co/50x50',
+            'id': user.id,
+            'username': user.username,
+            'avatar_url': user.avatar_url or 'https://placehold.co/50x50',
             'role': m.role,
-            'role_ids': sorted(role_map.get(m.user.id, [])),
-            'presence_status': 'hidden' if getattr(m.user, 'hide_status', False) else (m.user.presence_status or 'offline'),
+            'role_ids': sorted(role_map.get(user.id, [])),
+            'presence_status': 'hidden' if getattr(user, 'hide_status', False) else (user.presence_status or 'offline'),
             'muted_until': m.muted_until.isoformat() if getattr(m, 'muted_until', None) else None,
         })
 
@@ -1182,12 +1224,17 @@ def upload_room_avatar_api(room_id):
     room = Room.query.get_or_404(room_id)
     if not has_room_permission(current_user.id, room, 'manage_server'):
         return jsonify({'error': 'Access denied'}), 403
+    quota_response = limit_upload_to_quota(room_id)
+    if quota_response:
+        return quota_response
     if 'avatar' not in request.files:
         return jsonify({'error': 'avatar file is required'}), 400
     file = request.files['avatar']
     if not file or not file.filename:
         return jsonify({'error': 'avatar file is required'}), 400
-    filepath = save_file(file, 'room_avatars')
+    filepath, quota_error = save_file_with_quota(file, 'room_avatars', room_id=room_id)
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
     if not filepath:
         return jsonify({'error': 'failed to save avatar'}), 500
     room.avatar_url = filepath
@@ -1201,12 +1248,17 @@ def upload_room_banner_api(room_id):
     room = Room.query.get_or_404(room_id)
     if not has_room_permission(current_user.id, room, 'manage_server'):
         return jsonify({'error': 'Access denied'}), 403
+    quota_response = limit_upload_to_quota(room_id)
+    if quota_response:
+        return quota_response
     if 'banner' not in request.files:
         return jsonify({'error': 'banner file is required'}), 400
     file = request.files['banner']
     if not file or not file.filename:
         return jsonify({'error': 'banner file is required'}), 400
-    filepath = save_file(file, 'room_avatars')
+    filepath, quota_error = save_file_with_quota(file, 'room_avatars', room_id=room_id)
+    if quota_error:
+        return jsonify({'error': quota_error}), 413
     if not filepath:
         return jsonify({'error': 'failed to save banner'}), 500
     room.banner_url = filepath
@@ -1227,6 +1279,7 @@ def delete_room_banner_api(room_id):
 
 @api_bp.route('/api/v1/room/<int:room_id>/roles', methods=['GET'])
 @login_required
+@query_budget(8)
 def get_room_roles(room_id):
     room = Room.query.get_or_404(room_id)
     member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
@@ -1237,12 +1290,12 @@ def get_room_roles(room_id):
     db.session.commit()
 
     roles = Role.query.filter_by(room_id=room_id).all()
+    mentioners = {}
+    for p in RoleMentionPermission.query.filter_by(room_id=room_id).order_by(RoleMentionPermission.id):
+        mentioners.setdefault(p.target_role_id, []).append(p.source_role_id)
     data = []
     for role in roles:
-        allowed_source_roles = [
-            p.source_role_id
-            for p in RoleMentionPermission.query.filter_by(room_id=room_id, target_role_id=role.id).all()
-        ]
+        allowed_source_roles = mentioners.get(role.id, [])
         data.append({
             'id': role.id,
             'name': role.name,
@@ -1432,30 +1485,33 @@ def assign_member_roles(room_id, user_id):
 
     db.session.commit()
     try:
-        for m in Member.query.filter_by(room_id=room_id).all():
-            socketio.emit('room_state_refresh', {'room_id': room_id}, room=f"user_{m.user_id}")
+        member_rooms = [f"user_{m.user_id}" for m in Member.query.filter_by(room_id=room_id).all()]
+        if member_rooms:
+            socketio.emit('room_state_refresh', {'room_id': room_id}, room=member_rooms)
     except Exception:
         pass
     return jsonify({'success': True, 'user_id': user_id, 'role_ids': sorted(valid_ids)})
 
 @api_bp.route('/api/v1/channel/<int:channel_id>/messages', methods=['GET'])
 @login_required
+@query_budget(6)
 def get_channel_messages(channel_id):
     # Get messages from a channel - for desktop clients
     channel = Channel.query.get_or_404(channel_id)
-    room = channel.room
     
     # Check access
-    member = Member.query.filter_by(user_id=current_user.id, room_id=room.id).first()
+    member = Member.query.filter_by(user_id=current_user.id, room_id=channel.room_id).first()
     if not member:
         return jsonify({'error': 'Access denied'}), 403
     
     limit = request.args.get('limit', 50, type=int)
     offset = request.args.get('offset', 0, type=int)
     
-    messages = Message.query.filter_by(channel_id=channel_id).order_by(
-        Message.timestamp.desc()
-    ).limit(limit).offset(offset).all()
+    # Authors and reactors are loaded in one IN query each instead of per message
+    messages = Message.query.filter_by(channel_id=channel_id).options(
+        selectinload(Message.user),
+        selectinload(Message.reactions).selectinload(MessageReaction.user),
+    ).order_by(Message.id.desc()).limit(limit).offset(offset).all()
     
     messages_data = []
     for msg in reversed(messages):
@@ -1544,12 +1600,6 @@ def get_statistics():
 
 # --- ADMIN FUNCTIONS ---
 
-def get_client_ip():
-    # Safely get client IP address
-    if request.headers.get('X-Forwarded-For'):
-        return request.headers.get('X-Forwarded-For').split(',')[0].strip()
-    return request.remote_addr
-
 @api_bp.route('/admin/user/<int:user_id>/ban', methods=['POST'])
 @login_required
 def ban_user(user_id):
@@ -1601,20 +1651,6 @@ def ban_user(user_id):
         # Mark target membership as 'banned' so it can be unbanned later
         target_membership = Member.query.filter_by(user_id=user_id, room_id=room_id).first()
         if target_membership:
-            # Optional deletion of messages in room
-            if data.get('delete_messages'):
-                try:
-                    channel_ids = [c.id for c in target_membership.room.channels]
-                    if channel_ids:
-                        deleted = Message.query.filter(Message.user_id == user_id, Message.channel_id.in_(channel_ids)).delete(synchronize_session=False)
-                        db.session.commit()
-                        try:
-                            socketio.emit('bulk_messages_deleted', {'user_id': user_id, 'room_id': room_id, 'deleted': deleted}, room=str(room_id))
-                        except Exception:
-                            pass
-                except Exception:
-                    db.session.rollback()
-
             # Create RoomBan record
             existing_ban = RoomBan.query.filter_by(user_id=user_id, room_id=room_id).first()
             if not existing_ban:
@@ -1637,6 +1673,12 @@ def ban_user(user_id):
             db.session.delete(target_membership)
             db.session.commit()
 
+            # Optional deletion of messages in room, done in chunks by a background job.
+            # Queued only once the ban is committed: enqueue_job commits and starts the job
+            purge_job = None
+            if data.get('delete_messages'):
+                purge_job = start_user_message_purge(user_id, room_id, created_by_id=current_user.id)
+
             # Notify room members to remove this member from UI
             try:
                 socketio.emit('member_removed', {'user_id': user_id, 'room_id': room_id}, room=str(room_id))
@@ -1656,7 +1698,8 @@ def ban_user(user_id):
                 'success': True,
                 'message': f'user {user.username} banned in room',
                 'room_id': room_id,
-                'banned_until': banned_until.isoformat() if banned_until else None
+                'banned_until': banned_until.isoformat() if banned_until else None,
+                'job_id': purge_job.id if purge_job else None
             })
         else:
             return jsonify({'error': 'user is not in the room'}), 404
@@ -1670,17 +1713,12 @@ def ban_user(user_id):
     user.ban_reason = ban_reason
     user.banned_at = datetime.utcnow()
 
-    # Add IP to banned list if requested
+    # Add IP to banned list if requested: an explicit address/CIDR range,
+    # otherwise the address the user last logged in from
     if ban_ip:
-        user_ip = get_client_ip()
-        if user.banned_ips:
-            ips = [ip.strip() for ip in user.banned_ips.split(',') if ip.strip()]
-        else:
-            ips = []
-
-        if user_ip not in ips:
-            ips.append(user_ip)
-            user.banned_ips = ','.join(ips)
+        target_ip = data.get('ip') or user.last_login_ip
+        if target_ip and not add_ip_ban(user, target_ip):
+            return jsonify({'error': 'invalid ip address or range'}), 400
 
     # Mark the user's memberships as 'banned' in all rooms (create RoomBan records)
     memberships = Member.query.filter_by(user_id=user_id).all()
@@ -1703,27 +1741,20 @@ def ban_user(user_id):
     for m in memberships:
         db.session.delete(m)
     db.session.commit()
+    invalidate_ip_bans()
 
-    # Optional deletion of all messages for global ban
+    # Optional deletion of all messages for global ban, done in chunks by a background job
+    # (queued after the ban is committed, as enqueue_job commits and starts the job)
+    purge_job = None
     if data.get('delete_messages'):
-        try:
-            deleted = Message.query.filter(Message.user_id == user_id).delete(synchronize_session=False)
-            db.session.commit()
-            try:
-                for rid in set(room_ids):
-                    try:
-                        socketio.emit('bulk_messages_deleted', {'user_id': user_id, 'room_id': rid, 'deleted': deleted}, room=str(rid))
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-        except Exception:
-            db.session.rollback()
+        purge_job = start_user_message_purge(
+            user_id, None, created_by_id=current_user.id, notify_room_ids=room_ids
+        )
 
     # Notify affected rooms and the user
     try:
         target_room = f"user_{user_id}"
-        print(f"[GLOBAL BAN] Banning user {user_id} globally to room {target_room}")
+        log.info('user.global_ban', user_id=user_id, rooms=len(set(room_ids)), by_user_id=current_user.id)
         
         for rid in set(room_ids):
             try:
@@ -1737,20 +1768,16 @@ def ban_user(user_id):
             for rid in set(room_ids):
                 socketio.emit('server_removed', {'room_id': rid}, room=target_room)
         except Exception as e:
-            print(f"[GLOBAL BAN] ERROR emitting server_removed: {e}")
-            pass
-        print(f"[GLOBAL BAN] All events emitted for user {user_id}")
+            log.error('user.global_ban_emit_failed', user_id=user_id, event='server_removed', error=str(e))
     except Exception as e:
-        print(f"[GLOBAL BAN] ERROR: {e}")
-    except Exception as e:
-        print(f"[GLOBAL BAN DEBUG] ERROR in emit block: {e}")
-        pass
+        log.error('user.global_ban_emit_failed', user_id=user_id, error=str(e))
 
     return jsonify({
         'success': True,
         'message': f'user {user.username} is banned',
         'user_id': user_id,
-        'reason': ban_reason
+        'reason': ban_reason,
+        'job_id': purge_job.id if purge_job else None
     })
 
 @api_bp.route('/admin/user/<int:user_id>/unban', methods=['POST'])
@@ -1803,13 +1830,14 @@ def unban_user(user_id):
     user.is_banned = False
     user.ban_reason = None
     user.banned_at = None
-    user.banned_ips = ""
+    remove_user_ip_bans(user)
 
     # Unban globally - delete all RoomBan records for this user
     room_bans = RoomBan.query.filter_by(user_id=user_id).all()
     for room_ban in room_bans:
         db.session.delete(room_ban)
     db.session.commit()
+    invalidate_ip_bans()
 
     return jsonify({
         'success': True,
@@ -1833,7 +1861,7 @@ def admin_change_password(user_id):
     if not is_valid:
         return jsonify({'error': error_message}), 400
     
-    user.password = generate_password_hash(new_password, method='scrypt')
+    user.password = hash_password(new_password)
     db.session.commit()
     
     return jsonify({
@@ -1854,7 +1882,7 @@ def change_password():
     if not old_password or not new_password:
         return jsonify({'error': 'fill in all fields'}), 400
     
-    if not check_password_hash(current_user.password, old_password):
+    if not verify_password(current_user.password, old_password):
         return jsonify({'error': 'old password is wrong'}), 403
     
     if new_password != confirm_password:
@@ -1868,7 +1896,7 @@ def change_password():
     if new_password == old_password:
         return jsonify({'error': 'new password should differ from old'}), 400
     
-    current_user.password = generate_password_hash(new_password, method='scrypt')
+    current_user.password = hash_password(new_password)
     db.session.commit()
     
     return jsonify({
@@ -1883,21 +1911,7 @@ def get_banned_ips():
     if not current_user.is_superuser:
         return jsonify({'error': 'not enough rights'}), 403
     
-    banned_users = User.query.filter_by(is_banned=True).all()
-    banned_ips_list = {}
-    
-    for user in banned_users:
-        if user.banned_ips:
-            ips = [ip.strip() for ip in user.banned_ips.split(',') if ip.strip()]
-            for ip in ips:
-                if ip not in banned_ips_list:
-                    banned_ips_list[ip] = []
-                banned_ips_list[ip].append({
-                    'username': user.username,
-                    'user_id': user.id,
-                    'reason': user.ban_reason,
-                    'banned_at': user.banned_at.isoformat() if user.banned_at else None
-                })
+    banned_ips_list = list_banned_ips()
     
     return jsonify({
         'success': True,
@@ -1905,6 +1919,124 @@ def get_banned_ips():
         'total_ips': len(banned_ips_list)
     })
 
+@api_bp.route('/admin/auth/hasher', methods=['GET'])
+@login_required
+def password_hasher_stats():
+    # Password hashing pool: queue depth, rejections and timings
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    return jsonify({'success': True, 'hasher': get_hasher_stats()})
+
+@api_bp.route('/admin/admission', methods=['GET'])
+@login_required
+def admission_stats():
+    # Current shedding level, the load signals behind it and deferred presence writes
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    return jsonify({'success': True, 'admission': get_admission_stats()})
+
+@api_bp.route('/admin/profile', methods=['GET'])
+@login_required
+def sample_profile():
+    # Sample this worker's threads and greenlets for ?seconds=N (at ?hz=, ?idle=1 keeps idle waits)
+    # and return collapsed stacks for flamegraph.pl / speedscope
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    seconds = request.args.get('seconds', 10, type=float)
+    hz = request.args.get('hz', None, type=float)
+    include_idle = request.args.get('idle', '0') in ('1', 'true', 'yes')
+    if seconds is None or seconds <= 0:
+        return jsonify({'error': 'seconds must be a positive number'}), 400
+    try:
+        sampler = run_profile(seconds, hz=hz, include_idle=include_idle)
+    except ProfilerBusy:
+        return jsonify({'error': 'a profile is already running'}), 409
+    log.info('profile.requested', user_id=current_user.id, seconds=seconds, samples=sampler.samples)
+    return Response(sampler.collapsed(), content_type='text/plain; charset=utf-8', headers={
+        'X-Profile-Samples': str(sampler.samples),
+        'X-Profile-Seconds': f'{sampler.duration:.2f}',
+        'Content-Disposition': f'inline; filename="profile-{os.getpid()}.collapsed"',
+    })
+
+@api_bp.route('/admin/profile/rolling', methods=['GET'])
+@login_required
+def list_rolling_profiles():
+    # Files written by the continuous profiler (PROFILER_CONTINUOUS), newest first
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    return jsonify({'success': True, 'profiles': list_profiles()})
+
+@api_bp.route('/admin/profile/rolling/<path:filename>', methods=['GET'])
+@login_required
+def get_rolling_profile(filename):
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+    if filename not in {p['name'] for p in list_profiles()}:
+        return jsonify({'error': 'not found'}), 404
+    return send_from_directory(profile_dir(), filename, mimetype='text/plain')
+
+@api_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus scrape endpoint (see app/functions/metrics.py for access rules)
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'metrics are disabled'}), 404
+    if not metrics_scrape_allowed():
+        return jsonify({'error': 'forbidden'}), 403
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_bp.route('/admin/uploads/gc', methods=['GET', 'POST'])
+@login_required
+def uploads_gc():
+    # Orphaned uploads GC: GET returns reclaimed-bytes metrics,
+    # POST runs one bounded batch (JSON {dry_run, batch_size, cursor})
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+
+    if request.method == 'GET':
+        return jsonify({'success': True, 'stats': get_gc_stats()})
+
+    data = request.get_json(silent=True) or {}
+    dry_run = bool(data.get('dry_run', True))
+    batch_size = data.get('batch_size')
+    try:
+        batch_size = max(1, min(int(batch_size), 5000)) if batch_size else None
+    except Exception:
+        return jsonify({'error': 'batch_size must be a number'}), 400
+    cursor = data.get('cursor') if dry_run else None
+
+    report = run_gc_batch(
+        get_upload_folder(),
+        batch_size=batch_size,
+        dry_run=dry_run,
+        cursor=str(cursor) if cursor is not None else None,
+    )
+    return jsonify({'success': True, 'report': report, 'stats': get_gc_stats()})
+
+@api_bp.route('/admin/storage/top', methods=['GET'])
+@login_required
+def storage_top_consumers():
+    # Top storage consumers from the running counters (no filesystem scan)
+    # Query: ?type=user|room&limit=20
+    if not current_user.is_superuser:
+        return jsonify({'error': 'not enough rights'}), 403
+
+    owner_type = request.args.get('type', 'user', type=str)
+    if owner_type not in ('user', 'room'):
+        return jsonify({'error': 'type must be user or room'}), 400
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, 200))
+
+    consumers = top_consumers(owner_type, limit)
+    owner_ids = [c['owner_id'] for c in consumers]
+    if owner_type == 'user':
+        names = dict(db.session.query(User.id, User.username).filter(User.id.in_(owner_ids)).all()) if owner_ids else {}
+    else:
+        names = dict(db.session.query(Room.id, Room.name).filter(Room.id.in_(owner_ids)).all()) if owner_ids else {}
+    for c in consumers:
+        c['name'] = names.get(c['owner_id'])
+
+    return jsonify({'success': True, 'type': owner_type, 'consumers': consumers})
+
 @api_bp.route('/admin/user/<int:user_id>/kick_from_room/<int:room_id>', methods=['POST'])
 @login_required
 def kick_user_from_room(user_id, room_id):
@@ -1940,13 +2072,10 @@ def kick_user_from_room(user_id, room_id):
         return jsonify({'error': 'the user is already banned, cannot kick'}), 400
 
     db.session.delete(target_member)
+    enqueue_emit('member_removed', {'user_id': user_id, 'room_id': room_id}, room=str(room_id))
     db.session.commit()
 
-    # Notify room and target user
-    try:
-        socketio.emit('member_removed', {'user_id': user_id, 'room_id': room_id}, room=str(room_id))
-    except Exception:
-        pass
+    # Notify target user
     try:
         from flask import url_for
         socketio.emit('force_redirect', {'reason': 'kicked', 'location': url_for('main.dashboard')}, room=f"user_{user_id}")
@@ -1987,15 +2116,12 @@ def mute_user_in_room(user_id, room_id):
     muted_until = datetime.utcnow() + timedelta(minutes=minutes)
     for target_member in target_members:
         target_member.muted_until = muted_until
+    enqueue_emit('member_mute_updated', {
+        'room_id': room_id,
+        'user_id': user_id,
+        'muted_until': muted_until.isoformat()
+    }, room=str(room_id))
     db.session.commit()
-    try:
-        socketio.emit('member_mute_updated', {
-            'room_id': room_id,
-            'user_id': user_id,
-            'muted_until': muted_until.isoformat()
-        }, room=str(room_id))
-    except Exception:
-        pass
     return jsonify({'success': True, 'muted_until': muted_until.isoformat()})
 
 
@@ -2019,15 +2145,12 @@ def unmute_user_in_room(user_id, room_id):
 
     for target_member in target_members:
         target_member.muted_until = None
+    enqueue_emit('member_mute_updated', {
+        'room_id': room_id,
+        'user_id': user_id,
+        'muted_until': None
+    }, room=str(room_id))
     db.session.commit()
-    try:
-        socketio.emit('member_mute_updated', {
-            'room_id': room_id,
-            'user_id': user_id,
-            'muted_until': None
-        }, room=str(room_id))
-    except Exception:
-        pass
     return jsonify({'success': True})
 
 
@@ -2133,7 +2256,7 @@ def demote_user(user_id):
 @login_required
 def delete_user_messages(user_id):
     # Delete all messages from a user in a specific room (owner/admin allowed). Expects JSON {room_id}
-    # Emits a `bulk_messages_deleted` socket event for the room with user_id
+    # Emits a `bulk_messages_deleted` socket event for the room with user_id once the purge job finishes
     data = request.json or {}
     room_id = data.get('room_id')
     try:
@@ -2169,11 +2292,8 @@ def delete_user_messages(user_id):
     if not channel_ids:
         return jsonify({'success': True, 'deleted': 0})
 
-    # delete messages from these channels by user
-    deleted = Message.query.filter(Message.user_id == user_id, Message.channel_id.in_(channel_ids)).delete(synchronize_session=False)
-    db.session.commit()
-
-    # Notify room listeners that messages from this user were removed
-    socketio.emit('bulk_messages_deleted', {'user_id': user_id, 'room_id': room_id, 'deleted': deleted}, room=str(room_id))
+    # Delete the user's messages in chunks in the background; room listeners get
+    # `bulk_messages_deleted` when it finishes, the requester gets `job_progress`
+    job = start_user_message_purge(user_id, room_id, created_by_id=current_user.id)
 
-    return jsonify({'success': True, 'deleted': deleted, 'room_id': room_id})
+    return jsonify({'success': True, 'job_id': job.id, 'total': job.total, 'room_id': room_id}), 202
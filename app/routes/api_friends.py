@@ -6,6 +6,9 @@ from sqlalchemy import or_, and_, func
 
 from app.extensions import db, socketio
 from app.models import User, Room, Channel, Member
+from app.functions import query_budget, get_logger
+
+log = get_logger('friends')
 
 
 def _friendship_pair(a_id, b_id):
@@ -80,19 +83,13 @@ def register_friends_routes(api_bp):
             )
         ).first()
         if pending:
-            try:
-                print(f"[FRIEND REQUEST] Pending already exists between {current_user.id} and {target.id}")
-            except Exception:
-                pass
+            log.debug('friend_request.already_pending', from_user_id=current_user.id, to_user_id=target.id)
             return jsonify({'success': True, 'status': 'pending'}), 200
 
         fr = FriendRequest(from_user_id=current_user.id, to_user_id=target.id, status='pending')
         db.session.add(fr)
         db.session.commit()
-        try:
-            print(f"[FRIEND REQUEST] Emitting friend_request_received to user_{target.id} request_id={fr.id}")
-        except Exception:
-            pass
+        log.debug('friend_request.sent', from_user_id=current_user.id, to_user_id=target.id, request_id=fr.id)
         socketio.emit('friend_request_received', {
             'request_id': fr.id,
             'from_user_id': current_user.id,
@@ -102,15 +99,18 @@ def register_friends_routes(api_bp):
 
     @api_bp.route('/api/v1/friends/requests', methods=['GET'])
     @login_required
+    @query_budget(3)
     def list_friend_requests():
         from app.models import FriendRequest
 
         incoming = FriendRequest.query.filter_by(to_user_id=current_user.id, status='pending').order_by(FriendRequest.id.desc()).limit(50).all()
         outgoing = FriendRequest.query.filter_by(from_user_id=current_user.id, status='pending').order_by(FriendRequest.id.desc()).limit(50).all()
+        other_ids = {fr.from_user_id for fr in incoming} | {fr.to_user_id for fr in outgoing}
+        others = {u.id: u for u in User.query.filter(User.id.in_(other_ids)).all()} if other_ids else {}
 
         def _serialize(fr):
             other_id = fr.from_user_id if fr.to_user_id == current_user.id else fr.to_user_id
-            other = User.query.get(other_id)
+            other = others.get(other_id)
             return {
                 'id': fr.id,
                 'status': fr.status,
@@ -166,6 +166,7 @@ def register_friends_routes(api_bp):
         # Auto-create DM on accept so it appears immediately in dashboard/sidebar.
         existing_dm = Room.query.filter(
             Room.type == 'dm',
+            Room.deleted_at.is_(None),
             Room.members.any(Member.user_id == fr.from_user_id),
             Room.members.any(Member.user_id == fr.to_user_id)
         ).first()
@@ -214,6 +215,7 @@ def register_friends_routes(api_bp):
 
         existing_dm = Room.query.filter(
             Room.type == 'dm',
+            Room.deleted_at.is_(None),
             Room.members.any(Member.user_id == current_user.id),
             Room.members.any(Member.user_id == user_id)
         ).first()
@@ -1,7 +1,10 @@
 from flask import request, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy import func
 
-from app.models import Room
+from app.extensions import db
+from app.functions import query_budget
+from app.models import Room, Member
 
 
 def register_search_routes(api_bp):
@@ -12,16 +15,22 @@ def register_search_routes(api_bp):
 
     @api_bp.route('/api/v1/search/servers', methods=['GET'])
     @login_required
+    @query_budget(2)
     def search_servers():
         query = request.args.get('q', '', type=str).strip()
         rooms_query = Room.query.filter(
             Room.type != 'dm',
-            (Room.is_public == True)
+            (Room.is_public == True),
+            Room.deleted_at.is_(None)
         )
         if query:
             rooms_query = rooms_query.filter(Room.name.ilike(f'%{query}%'))
 
         rooms = rooms_query.order_by(Room.name.asc()).limit(20).all()
+        member_counts = dict(
+            db.session.query(Member.room_id, func.count(Member.id))
+            .filter(Member.room_id.in_([r.id for r in rooms])).group_by(Member.room_id).all()
+        ) if rooms else {}
 
         rooms_data = [{
             'id': r.id,
@@ -29,7 +38,7 @@ def register_search_routes(api_bp):
             'description': getattr(r, 'description', None) or '',
             'type': r.type,
             'avatar_url': r.avatar_url or 'https://placehold.co/100x100',
-            'member_count': len(r.members)
+            'member_count': member_counts.get(r.id, 0)
         } for r in rooms]
 
         return jsonify({'servers': rooms_data})
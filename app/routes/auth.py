@@ -2,23 +2,32 @@
 
 from datetime import datetime, timedelta
 import os
-import sqlite3
 from flask import Blueprint, request, redirect, url_for, flash, jsonify, session, current_app
 from flask_login import login_user, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import func
 from app.extensions import db
-from app.models import User, AuthThrottle
+from app.models import User, LegacyImportState
+from app.functions import (
+    is_ip_banned, PasswordHasherBusy, hash_password, verify_dummy_password, verify_and_upgrade_password,
+    check_ip_lockout, register_ip_failed_attempt, reset_ip_throttle, add_ip_ban, invalidate_ip_bans
+)
 from app.routes.spa import send_spa_index
 import re
+import time
 
 auth_bp = Blueprint('auth', __name__)
-DUMMY_PASSWORD_HASH = generate_password_hash('not_the_real_password_123!', method='scrypt')
 MAX_FAILED_LOGIN_ATTEMPTS = 5
-MAX_FAILED_IP_ATTEMPTS = 15
 LOCKOUT_MINUTES = 15
-IP_LOCKOUT_MINUTES = 30
-ATTEMPT_WINDOW_MINUTES = 15
+# How often an unfinished legacy import is re-checked before the fallback is consulted again
+LEGACY_STATE_RECHECK_SECONDS = 60
+_legacy_fallback = {'enabled': None, 'checked_at': 0.0}
+
+@auth_bp.errorhandler(PasswordHasherBusy)
+def _password_hasher_busy(e):
+    response = auth_error_response('server is busy, try again shortly', 503)
+    response = current_app.make_response(response)
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
 def get_client_ip():
     # Safely get client IP address
@@ -79,16 +88,6 @@ def get_request_value(name, default=''):
         return str(data.get(name, default) or default)
     return request.form.get(name, default)
 
-def is_ip_banned(ip):
-    # Check if IP is in banned list
-    banned_users = User.query.filter_by(is_banned=True).all()
-    for user in banned_users:
-        if user.banned_ips:
-            ips = [ip_addr.strip() for ip_addr in user.banned_ips.split(',') if ip_addr.strip()]
-            if ip in ips:
-                return True
-    return False
-
 def is_true_value(value):
     if isinstance(value, bool):
         return value
@@ -138,57 +137,39 @@ def clear_client_auth_cookies(response):
     response.delete_cookie('boxchat_auth_mode')
     return response
 
-def get_or_create_ip_throttle(ip):
-    throttle = AuthThrottle.query.filter_by(ip_address=ip).first()
-    if throttle:
-        return throttle
-    throttle = AuthThrottle(
-        ip_address=ip,
-        failed_attempts=0,
-        lockout_until=None,
-        last_attempt_at=None
-    )
-    db.session.add(throttle)
-    db.session.flush()
-    return throttle
-
-def check_ip_lockout(ip, now):
-    throttle = AuthThrottle.query.filter_by(ip_address=ip).first()
-    if throttle and throttle.lockout_until and throttle.lockout_until > now:
-        remaining_seconds = int((throttle.lockout_until - now).total_seconds())
-        remaining_minutes = max(1, (remaining_seconds + 59) // 60)
-        return remaining_minutes
-    return None
-
-def register_ip_failed_attempt(ip, now):
-    throttle = get_or_create_ip_throttle(ip)
-    if throttle.last_attempt_at and (now - throttle.last_attempt_at) > timedelta(minutes=ATTEMPT_WINDOW_MINUTES):
-        throttle.failed_attempts = 0
-    throttle.failed_attempts = (throttle.failed_attempts or 0) + 1
-    throttle.last_attempt_at = now
-    if throttle.failed_attempts >= MAX_FAILED_IP_ATTEMPTS:
-        throttle.lockout_until = now + timedelta(minutes=IP_LOCKOUT_MINUTES)
-        throttle.failed_attempts = 0
-    db.session.commit()
 
-def reset_ip_throttle(ip, now):
-    throttle = AuthThrottle.query.filter_by(ip_address=ip).first()
-    if not throttle:
-        return
-    throttle.failed_attempts = 0
-    throttle.lockout_until = None
-    throttle.last_attempt_at = now
-    db.session.commit()
+def _legacy_db_path():
+    project_root = os.path.dirname(current_app.root_path)
+    return os.path.join(project_root, 'instance', 'thecomboxmsgr.db')
 
+def _legacy_fallback_enabled():
+    # The per-login legacy lookup stays on only until tools/import_legacy_users.py
+    # has completed; the answer is cached so logins do not stat/query every time
+    if _legacy_fallback['enabled'] is False:
+        return False
+    now = time.monotonic()
+    if _legacy_fallback['enabled'] is not None and now - _legacy_fallback['checked_at'] < LEGACY_STATE_RECHECK_SECONDS:
+        return _legacy_fallback['enabled']
+    enabled = os.path.exists(_legacy_db_path())
+    if enabled:
+        try:
+            state = db.session.get(LegacyImportState, 1)
+            enabled = not (state and state.completed_at)
+        except Exception:
+            db.session.rollback()
+    _legacy_fallback['enabled'] = enabled
+    _legacy_fallback['checked_at'] = now
+    return enabled
 
 def import_legacy_user_from_instance(username):
     # Fallback import for accounts that still exist in instance/thecomboxmsgr.db
     try:
-        project_root = os.path.dirname(current_app.root_path)
-        legacy_db_path = os.path.join(project_root, 'instance', 'thecomboxmsgr.db')
+        legacy_db_path = _legacy_db_path()
         if not os.path.exists(legacy_db_path):
             return None
 
+        import sqlite3
+
         con = sqlite3.connect(legacy_db_path)
         con.row_factory = sqlite3.Row
         cur = con.cursor()
@@ -221,7 +202,12 @@ def import_legacy_user_from_instance(username):
             ban_reason=row['ban_reason']
         )
         db.session.add(user)
+        db.session.flush()
+        # The IP ban check reads ip_ban, not the banned_ips column
+        banned_networks = [add_ip_ban(user, raw) for raw in user.banned_ips.split(',')] if user.is_banned else []
         db.session.commit()
+        if any(banned_networks):
+            invalidate_ip_bans()
         return user
     except Exception:
         db.session.rollback()
@@ -248,11 +234,13 @@ def _handle_login_post():
         )
 
     user = User.query.filter(func.lower(User.username) == username.lower()).first()
-    if not user:
+    if not user and _legacy_fallback_enabled():
         user = import_legacy_user_from_instance(username)
-    check_password_hash(DUMMY_PASSWORD_HASH, password)
+    if not user:
+        verify_dummy_password(password)
 
     if user and user.lockout_until and user.lockout_until > now:
+        verify_dummy_password(password)  # same hashing cost as a real attempt, so timing shows nothing
         remaining_seconds = int((user.lockout_until - now).total_seconds())
         remaining_minutes = max(1, (remaining_seconds + 59) // 60)
         return auth_error_response(
@@ -261,9 +249,10 @@ def _handle_login_post():
         )
 
     if user and user.is_banned:
+        verify_dummy_password(password)
         return auth_error_response('access denied', 403)
 
-    if user and check_password_hash(user.password, password):
+    if user and verify_and_upgrade_password(user, password):
         user.failed_login_attempts = 0
         user.lockout_until = None
         user.last_login_at = now
@@ -336,7 +325,7 @@ def _handle_register_post():
 
     new_user = User(
         username=username,
-        password=generate_password_hash(password, method='scrypt'),
+        password=hash_password(password),
         failed_login_attempts=0,
         lockout_until=None,
         last_login_ip=client_ip,
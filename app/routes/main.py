@@ -40,7 +40,7 @@ def explore():
 @login_required
 def view_room(room_id):
     # View room and messages
-    room = Room.query.get_or_404(room_id)
+    room = Room.query.filter_by(id=room_id, deleted_at=None).first_or_404()
     member = Member.query.filter_by(user_id=current_user.id, room_id=room_id).first()
     
     room_ban = _get_active_room_ban(current_user.id, room_id)
@@ -96,6 +96,7 @@ def start_dm(user_id):
     # Check if DM already exists
     existing_dm = db.session.query(Room).join(Member).filter(
         Room.type == 'dm',
+        Room.deleted_at.is_(None),
         Member.user_id.in_([current_user.id, other.id])
     ).group_by(Room.id).having(
         db.func.count(db.distinct(Member.user_id)) == 2
@@ -135,7 +136,7 @@ def start_dm(user_id):
 @login_required
 def join_room_view(room_id):
     # Join public room
-    room = Room.query.get_or_404(room_id)
+    room = Room.query.filter_by(id=room_id, deleted_at=None).first_or_404()
     # Block globally banned users from joining
     if getattr(current_user, 'is_banned', False):
         flash('your account is banned and cannot join rooms')
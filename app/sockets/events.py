@@ -3,16 +3,19 @@
 from flask_socketio import join_room, leave_room, emit
 from flask_login import current_user
 from app.extensions import db, socketio
-from app.models import Message, Member, Room, Channel, ReadMessage, User, Role, MemberRole, RoomBan
-from app.functions import can_user_mention_role
+from app.models import Message, Member, Room, Channel, ReadMessage, User, Role, MemberRole, RoomBan, RoleMentionPermission
 from datetime import datetime, timedelta
 import json
 import os
 import re
 from urllib.parse import urlparse
-from app.functions import get_user_role_ids, user_has_room_permission
+from app.functions import get_user_role_ids, user_has_room_permission, enqueue_emit, socket_event_metrics, query_budget
+from app.functions import get_logger, start_dispatcher, resume_jobs_once, admit_connection, defer_presence, presence_writes_deferred, shed_non_essential
+from app.functions import cancel_deferred_presence
 from sqlalchemy import func
 
+log = get_logger('socket')
+
 
 def _parse_mentions(content, room_id):
     # Parse @username + @role mentions (including @everyone role)
@@ -28,11 +31,15 @@ def _parse_mentions(content, room_id):
             'denied_role_tags': [],
         }
 
-    members = Member.query.filter_by(room_id=room_id).all()
+    members = db.session.query(Member, User).join(User, User.id == Member.user_id).filter(Member.room_id == room_id).all()
     username_to_user = {}
-    for m in members:
-        if m.user:
-            username_to_user[m.user.username.lower()] = m.user
+    users_by_id = {}
+    my_member = None
+    for m, user in members:
+        username_to_user[user.username.lower()] = user
+        users_by_id[user.id] = user
+        if m.user_id == current_user.id:
+            my_member = m
 
     room_roles = Role.query.filter_by(room_id=room_id).all()
     role_tag_to_role = {r.mention_tag.lower(): r for r in room_roles}
@@ -52,25 +59,45 @@ def _parse_mentions(content, room_id):
         if user:
             mentioned_users.append(user)
 
+    # Same rules as can_user_mention_role, checked for all mentioned roles at once
+    mentionable_ids = set()
+    if role_tokens and my_member and my_member.role not in ('owner', 'admin'):
+        my_role_ids = get_user_role_ids(current_user.id, room_id)
+        if my_role_ids:
+            mentionable_ids = {
+                row[0] for row in db.session.query(RoleMentionPermission.target_role_id).filter(
+                    RoleMentionPermission.room_id == room_id,
+                    RoleMentionPermission.target_role_id.in_([role_tag_to_role[t].id for t in role_tokens]),
+                    RoleMentionPermission.source_role_id.in_(list(my_role_ids)),
+                )
+            }
+
     allowed_roles = []
     denied_role_tags = []
     for tag in sorted(role_tokens):
         role = role_tag_to_role[tag]
-        if can_user_mention_role(current_user.id, room_id, role):
+        if my_member and (
+            my_member.role in ('owner', 'admin') or role.can_be_mentioned_by_everyone or role.id in mentionable_ids
+        ):
             allowed_roles.append(role)
         else:
             denied_role_tags.append(role.mention_tag)
 
     role_user_ids = set()
-    for role in allowed_roles:
-        links = MemberRole.query.filter_by(room_id=room_id, role_id=role.id).all()
+    if allowed_roles:
+        links = MemberRole.query.filter(
+            MemberRole.room_id == room_id, MemberRole.role_id.in_([r.id for r in allowed_roles])
+        ).all()
         for link in links:
             role_user_ids.add(link.user_id)
 
     all_mentioned_user_ids = set([u.id for u in mentioned_users]) | role_user_ids
+    missing_ids = all_mentioned_user_ids - set(users_by_id)
+    if missing_ids:
+        users_by_id.update({u.id: u for u in User.query.filter(User.id.in_(missing_ids)).all()})
     all_mentioned_usernames = []
     for uid in sorted(all_mentioned_user_ids):
-        user = User.query.get(uid)
+        user = users_by_id.get(uid)
         if user:
             all_mentioned_usernames.append(user.username)
 
@@ -138,6 +165,7 @@ def _emit_command_result(ok: bool, message: str):
     emit('command_result', {'ok': bool(ok), 'message': str(message or '')})
 
 @socketio.on('join')
+@socket_event_metrics('join')
 def on_join(data):
     # Join a channel room
     channel_id = data.get('channel_id')
@@ -145,112 +173,112 @@ def on_join(data):
     if channel_id:
         join_room(str(channel_id))
         if hasattr(current_user, 'id'):
-            print(f"[SOCKET JOIN] User {current_user.id} joined channel room: {channel_id}")
+            log.sampled('socket.join_channel', user_id=current_user.id, channel_id=channel_id)
     
     # Join personal notification room
     try:
         if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
             room_name = f"user_{current_user.id}"
             join_room(room_name)
-            print(f"[SOCKET JOIN] User {current_user.id} joined notification room: {room_name}")
     except Exception as e:
-        print(f"[SOCKET JOIN ERROR] Failed to join notification room: {e}")
-        pass
+        log.warning('socket.join_notification_room_failed', error=str(e))
 
 @socketio.on('connect')
+@socket_event_metrics('connect')
 def on_connect():
     # Handle new socket connection: mark user online and notify rooms
-    print(f"[SOCKET CONNECT] Connection event received")
+    start_dispatcher()
+    resume_jobs_once()
+    admission = admit_connection()  # raises ConnectionRefusedError while the worker sheds load
     try:
         if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
             user_id = current_user.id
             room_name = f"user_{user_id}"
-            print(f"[SOCKET CONNECT] User {user_id} ({current_user.username}) is authenticated")
             
             # Join user's personal notification room immediately
             try:
                 join_room(room_name)
-                print(f"[SOCKET CONNECT] ✓ User {user_id} joined notification room: {room_name}")
             except Exception as e:
-                print(f"[SOCKET CONNECT] ✗ Failed to join notification room: {e}")
+                log.warning('socket.join_notification_room_failed', user_id=user_id, error=str(e))
                 raise
             
             # Respect user's hide_status preference
-            if getattr(current_user, 'hide_status', False):
-                current_user.presence_status = 'hidden'
-            else:
-                current_user.presence_status = 'online'
+            status = 'hidden' if getattr(current_user, 'hide_status', False) else 'online'
+            if admission == 'defer':
+                # Overloaded: skip the commit and fan-out, the status is written once load drops
+                defer_presence(user_id, status)
+                log.sampled('socket.connected_deferred', user_id=user_id)
+                return
+            cancel_deferred_presence(user_id)
+            current_user.presence_status = status
             current_user.last_seen = None
             db.session.commit()
-            print(f"[SOCKET CONNECT] ✓ User {user_id} status set to online")
+            if shed_non_essential():
+                log.sampled('socket.connected', user_id=user_id, presence_fanout=False)
+                return
             
-            # Notify members in all channels of the rooms user is member of
+            # Notify members in all channels of the rooms user is member of: one
+            # broadcast to every channel room, so the payload is encoded once
             memberships = Member.query.filter_by(user_id=user_id).all()
-            print(f"[SOCKET CONNECT] User {user_id} has {len(memberships)} memberships")
-            
-            for m in memberships:
-                # For each channel in the room, emit presence update so clients viewing channel update status
-                for ch in m.room.channels:
-                    try:
-                        socketio.emit('presence_updated', {
-                            'user_id': current_user.id,
-                            'username': current_user.username,
-                            'status': current_user.presence_status
-                        }, room=str(ch.id), skip_sid=None)  # Include sender in emission
-                    except Exception as e:
-                        print(f"[SOCKET CONNECT] Error emitting presence for channel {ch.id}: {e}")
+            channel_rooms = [str(ch.id) for m in memberships for ch in m.room.channels]
+            if channel_rooms:
+                try:
+                    socketio.emit('presence_updated', {
+                        'user_id': current_user.id,
+                        'username': current_user.username,
+                        'status': current_user.presence_status
+                    }, room=channel_rooms, skip_sid=None)  # Include sender in emission
+                except Exception as e:
+                    log.warning('socket.presence_emit_failed', user_id=user_id, channels=len(channel_rooms),
+                                error=str(e))
             
-            print(f"[SOCKET CONNECT] ✓ User {user_id} fully connected")
+            log.sampled('socket.connected', user_id=user_id, memberships=len(memberships))
         else:
-            print(f"[SOCKET CONNECT] No authenticated user found")
-    except Exception as e:
-        print(f"[SOCKET CONNECT] ✗ ERROR: {e}")
-        import traceback
-        traceback.print_exc()
+            log.sampled('socket.connected_anonymous')
+    except Exception:
+        log.exception('socket.connect_failed')
         db.session.rollback()
-        pass
 
 
 @socketio.on('disconnect')
+@socket_event_metrics('disconnect')
 def on_disconnect():
     # Mark user offline and notify rooms
     user_id = None
     try:
         if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
             user_id = current_user.id
-            print(f"[SOCKET DISCONNECT] User {user_id} disconnecting...")
             # Respect hide_status: if hidden, keep hidden; otherwise set offline
-            if getattr(current_user, 'hide_status', False):
-                current_user.presence_status = 'hidden'
-            else:
-                current_user.presence_status = 'offline'
+            status = 'hidden' if getattr(current_user, 'hide_status', False) else 'offline'
+            if presence_writes_deferred():
+                defer_presence(user_id, status, datetime.utcnow())
+                return
+            cancel_deferred_presence(user_id)
+            current_user.presence_status = status
             current_user.last_seen = datetime.utcnow()
             db.session.commit()
-            print(f"[SOCKET DISCONNECT] User {user_id} status set to offline, notifying rooms...")
+            if shed_non_essential():
+                return
             memberships = Member.query.filter_by(user_id=user_id).all()
-            for m in memberships:
-                for ch in m.room.channels:
-                    socketio.emit('presence_updated', {
-                        'user_id': current_user.id,
-                        'username': current_user.username,
-                        'status': current_user.presence_status,
-                        'last_seen_iso': current_user.last_seen.strftime('%Y-%m-%dT%H:%M:%SZ') if current_user.last_seen else None
-                    }, room=str(ch.id), skip_sid=None)  # Include sender in emission
-            print(f"[SOCKET DISCONNECT] User {user_id} disconnect complete")
-    except Exception as e:
-        print(f"[SOCKET DISCONNECT ERROR] {e}")
-        if user_id:
-            print(f"[SOCKET DISCONNECT ERROR] Error for user {user_id}")
+            channel_rooms = [str(ch.id) for m in memberships for ch in m.room.channels]
+            if channel_rooms:
+                socketio.emit('presence_updated', {
+                    'user_id': current_user.id,
+                    'username': current_user.username,
+                    'status': current_user.presence_status,
+                    'last_seen_iso': current_user.last_seen.strftime('%Y-%m-%dT%H:%M:%SZ') if current_user.last_seen else None
+                }, room=channel_rooms, skip_sid=None)  # Include sender in emission
+            log.sampled('socket.disconnected', user_id=user_id, memberships=len(memberships))
+    except Exception:
+        log.exception('socket.disconnect_failed', user_id=user_id)
         db.session.rollback()
-        pass
 
 
 @socketio.on('send_message')
+@socket_event_metrics('send_message')
+@query_budget(24)
 def handle_send_message(data):
     # Handle incoming message
-    import sys
-    print(f"[handle_send_message] START - from user {current_user.id} ({current_user.username})", file=sys.stderr)
-    
     channel_id = data.get('channel_id')
     content = data.get('msg', '')
     room_id = data.get('room_id')
@@ -286,7 +314,7 @@ def handle_send_message(data):
 
     # Validate room and channel exist
     room = Room.query.get(room_id)
-    if not room:
+    if not room or room.deleted_at:
         emit('error', {'message': 'Комната не найдена'})
         return
 
@@ -354,12 +382,12 @@ def handle_send_message(data):
                 targets = Member.query.filter_by(user_id=target.user_id, room_id=room_id).all()
                 for t in targets:
                     t.muted_until = until
-                db.session.commit()
-                socketio.emit('member_mute_updated', {
+                enqueue_emit('member_mute_updated', {
                     'room_id': room_id,
                     'user_id': target.user_id,
                     'muted_until': until.strftime('%Y-%m-%dT%H:%M:%SZ'),
                 }, room=str(room_id))
+                db.session.commit()
                 _emit_command_result(True, f'{target.user.username} muted for {minutes}m.')
                 return
 
@@ -377,12 +405,12 @@ def handle_send_message(data):
                 targets = Member.query.filter_by(user_id=target.user_id, room_id=room_id).all()
                 for t in targets:
                     t.muted_until = None
-                db.session.commit()
-                socketio.emit('member_mute_updated', {
+                enqueue_emit('member_mute_updated', {
                     'room_id': room_id,
                     'user_id': target.user_id,
                     'muted_until': None,
                 }, room=str(room_id))
+                db.session.commit()
                 _emit_command_result(True, f'{target.user.username} unmuted.')
                 return
 
@@ -406,9 +434,9 @@ def handle_send_message(data):
                 targets = Member.query.filter_by(user_id=target.user_id, room_id=room_id).all()
                 for t in targets:
                     db.session.delete(t)
+                enqueue_emit('member_removed', {'user_id': target.user_id, 'room_id': room_id}, room=str(room_id))
+                enqueue_emit('force_redirect', {'location': '/', 'reason': 'You were kicked from this room.'}, room=f"user_{target.user_id}")
                 db.session.commit()
-                socketio.emit('member_removed', {'user_id': target.user_id, 'room_id': room_id}, room=str(room_id))
-                socketio.emit('force_redirect', {'location': '/', 'reason': 'You were kicked from this room.'}, room=f"user_{target.user_id}")
                 _emit_command_result(True, f'{target.user.username} kicked.')
                 return
 
@@ -451,9 +479,9 @@ def handle_send_message(data):
                 targets = Member.query.filter_by(user_id=target.user_id, room_id=room_id).all()
                 for t in targets:
                     db.session.delete(t)
+                enqueue_emit('member_removed', {'user_id': target.user_id, 'room_id': room_id}, room=str(room_id))
+                enqueue_emit('force_redirect', {'location': '/', 'reason': f'You were banned. Reason: {reason}'}, room=f"user_{target.user_id}")
                 db.session.commit()
-                socketio.emit('member_removed', {'user_id': target.user_id, 'room_id': room_id}, room=str(room_id))
-                socketio.emit('force_redirect', {'location': '/', 'reason': f'You were banned. Reason: {reason}'}, room=f"user_{target.user_id}")
                 if banned_until is not None:
                     _emit_command_result(True, f'{target.user.username} banned until {banned_until.strftime("%Y-%m-%d %H:%M UTC")}.')
                 else:
@@ -527,7 +555,7 @@ def handle_send_message(data):
         reply_to_id=(reply_to.get('id') if isinstance(reply_to, dict) and reply_to.get('id') else None)
     )
     db.session.add(msg)
-    db.session.commit()
+    db.session.flush()
 
     mention_data = _parse_mentions(content, room_id)
     
@@ -553,9 +581,9 @@ def handle_send_message(data):
     except Exception:
         reply_payload = (reply_to if reply_to else None)
 
-    # Broadcast to channel (include server-built reply metadata)
-    print(f"[handle_send_message] Broadcasting receive_message to channel {channel_id}", file=sys.stderr)
-    emit('receive_message', {
+    # Broadcast to channel (include server-built reply metadata); the event is
+    # committed together with the message and emitted by the outbox dispatcher
+    enqueue_emit('receive_message', {
         'id': msg.id,
         'user_id': current_user.id,
         'username': current_user.username,
@@ -578,11 +606,37 @@ def handle_send_message(data):
             'denied_role_tags': mention_data['denied_role_tags'],
         }
     }, room=str(channel_id))
+    db.session.commit()
 
     # Send per-user notifications and unread counts to members' personal rooms
     try:
         members = Member.query.filter_by(room_id=room_id).all()
-        print(f"[handle_send_message] Sending notifications to {len(members)} members", file=sys.stderr)
+
+        # Unread counts for every reader of the channel in one query: messages after
+        # each user's last_read_message_id (the first marker row per user wins)
+        unread_after_marker = (
+            db.session.query(func.count(Message.id))
+            .filter(Message.channel_id == channel_id, Message.id > ReadMessage.last_read_message_id)
+            .correlate(ReadMessage)
+            .scalar_subquery()
+        )
+        unread_by_user = {}
+        for uid, last_read_id, count in db.session.query(
+            ReadMessage.user_id, ReadMessage.last_read_message_id, unread_after_marker
+        ).filter(ReadMessage.channel_id == channel_id).order_by(ReadMessage.id):
+            if uid not in unread_by_user:
+                unread_by_user[uid] = count if last_read_id else None
+        channel_total = None
+
+        # Build small snippet for notification
+        snippet = (content or '')
+        if snippet:
+            snippet = snippet.strip().split('\n')[0][:140]
+        mentioned_user_ids = set(mention_data['mentioned_user_ids'])
+
+        # Recipients with the same unread count and mention flag get the same
+        # payload: group their personal rooms so each payload is encoded once
+        groups = {}
         for m in members:
             uid = m.user_id
             # skip sender
@@ -590,26 +644,16 @@ def handle_send_message(data):
                 continue
 
             # compute unread count for this user in this channel
-            # Count all messages after last_read_message_id, excluding the current user's own messages
-            unread_count = 0
-            rm = ReadMessage.query.filter_by(user_id=uid, channel_id=channel_id).first()
-            if rm and rm.last_read_message_id:
-                # Messages after what they've read
-                unread_count = Message.query.filter(
-                    Message.channel_id == channel_id,
-                    Message.id > rm.last_read_message_id
-                ).count()
-            else:
+            unread_count = unread_by_user.get(uid)
+            if unread_count is None:
                 # No reading history, count all messages
-                unread_count = Message.query.filter(
-                    Message.channel_id == channel_id
-                ).count()
-
-            # Build small snippet for notification
-            snippet = (content or '')
-            if snippet:
-                snippet = snippet.strip().split('\n')[0][:140]
+                if channel_total is None:
+                    channel_total = Message.query.filter(Message.channel_id == channel_id).count()
+                unread_count = channel_total
+            mention = mention_data['mention_everyone'] or uid in mentioned_user_ids
+            groups.setdefault((unread_count, mention), []).append(f"user_{uid}")
 
+        for (unread_count, mention), user_rooms in groups.items():
             payload = {
                 'room_id': room_id,
                 'channel_id': channel_id,
@@ -618,26 +662,26 @@ def handle_send_message(data):
                 'from_user_id': current_user.id,
                 'snippet': snippet,
                 'unread_count': unread_count,
-                'mention': (
-                    mention_data['mention_everyone']
-                    or uid in set(mention_data['mentioned_user_ids'])
-                ),
+                'mention': mention,
                 'mention_everyone': mention_data['mention_everyone'],
                 'mention_roles': mention_data['mentioned_role_tags'],
             }
 
-            # Emit a generic notification event to the user's personal room
-            print(f"[handle_send_message] Sending notification to user {uid}: {payload}", file=sys.stderr)
-            socketio.emit('message_notification', payload, room=f"user_{uid}")
+            # Emit a generic notification event to the users' personal rooms
+            log.sampled('send_message.notify', recipients=len(user_rooms), channel_id=channel_id, message_id=msg.id,
+                        unread_count=unread_count)
+            socketio.emit('message_notification', payload, room=user_rooms)
 
-            # For DM rooms, keep the legacy dashboard handler name
-            try:
-                if room.type == 'dm':
-                    socketio.emit('new_dm_message', {'room_id': room.id}, room=f"user_{uid}")
-            except Exception:
-                pass
+        # For DM rooms, keep the legacy dashboard handler name
+        try:
+            if room.type == 'dm':
+                dm_rooms = [user_room for user_rooms in groups.values() for user_room in user_rooms]
+                if dm_rooms:
+                    socketio.emit('new_dm_message', {'room_id': room.id}, room=dm_rooms)
+        except Exception:
+            pass
+        log.sampled('send_message.done', user_id=current_user.id, channel_id=channel_id, message_id=msg.id,
+                    recipients=max(0, len(members) - 1))
     except Exception:
+        log.exception('send_message.notify_failed', channel_id=channel_id, message_id=msg.id)
         db.session.rollback()
-        pass
-    
-    print(f"[handle_send_message] COMPLETE", file=sys.stderr)
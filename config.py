@@ -43,7 +43,101 @@ _defaults = {
         'files': 'files',
         'music': 'music',
         'videos': 'videos'
-    }
+    },
+    'UPLOAD_GC_BATCH_SIZE': 500,
+    'UPLOAD_GC_MIN_AGE_SECONDS': 60 * 60,
+    # Storage quotas in bytes (0 disables the quota)
+    'STORAGE_QUOTA_USER_BYTES': 2 * 1024 * 1024 * 1024,
+    'STORAGE_QUOTA_ROOM_BYTES': 10 * 1024 * 1024 * 1024,
+    # Image uploads: hard pixel cap, and the largest image decoded on the request thread
+    'IMAGE_MAX_PIXELS': 50 * 1000 * 1000,
+    'IMAGE_INLINE_DECODE_MAX_PIXELS': 4 * 1000 * 1000,
+    # GIF picker: 'giphy' or 'stub' (offline provider for development/tests)
+    'GIF_PROVIDER': 'giphy',
+    'GIF_CACHE_TRENDING_TTL_SECONDS': 300,
+    'GIF_CACHE_SEARCH_TTL_SECONDS': 120,
+    'GIF_CACHE_STALE_SECONDS': 24 * 60 * 60,
+    'GIF_CACHE_MAX_ENTRIES': 1000,
+    # How often each worker reloads the IP ban trie (picks up bans made by other workers)
+    'IP_BAN_CACHE_TTL_SECONDS': 60,
+    # Password hashing: werkzeug method (existing hashes are upgraded on login),
+    # native worker threads, and how many requests may wait before returning 503
+    'PASSWORD_HASH_METHOD': 'scrypt:32768:8:1',
+    'PASSWORD_HASH_WORKERS': 4,
+    'PASSWORD_HASH_MAX_QUEUE': 32,
+    # Auth throttle: write-behind interval to auth_throttle, and max IPs tracked in memory
+    'AUTH_THROTTLE_FLUSH_SECONDS': 5,
+    'AUTH_THROTTLE_MAX_IPS': 100000,
+    # How long Flask-Login may reuse a loaded user without a SELECT (0 disables the cache)
+    'USER_CACHE_TTL_SECONDS': 30,
+    # Background jobs (bulk purges): rows deleted per transaction, pause between chunks, and how
+    # long a worker's claim on a job lasts without progress before another worker resumes it
+    'JOB_CHUNK_SIZE': 500,
+    'JOB_CHUNK_PAUSE_SECONDS': 0.05,
+    'JOB_CLAIM_TIMEOUT_SECONDS': 60,
+    # Socket outbox: rows emitted per dispatcher batch, poll interval for rows from other
+    # processes, and how long a dispatcher's claim lasts before another process takes over
+    'SOCKET_OUTBOX_BATCH_SIZE': 200,
+    'SOCKET_OUTBOX_POLL_SECONDS': 1.0,
+    'SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS': 30,
+    # receive_message micro-batching: while messages arrive faster than one per window, the
+    # outbox dispatcher waits out the window and sends each channel's messages as one
+    # receive_messages frame to clients that connect with ?batch=1 (0 = off), capped per frame
+    'SOCKET_BATCH_WINDOW_MS': 5,
+    'SOCKET_BATCH_MAX_MESSAGES': 100,
+    # Wire formats: orjson for REST responses and Socket.IO JSON packets, and msgpack
+    # Socket.IO packets for clients that connect with ?serializer=msgpack (each is used
+    # only when its library is installed)
+    'FAST_JSON': True,
+    'SOCKET_MSGPACK': True,
+    # Socket.IO transports: 'any' (polling, optional upgrade), 'upgrade' (polling sessions that
+    # have not upgraded to a WebSocket within the timeout are disconnected) or 'websocket'
+    'SOCKET_TRANSPORT_POLICY': 'any',
+    'SOCKET_UPGRADE_TIMEOUT_SECONDS': 10,
+    # Compression: permessage-deflate for WebSockets and gzip for polling responses, only for
+    # messages of at least the threshold; deflate window and memLevel bound the zlib state
+    # every WebSocket keeps (15 and 8 cost ~300KB per connection, 12 and 5 ~45KB)
+    'SOCKET_COMPRESSION': True,
+    'SOCKET_COMPRESSION_THRESHOLD': 256,
+    'SOCKET_WS_DEFLATE_WINDOW_BITS': 12,
+    'SOCKET_WS_DEFLATE_MEM_LEVEL': 5,
+    # Admission control: load signals sampled every ADMISSION_SAMPLE_SECONDS, each with three
+    # thresholds for shedding levels 1 (drop presence/read-status/progress events), 2 (defer the
+    # presence writes of new connections) and 3 (refuse new connections with a retry_after);
+    # a level is left only after the signals stayed below it for the cooldown
+    'ADMISSION_CONTROL': True,
+    'ADMISSION_SAMPLE_SECONDS': 0.5,
+    'ADMISSION_LOOP_LAG_MS': [100, 250, 1000],
+    'ADMISSION_DB_POOL_USAGE': [0.75, 0.9, 1.0],
+    'ADMISSION_QUEUE_DEPTH': [500, 2000, 10000],
+    'ADMISSION_COOLDOWN_SECONDS': 10,
+    'ADMISSION_RETRY_AFTER_SECONDS': 5,
+    # Prometheus /metrics: collection on/off, and the bearer token scrapers must send
+    # (empty = only loopback clients may scrape)
+    'METRICS_ENABLED': True,
+    'METRICS_TOKEN': '',
+    # Statements slower than this are logged with the route or socket event that ran them
+    # (0 = off); QUERY_BUDGET_ENFORCE makes @query_budget raise outside tests too
+    'SLOW_QUERY_MS': 200,
+    'QUERY_BUDGET_ENFORCE': False,
+    # Logging: default level, per-logger overrides ({"boxchat.socket": "DEBUG"}), 'json' lines
+    # or 'text', target file (empty = stderr), records buffered before new ones are dropped,
+    # and the fraction of high-volume debug events (log.sampled) that are kept
+    'LOG_LEVEL': 'INFO',
+    'LOG_LEVELS': {},
+    'LOG_FORMAT': 'json',
+    'LOG_FILE': '',
+    'LOG_QUEUE_SIZE': 10000,
+    'LOG_DEBUG_SAMPLE_RATE': 0.01,
+    # Sampling profiler: longest on-demand run, default rate, and the optional continuous
+    # low-rate mode writing one collapsed-stack file per window into PROFILER_DIR
+    'PROFILER_MAX_SECONDS': 60,
+    'PROFILER_DEFAULT_HZ': 100,
+    'PROFILER_CONTINUOUS': False,
+    'PROFILER_CONTINUOUS_HZ': 10,
+    'PROFILER_WINDOW_SECONDS': 60,
+    'PROFILER_DIR': 'profiles',
+    'PROFILER_KEEP_FILES': 60,
 }
 
 _cfg = {}
@@ -93,9 +187,101 @@ IMAGE_EXTENSIONS = set(_get('IMAGE_EXTENSIONS') or [])
 MUSIC_EXTENSIONS = set(_get('MUSIC_EXTENSIONS') or [])
 VIDEO_EXTENSIONS = set(_get('VIDEO_EXTENSIONS') or [])
 
+# GIF picker cache
+GIF_PROVIDER = str(_get('GIF_PROVIDER') or 'giphy')
+GIF_CACHE_TRENDING_TTL_SECONDS = int(_get('GIF_CACHE_TRENDING_TTL_SECONDS') or 0)
+GIF_CACHE_SEARCH_TTL_SECONDS = int(_get('GIF_CACHE_SEARCH_TTL_SECONDS') or 0)
+GIF_CACHE_STALE_SECONDS = int(_get('GIF_CACHE_STALE_SECONDS') or 0)
+GIF_CACHE_MAX_ENTRIES = int(_get('GIF_CACHE_MAX_ENTRIES') or 1000)
+
+# Password hashing
+PASSWORD_HASH_METHOD = str(_get('PASSWORD_HASH_METHOD') or 'scrypt')
+PASSWORD_HASH_WORKERS = int(_get('PASSWORD_HASH_WORKERS') or 4)
+PASSWORD_HASH_MAX_QUEUE = int(_get('PASSWORD_HASH_MAX_QUEUE') or 0)
+
+# Identity cache for the Flask-Login user loader
+USER_CACHE_TTL_SECONDS = float(_get('USER_CACHE_TTL_SECONDS') or 0)
+
+# Background jobs
+JOB_CHUNK_SIZE = int(_get('JOB_CHUNK_SIZE') or 500)
+JOB_CHUNK_PAUSE_SECONDS = float(_get('JOB_CHUNK_PAUSE_SECONDS') or 0)
+JOB_CLAIM_TIMEOUT_SECONDS = float(_get('JOB_CLAIM_TIMEOUT_SECONDS') or 60)
+
+# Socket.IO transactional outbox
+SOCKET_OUTBOX_BATCH_SIZE = int(_get('SOCKET_OUTBOX_BATCH_SIZE') or 200)
+SOCKET_OUTBOX_POLL_SECONDS = float(_get('SOCKET_OUTBOX_POLL_SECONDS') or 1.0)
+SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS = float(_get('SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS') or 30)
+SOCKET_BATCH_WINDOW_MS = float(_get('SOCKET_BATCH_WINDOW_MS') or 0)
+SOCKET_BATCH_MAX_MESSAGES = int(_get('SOCKET_BATCH_MAX_MESSAGES') or 100)
+
+# Wire serialization
+FAST_JSON = bool(_get('FAST_JSON'))
+SOCKET_MSGPACK = bool(_get('SOCKET_MSGPACK'))
+
+# Socket.IO transports and compression
+SOCKET_TRANSPORT_POLICY = str(_get('SOCKET_TRANSPORT_POLICY') or 'any').strip().lower()
+SOCKET_UPGRADE_TIMEOUT_SECONDS = float(_get('SOCKET_UPGRADE_TIMEOUT_SECONDS') or 10)
+SOCKET_COMPRESSION = bool(_get('SOCKET_COMPRESSION'))
+SOCKET_COMPRESSION_THRESHOLD = int(_get('SOCKET_COMPRESSION_THRESHOLD') or 0)
+SOCKET_WS_DEFLATE_WINDOW_BITS = int(_get('SOCKET_WS_DEFLATE_WINDOW_BITS') or 15)
+SOCKET_WS_DEFLATE_MEM_LEVEL = int(_get('SOCKET_WS_DEFLATE_MEM_LEVEL') or 8)
+
+# Admission control and overload shedding
+ADMISSION_CONTROL = bool(_get('ADMISSION_CONTROL'))
+ADMISSION_SAMPLE_SECONDS = float(_get('ADMISSION_SAMPLE_SECONDS') or 0.5)
+ADMISSION_LOOP_LAG_MS = [float(v) for v in _get('ADMISSION_LOOP_LAG_MS') or []]
+ADMISSION_DB_POOL_USAGE = [float(v) for v in _get('ADMISSION_DB_POOL_USAGE') or []]
+ADMISSION_QUEUE_DEPTH = [float(v) for v in _get('ADMISSION_QUEUE_DEPTH') or []]
+ADMISSION_COOLDOWN_SECONDS = float(_get('ADMISSION_COOLDOWN_SECONDS') or 0)
+ADMISSION_RETRY_AFTER_SECONDS = float(_get('ADMISSION_RETRY_AFTER_SECONDS') or 5)
+
+# Metrics
+METRICS_ENABLED = bool(_get('METRICS_ENABLED'))
+METRICS_TOKEN = str(_get('METRICS_TOKEN') or '')
+
+# Query budgets and slow-query log
+SLOW_QUERY_MS = float(_get('SLOW_QUERY_MS') or 0)
+QUERY_BUDGET_ENFORCE = bool(_get('QUERY_BUDGET_ENFORCE'))
+
+# Logging
+LOG_LEVEL = str(_get('LOG_LEVEL') or 'INFO').upper()
+LOG_LEVELS = dict(_get('LOG_LEVELS') or {})
+LOG_FORMAT = str(_get('LOG_FORMAT') or 'json').lower()
+LOG_FILE = str(_get('LOG_FILE') or '')
+LOG_QUEUE_SIZE = int(_get('LOG_QUEUE_SIZE') or 10000)
+LOG_DEBUG_SAMPLE_RATE = float(_get('LOG_DEBUG_SAMPLE_RATE') or 0)
+
+# Sampling profiler
+PROFILER_MAX_SECONDS = float(_get('PROFILER_MAX_SECONDS') or 60)
+PROFILER_DEFAULT_HZ = float(_get('PROFILER_DEFAULT_HZ') or 100)
+PROFILER_CONTINUOUS = bool(_get('PROFILER_CONTINUOUS'))
+PROFILER_CONTINUOUS_HZ = float(_get('PROFILER_CONTINUOUS_HZ') or 10)
+PROFILER_WINDOW_SECONDS = float(_get('PROFILER_WINDOW_SECONDS') or 60)
+PROFILER_DIR = str(_get('PROFILER_DIR') or 'profiles')
+PROFILER_KEEP_FILES = int(_get('PROFILER_KEEP_FILES') or 60)
+
+# Auth throttle store
+AUTH_THROTTLE_FLUSH_SECONDS = float(_get('AUTH_THROTTLE_FLUSH_SECONDS') or 0)
+AUTH_THROTTLE_MAX_IPS = int(_get('AUTH_THROTTLE_MAX_IPS') or 100000)
+
+# IP bans
+IP_BAN_CACHE_TTL_SECONDS = int(_get('IP_BAN_CACHE_TTL_SECONDS') or 0)
+
+# Image validation limits (pixels)
+IMAGE_MAX_PIXELS = int(_get('IMAGE_MAX_PIXELS') or 0)
+IMAGE_INLINE_DECODE_MAX_PIXELS = int(_get('IMAGE_INLINE_DECODE_MAX_PIXELS') or 0)
+
 # Upload subdirectories (relative names only)
 UPLOAD_SUBDIRS = dict(_get('UPLOAD_SUBDIRS') or {})
 
+# Orphaned upload garbage collector
+UPLOAD_GC_BATCH_SIZE = int(_get('UPLOAD_GC_BATCH_SIZE') or 500)
+UPLOAD_GC_MIN_AGE_SECONDS = int(_get('UPLOAD_GC_MIN_AGE_SECONDS') or 0)
+
+# Storage quotas (bytes, 0 = unlimited)
+STORAGE_QUOTA_USER_BYTES = int(_get('STORAGE_QUOTA_USER_BYTES') or 0)
+STORAGE_QUOTA_ROOM_BYTES = int(_get('STORAGE_QUOTA_ROOM_BYTES') or 0)
+
 
 def init_upload_folders():
     # Create upload directories if they don't exist
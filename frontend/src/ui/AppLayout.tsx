@@ -1,6 +1,7 @@
 import { useContext, useEffect, useMemo, useState, useCallback } from 'react'
 import { Link as RouterLink, Outlet, useLocation, useNavigate, useRouteLoaderData } from 'react-router-dom'
 import { io } from 'socket.io-client'
+import { retryWhenServerBusy } from './socketRetry'
 import {
   Avatar,
   Badge,
@@ -160,7 +161,9 @@ export default function AppLayout() {
   }, [askedNotifPermission])
 
   useEffect(() => {
-    const s = io({ withCredentials: true })
+    // WebSocket first; polling only if the WebSocket cannot be opened
+    const s = io({ withCredentials: true, transports: ['websocket', 'polling'], tryAllTransports: true })
+    const stopRetry = retryWhenServerBusy(s)
     s.on('friend_request_received', (data: any) => {
       const fromUser = String(data?.from_username || 'User')
       const requestId = Number(data?.request_id || 0)
@@ -224,6 +227,7 @@ export default function AppLayout() {
       void loadRooms()
     })
     return () => {
+      stopRetry()
       s.disconnect()
     }
   }, [loadRooms])
@@ -0,0 +1,16 @@
+import type { Socket } from 'socket.io-client'
+
+// An overloaded server refuses new connections with { retry_after } (seconds).
+// socket.io does not reconnect after a refusal, so connect again once the delay has passed.
+// Returns a cleanup function that cancels a pending retry.
+export function retryWhenServerBusy(s: Socket): () => void {
+  let timer: ReturnType<typeof setTimeout> | undefined
+  s.on('connect_error', (err: any) => {
+    const retryAfter = Number(err?.data?.retry_after || 0)
+    if (retryAfter > 0 && !s.active) {
+      clearTimeout(timer)
+      timer = setTimeout(() => s.connect(), retryAfter * 1000)
+    }
+  })
+  return () => clearTimeout(timer)
+}
@@ -25,6 +25,7 @@ import ChatComposer from '../ui/ChatComposer'
 import MessageContextMenu from '../ui/MessageContextMenu'
 import ServerSettingsDialog from '../ui/ServerSettingsDialog'
 import { addNotification, clearNotificationsByHref, playNotificationSound, showBrowserNotification } from '../ui/notificationsStore'
+import { retryWhenServerBusy } from '../ui/socketRetry'
 
 type SessionPayload = { user?: { id: number; username: string } }
 type Channel = { id: number; name: string; description?: string; writer_role_ids?: number[] }
@@ -65,6 +66,24 @@ type RoomMember = {
 }
 type RoomRole = { id: number; name: string; mention_tag: string; is_system?: boolean }
 
+function applyReactionDelta(
+  reactions: Record<string, string[]> | undefined,
+  emoji: string,
+  action: string,
+  username: string,
+): Record<string, string[]> {
+  const next = { ...(reactions ?? {}) }
+  const users = Array.isArray(next[emoji]) ? next[emoji] : []
+  if (action === 'added') {
+    next[emoji] = users.includes(username) ? users : [...users, username]
+  } else {
+    const rest = users.filter((u) => u !== username)
+    if (rest.length) next[emoji] = rest
+    else delete next[emoji]
+  }
+  return next
+}
+
 function parseServerDateMs(value?: string | null): number | null {
   const raw = String(value || '').trim()
   if (!raw) return null
@@ -143,6 +162,8 @@ export default function RoomPage() {
   const pendingBottomRef = useRef(false)
   const prefetchingRef = useRef(false)
   const pendingPrependRef = useRef<{ prevHeight: number; prevTop: number } | null>(null)
+  const reactionQueueRef = useRef<{ message_id: number; emoji: string; reaction_type: string }[]>([])
+  const reactionFlushTimerRef = useRef<number | null>(null)
 
   const [userCardAnchor, setUserCardAnchor] = useState<HTMLElement | null>(null)
   const [userCardUserId, setUserCardUserId] = useState<number | null>(null)
@@ -358,8 +379,20 @@ export default function RoomPage() {
     setReplyTo(null)
   }
 
-  async function toggleReaction(messageId: number, emoji: string) {
-    const res = await fetch(`/message/${messageId}/reaction`, {
+  function applyLocalReaction(messageId: number, emoji: string, action: string, username: string) {
+    setMessages((prev) =>
+      prev.map((m) =>
+        Number(m.id) === Number(messageId) ? { ...m, reactions: applyReactionDelta(m.reactions, emoji, action, username) } : m,
+      ),
+    )
+  }
+
+  async function flushReactionQueue() {
+    reactionFlushTimerRef.current = null
+    const toggles = reactionQueueRef.current
+    reactionQueueRef.current = []
+    if (!toggles.length) return
+    const res = await fetch('/api/v1/reactions/batch', {
       method: 'POST',
       credentials: 'include',
       headers: {
@@ -367,14 +400,23 @@ export default function RoomPage() {
         Accept: 'application/json',
         'X-Requested-With': 'XMLHttpRequest',
       },
-      body: JSON.stringify({ emoji, reaction_type: 'emoji' }),
+      body: JSON.stringify({ toggles }),
     }).catch(() => null)
 
     if (!res?.ok) return
     const payload = await res.json().catch(() => null)
-    const reactions = payload?.reactions
-    if (reactions && typeof reactions === 'object') {
-      setMessages((prev) => prev.map((m) => (Number(m.id) === Number(messageId) ? { ...m, reactions } : m)))
+    const me = session?.user?.username
+    if (!me || !Array.isArray(payload?.results)) return
+    for (const r of payload.results) {
+      if (r?.action) applyLocalReaction(Number(r.message_id), String(r.emoji), String(r.action), me)
+    }
+  }
+
+  function toggleReaction(messageId: number, emoji: string) {
+    // Toggles are queued briefly and flushed together in one batch request
+    reactionQueueRef.current.push({ message_id: Number(messageId), emoji, reaction_type: 'emoji' })
+    if (reactionFlushTimerRef.current === null) {
+      reactionFlushTimerRef.current = window.setTimeout(() => void flushReactionQueue(), 150)
     }
   }
 
@@ -395,7 +437,7 @@ export default function RoomPage() {
             key={r.emoji}
             size="small"
             variant={mine ? 'contained' : 'outlined'}
-            onClick={() => void toggleReaction(m.id, r.emoji)}
+            onClick={() => toggleReaction(m.id, r.emoji)}
             sx={{
               minWidth: 0,
               px: 1.1,
@@ -562,10 +604,12 @@ export default function RoomPage() {
 
   useEffect(() => {
     if (!channelId) return
-    const s = io({ withCredentials: true })
+    // batch=1: bursts arrive as one receive_messages frame instead of many receive_message events
+    const s = io({ withCredentials: true, query: { batch: '1' }, transports: ['websocket', 'polling'], tryAllTransports: true })
+    const stopRetry = retryWhenServerBusy(s)
     setSocket(s)
     s.on('connect', () => s.emit('join', { channel_id: channelId }))
-    s.on('receive_message', (data: any) => {
+    const onReceiveMessage = (data: any) => {
       if (Number(data.channel_id ?? channelId) !== Number(channelId)) return
       const el = scrollRef.current
       const wasNearBottom = isNearBottom(el, 180)
@@ -608,12 +652,22 @@ export default function RoomPage() {
         })
         showBrowserNotification(data.username ?? 'Message', body, href)
       }
+    }
+    s.on('receive_message', onReceiveMessage)
+    s.on('receive_messages', (frame: any) => {
+      for (const data of frame?.messages ?? []) onReceiveMessage(data)
     })
     s.on('reactions_updated', (data: any) => {
       const messageId = Number(data?.message_id ?? 0)
-      if (!messageId) return
+      const emoji = String(data?.emoji ?? '')
+      const username = String(data?.user ?? '')
+      if (!messageId || !emoji || !username) return
       setMessages((prev) =>
-        prev.map((m) => (Number(m.id) === messageId ? { ...m, reactions: data?.reactions ?? {} } : m)),
+        prev.map((m) =>
+          Number(m.id) === messageId
+            ? { ...m, reactions: applyReactionDelta(m.reactions, emoji, String(data?.action ?? ''), username) }
+            : m,
+        ),
       )
     })
     s.on('message_deleted', (data: any) => {
@@ -653,6 +707,7 @@ export default function RoomPage() {
       if (message) setError(message)
     })
     return () => {
+      stopRetry()
       s.disconnect()
       setSocket(null)
     }
@@ -762,7 +817,7 @@ export default function RoomPage() {
     try {
       const form = new FormData()
       form.append('file', file)
-      const uploadRes = await fetch('/upload_file', {
+      const uploadRes = await fetch(`/upload_file?room_id=${Number(roomId)}`, {
         method: 'POST',
         credentials: 'include',
         body: form,
@@ -1480,7 +1535,7 @@ export default function RoomPage() {
               onClick={() => {
                 const m = reactionMenu?.msg
                 if (!m) return
-                void toggleReaction(m.id, e)
+                toggleReaction(m.id, e)
                 setReactionMenu(null)
               }}
               sx={{ minWidth: 0, px: 1.1, py: 0.35, borderRadius: 2.2, fontWeight: 800 }}
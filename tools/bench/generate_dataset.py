@@ -0,0 +1,369 @@
+"""Generate a large synthetic BoxChat database for scale testing.
+
+Creates a fresh database through the app's own schema and migrations, then
+fills it with set-based INSERT ... SELECT statements over a recursive row
+counter. No Python loop runs per message. Choices such as which channel
+a message lands in, who wrote it and who reacted are derived from a
+multiplicative hash of the row number and --seed, so the same arguments
+always produce the same data.
+
+Profiles:
+  giant-public-server  one public server, every user a member, skewed channel traffic
+  many-small-dms       tens of thousands of two-person DM rooms
+  mixed                a thousand mid-sized servers
+  small                a quick smoke-test dataset
+
+Any profile value can be overridden (--users, --messages, ...), and --scale
+multiplies the row counts of the chosen profile.
+
+Usage:
+  python tools/bench/generate_dataset.py --db ./bench.db
+  python tools/bench/generate_dataset.py --db ./giant.db --profile giant-public-server
+  python tools/bench/generate_dataset.py --db ./dms.db --profile many-small-dms --scale 0.1 --seed 7
+  python tools/bench/generate_dataset.py --db ./big.db --profile mixed --messages 10000000
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import config as app_config
+
+PROFILES = {
+    'giant-public-server': {
+        'room_type': 'server', 'users': 100000, 'rooms': 1, 'channels_per_room': 50,
+        'members_per_room': 100000, 'messages': 5000000, 'skew': True,
+        'reaction_pct': 20, 'reactions_per_message': 3, 'read_pct': 30, 'unread_depth': 2000,
+    },
+    'many-small-dms': {
+        'room_type': 'dm', 'users': 20000, 'rooms': 50000, 'channels_per_room': 1,
+        'members_per_room': 2, 'messages': 2000000, 'skew': False,
+        'reaction_pct': 5, 'reactions_per_message': 1, 'read_pct': 100, 'unread_depth': 20,
+    },
+    'mixed': {
+        'room_type': 'server', 'users': 20000, 'rooms': 1000, 'channels_per_room': 5,
+        'members_per_room': 200, 'messages': 2000000, 'skew': True,
+        'reaction_pct': 10, 'reactions_per_message': 2, 'read_pct': 50, 'unread_depth': 200,
+    },
+    'small': {
+        'room_type': 'server', 'users': 200, 'rooms': 10, 'channels_per_room': 3,
+        'members_per_room': 50, 'messages': 20000, 'skew': True,
+        'reaction_pct': 10, 'reactions_per_message': 2, 'read_pct': 50, 'unread_depth': 50,
+    },
+}
+# Profile keys that --scale multiplies
+SCALED_KEYS = ('users', 'rooms', 'messages')
+
+EMOJIS = ('👍', '❤️', '😂', '🔥', '🎉', '👀')
+GENERATED_PASSWORD = 'generated-password-1'
+# Knuth's multiplicative hash constant; hashes stay well inside SQLite's 64-bit integers
+HASH_MULTIPLIER = 2654435761
+HASH_MODULUS = 4294967296
+
+
+def _sqlite_uri_from_path(db_path: str) -> str:
+    abs_db = os.path.abspath(db_path).replace('\\', '/')
+    # Windows absolute path: C:/...
+    if len(abs_db) > 2 and abs_db[1] == ':':
+        return f"sqlite:///{abs_db}"
+    # POSIX absolute path: /...
+    return f"sqlite:////{abs_db.lstrip('/')}"
+
+
+def _build_config(db_path):
+    values = {k: getattr(app_config, k) for k in dir(app_config) if k.isupper()}
+    values['SQLALCHEMY_DATABASE_URI'] = _sqlite_uri_from_path(db_path)
+    return SimpleNamespace(**values)
+
+
+def _create_schema(db_path):
+    # Let the app create and migrate the schema; returns the password hash used for generated users
+    from app import create_app
+    from app.extensions import db
+    from app.functions import hash_password
+
+    app = create_app(config=_build_config(db_path))
+    with app.app_context():
+        password_hash = hash_password(GENERATED_PASSWORD)
+        db.engine.dispose()
+    return password_hash
+
+
+def _counter(limit):
+    # Recursive CTE yielding n = 0 .. limit - 1
+    return f"WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < {int(limit)}) "
+
+
+def _hash(expr, salt):
+    return f"((({expr}) + {int(salt)}) * {HASH_MULTIPLIER} % {HASH_MODULUS})"
+
+
+class Generator:
+
+    def __init__(self, conn, spec, seed, batch_size, password_hash):
+        self.conn = conn
+        self.spec = spec
+        self.seed = seed
+        self.batch_size = batch_size
+        self.password_hash = password_hash
+        self.rows = {}
+        self.started = time.perf_counter()
+        # First ids of the generated ranges, filled in as tables are populated
+        self.u0 = self.r0 = self.c0 = None
+
+    def _report(self, table, inserted, step_started):
+        self.rows[table] = self.rows.get(table, 0) + inserted
+        elapsed = time.perf_counter() - step_started
+        rate = inserted / elapsed if elapsed else 0
+        print(f'[DATASET] {table}: {self.rows[table]} rows ({rate:,.0f} rows/s)')
+
+    def _insert(self, table, sql, params=()):
+        step_started = time.perf_counter()
+        # cursor.rowcount is -1 for statements that start with WITH
+        before = self.conn.total_changes
+        self.conn.execute(sql, params)
+        inserted = self.conn.total_changes - before
+        self.conn.commit()
+        self._report(table, inserted, step_started)
+        return inserted
+
+    def _next_id(self, table):
+        return (self.conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{table}"').fetchone()[0] or 0) + 1
+
+    def _member_user(self, room_index, slot):
+        # SQL expression: user id at position `slot` of room `room_index`. Members of
+        # a room are a window of consecutive users; two-person rooms use a step
+        # that varies with the room so DM pairs do not repeat.
+        users = self.spec['users']
+        stride = max(1, users // max(1, self.spec['rooms']))
+        if self.spec['members_per_room'] == 2 and users > 2:
+            step = f"(1 + (({room_index}) / {users}) % {users - 1})"
+        else:
+            step = '1'
+        return f"({self.u0} + ((({room_index}) * {stride}) % {users} + ({slot}) * {step}) % {users})"
+
+    def users(self):
+        self.u0 = self._next_id('user')
+        self._insert('user', _counter(self.spec['users']) + (
+            "INSERT INTO user (username, password, bio, privacy_searchable, privacy_listable, hide_status, "
+            "presence_status, is_superuser, is_banned, banned_ips, failed_login_attempts) "
+            "SELECT 'gen_user_' || n, ?, '', 1, 1, 0, 'offline', 0, 0, '', 0 FROM seq ORDER BY n"
+        ), (self.password_hash,))
+
+    def rooms(self):
+        self.r0 = self._next_id('room')
+        is_dm = self.spec['room_type'] == 'dm'
+        if is_dm:
+            name = f"'dm_' || {self._member_user('n', 0)} || '_' || {self._member_user('n', 1)}"
+        else:
+            name = "'Server ' || n"
+        self._insert('room', _counter(self.spec['rooms']) + (
+            "INSERT INTO room (name, type, is_public, owner_id, description) "
+            f"SELECT {name}, ?, ?, {'NULL' if is_dm else self._member_user('n', 0)}, '' FROM seq ORDER BY n"
+        ), (self.spec['room_type'], 0 if is_dm else 1))
+
+        self.c0 = self._next_id('channel')
+        per_room = self.spec['channels_per_room']
+        self._insert('channel', _counter(self.spec['rooms'] * per_room) + (
+            f"INSERT INTO channel (name, room_id, description) "
+            f"SELECT CASE WHEN n % {per_room} = 0 THEN 'general' ELSE 'channel-' || (n % {per_room}) END, "
+            f"{self.r0} + n / {per_room}, '' FROM seq ORDER BY n"
+        ))
+
+    def members(self):
+        members = min(self.spec['members_per_room'], self.spec['users'])
+        is_dm = self.spec['room_type'] == 'dm'
+        owner_role = "'member'" if is_dm else "CASE WHEN s.n = 0 THEN 'owner' ELSE 'member' END"
+        # One statement per slot batch keeps transactions bounded for giant rooms
+        room_ids = f"room.id BETWEEN {self.r0} AND {self.r0 + self.spec['rooms'] - 1}"
+        for start in range(0, members, max(1, self.batch_size // max(1, self.spec['rooms']))):
+            end = min(members, start + max(1, self.batch_size // max(1, self.spec['rooms'])))
+            self._insert('member', _counter(end) + (
+                "INSERT INTO member (user_id, room_id, role) "
+                f"SELECT {self._member_user('room.id - ' + str(self.r0), 's.n')}, room.id, {owner_role} "
+                f"FROM room JOIN seq s ON s.n >= {start} WHERE {room_ids} ORDER BY room.id, s.n"
+            ))
+
+    def roles(self):
+        # Default everyone/admin roles, as migration 14 seeds them for existing rooms
+        from app.functions.roles import ROLE_PERMISSION_KEYS
+        room_ids = f"room.id BETWEEN {self.r0} AND {self.r0 + self.spec['rooms'] - 1}"
+        for tag, permissions in (('everyone', '[]'), ('admin', json.dumps(list(ROLE_PERMISSION_KEYS)))):
+            self._insert('role', (
+                "INSERT INTO role (room_id, name, mention_tag, is_system, can_be_mentioned_by_everyone, "
+                "permissions_json, created_at) "
+                f"SELECT room.id, ?, ?, 1, 0, ?, CURRENT_TIMESTAMP FROM room WHERE {room_ids} ORDER BY room.id"
+            ), (tag, tag, permissions))
+        for tag, member_filter in (('everyone', ''), ('admin', "AND m.role IN ('owner', 'admin')")):
+            self._insert('member_role', (
+                "INSERT INTO member_role (user_id, room_id, role_id, assigned_at) "
+                "SELECT m.user_id, m.room_id, r.id, CURRENT_TIMESTAMP FROM member m "
+                "JOIN role r ON r.room_id = m.room_id AND r.mention_tag = ? "
+                f"WHERE m.room_id BETWEEN {self.r0} AND {self.r0 + self.spec['rooms'] - 1} {member_filter}"
+            ), (tag,))
+
+    def _channel_index(self, h):
+        channels = self.spec['rooms'] * self.spec['channels_per_room']
+        if self.spec['skew']:
+            # Quadratic skew: low channel indexes (the "general" channels of the first rooms) get most traffic
+            return f"((({h}) % 10007) * (({h}) % 10007) * {channels} / {10007 * 10007})"
+        return f"(({h}) % {channels})"
+
+    def messages(self):
+        total = self.spec['messages']
+        members = min(self.spec['members_per_room'], self.spec['users'])
+        per_room = self.spec['channels_per_room']
+        span = max(1, self.spec['history_days']) * 86400
+        start_epoch = int((datetime.utcnow() - timedelta(days=self.spec['history_days'])).timestamp())
+        # seq yields offsets inside the batch; `base` is added to get the global message number
+        for base in range(0, total, self.batch_size):
+            size = min(self.batch_size, total - base)
+            h = _hash(f'{base} + n', self.seed)
+            channel_index = self._channel_index(h)
+            self._insert('message', _counter(size) + (
+                "INSERT INTO message (content, timestamp, user_id, channel_id, message_type) "
+                f"SELECT 'generated message ' || ({base} + n), "
+                f"datetime({start_epoch} + ({base} + n) * {span} / {total}, 'unixepoch'), "
+                f"{self._member_user(f'({channel_index}) / {per_room}', f'(({h}) / 65536) % {members}')}, "
+                f"{self.c0} + {channel_index}, 'text' "
+                "FROM seq ORDER BY n"
+            ))
+
+    def reactions(self):
+        per_message = min(self.spec['reactions_per_message'], self.spec['members_per_room'], self.spec['users'])
+        if not per_message or not self.spec['reaction_pct']:
+            return
+        members = min(self.spec['members_per_room'], self.spec['users'])
+        per_room = self.spec['channels_per_room']
+        emoji = f'CASE k.n % {len(EMOJIS)} ' + ' '.join(f"WHEN {i} THEN '{e}'" for i, e in enumerate(EMOJIS)) + ' END'
+        first, last = self.conn.execute('SELECT MIN(id), MAX(id) FROM message').fetchone()
+        room_index = f'(m.channel_id - {self.c0}) / {per_room}'
+        for low in range(first or 0, (last or 0) + 1, self.batch_size):
+            high = low + self.batch_size - 1
+            self._insert('message_reaction', (
+                f"WITH RECURSIVE k(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM k WHERE n + 1 < {per_message}) "
+                "INSERT INTO message_reaction (message_id, user_id, emoji, reaction_type) "
+                f"SELECT m.id, {self._member_user(room_index, f'(m.id + k.n) % {members}')}, "
+                f"{emoji}, 'emoji' "
+                f"FROM message m JOIN k WHERE m.id BETWEEN {low} AND {high} "
+                f"AND {_hash('m.id', self.seed + 1)} % 100 < {self.spec['reaction_pct']} "
+                "ORDER BY m.id, k.n"
+            ))
+            self._insert('message_reaction_count', (
+                "INSERT INTO message_reaction_count (message_id, emoji, count) "
+                "SELECT message_id, emoji, COUNT(*) FROM message_reaction "
+                f"WHERE message_id BETWEEN {low} AND {high} GROUP BY message_id, emoji"
+            ))
+
+    def read_markers(self):
+        if not self.spec['read_pct']:
+            return
+        self.conn.execute('DROP TABLE IF EXISTS temp.gen_channel_range')
+        self.conn.execute(
+            'CREATE TEMP TABLE gen_channel_range AS '
+            'SELECT channel_id, MIN(id) AS min_id, MAX(id) AS max_id FROM message GROUP BY channel_id'
+        )
+        first, last = self.conn.execute(
+            f'SELECT MIN(id), MAX(id) FROM member WHERE room_id >= {self.r0}'
+        ).fetchone()
+        step = max(1, self.batch_size // max(1, self.spec['channels_per_room']))
+        for low in range(first or 0, (last or 0) + 1, step):
+            high = low + step - 1
+            h = _hash('m.id * 131 + ch.id', self.seed + 2)
+            self._insert('read_message', (
+                "INSERT INTO read_message (user_id, channel_id, last_read_message_id, last_read_at) "
+                f"SELECT m.user_id, ch.id, MAX(cr.min_id, cr.max_id - ({h} / 1024) % {self.spec['unread_depth'] + 1}), "
+                "CURRENT_TIMESTAMP FROM member m "
+                "JOIN channel ch ON ch.room_id = m.room_id "
+                "JOIN temp.gen_channel_range cr ON cr.channel_id = ch.id "
+                f"WHERE m.id BETWEEN {low} AND {high} AND {h} % 100 < {self.spec['read_pct']} "
+                "ORDER BY m.id, ch.id"
+            ))
+        self.conn.execute('DROP TABLE temp.gen_channel_range')
+
+    def run(self):
+        self.users()
+        self.rooms()
+        self.members()
+        self.roles()
+        self.messages()
+        self.reactions()
+        self.read_markers()
+        step_started = time.perf_counter()
+        self.conn.execute('ANALYZE')
+        print(f'[DATASET] ANALYZE in {time.perf_counter() - step_started:.1f}s')
+        return self.rows
+
+
+def _resolve_spec(args):
+    spec = dict(PROFILES[args.profile])
+    for key in SCALED_KEYS:
+        spec[key] = max(1, int(spec[key] * args.scale))
+    for key in ('users', 'rooms', 'channels_per_room', 'members_per_room', 'messages',
+                'reaction_pct', 'reactions_per_message', 'read_pct', 'unread_depth'):
+        value = getattr(args, key)
+        if value is not None:
+            spec[key] = value
+    spec['history_days'] = args.history_days
+    if spec['room_type'] == 'dm':
+        spec['members_per_room'] = 2
+    spec['members_per_room'] = min(spec['members_per_room'], spec['users'])
+    return spec
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic BoxChat database for scale testing.')
+    parser.add_argument('--db', required=True, help='SQLite file to create (must not exist yet)')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply users, rooms and messages of the profile')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=250000, help='Rows per INSERT ... SELECT statement')
+    parser.add_argument('--history-days', type=int, default=365, help='Spread message timestamps over this many days')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--rooms', type=int)
+    parser.add_argument('--channels-per-room', type=int)
+    parser.add_argument('--members-per-room', type=int)
+    parser.add_argument('--messages', type=int)
+    parser.add_argument('--reaction-pct', type=int, help='Percent of messages that get reactions')
+    parser.add_argument('--reactions-per-message', type=int)
+    parser.add_argument('--read-pct', type=int, help='Percent of (member, channel) pairs with a read marker')
+    parser.add_argument('--unread-depth', type=int, help='Read markers trail the newest message by up to this many ids')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f'{args.db} already exists')
+    spec = _resolve_spec(args)
+    if spec['users'] < 2 or spec['rooms'] < 1 or spec['channels_per_room'] < 1:
+        parser.error('need at least 2 users, 1 room and 1 channel per room')
+    print(f"[DATASET] profile {args.profile} (seed {args.seed}): " +
+          ', '.join(f'{k}={v}' for k, v in sorted(spec.items())))
+
+    started = time.perf_counter()
+    password_hash = _create_schema(args.db)
+    conn = sqlite3.connect(args.db)
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    try:
+        rows = Generator(conn, spec, args.seed, max(1, args.batch_size), password_hash).run()
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    total = sum(rows.values())
+    print(f'[DATASET] done: {total:,} rows in {elapsed:.1f}s ({total / elapsed * 60:,.0f} rows/min) -> {args.db}')
+    print(f'[DATASET] generated users log in as gen_user_<n> with password {GENERATED_PASSWORD!r}')
+
+
+if __name__ == '__main__':
+    main()
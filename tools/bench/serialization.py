@@ -0,0 +1,243 @@
+"""Serialization benchmark for BoxChat wire payloads.
+
+Builds realistic payloads with a seeded generator:
+  - a channel message page as returned by GET /api/v1/channel/<id>/messages
+    (--page-size messages with reactions, replies, edits, attachments and a
+    mix of Latin and Cyrillic text)
+  - a receive_message event
+  - a message_notification event
+
+and encodes each one with every available wire format:
+  stdlib-json    Flask's default provider (ensure_ascii, sorted keys, compact)
+  fast-json      app.functions.serialization.FastJSONProvider (orjson)
+  sio-json       Socket.IO event packet, stdlib json (the previous packet class)
+  sio-wire-json  Socket.IO event packet, WirePacket (orjson when installed)
+  sio-msgpack    Socket.IO event packet, WirePacket.encode_msgpack()
+
+Reported per payload and format: encode time per call (best of --repeat runs),
+bytes on the wire, and gzip-compressed bytes. The fan-out table shows the
+encode cost of one broadcast to --recipients clients: encoded once per
+recipient (the previous per-room emits) against once per broadcast
+(WireManager).
+
+Formats whose library (orjson, msgpack) is not installed are skipped.
+
+Usage:
+  python tools/bench/serialization.py
+  python tools/bench/serialization.py --page-size 100 --recipients 1000
+  python tools/bench/serialization.py --seed 7 --json results.json
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from flask import Flask
+from socketio import packet as sio_packet
+from app.functions.serialization import FastJSONProvider, WirePacket, fast_json_enabled, msgpack_enabled
+
+WORDS_LATIN = ('hello', 'deploy', 'build', 'merge', 'review', 'lunch', 'meeting', 'ticket', 'release', 'ok',
+               'thanks', 'link', 'screenshot', 'tomorrow', 'server', 'bug', 'fixed', 'test', 'channel', 'voice')
+WORDS_CYRILLIC = ('привет', 'сборка', 'релиз', 'спасибо', 'завтра', 'сервер', 'ошибка', 'готово', 'посмотри',
+                  'обед', 'встреча', 'канал', 'ссылка', 'тест', 'исправил', 'ладно', 'сейчас', 'давай')
+EMOJI = ('👍', '😂', '🔥', '❤️', '🎉', '👀', '✅')
+
+
+def _text(rng):
+    words = WORDS_CYRILLIC if rng.random() < 0.5 else WORDS_LATIN
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(2, 40)))
+
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def build_message_page(rng, size):
+    # {'messages': [...], 'count'} shaped like the channel messages endpoint
+    usernames = [f'user{n}' for n in range(40)]
+    started = datetime(2024, 5, 1, 9, 0, 0)
+    messages = []
+    for n in range(size):
+        uid = rng.randrange(len(usernames))
+        timestamp = started + timedelta(seconds=n * rng.randint(5, 120))
+        has_file = rng.random() < 0.1
+        reactions = {}
+        for emoji in rng.sample(EMOJI, rng.choice((0, 0, 0, 1, 1, 2, 3))):
+            reactions[emoji] = rng.sample(usernames, rng.randint(1, 6))
+        messages.append({
+            'id': 100000 + n,
+            'user_id': uid + 1,
+            'username': usernames[uid],
+            'avatar_url': f'/uploads/avatars/{uid + 1}_avatar.webp' if rng.random() < 0.7 else None,
+            'content': _text(rng),
+            'message_type': 'file' if has_file else 'text',
+            'timestamp': timestamp.isoformat(),
+            'edited_at': (timestamp + timedelta(minutes=3)).isoformat() if rng.random() < 0.05 else None,
+            'file_url': f'/uploads/files/{n}_report.pdf' if has_file else None,
+            'file_name': 'report.pdf' if has_file else None,
+            'file_size': rng.randint(10_000, 5_000_000) if has_file else None,
+            'reactions': reactions,
+            'reply_to_id': 100000 + rng.randrange(n) if n and rng.random() < 0.15 else None,
+        })
+    return {'messages': messages, 'count': len(messages)}
+
+
+def build_receive_message(rng):
+    return {
+        'id': 123456,
+        'user_id': 7,
+        'username': 'user7',
+        'avatar': '/uploads/avatars/7_avatar.webp',
+        'msg': _text(rng),
+        'timestamp_iso': _iso(datetime(2024, 5, 1, 12, 30)),
+        'message_type': 'text',
+        'file_url': None,
+        'file_name': None,
+        'file_size': None,
+        'edited_at_iso': None,
+        'reactions': {},
+        'reply_to': {'id': 123400, 'username': 'user3', 'snippet': _text(rng)[:200]},
+        'mentions': {'everyone': False, 'user_ids': [3], 'usernames': ['user3'], 'role_ids': [],
+                     'role_tags': [], 'denied_role_tags': []},
+    }
+
+
+def build_notification(rng):
+    return {
+        'room_id': 42,
+        'channel_id': 314,
+        'message_id': 123456,
+        'from_user': 'user7',
+        'from_user_id': 7,
+        'snippet': _text(rng)[:140],
+        'unread_count': 3,
+        'mention': False,
+        'mention_everyone': False,
+        'mention_roles': [],
+    }
+
+
+def _encoders():
+    # name -> (kind, encode(event, payload) -> str | bytes); kind is 'rest' or 'socket'
+    app = Flask('serialization-bench')
+    stdlib_provider = app.json
+
+    def stdlib_rest(event, payload):
+        return stdlib_provider.dumps(payload, separators=(',', ':'))
+
+    def sio_json(event, payload):
+        return sio_packet.Packet(sio_packet.EVENT, namespace='/', data=[event, payload]).encode()
+
+    def sio_wire_json(event, payload):
+        return WirePacket(sio_packet.EVENT, namespace='/', data=[event, payload]).encode()
+
+    encoders = {'stdlib-json': ('rest', stdlib_rest)}
+    if fast_json_enabled():
+        fast_provider = FastJSONProvider(app)
+        encoders['fast-json'] = ('rest', lambda event, payload: fast_provider.dumps(payload))
+    encoders['sio-json'] = ('socket', sio_json)
+    encoders['sio-wire-json'] = ('socket', sio_wire_json)
+    if msgpack_enabled():
+        encoders['sio-msgpack'] = (
+            'socket', lambda event, payload: WirePacket(
+                sio_packet.EVENT, namespace='/', data=[event, payload], binary=False
+            ).encode_msgpack()
+        )
+    return encoders
+
+
+def _time_per_call(fn, repeat, min_seconds=0.2):
+    # Best per-call time over `repeat` runs, each long enough to be measurable
+    calls = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds / max(1, repeat) or calls >= 1 << 20:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, (time.perf_counter() - started) / calls)
+    return best
+
+
+def _size(encoded):
+    return len(encoded.encode('utf-8') if isinstance(encoded, str) else encoded)
+
+
+def _gzip_size(encoded):
+    return len(gzip.compress(encoded.encode('utf-8') if isinstance(encoded, str) else encoded, 6))
+
+
+def run(page_size, repeat, seed):
+    rng = random.Random(seed)
+    payloads = [
+        ('message page', 'messages_page', build_message_page(rng, page_size)),
+        ('receive_message', 'receive_message', build_receive_message(rng)),
+        ('message_notification', 'message_notification', build_notification(rng)),
+    ]
+    results = []
+    for label, event, payload in payloads:
+        for name, (kind, encode) in _encoders().items():
+            if kind == 'rest' and label != 'message page':
+                continue
+            encoded = encode(event, payload)
+            seconds = _time_per_call(lambda: encode(event, payload), repeat)
+            results.append({
+                'payload': label, 'format': name, 'encode_us': seconds * 1e6,
+                'bytes': _size(encoded), 'gzip_bytes': _gzip_size(encoded),
+            })
+    return results
+
+
+def _print_results(results, recipients):
+    print(f"{'payload':<22}{'format':<15}{'encode us':>11}{'bytes':>10}{'gzip':>9}")
+    for r in results:
+        print(f"{r['payload']:<22}{r['format']:<15}{r['encode_us']:>11.1f}{r['bytes']:>10,}{r['gzip_bytes']:>9,}")
+
+    print(f"\nFan-out to {recipients} recipients (encode cost of one broadcast, ms):")
+    print(f"{'payload':<22}{'format':<15}{'per recipient':>15}{'per broadcast':>15}")
+    for r in results:
+        if r['format'].startswith('sio-'):
+            per_recipient = r['encode_us'] * recipients / 1000
+            per_broadcast = r['encode_us'] / 1000
+            print(f"{r['payload']:<22}{r['format']:<15}{per_recipient:>15.2f}{per_broadcast:>15.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=50, help='messages in the message page payload')
+    parser.add_argument('--recipients', type=int, default=200, help='clients reached by one broadcast')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement (best is kept)')
+    parser.add_argument('--seed', type=int, default=1, help='payload generator seed')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if not fast_json_enabled():
+        print('[SERIALIZATION] orjson not installed or FAST_JSON off: fast-json skipped')
+    if not msgpack_enabled():
+        print('[SERIALIZATION] msgpack not installed or SOCKET_MSGPACK off: sio-msgpack skipped')
+    results = run(max(1, args.page_size), max(1, args.repeat), args.seed)
+    _print_results(results, max(1, args.recipients))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+        print(f'\n[SERIALIZATION] results written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,624 @@
+"""Socket.IO load generator for BoxChat.
+
+Boots the app in a subprocess against a throw-away SQLite database, seeds
+--users accounts spread round-robin over --rooms rooms (one channel each),
+connects one python-socketio client per account and drives `join`,
+`send_message`, reactions, edits and reconnects at per-client Poisson rates
+for --duration seconds.
+
+Reported:
+  - end-to-end delivery latency of `receive_message` and `message_edited`
+    (client send -> event received by every client in the channel), p50/p90/p99/max
+  - HTTP round-trip latency of reaction and edit requests
+  - messages sent per second and events delivered per second
+  - server CPU time and RSS over the measured window (Linux /proc)
+  - Socket.IO frames that carried messages, and messages per frame
+  - connections refused by admission control (retried after retry_after)
+  - server RSS added per connected client, and server CPU per client while
+    connected but idle (--warmup) and under load
+
+With --batch the clients connect with ?batch=1 and accept receive_messages
+frames (micro-batched bursts). --batch-window-ms sets the server's
+SOCKET_BATCH_WINDOW_MS for the run, so latency and throughput can be
+compared with batching off (0) and at different windows.
+
+--transport picks the clients' Engine.IO transport (websocket, or polling
+with no upgrade) and --transport-policy sets the server's
+SOCKET_TRANSPORT_POLICY, so connections per worker can be compared between
+the two: run the same load with each transport and compare RSS and CPU per
+client.
+
+All clients run in this process, so send and receive timestamps share one
+clock. Use --json to keep results for before/after comparisons.
+
+Needs the Socket.IO client extras: pip install "python-socketio[client]"
+
+Usage:
+  python tools/bench/socket_load.py
+  python tools/bench/socket_load.py --users 200 --rooms 20 --duration 60 --message-rate 0.5
+  python tools/bench/socket_load.py --reaction-rate 0.2 --edit-rate 0.05 --reconnect-rate 0.01
+  python tools/bench/socket_load.py --db ./bench.db --json results.json
+  python tools/bench/socket_load.py --message-rate 5 --batch-window-ms 0 --json unbatched.json
+  python tools/bench/socket_load.py --message-rate 5 --batch --batch-window-ms 5 --json batched.json
+  python tools/bench/socket_load.py --users 200 --warmup 10 --transport polling --json polling.json
+  python tools/bench/socket_load.py --users 200 --warmup 10 --transport-policy websocket --json websocket.json
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import config as app_config
+
+BENCH_PASSWORD = 'bench-password-1'
+TOKEN_PREFIX = 'bench:'
+REACTION_EMOJIS = ('👍', '🔥', '😂', '🎉')
+# Recent message ids a client remembers as reaction targets
+RECENT_MESSAGES = 50
+# Connection attempts per connect when the server refuses with a retry_after
+CONNECT_ATTEMPTS = 5
+
+SERVER_SCRIPT = """
+import json
+import sys
+sys.path.insert(0, sys.argv[1])
+import config
+for key, value in json.loads(sys.argv[4]).items():
+    setattr(config, key, value)
+from types import SimpleNamespace
+from app import create_app
+from app.extensions import socketio
+values = {k: getattr(config, k) for k in dir(config) if k.isupper()}
+values['SQLALCHEMY_DATABASE_URI'] = sys.argv[2]
+app = create_app(config=SimpleNamespace(**values))
+socketio.run(app, host='127.0.0.1', port=int(sys.argv[3]), allow_unsafe_werkzeug=True,
+             debug=False, use_reloader=False, log_output=False)
+"""
+
+
+def _sqlite_uri_from_path(db_path: str) -> str:
+    abs_db = os.path.abspath(db_path).replace('\\', '/')
+    # Windows absolute path: C:/...
+    if len(abs_db) > 2 and abs_db[1] == ':':
+        return f"sqlite:///{abs_db}"
+    # POSIX absolute path: /...
+    return f"sqlite:////{abs_db.lstrip('/')}"
+
+
+def _build_config(db_uri):
+    values = {k: getattr(app_config, k) for k in dir(app_config) if k.isupper()}
+    values['SQLALCHEMY_DATABASE_URI'] = db_uri
+    return SimpleNamespace(**values)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def _summary(values):
+    # Latency summary in milliseconds
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(_percentile(values, 50) * 1000, 2),
+        'p90_ms': round(_percentile(values, 90) * 1000, 2),
+        'p99_ms': round(_percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2),
+        'mean_ms': round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+def seed_database(db_uri, users, rooms):
+    # Create bench accounts, rooms, channels and memberships; returns [(username, channel_id, room_id)]
+    from app import create_app
+    from app.extensions import db
+    from app.models import User, Room, Channel, Member
+    from app.functions import hash_password
+
+    app = create_app(config=_build_config(db_uri))
+    with app.app_context():
+        password_hash = hash_password(BENCH_PASSWORD)
+        user_rows = [User(username=f'bench_{i}', password=password_hash) for i in range(users)]
+        room_rows = [Room(name=f'bench-room-{i}', type='server', is_public=True) for i in range(rooms)]
+        db.session.add_all(user_rows + room_rows)
+        db.session.flush()
+        channel_rows = [Channel(name='general', room_id=room.id) for room in room_rows]
+        db.session.add_all(channel_rows)
+        db.session.flush()
+        placement = []
+        for i, user in enumerate(user_rows):
+            room, channel = room_rows[i % rooms], channel_rows[i % rooms]
+            db.session.add(Member(user_id=user.id, room_id=room.id, role='owner' if i < rooms else 'member'))
+            placement.append((user.username, channel.id, room.id))
+        db.session.commit()
+        db.engine.dispose()
+    return placement
+
+
+class ServerProcess:
+    # The app served by socketio.run() in a child interpreter
+
+    def __init__(self, db_uri, port, log_path, overrides=None):
+        # overrides: config module values set before the app is imported
+        self.port = port
+        self.log_path = log_path
+        self._log = open(log_path, 'w')
+        self.proc = subprocess.Popen(
+            [sys.executable, '-c', SERVER_SCRIPT, ROOT_DIR, db_uri, str(port), json.dumps(overrides or {})],
+            cwd=ROOT_DIR, stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f'server exited with code {self.proc.returncode}:\n{self.log_tail()}')
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.5):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f'server did not start within {timeout}s:\n{self.log_tail()}')
+
+    def log_tail(self, lines=30):
+        self._log.flush()
+        with open(self.log_path, errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+
+    def cpu_seconds(self):
+        # utime + stime of the server process, None where /proc is unavailable
+        try:
+            with open(f'/proc/{self.proc.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def rss_bytes(self):
+        try:
+            with open(f'/proc/{self.proc.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self._log.close()
+
+
+class Stats:
+    # Shared, lock-protected counters and latency samples of all clients
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recording = False
+        self.pending = {}  # token -> send time
+        self.connected = {}  # channel_id -> connected client count
+        self.latency = {'receive_message': [], 'message_edited': []}
+        self.http_latency = {'reaction': [], 'edit': []}
+        self.counts = {
+            'messages_sent': 0, 'edits_sent': 0, 'reactions_sent': 0, 'reconnects': 0,
+            'expected_deliveries': 0, 'events_received': 0, 'message_frames': 0, 'errors': 0,
+            'connects_refused': 0,
+        }
+        self.connect_latency = []
+
+    def count(self, key, n=1):
+        with self.lock:
+            if self.recording:
+                self.counts[key] += n
+
+    def sent(self, token, channel_id, kind):
+        with self.lock:
+            self.pending[token] = time.perf_counter()
+            if self.recording:
+                self.counts[kind] += 1
+                self.counts['expected_deliveries'] += self.connected.get(channel_id, 0)
+
+    def delivered(self, event, token):
+        now = time.perf_counter()
+        with self.lock:
+            sent_at = self.pending.get(token)
+            if self.recording:
+                self.counts['events_received'] += 1
+                if sent_at is not None:
+                    self.latency[event].append(now - sent_at)
+
+    def request_done(self, kind, elapsed):
+        with self.lock:
+            if self.recording:
+                self.http_latency[kind].append(elapsed)
+
+    def set_connected(self, channel_id, delta):
+        with self.lock:
+            self.connected[channel_id] = self.connected.get(channel_id, 0) + delta
+
+
+class BenchClient:
+    # One simulated user: a logged-in HTTP session plus a Socket.IO connection
+
+    def __init__(self, index, url, username, channel_id, room_id, stats, args):
+        self.index = index
+        self.url = url
+        self.username = username
+        self.channel_id = channel_id
+        self.room_id = room_id
+        self.stats = stats
+        self.args = args
+        self.user_id = None
+        self.rng = random.Random(args.seed * 100003 + index)
+        self.jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar))
+        self.sio = None
+        self.own_messages = []
+        self.recent_messages = []
+
+    def _post(self, path, body):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'}, method='POST',
+        )
+        with self.opener.open(request, timeout=30) as response:
+            return json.loads(response.read() or b'{}')
+
+    def login(self):
+        data = self._post('/api/v1/auth/login', {'username': self.username, 'password': BENCH_PASSWORD})
+        self.user_id = data['user']['id']
+
+    def _client(self, refusal):
+        import socketio
+
+        sio = socketio.Client(reconnection=False)
+        sio.on('receive_message', self._on_receive_message)
+        sio.on('receive_messages', self._on_receive_messages)
+        sio.on('message_edited', self._on_message_edited)
+        sio.on('reactions_updated', lambda data: self.stats.count('events_received'))
+        sio.on('error', lambda data: self.stats.count('errors'))
+        sio.on('connect_error', lambda data: refusal.update(data.get('data') or {} if isinstance(data, dict) else {}))
+        return sio
+
+    def connect(self):
+        import socketio
+
+        cookie = '; '.join(f'{c.name}={c.value}' for c in self.jar)
+        started = time.perf_counter()
+        url = self.url + ('?batch=1' if self.args.batch else '')
+        for attempt in range(CONNECT_ATTEMPTS):
+            refusal = {}
+            sio = self._client(refusal)
+            try:
+                sio.connect(url, headers={'Cookie': cookie}, transports=[self.args.transport], wait_timeout=30)
+                break
+            except socketio.exceptions.ConnectionError:
+                # An overloaded server refuses with a retry_after; wait it out like the web client
+                if 'retry_after' not in refusal or attempt == CONNECT_ATTEMPTS - 1:
+                    raise
+                self.stats.count('connects_refused')
+                time.sleep(float(refusal['retry_after']))
+        if self.args.ack_join:
+            sio.call('join', {'channel_id': self.channel_id}, timeout=30)
+        else:
+            sio.emit('join', {'channel_id': self.channel_id})
+        self.stats.connect_latency.append(time.perf_counter() - started)
+        self.sio = sio
+        self.stats.set_connected(self.channel_id, 1)
+
+    def disconnect(self):
+        if self.sio is not None:
+            self.stats.set_connected(self.channel_id, -1)
+            try:
+                self.sio.disconnect()
+            except Exception:
+                pass
+            self.sio = None
+
+    def _on_receive_messages(self, frame):
+        self.stats.count('message_frames')
+        for data in frame.get('messages') or []:
+            self._deliver_message(data)
+
+    def _on_receive_message(self, data):
+        self.stats.count('message_frames')
+        self._deliver_message(data)
+
+    def _deliver_message(self, data):
+        text = data.get('msg') or ''
+        if data.get('user_id') == self.user_id:
+            self.own_messages = (self.own_messages + [data.get('id')])[-RECENT_MESSAGES:]
+        self.recent_messages = (self.recent_messages + [data.get('id')])[-RECENT_MESSAGES:]
+        self.stats.delivered('receive_message', text[len(TOKEN_PREFIX):] if text.startswith(TOKEN_PREFIX) else None)
+
+    def _on_message_edited(self, data):
+        text = data.get('content') or data.get('msg') or ''
+        self.stats.delivered('message_edited', text[len(TOKEN_PREFIX):] if text.startswith(TOKEN_PREFIX) else None)
+
+    def send_message(self):
+        token = uuid.uuid4().hex
+        self.stats.sent(token, self.channel_id, 'messages_sent')
+        self.sio.emit('send_message', {
+            'channel_id': self.channel_id,
+            'room_id': self.room_id,
+            'msg': TOKEN_PREFIX + token,
+        })
+
+    def edit_message(self):
+        if not self.own_messages:
+            return
+        token = uuid.uuid4().hex
+        self.stats.sent(token, self.channel_id, 'edits_sent')
+        started = time.perf_counter()
+        self._post(f'/message/{self.rng.choice(self.own_messages)}/edit', {'content': TOKEN_PREFIX + token})
+        self.stats.request_done('edit', time.perf_counter() - started)
+
+    def react(self):
+        if not self.recent_messages:
+            return
+        started = time.perf_counter()
+        self._post(f'/message/{self.rng.choice(self.recent_messages)}/reaction', {'emoji': self.rng.choice(REACTION_EMOJIS)})
+        self.stats.request_done('reaction', time.perf_counter() - started)
+        self.stats.count('reactions_sent')
+
+    def reconnect(self):
+        self.disconnect()
+        self.connect()
+        self.stats.count('reconnects')
+
+    def drive(self, stop_at, stop_event):
+        # Fire each action on its own Poisson clock until stop_at
+        actions = [
+            (self.args.message_rate, self.send_message),
+            (self.args.reaction_rate, self.react),
+            (self.args.edit_rate, self.edit_message),
+            (self.args.reconnect_rate, self.reconnect),
+        ]
+        now = time.monotonic()
+        due = [(now + self.rng.expovariate(rate), rate, action) for rate, action in actions if rate > 0]
+        while due and not stop_event.is_set():
+            due.sort(key=lambda item: item[0])
+            at, rate, action = due[0]
+            if at >= stop_at:
+                return
+            if stop_event.wait(max(0.0, at - time.monotonic())):
+                return
+            try:
+                action()
+            except Exception as e:
+                self.stats.count('errors')
+                if self.args.verbose:
+                    print(f"  [client {self.index}] {action.__name__} failed: {e}")
+            due[0] = (at + self.rng.expovariate(rate), rate, action)
+
+
+def _run_parallel(func, items, workers):
+    # Run func(item) for all items on a small thread pool; returns the errors
+    errors = []
+    queue = list(items)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                item = queue.pop()
+            try:
+                func(item)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, workers))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+def run_benchmark(args):
+    tmp_dir = tempfile.mkdtemp(prefix='boxchat-bench-')
+    db_path = args.db or os.path.join(tmp_dir, 'bench.db')
+    db_uri = _sqlite_uri_from_path(db_path)
+
+    print(f"Seeding {args.users} users in {args.rooms} rooms -> {db_path}")
+    placement = seed_database(db_uri, args.users, args.rooms)
+
+    overrides = {}
+    if args.batch_window_ms is not None:
+        overrides['SOCKET_BATCH_WINDOW_MS'] = args.batch_window_ms
+    if args.transport_policy is not None:
+        overrides['SOCKET_TRANSPORT_POLICY'] = args.transport_policy
+    server = ServerProcess(db_uri, args.port or _free_port(), args.server_log or os.path.join(tmp_dir, 'server.log'),
+                           overrides)
+    stats = Stats()
+    clients = []
+    try:
+        server.wait_ready()
+        print(f"Server up at {server.url} (pid {server.proc.pid}, log {server.log_path})")
+        rss_idle_server = server.rss_bytes()
+
+        clients = [
+            BenchClient(i, server.url, username, channel_id, room_id, stats, args)
+            for i, (username, channel_id, room_id) in enumerate(placement)
+        ]
+        started = time.perf_counter()
+        errors = _run_parallel(lambda c: (c.login(), c.connect()), clients, args.connect_workers)
+        if errors:
+            raise RuntimeError(f'{len(errors)} clients failed to connect, first: {errors[0]!r}\n{server.log_tail()}')
+        print(f"Connected {len(clients)} clients in {time.perf_counter() - started:.1f}s")
+        cpu_idle_before, idle_before = server.cpu_seconds(), time.perf_counter()
+        time.sleep(args.warmup)
+        cpu_idle_after, idle_after = server.cpu_seconds(), time.perf_counter()
+        rss_connected = server.rss_bytes()
+
+        cpu_before, wall_before = server.cpu_seconds(), time.perf_counter()
+        with stats.lock:
+            stats.recording = True
+        stop_event = threading.Event()
+        stop_at = time.monotonic() + args.duration
+        drivers = [threading.Thread(target=c.drive, args=(stop_at, stop_event), daemon=True) for c in clients]
+        for t in drivers:
+            t.start()
+        for t in drivers:
+            t.join(args.duration + 30)
+        stop_event.set()
+        time.sleep(args.drain)
+        with stats.lock:
+            stats.recording = False
+        cpu_after, wall_after = server.cpu_seconds(), time.perf_counter()
+        rss = server.rss_bytes()
+    finally:
+        for c in clients:
+            c.disconnect()
+        server.stop()
+
+    elapsed = wall_after - wall_before
+    cpu = (cpu_after - cpu_before) if cpu_before is not None and cpu_after is not None else None
+    idle_cpu = (cpu_idle_after - cpu_idle_before) if cpu_idle_before is not None and cpu_idle_after is not None else None
+    idle_elapsed = idle_after - idle_before
+    counts = dict(stats.counts)
+    return {
+        'params': {
+            'users': args.users, 'rooms': args.rooms, 'duration': args.duration, 'seed': args.seed,
+            'message_rate': args.message_rate, 'reaction_rate': args.reaction_rate,
+            'edit_rate': args.edit_rate, 'reconnect_rate': args.reconnect_rate,
+            'batch': args.batch, 'batch_window_ms': args.batch_window_ms,
+            'transport': args.transport, 'transport_policy': args.transport_policy,
+        },
+        'elapsed_s': round(elapsed, 2),
+        'counts': counts,
+        'messages_per_s': round(counts['messages_sent'] / args.duration, 2),
+        'events_per_s': round(counts['events_received'] / elapsed, 2) if elapsed else None,
+        'delivery_ratio': round(len(stats.latency['receive_message']) / counts['expected_deliveries'], 4)
+        if counts['expected_deliveries'] else None,
+        'messages_per_frame': round(len(stats.latency['receive_message']) / counts['message_frames'], 2)
+        if counts['message_frames'] else None,
+        'latency': {event: _summary(values) for event, values in stats.latency.items()},
+        'http_latency': {kind: _summary(values) for kind, values in stats.http_latency.items()},
+        'connect_latency': _summary(stats.connect_latency),
+        'server_cpu_s': round(cpu, 2) if cpu is not None else None,
+        'server_cpu_pct': round(cpu / elapsed * 100, 1) if cpu is not None and elapsed else None,
+        'server_rss_mib': round(rss / (1024 * 1024), 1) if rss else None,
+        'rss_per_client_kib': round((rss_connected - rss_idle_server) / 1024 / args.users, 1)
+        if rss_connected and rss_idle_server else None,
+        # CPU milliseconds per second per client: idle keep-alive cost and cost under load
+        'idle_cpu_ms_per_client_s': round(idle_cpu * 1000 / idle_elapsed / args.users, 3)
+        if idle_cpu is not None and idle_elapsed else None,
+        'load_cpu_ms_per_client_s': round(cpu * 1000 / elapsed / args.users, 3) if cpu is not None and elapsed else None,
+    }
+
+
+def _format_latency(summary):
+    if not summary.get('count'):
+        return 'no samples'
+    return (f"p50 {summary['p50_ms']}ms  p90 {summary['p90_ms']}ms  p99 {summary['p99_ms']}ms  "
+            f"max {summary['max_ms']}ms  (n={summary['count']})")
+
+
+def print_report(result):
+    counts = result['counts']
+    print(f"\nMeasured {result['elapsed_s']}s:")
+    print(f"  sent: {counts['messages_sent']} messages ({result['messages_per_s']}/s), "
+          f"{counts['edits_sent']} edits, {counts['reactions_sent']} reactions, {counts['reconnects']} reconnects")
+    print(f"  received: {counts['events_received']} events ({result['events_per_s']}/s), "
+          f"delivery ratio {result['delivery_ratio']}, errors {counts['errors']}")
+    print(f"  message frames: {counts['message_frames']} ({result['messages_per_frame']} messages per frame)")
+    for event, summary in result['latency'].items():
+        print(f"  {event} delivery: {_format_latency(summary)}")
+    for kind, summary in result['http_latency'].items():
+        print(f"  {kind} request: {_format_latency(summary)}")
+    print(f"  connect: {_format_latency(result['connect_latency'])}, {counts['connects_refused']} refused (retried)")
+    if result['server_cpu_s'] is not None:
+        print(f"  server cpu: {result['server_cpu_s']}s ({result['server_cpu_pct']}% of one core), "
+              f"rss {result['server_rss_mib']} MiB")
+        print(f"  per client: {result['rss_per_client_kib']} KiB rss, cpu {result['idle_cpu_ms_per_client_s']} ms/s idle, "
+              f"{result['load_cpu_ms_per_client_s']} ms/s under load")
+    else:
+        print('  server cpu: n/a (no /proc)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO load benchmark for BoxChat.')
+    parser.add_argument('--users', type=int, default=50, help='Simulated clients (one account each)')
+    parser.add_argument('--rooms', type=int, default=5, help='Rooms the clients are spread over')
+    parser.add_argument('--duration', type=float, default=20.0, help='Measured seconds of load')
+    parser.add_argument('--warmup', type=float, default=1.0, help='Seconds to idle after connecting')
+    parser.add_argument('--drain', type=float, default=2.0, help='Seconds to keep listening after the load stops')
+    parser.add_argument('--message-rate', type=float, default=1.0, help='Messages per second per client')
+    parser.add_argument('--reaction-rate', type=float, default=0.2, help='Reaction toggles per second per client')
+    parser.add_argument('--edit-rate', type=float, default=0.05, help='Edits per second per client')
+    parser.add_argument('--reconnect-rate', type=float, default=0.0, help='Reconnects per second per client')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the action schedule')
+    # Logins hold a DB connection while waiting for the password hasher; keep this
+    # below the server's SQLAlchemy pool size (5 + 10 overflow) or the pool runs dry
+    parser.add_argument('--connect-workers', type=int, default=8, help='Parallel logins/connects at startup')
+    parser.add_argument('--ack-join', action='store_true', help='Wait for the join acknowledgement before driving')
+    parser.add_argument('--batch', action='store_true', help='Clients accept batched receive_messages frames')
+    parser.add_argument('--batch-window-ms', type=float, help='Server SOCKET_BATCH_WINDOW_MS (default: config value)')
+    parser.add_argument('--transport', choices=('websocket', 'polling'), default='websocket',
+                        help='Engine.IO transport the clients use (polling never upgrades)')
+    parser.add_argument('--transport-policy', choices=('any', 'upgrade', 'websocket'),
+                        help='Server SOCKET_TRANSPORT_POLICY (default: config value)')
+    parser.add_argument('--db', help='SQLite file to use instead of a temporary one (must not exist yet)')
+    parser.add_argument('--port', type=int, default=0, help='Server port (default: a free one)')
+    parser.add_argument('--server-log', help='Where to write the server output (default: temp dir)')
+    parser.add_argument('--json', help='Also write the results as JSON to this path')
+    parser.add_argument('--verbose', action='store_true', help='Print individual client errors')
+    args = parser.parse_args()
+
+    if args.users < 1 or args.rooms < 1:
+        parser.error('--users and --rooms must be at least 1')
+    if args.db and os.path.exists(args.db):
+        parser.error(f'{args.db} already exists')
+    if args.transport == 'polling' and args.transport_policy == 'websocket':
+        parser.error('--transport polling cannot connect to a --transport-policy websocket server')
+
+    result = run_benchmark(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
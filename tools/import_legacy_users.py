@@ -0,0 +1,219 @@
+"""Import accounts from the legacy instance DB into the main database in bulk.
+
+Replaces the per-login fallback that opened instance/thecomboxmsgr.db for every
+unknown username. Rows are streamed from the legacy `user` table in rowid
+order and inserted with executemany; usernames that already exist (compared
+case-insensitively) are skipped. Progress is committed together with each
+batch, so an interrupted run resumes where it stopped. Legacy IP bans of
+banned accounts are written to ip_ban in the same batch (the login check
+reads that table, not user.banned_ips); running workers pick them up within
+IP_BAN_CACHE_TTL_SECONDS. When the run reaches the end, the import is marked
+complete and the login path stops consulting the legacy DB.
+
+Usage:
+  python tools/import_legacy_users.py
+  python tools/import_legacy_users.py --source ./instance/thecomboxmsgr.db --db ./thecomboxmsgr.db
+  python tools/import_legacy_users.py --batch-size 5000 --restart
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import config as app_config
+from app import create_app
+from app.functions.ip_bans import normalize_network, invalidate_ip_bans
+
+# Legacy column -> default when the legacy schema predates it
+LEGACY_COLUMNS = [
+    ('username', None),
+    ('password', None),
+    ('bio', ''),
+    ('avatar_url', None),
+    ('privacy_searchable', 1),
+    ('privacy_listable', 1),
+    ('hide_status', 0),
+    ('presence_status', 'offline'),
+    ('is_superuser', 0),
+    ('is_banned', 0),
+    ('banned_ips', ''),
+    ('ban_reason', None),
+]
+
+INSERT_SQL = (
+    'INSERT INTO user (username, password, bio, avatar_url, privacy_searchable, privacy_listable, '
+    'hide_status, presence_status, is_superuser, is_banned, banned_ips, ban_reason, failed_login_attempts) '
+    'SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0 '
+    'WHERE NOT EXISTS (SELECT 1 FROM user WHERE lower(username) = lower(?))'
+)
+IP_BAN_SQL = 'INSERT OR IGNORE INTO ip_ban (network, user_id, created_at) VALUES (?, ?, CURRENT_TIMESTAMP)'
+
+
+def _sqlite_uri_from_path(db_path: str) -> str:
+    abs_db = os.path.abspath(db_path).replace('\\', '/')
+    # Windows absolute path: C:/...
+    if len(abs_db) > 2 and abs_db[1] == ':':
+        return f"sqlite:///{abs_db}"
+    # POSIX absolute path: /...
+    return f"sqlite:////{abs_db.lstrip('/')}"
+
+
+def _build_config(db_path):
+    values = {k: getattr(app_config, k) for k in dir(app_config) if k.isupper()}
+    if db_path:
+        values['SQLALCHEMY_DATABASE_URI'] = _sqlite_uri_from_path(db_path)
+    return SimpleNamespace(**values)
+
+
+def _target_db_path(db_path):
+    # Run migrations on the target (creates legacy_import_state) and resolve its file
+    app = create_app(config=_build_config(db_path), init_db=True)
+    with app.app_context():
+        from app.extensions import db
+        return os.path.abspath(db.engine.url.database)
+
+
+def _source_select(src):
+    present = {row[1] for row in src.execute('PRAGMA table_info(user)')}
+    if 'username' not in present or 'password' not in present:
+        raise SystemExit('[LEGACY IMPORT] source has no usable user table')
+    fields = []
+    params = []
+    for name, default in LEGACY_COLUMNS:
+        if default is None:
+            fields.append(name if name in present else 'NULL')
+            continue
+        fields.append(f'COALESCE({name}, ?)' if name in present else '?')
+        params.append(default)
+    sql = f"SELECT rowid, {', '.join(fields)} FROM user WHERE rowid > ? ORDER BY rowid LIMIT ?"
+    return sql, params
+
+
+def _ip_ban_rows(dst, after_user_id):
+    # (network, user_id) for banned users inserted after after_user_id, normalized as migration 12 does
+    rows = dst.execute(
+        "SELECT id, banned_ips FROM user WHERE id > ? AND is_banned = 1 "
+        "AND banned_ips IS NOT NULL AND banned_ips != ''", (after_user_id,)
+    ).fetchall()
+    bans = []
+    for user_id, banned_ips in rows:
+        for raw in str(banned_ips).split(','):
+            network = normalize_network(raw)
+            if network:
+                bans.append((network, user_id))
+    return bans
+
+
+def _load_state(dst, source_path, restart):
+    row = dst.execute('SELECT last_rowid, rows_imported, rows_skipped, source_path, completed_at '
+                      'FROM legacy_import_state WHERE id = 1').fetchone()
+    now = datetime.utcnow().isoformat(sep=' ')
+    if row is None or restart or row[3] != source_path:
+        dst.execute('DELETE FROM legacy_import_state WHERE id = 1')
+        dst.execute('INSERT INTO legacy_import_state (id, source_path, last_rowid, rows_imported, rows_skipped, started_at) '
+                    'VALUES (1, ?, 0, 0, 0, ?)', (source_path, now))
+        dst.commit()
+        return 0, 0, 0, None
+    return row[0], row[1], row[2], row[4]
+
+
+def _mark_complete(dst):
+    dst.execute('UPDATE legacy_import_state SET completed_at = ? WHERE id = 1',
+                (datetime.utcnow().isoformat(sep=' '),))
+    dst.commit()
+
+
+def run_import(source_path, target_path, batch_size, restart):
+    if os.path.abspath(source_path) == os.path.abspath(target_path):
+        print('[LEGACY IMPORT] source and target are the same database; nothing to import')
+        dst = sqlite3.connect(target_path)
+        _load_state(dst, source_path, restart)
+        _mark_complete(dst)
+        dst.close()
+        return
+
+    src = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    dst = sqlite3.connect(target_path)
+    dst.execute('PRAGMA journal_mode=WAL')
+    dst.execute('PRAGMA synchronous=NORMAL')
+
+    last_rowid, imported, skipped, completed_at = _load_state(dst, source_path, restart)
+    if completed_at:
+        print(f'[LEGACY IMPORT] already completed at {completed_at} ({imported} imported, {skipped} skipped); '
+              'use --restart to run again')
+        src.close()
+        dst.close()
+        return
+
+    select_sql, select_params = _source_select(src)
+    total = src.execute('SELECT COUNT(*) FROM user WHERE rowid > ?', (last_rowid,)).fetchone()[0]
+    print(f'[LEGACY IMPORT] {total} rows to process from {source_path} (resuming after rowid {last_rowid})')
+
+    started = time.perf_counter()
+    processed = 0
+    ip_bans = 0
+    while True:
+        rows = src.execute(select_sql, select_params + [last_rowid, batch_size]).fetchall()
+        if not rows:
+            break
+        batch = [tuple(r[1:]) + (r[1],) for r in rows]
+        max_user_id = dst.execute('SELECT COALESCE(MAX(id), 0) FROM user').fetchone()[0]
+        before = dst.total_changes
+        dst.executemany(INSERT_SQL, batch)
+        inserted = dst.total_changes - before
+        bans = _ip_ban_rows(dst, max_user_id)
+        dst.executemany(IP_BAN_SQL, bans)
+        ip_bans += len(bans)
+        imported += inserted
+        skipped += len(rows) - inserted
+        last_rowid = rows[-1][0]
+        dst.execute('UPDATE legacy_import_state SET last_rowid = ?, rows_imported = ?, rows_skipped = ? WHERE id = 1',
+                    (last_rowid, imported, skipped))
+        dst.commit()
+
+        processed += len(rows)
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        rate = processed / elapsed
+        remaining = max(total - processed, 0)
+        print(f'[LEGACY IMPORT] {processed}/{total} rows ({inserted} new in batch) '
+              f'{rate:.0f} rows/s, ETA {remaining / rate if rate else 0:.0f}s')
+
+    _mark_complete(dst)
+    invalidate_ip_bans()  # for callers in an app process; other workers reload after the TTL
+    elapsed = time.perf_counter() - started
+    print(f'[LEGACY IMPORT] done: {imported} imported, {skipped} skipped (already present), '
+          f'{ip_bans} IP bans in {elapsed:.1f}s')
+    src.close()
+    dst.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-import users from the legacy BoxChat instance DB.')
+    parser.add_argument('--source', help='Legacy sqlite DB (default: <project>/instance/thecomboxmsgr.db)')
+    parser.add_argument('--db', help='Target sqlite DB file (default: from config)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--restart', action='store_true', help='Ignore saved progress and start over')
+    args = parser.parse_args()
+
+    source_path = os.path.abspath(args.source or os.path.join(ROOT_DIR, 'instance', 'thecomboxmsgr.db'))
+    target_path = _target_db_path(args.db)
+    if not os.path.exists(source_path):
+        print(f'[LEGACY IMPORT] no legacy DB at {source_path}; marking import as complete')
+        dst = sqlite3.connect(target_path)
+        _load_state(dst, source_path, args.restart)
+        _mark_complete(dst)
+        dst.close()
+        return
+    run_import(source_path, target_path, max(1, args.batch_size), args.restart)
+
+
+if __name__ == '__main__':
+    main()
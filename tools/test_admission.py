@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Admission control and overload shedding
+# Checks that load signals map to shedding levels and that the level only
+# steps down after the cooldown. Then checks the behaviour at each level:
+# non-essential emits are dropped while degraded, new connections have their
+# presence write deferred (and applied in bulk later) while deferring, and are
+# refused with a retry_after while rejecting; a direct presence write drops
+# the user's pending deferred change. Also checks that the queue
+# depth signal ignores rolled-back outbox enqueues and rows another process
+# has already delivered.
+#
+#   python tools/test_admission.py
+
+import os
+import sys
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db, socketio
+from app.functions import admission
+from app.functions.admission import (
+    NORMAL, DEGRADED, DEFERRING, REJECTING, SHED_EVENTS, flush_deferred_presence, get_admission_stats, level_for,
+    sample_signals, update
+)
+from app.functions.outbox import enqueue_emit
+from app.models import User, SocketOutbox
+
+
+def _get_app():
+    return get_app('admission')
+
+
+def _login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def _lag_for(level):
+    # A loop lag that reaches `level` on its own
+    return {'loop_lag_ms': admission.THRESHOLDS['loop_lag_ms'][level - 1]} if level else {'loop_lag_ms': 0.0}
+
+
+def _set_level(level):
+    with mock.patch.object(admission, 'ADMISSION_COOLDOWN_SECONDS', 0):
+        for _ in range(REJECTING + 1):
+            update(_lag_for(level))
+    assert admission.shedding_level() == level
+
+
+def test_levels_and_cooldown():
+    lag, pool, depth = (admission.THRESHOLDS[k] for k in ('loop_lag_ms', 'db_pool_usage', 'queue_depth'))
+    assert level_for({'loop_lag_ms': 0.0, 'db_pool_usage': 0.0, 'queue_depth': 0.0}) == (NORMAL, [])
+    assert level_for({'loop_lag_ms': lag[0], 'db_pool_usage': 0.0}) == (DEGRADED, ['loop_lag_ms'])
+    assert level_for({'loop_lag_ms': lag[0], 'db_pool_usage': pool[1]}) == (DEFERRING, ['db_pool_usage'])
+    assert level_for({'queue_depth': depth[2], 'loop_lag_ms': lag[2]}) == (REJECTING, ['queue_depth', 'loop_lag_ms'])
+
+    _set_level(NORMAL)
+    with mock.patch.object(admission, 'ADMISSION_COOLDOWN_SECONDS', 10):
+        assert update(_lag_for(REJECTING), now=100.0) == REJECTING  # rises at once
+        assert update(_lag_for(NORMAL), now=101.0) == REJECTING     # cooldown starts
+        assert update(_lag_for(NORMAL), now=105.0) == REJECTING
+        assert update(_lag_for(NORMAL), now=111.0) == DEFERRING      # one step per cooldown
+        assert update(_lag_for(DEGRADED), now=115.0) == DEFERRING
+        assert update(_lag_for(DEGRADED), now=121.5) == DEGRADED
+        assert update(_lag_for(DEFERRING), now=122.0) == DEFERRING   # and back up at once
+    stats = get_admission_stats()
+    assert stats['level_name'] == 'deferring' and stats['reasons'] == ['loop_lag_ms'], stats
+    _set_level(NORMAL)
+    print('   ✓ Signals map to shedding levels; levels step down only after the cooldown')
+
+
+def test_degraded_drops_non_essential_events():
+    app = _get_app()
+    with app.app_context():
+        client = socketio.test_client(app)
+        sid = socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/')
+        socketio.server.enter_room(sid, 'shed')
+        client.get_received()
+        _set_level(DEGRADED)
+        dropped = SHED_EVENTS._values.get(('presence_updated',), 0)
+        socketio.emit('presence_updated', {'user_id': 1, 'status': 'online'}, room='shed')
+        socketio.emit('receive_message', {'id': 1}, room='shed')
+        assert [e['name'] for e in client.get_received()] == ['receive_message']
+        assert SHED_EVENTS._values.get(('presence_updated',)) == dropped + 1
+        _set_level(NORMAL)
+        socketio.emit('presence_updated', {'user_id': 1, 'status': 'online'}, room='shed')
+        assert [e['name'] for e in client.get_received()] == ['presence_updated']
+        client.disconnect()
+    print('   ✓ Degraded level drops presence updates and keeps messages')
+
+
+def test_deferred_and_rejected_connections():
+    app = _get_app()
+    with app.app_context():
+        user = User(username='admission-user', password='x', presence_status='offline')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    http = app.test_client()
+    _login(http, user_id)
+    _set_level(DEFERRING)
+    client = socketio.test_client(app, flask_test_client=http)
+    assert client.is_connected()
+    with app.app_context():
+        assert db.session.get(User, user_id).presence_status == 'offline'
+        assert get_admission_stats()['deferred_presence'] == 1
+        assert flush_deferred_presence() == 1
+        db.session.expire_all()
+        assert db.session.get(User, user_id).presence_status == 'online'
+    client.disconnect()
+    with app.app_context():
+        flush_deferred_presence()
+        db.session.expire_all()
+        assert db.session.get(User, user_id).presence_status == 'offline'
+
+    _set_level(REJECTING)
+    refused = socketio.test_client(app, flask_test_client=http)
+    assert not refused.is_connected()
+    _set_level(NORMAL)
+    client = socketio.test_client(app, flask_test_client=http)
+    assert client.is_connected()
+    with app.app_context():
+        assert db.session.get(User, user_id).presence_status == 'online'
+    client.disconnect()
+    print('   ✓ Connections are deferred, then refused, as the level rises')
+
+
+def test_direct_write_drops_the_deferred_change():
+    app = _get_app()
+    with app.app_context():
+        user = User(username='admission-late', password='x', presence_status='offline')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    http = app.test_client()
+    _login(http, user_id)
+    _set_level(DEFERRING)
+    client = socketio.test_client(app, flask_test_client=http)  # 'online' is deferred
+    _set_level(DEGRADED)  # the monitor has not flushed yet when the user leaves
+    client.disconnect()
+    with app.app_context():
+        assert get_admission_stats()['deferred_presence'] == 0
+        assert flush_deferred_presence() == 0
+        db.session.expire_all()
+        assert db.session.get(User, user_id).presence_status == 'offline'
+    _set_level(NORMAL)
+    print('   ✓ A direct presence write drops the older deferred one')
+
+
+def test_queue_depth_follows_pending_outbox_rows():
+    app = _get_app()
+    _set_level(NORMAL)
+    with app.app_context(), \
+            mock.patch.dict(admission.THRESHOLDS, {'queue_depth': [2.0, 4.0, 8.0]}), \
+            mock.patch.object(admission, 'ADMISSION_COOLDOWN_SECONDS', 0):
+        for n in range(10):
+            enqueue_emit('admission_test', {'n': n}, room='nobody')
+        db.session.rollback()
+        signals = sample_signals(app, 0.0)
+        assert signals['queue_depth'] == 0.0, signals
+        assert update(signals) == NORMAL
+
+        for n in range(10):
+            enqueue_emit('admission_test', {'n': n}, room='nobody')
+        db.session.commit()
+        assert update(sample_signals(app, 0.0)) == REJECTING
+
+        # Another process's dispatcher delivered (and deleted) the rows
+        SocketOutbox.query.delete()
+        db.session.commit()
+        for _ in range(REJECTING + 1):  # one step down per sample with no cooldown
+            update(sample_signals(app, 0.0))
+        assert admission.shedding_level() == NORMAL
+    print('   ✓ Queue depth drops back once outbox rows are rolled back or delivered elsewhere')
+
+
+if __name__ == '__main__':
+    print("Testing admission control...")
+    test_levels_and_cooldown()
+    test_degraded_drops_non_essential_events()
+    test_deferred_and_rejected_connections()
+    test_direct_write_drops_the_deferred_change()
+    test_queue_depth_follows_pending_outbox_rows()
+    print("\nAll admission tests passed.")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# Per-IP auth throttling
+# Checks the in-memory sliding window (failures older than
+# ATTEMPT_WINDOW_MINUTES stop counting), the lockout after
+# MAX_FAILED_IP_ATTEMPTS and its reset by a successful login, then the
+# write-behind: a flush persists changed IPs to auth_throttle, picks up
+# lockouts written by another worker, and a fresh process warms its store
+# from the table. Checks that failure counts add up across workers instead of
+# the last flush overwriting them, and that keeping the store bounded never
+# drops an unflushed or locked IP. Finally, repeated failed logins over HTTP
+# end in 429.
+#
+#   python tools/test_auth_throttle.py
+
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db
+from app.functions import auth_throttle
+from app.functions.auth_throttle import (
+    MAX_FAILED_IP_ATTEMPTS, IP_LOCKOUT_MINUTES, ATTEMPT_WINDOW_MINUTES,
+    check_ip_lockout, register_ip_failed_attempt, reset_ip_throttle, flush_auth_throttle
+)
+from app.models import AuthThrottle
+
+
+def _get_app():
+    return get_app('throttle')
+
+
+def _fail(ip, times, now):
+    for _ in range(times):
+        register_ip_failed_attempt(ip, now)
+
+
+def _restart_worker():
+    # Forget everything in memory, as a new process would
+    auth_throttle._states.clear()
+    auth_throttle._warmed = False
+
+
+def test_window_lockout_and_reset():
+    app = _get_app()
+    now = datetime.utcnow()
+    with app.app_context(), mock.patch.object(auth_throttle, 'AUTH_THROTTLE_FLUSH_SECONDS', 0):
+        _fail('198.51.100.1', MAX_FAILED_IP_ATTEMPTS - 1, now)
+        assert check_ip_lockout('198.51.100.1', now) is None
+        # The earlier failures have left the window by now, so one more does not lock
+        later = now + timedelta(minutes=ATTEMPT_WINDOW_MINUTES, seconds=1)
+        _fail('198.51.100.1', 1, later)
+        assert check_ip_lockout('198.51.100.1', later) is None
+
+        _fail('198.51.100.2', MAX_FAILED_IP_ATTEMPTS, now)
+        assert check_ip_lockout('198.51.100.2', now) == IP_LOCKOUT_MINUTES
+        assert check_ip_lockout('198.51.100.2', now + timedelta(minutes=IP_LOCKOUT_MINUTES - 1)) == 1
+        assert check_ip_lockout('198.51.100.2', now + timedelta(minutes=IP_LOCKOUT_MINUTES, seconds=1)) is None
+        assert check_ip_lockout('198.51.100.3', now) is None  # other IPs are unaffected
+
+        reset_ip_throttle('198.51.100.2', now)
+        assert check_ip_lockout('198.51.100.2', now) is None
+        _fail('198.51.100.2', MAX_FAILED_IP_ATTEMPTS - 1, now)  # the reset also cleared the count
+        assert check_ip_lockout('198.51.100.2', now) is None
+    print('   ✓ Failures slide out of the window; lockout after the limit, cleared by a reset')
+
+
+def test_write_behind_and_warm_up():
+    app = _get_app()
+    now = datetime.utcnow()
+    with app.app_context(), mock.patch.object(auth_throttle, 'AUTH_THROTTLE_FLUSH_SECONDS', 0):
+        _restart_worker()
+        _fail('203.0.113.1', MAX_FAILED_IP_ATTEMPTS, now)
+        _fail('203.0.113.2', 3, now)
+        assert AuthThrottle.query.filter(AuthThrottle.ip_address.like('203.0.113.%')).count() == 0
+        assert flush_auth_throttle() == 2
+        locked = AuthThrottle.query.filter_by(ip_address='203.0.113.1').one()
+        assert locked.lockout_until > now and locked.failed_attempts == 0
+        assert AuthThrottle.query.filter_by(ip_address='203.0.113.2').one().failed_attempts == 3
+        assert flush_auth_throttle() == 0  # nothing changed since
+
+        # A lockout recorded by another worker reaches this one on the next flush
+        db.session.add(AuthThrottle(ip_address='203.0.113.3', failed_attempts=0,
+                                    lockout_until=now + timedelta(minutes=10), last_attempt_at=now))
+        db.session.commit()
+        assert check_ip_lockout('203.0.113.3', now) is None
+        flush_auth_throttle()
+        assert check_ip_lockout('203.0.113.3', now) == 10
+
+        # A reset is persisted too, so a restarted worker does not bring the lockout back
+        reset_ip_throttle('203.0.113.1', now)
+        flush_auth_throttle()
+        assert AuthThrottle.query.filter_by(ip_address='203.0.113.1').one().lockout_until is None
+
+        _restart_worker()
+        assert check_ip_lockout('203.0.113.3', now) == 10
+        assert check_ip_lockout('203.0.113.1', now) is None
+        _fail('203.0.113.2', MAX_FAILED_IP_ATTEMPTS - 3, now)  # warmed with its 3 earlier failures
+        assert check_ip_lockout('203.0.113.2', now) == IP_LOCKOUT_MINUTES
+    print('   ✓ Flushes persist changes and share lockouts; a restart warms up from the table')
+
+
+def test_failures_add_up_across_workers():
+    app = _get_app()
+    now = datetime.utcnow()
+    half = MAX_FAILED_IP_ATTEMPTS // 2 + 1
+    with app.app_context(), mock.patch.object(auth_throttle, 'AUTH_THROTTLE_FLUSH_SECONDS', 0):
+        _restart_worker()
+        _fail('203.0.113.20', half, now)  # worker A
+        flush_auth_throttle()
+
+        _restart_worker()
+        auth_throttle._warmed = True  # worker B has been up for a while: no warm-up
+        _fail('203.0.113.20', half, now)
+        assert check_ip_lockout('203.0.113.20', now) is None
+        flush_auth_throttle()
+        # B's failures were added to A's, and the total is over the limit
+        assert check_ip_lockout('203.0.113.20', now) == IP_LOCKOUT_MINUTES
+        flush_auth_throttle()
+        row = AuthThrottle.query.filter_by(ip_address='203.0.113.20').one()
+        assert row.lockout_until > now and row.failed_attempts == 0
+    print('   ✓ Failure counts add up across workers and lock the IP')
+
+
+def test_bounding_the_store_keeps_unflushed_and_locked_ips():
+    app = _get_app()
+    now = datetime.utcnow()
+    with app.app_context(), mock.patch.object(auth_throttle, 'AUTH_THROTTLE_FLUSH_SECONDS', 0), \
+            mock.patch.object(auth_throttle, 'AUTH_THROTTLE_MAX_IPS', 10):
+        _restart_worker()
+        auth_throttle._warmed = True
+        _fail('198.51.100.200', MAX_FAILED_IP_ATTEMPTS, now)
+        _fail('198.51.100.201', 3, now)
+        for n in range(20):  # an attacker rotating addresses, before any flush
+            _fail(f'192.0.2.{n}', 1, now)
+        assert check_ip_lockout('198.51.100.200', now) == IP_LOCKOUT_MINUTES
+        assert len(auth_throttle._states) == 22  # nothing unflushed was dropped
+
+        flush_auth_throttle()
+        for n in range(20, 40):
+            _fail(f'192.0.2.{n}', 1, now)
+        # The flushed, unlocked entries made room; the locked and unflushed ones stayed
+        assert all(st.dirty or auth_throttle._is_locked(st, now) for st in auth_throttle._states.values())
+        assert check_ip_lockout('198.51.100.200', now) == IP_LOCKOUT_MINUTES
+        assert all(auth_throttle._states[f'192.0.2.{n}'].dirty for n in range(20, 40))
+    print('   ✓ Bounding the store never drops unflushed failures or lockouts')
+
+
+def test_login_is_locked_out_over_http():
+    app = _get_app()
+    client = app.test_client()
+    statuses = [
+        client.post('/api/v1/auth/login', json={'username': 'nobody', 'password': 'wrong-password'},
+                    environ_base={'REMOTE_ADDR': '192.0.2.200'}).status_code
+        for _ in range(MAX_FAILED_IP_ATTEMPTS + 1)
+    ]
+    assert statuses == [401] * MAX_FAILED_IP_ATTEMPTS + [429], statuses
+    print('   ✓ Repeated failed logins from one IP end in 429')
+
+
+if __name__ == '__main__':
+    print("Testing auth throttling...")
+    test_window_lockout_and_reset()
+    test_write_behind_and_warm_up()
+    test_failures_add_up_across_workers()
+    test_bounding_the_store_keeps_unflushed_and_locked_ips()
+    test_login_is_locked_out_over_http()
+    print("\nAll auth throttle tests passed.")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Test script for the GIF picker cache
+# Uses the offline stub provider, so no GIPHY_API_KEY or network is needed
+
+import sys
+import os
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app.functions.gifs import (
+    GifCache, StubGifProvider, GifProviderError, ENDPOINT_TRENDING, ENDPOINT_SEARCH, set_gif_cache
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _make_cache(provider, clock):
+    return GifCache(provider, trending_ttl=300, search_ttl=120, stale_seconds=3600, max_entries=3, clock=clock)
+
+
+def test_ttl_hit_and_expiry():
+    provider = StubGifProvider()
+    clock = FakeClock()
+    cache = _make_cache(provider, clock)
+
+    first, status = cache.get(ENDPOINT_TRENDING, offset=0, limit=24)
+    assert status == 'miss' and len(first['gifs']) == 24
+    _, status = cache.get(ENDPOINT_TRENDING, offset=0, limit=24)
+    assert status == 'hit' and provider.calls == 1
+
+    # Different page is a different key
+    _, status = cache.get(ENDPOINT_TRENDING, offset=24, limit=24)
+    assert status == 'miss' and provider.calls == 2
+
+    clock.now += 301
+    _, status = cache.get(ENDPOINT_TRENDING, offset=0, limit=24)
+    assert status == 'miss' and provider.calls == 3
+    print("   ✓ TTL hit / expiry")
+
+
+def test_search_key_normalization():
+    provider = StubGifProvider()
+    cache = _make_cache(provider, FakeClock())
+    cache.get(ENDPOINT_SEARCH, q='Cats', offset=0, limit=10)
+    _, status = cache.get(ENDPOINT_SEARCH, q=' cats ', offset=0, limit=10)
+    assert status == 'hit' and provider.calls == 1
+    print("   ✓ Search query normalization")
+
+
+def test_stale_on_upstream_failure():
+    provider = StubGifProvider()
+    clock = FakeClock()
+    cache = _make_cache(provider, clock)
+    cache.get(ENDPOINT_SEARCH, q='dogs', offset=0, limit=10)
+
+    provider.fail = True
+    clock.now += 200  # past the search TTL, inside the stale window
+    result, status = cache.get(ENDPOINT_SEARCH, q='dogs', offset=0, limit=10)
+    assert status == 'stale' and len(result['gifs']) == 10
+
+    clock.now += 3600  # past the stale window: the error surfaces
+    try:
+        cache.get(ENDPOINT_SEARCH, q='dogs', offset=0, limit=10)
+    except GifProviderError:
+        pass
+    else:
+        raise AssertionError('expected upstream error once the stale window has passed')
+    print("   ✓ Stale fallback on upstream failure")
+
+
+def test_single_flight():
+    provider = StubGifProvider(delay=0.2)
+    cache = _make_cache(provider, FakeClock())
+    statuses = []
+    lock = threading.Lock()
+
+    def worker():
+        _, status = cache.get(ENDPOINT_TRENDING, offset=0, limit=24)
+        with lock:
+            statuses.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert provider.calls == 1, provider.calls
+    assert statuses.count('miss') == 1 and len(statuses) == 8
+    print("   ✓ Concurrent identical queries coalesced into one upstream call")
+
+
+def _make_app(tmp_dir):
+    from app import create_app
+    values = {k: getattr(config, k) for k in dir(config) if k.isupper()}
+    values['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp_dir, 'gifs.db').replace('\\', '/')
+    values['SECRET_KEY'] = 'gif-cache-test'
+    values['TESTING'] = True
+    return create_app(config=SimpleNamespace(**values))
+
+
+def test_green_requests_do_not_block_the_hub():
+    # Two concurrent picker requests under eventlet: one upstream call, run off the hub
+    import eventlet
+    from app.extensions import db, socketio
+    from app.models import User
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = _make_app(tmp_dir)
+        if socketio.async_mode != 'eventlet':
+            print("   - Skipped green single-flight test (async_mode is not eventlet)")
+            return
+        with app.app_context():
+            user = User(username='gif-user', password='x')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        provider = StubGifProvider(delay=0.3)
+        set_gif_cache(_make_cache(provider, FakeClock()))
+
+        def request_trending():
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+                session['_fresh'] = True
+            response = client.get('/api/v1/gifs/trending?limit=24')
+            return response.status_code, response.headers.get('X-Cache')
+
+        ticks = []
+        running = [True]
+
+        def ticker():
+            while running[0]:
+                ticks.append(time.monotonic())
+                eventlet.sleep(0.01)
+
+        ticking = eventlet.spawn(ticker)
+        try:
+            requests = [eventlet.spawn(request_trending) for _ in range(2)]
+            results = sorted(g.wait() for g in requests)
+        finally:
+            running[0] = False
+            ticking.wait()
+            set_gif_cache(None)
+        assert results == [(200, 'coalesced'), (200, 'miss')], results
+        assert provider.calls == 1, provider.calls
+        # The 0.3s upstream call ran in a native thread, so the ticker kept going meanwhile
+        assert len(ticks) >= 10, len(ticks)
+    print("   ✓ Green requests share one upstream call while other greenlets keep running")
+
+
+def test_lru_bound():
+    provider = StubGifProvider()
+    cache = _make_cache(provider, FakeClock())
+    for q in ('a', 'b', 'c', 'd'):
+        cache.get(ENDPOINT_SEARCH, q=q, offset=0, limit=5)
+    _, status = cache.get(ENDPOINT_SEARCH, q='a', offset=0, limit=5)
+    assert status == 'miss'  # evicted as least recently used
+    print("   ✓ Entry count bounded")
+
+
+if __name__ == '__main__':
+    print("\n" + "="*60)
+    print("BoxChat GIF Cache Test")
+    print("="*60 + "\n")
+    test_ttl_hit_and_expiry()
+    test_search_key_normalization()
+    test_stale_on_upstream_failure()
+    test_single_flight()
+    test_green_requests_do_not_block_the_hub()
+    test_lru_bound()
+    print("\nAll GIF cache tests passed.")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Image upload validation
+# Checks that uploads are identified by their magic bytes rather than their
+# extension, that oversized dimensions are refused from the header alone, that
+# metadata chunks are stripped while the image data is kept, and that a
+# container too malformed to strip is answered with the same 400 as a header
+# validation failure (and leaves nothing on disk).
+#
+#   python tools/test_image_uploads.py
+
+import io
+import os
+import struct
+import sys
+import zlib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import config
+from testapp import TMP_DIR, get_app
+from app.extensions import db
+from app.functions.images import ImageValidationError, inspect_image_stream, strip_image_metadata
+from app.models import User
+
+
+def _get_app():
+    return get_app('images', UPLOAD_FOLDER=os.path.join(TMP_DIR.name, 'uploads'))
+
+
+def _login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def _chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _png(width=1, height=1, extra=b''):
+    # A valid grayscale PNG; `extra` chunks go between IHDR and IDAT
+    ihdr = _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+    idat = _chunk(b'IDAT', zlib.compress(b'\x00' + b'\x7f' * width))
+    return b'\x89PNG\r\n\x1a\n' + ihdr + extra + idat + _chunk(b'IEND', b'')
+
+
+def _rejects(data, extension):
+    try:
+        inspect_image_stream(io.BytesIO(data), extension)
+    except ImageValidationError as e:
+        return str(e)
+    return None
+
+
+def test_magic_bytes_and_dimensions():
+    assert inspect_image_stream(io.BytesIO(_png(3, 2)), 'png') == {
+        'format': 'png', 'width': 3, 'height': 2, 'pixels': 6
+    }
+    assert _rejects(b'hello, not an image at all', 'png') == 'file content is not a supported image'
+    assert _rejects(_png(), 'jpg') == 'image content does not match file extension'
+    assert _rejects(_png()[:20], 'png') == 'truncated image header'
+    side = int(config.IMAGE_MAX_PIXELS ** 0.5) + 1
+    # A 1-pixel IDAT that claims huge dimensions: refused without decoding anything
+    assert _rejects(_png(side, side), 'png') == 'image dimensions are too large'
+    print('   ✓ Uploads are identified by magic bytes; oversized dimensions are refused')
+
+
+def test_strip_metadata():
+    path = os.path.join(TMP_DIR.name, 'meta.png')
+    text = _chunk(b'tEXt', b'Comment\x00taken at home')
+    exif = _chunk(b'eXIf', b'MM\x00*' + b'\x00' * 8)
+    with open(path, 'wb') as f:
+        f.write(_png(extra=text + exif))
+    assert strip_image_metadata(path, 'png') is True
+    with open(path, 'rb') as f:
+        assert f.read() == _png()
+    print('   ✓ Metadata chunks are stripped and the image data kept')
+
+
+def test_routes_answer_400_and_leave_nothing_on_disk():
+    app = _get_app()
+    with app.app_context():
+        user = User(username='image-user', password='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    _login(client, user_id)
+    files_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'files')
+
+    # IDAT claims 1000 bytes but the file ends after 10: headers pass, stripping fails
+    ihdr = _chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0))
+    malformed = b'\x89PNG\r\n\x1a\n' + ihdr + struct.pack('>I', 1000) + b'IDAT' + b'\x00' * 10
+    for name, data, error in (
+        ('fake.png', b'just some plain text', 'file content is not a supported image'),
+        ('broken.png', malformed, 'image file is malformed'),
+    ):
+        response = client.post('/upload_file', data={'file': (io.BytesIO(data), name)},
+                                content_type='multipart/form-data')
+        assert response.status_code == 400, (name, response.status_code, response.get_data(as_text=True))
+        assert response.get_json() == {'error': error}, response.get_json()
+    assert os.listdir(files_dir) == [], os.listdir(files_dir)
+
+    response = client.post('/upload_file', data={'file': (io.BytesIO(_png()), 'ok.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200 and response.get_json()['type'] == 'image', response.get_json()
+    assert len(os.listdir(files_dir)) == 1
+    print('   ✓ Invalid and malformed images get a 400 and leave nothing on disk')
+
+
+if __name__ == '__main__':
+    print("Testing image upload validation...")
+    test_magic_bytes_and_dimensions()
+    test_strip_metadata()
+    test_routes_answer_400_and_leave_nothing_on_disk()
+    print("\nAll image upload tests passed.")
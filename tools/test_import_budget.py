@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Worker boot import-time budget
+# Boots the app in a fresh interpreter under `python -X importtime`, fails if
+# the cumulative import time of the `app` package or the whole create_app()
+# call exceeds the budget, and checks that optional subsystems (Pillow, GIPHY)
+# are not imported at boot.
+#
+# Budgets can be overridden for slower machines:
+#   IMPORT_BUDGET_MS=1500 BOOT_BUDGET_MS=3000 python tools/test_import_budget.py
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_MS = float(os.environ.get('IMPORT_BUDGET_MS', 1500))
+BOOT_BUDGET_MS = float(os.environ.get('BOOT_BUDGET_MS', 3000))
+# Modules that must stay out of a freshly booted worker
+LAZY_MODULES = ('PIL', 'giphy_client')
+
+BOOT_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+import config
+from types import SimpleNamespace
+from app import create_app
+values = {k: getattr(config, k) for k in dir(config) if k.isupper()}
+values['SQLALCHEMY_DATABASE_URI'] = sys.argv[1]
+create_app(config=SimpleNamespace(**values))
+print(f"BOOT_MS={(time.perf_counter() - started) * 1000:.1f}")
+print('LOADED=' + ','.join(sorted(name for name in sys.modules if '.' not in name)))
+"""
+
+
+def _boot(db_uri):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT, db_uri],
+        cwd=ROOT_DIR, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return result.stdout, result.stderr
+
+
+def _parse_importtime(stderr):
+    # {module: cumulative microseconds}
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, _self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        cumulative[name] = max(cumulative.get(name, 0), int(cumulative_us))
+    return cumulative
+
+
+def test_boot_within_budget():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_uri = 'sqlite:///' + os.path.join(tmp, 'boot.db').replace('\\', '/')
+        _boot(db_uri)  # first boot creates and migrates the DB
+        stdout, stderr = _boot(db_uri)
+
+    values = dict(line.split('=', 1) for line in stdout.splitlines() if '=' in line and line.split('=', 1)[0].isupper())
+    boot_ms = float(values['BOOT_MS'])
+    loaded = set(values['LOADED'].split(','))
+    imports = _parse_importtime(stderr)
+    app_ms = imports.get('app', 0) / 1000
+
+    slowest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:5]
+    print(f"  app import {app_ms:.1f}ms (budget {IMPORT_BUDGET_MS:.0f}ms), "
+          f"boot {boot_ms:.1f}ms (budget {BOOT_BUDGET_MS:.0f}ms)")
+    print('  slowest imports: ' + ', '.join(f"{name} {us / 1000:.0f}ms" for name, us in slowest))
+
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    assert not eager, f"optional modules imported at boot: {eager}"
+    assert app_ms <= IMPORT_BUDGET_MS, f"app import took {app_ms:.1f}ms, budget {IMPORT_BUDGET_MS:.0f}ms"
+    assert boot_ms <= BOOT_BUDGET_MS, f"boot took {boot_ms:.1f}ms, budget {BOOT_BUDGET_MS:.0f}ms"
+
+
+if __name__ == '__main__':
+    print("Testing worker boot import budget...")
+    test_boot_within_budget()
+    print("\nImport budget test passed.")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# Bulk legacy user import
+# Builds a small legacy instance DB and imports it in batches of two, stopping
+# after the first batch and resuming. Checks that usernames already present
+# are skipped, that the IP bans of banned legacy accounts land in ip_ban (so
+# the login check enforces them) while banned_ips of accounts that are not
+# banned are ignored, and that the import is marked complete.
+#
+#   python tools/test_import_legacy_users.py
+
+import os
+import sqlite3
+import sys
+import tempfile
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app import create_app
+from app.extensions import db
+from app.functions.ip_bans import is_ip_banned
+from app.models import User, IpBan, LegacyImportState
+
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+import import_legacy_users
+
+LEGACY_USERS = [
+    # username, is_banned, banned_ips
+    ('alice', 0, ''),
+    ('spammer', 1, '192.0.2.7, 198.51.100.0/24,not-an-ip'),
+    ('Existing', 1, '203.0.113.9'),     # already in the target: skipped, its bans too
+    ('unbanned', 0, '192.0.2.99'),      # banned_ips left over from an old, lifted ban
+    ('v6troll', 1, '2001:db8::1'),
+]
+
+
+def _make_legacy_db(path):
+    con = sqlite3.connect(path)
+    con.execute('CREATE TABLE user (id INTEGER PRIMARY KEY, username TEXT, password TEXT, '
+                'is_banned INTEGER, banned_ips TEXT, ban_reason TEXT)')
+    con.executemany('INSERT INTO user (username, password, is_banned, banned_ips, ban_reason) VALUES (?, ?, ?, ?, ?)',
+                    [(name, 'legacy-hash', banned, ips, 'spam' if banned else None)
+                     for name, banned, ips in LEGACY_USERS])
+    con.commit()
+    con.close()
+
+
+def test_import_with_ip_bans():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, 'legacy.db')
+        _make_legacy_db(source)
+        app = create_app(config=import_legacy_users._build_config(os.path.join(tmp_dir, 'target.db')))
+        with app.app_context():
+            db.session.add(User(username='existing', password='x'))
+            db.session.commit()
+            target = os.path.abspath(db.engine.url.database)
+
+        # Interrupt the run after its first batch, then resume it
+        with mock.patch.object(import_legacy_users.sqlite3, 'connect', _interrupting_connect()):
+            try:
+                import_legacy_users.run_import(source, target, batch_size=2, restart=False)
+            except KeyboardInterrupt:
+                pass
+        with app.app_context():
+            state = db.session.get(LegacyImportState, 1)
+            assert state.last_rowid == 2 and state.completed_at is None
+            assert IpBan.query.count() == 2
+
+        import_legacy_users.run_import(source, target, batch_size=2, restart=False)
+        with app.app_context():
+            db.session.expire_all()
+            state = db.session.get(LegacyImportState, 1)
+            assert state.completed_at is not None
+            assert (state.rows_imported, state.rows_skipped) == (4, 1), (state.rows_imported, state.rows_skipped)
+            bans = sorted((network, db.session.get(User, user_id).username)
+                          for network, user_id in db.session.query(IpBan.network, IpBan.user_id))
+            assert bans == [('192.0.2.7/32', 'spammer'), ('198.51.100.0/24', 'spammer'),
+                            ('2001:db8::1/128', 'v6troll')], bans
+            assert is_ip_banned('198.51.100.42') and is_ip_banned('2001:db8::1')
+            assert not is_ip_banned('203.0.113.9') and not is_ip_banned('192.0.2.99')
+        client = app.test_client()
+        response = client.post('/api/v1/auth/login', json={'username': 'alice', 'password': 'whatever-1'},
+                               environ_base={'REMOTE_ADDR': '192.0.2.7'})
+        assert response.status_code == 403, response.status_code
+    print('   ✓ Imported IP bans land in ip_ban and are enforced; the run resumes after an interruption')
+
+
+def _interrupting_connect():
+    # sqlite3.connect that hands out a source connection failing on its second batch read
+    real_connect = sqlite3.connect
+
+    class _Source:
+        def __init__(self, con):
+            self._con = con
+            self._batches = 0
+
+        def execute(self, sql, params=()):
+            if sql.startswith('SELECT rowid'):
+                self._batches += 1
+                if self._batches > 1:
+                    raise KeyboardInterrupt
+            return self._con.execute(sql, params)
+
+        def close(self):
+            self._con.close()
+
+    def connect(database, *args, **kwargs):
+        con = real_connect(database, *args, **kwargs)
+        return _Source(con) if str(database).startswith('file:') else con
+
+    return connect
+
+
+if __name__ == '__main__':
+    print("Testing the legacy user import...")
+    test_import_with_ip_bans()
+    print("\nAll legacy import tests passed.")
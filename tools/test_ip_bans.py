@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# IP bans: prefix trie, ip_ban table and cache invalidation
+# Checks the trie on single addresses, CIDR ranges, IPv6 and IPv4-mapped IPv6
+# addresses, then that a ban or unban committed through add_ip_ban /
+# remove_user_ip_bans takes effect on the next login once invalidate_ip_bans()
+# runs, and that without invalidation the cached trie is only trusted for
+# IP_BAN_CACHE_TTL_SECONDS.
+#
+#   python tools/test_ip_bans.py
+
+import os
+import sys
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db
+from app.functions import ip_bans
+from app.functions.ip_bans import (
+    IpPrefixTrie, normalize_network, add_ip_ban, remove_user_ip_bans, invalidate_ip_bans, is_ip_banned
+)
+from app.models import User, IpBan
+
+
+def _get_app():
+    return get_app('ip_bans')
+
+
+def _login_status(client, ip):
+    response = client.post('/api/v1/auth/login', json={'username': 'nobody', 'password': 'wrong-password'},
+                           environ_base={'REMOTE_ADDR': ip})
+    return response.status_code
+
+
+def test_trie_lookups():
+    assert normalize_network('1.2.3.4') == '1.2.3.4/32'
+    assert normalize_network(' 10.9.8.7/8 ') == '10.0.0.0/8'
+    assert normalize_network('2001:db8::1') == '2001:db8::1/128'
+    assert normalize_network('not-an-ip') is None
+
+    trie = IpPrefixTrie()
+    for network in ('1.2.3.4/32', '10.0.0.0/8', '10.1.0.0/16', '2001:db8::/32'):
+        trie.add(network)
+    assert trie.size == 3  # 10.1.0.0/16 is already covered by 10.0.0.0/8
+    assert trie.contains('1.2.3.4') and not trie.contains('1.2.3.5')
+    assert trie.contains('10.200.1.1') and not trie.contains('11.0.0.1')
+    assert trie.contains('2001:db8:ffff::1') and not trie.contains('2001:db9::1')
+    assert trie.contains('::ffff:1.2.3.4')  # IPv4-mapped IPv6 matches the IPv4 ban
+    assert not trie.contains('garbage') and not trie.contains('')
+    print('   ✓ Prefix trie matches addresses, ranges, IPv6 and IPv4-mapped addresses')
+
+
+def test_ban_and_unban_take_effect_after_invalidation():
+    app = _get_app()
+    client = app.test_client()
+    with app.app_context():
+        user = User(username='ip-ban-user', password='x')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        assert not is_ip_banned('192.0.2.10')  # loads an empty trie into the cache
+        assert add_ip_ban(user, '192.0.2.99/24') == '192.0.2.0/24'
+        assert add_ip_ban(user, '198.51.100.7') == '198.51.100.7/32'
+        assert add_ip_ban(user, 'bogus') is None
+        db.session.commit()
+        assert user.banned_ips == '192.0.2.0/24,198.51.100.7'
+        assert IpBan.query.filter_by(user_id=user_id).count() == 2
+        assert not is_ip_banned('192.0.2.10')  # still the cached trie
+        invalidate_ip_bans()
+        assert is_ip_banned('192.0.2.10') and is_ip_banned('198.51.100.7')
+    assert _login_status(client, '192.0.2.10') == 403
+    assert _login_status(client, '203.0.113.1') == 401
+
+    with app.app_context():
+        remove_user_ip_bans(db.session.get(User, user_id))
+        db.session.commit()
+        invalidate_ip_bans()
+        assert not is_ip_banned('192.0.2.10')
+    assert _login_status(client, '192.0.2.10') == 401
+    print('   ✓ Bans and unbans apply to the next login once the trie is invalidated')
+
+
+def test_cached_trie_expires():
+    app = _get_app()
+    with app.app_context():
+        invalidate_ip_bans()
+        assert not is_ip_banned('203.0.113.50')
+        # A ban written by another worker: this worker has not invalidated its trie
+        db.session.add(IpBan(network='203.0.113.0/24', user_id=None))
+        db.session.commit()
+        assert not is_ip_banned('203.0.113.50')
+        with mock.patch.object(ip_bans, 'IP_BAN_CACHE_TTL_SECONDS', 0):
+            assert is_ip_banned('203.0.113.50')
+    print('   ✓ Without invalidation the cached trie is reloaded after its TTL')
+
+
+if __name__ == '__main__':
+    print("Testing IP bans...")
+    test_trie_lookups()
+    test_ban_and_unban_take_effect_after_invalidation()
+    test_cached_trie_expires()
+    print("\nAll IP ban tests passed.")
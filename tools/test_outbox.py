@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Socket.IO transactional outbox
+# Checks that enqueue_emit rows exist only once their transaction commits
+# (rolled-back enqueues leave no rows and do not count towards
+# outbox_backlog()), that a batch goes out in id order and is deleted, that a
+# fresh claim held by another dispatcher blocks this one until it goes stale,
+# that without a message queue a process only claims the rows it wrote (unless
+# their writer is gone), that an idle poll does not write, and that rows
+# emitted by a dispatcher that died before deleting them are delivered again
+# (at-least-once). Finally, that the background dispatcher starts with the
+# first request and drains rows left by a dead process.
+#
+#   python tools/test_outbox.py
+
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import config
+from testapp import get_app
+from app.extensions import db, socketio
+from app.functions import outbox, assert_max_queries
+from app.functions.outbox import enqueue_emit, dispatch_outbox_batch, outbox_backlog, get_outbox_stats
+from app.models import SocketOutbox
+
+FOREIGN_DISPATCHER = 'other-host:4242:deadbeef'
+
+
+def _get_app():
+    return get_app('outbox')
+
+
+def _listener(app):
+    client = socketio.test_client(app)
+    socketio.server.enter_room(socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/'), 'outbox-room')
+    client.get_received()
+    return client
+
+
+def _received(client):
+    return [e['args'][0]['n'] for e in client.get_received() if e['name'] == 'outbox_test']
+
+
+def _enqueue(*numbers):
+    for n in numbers:
+        enqueue_emit('outbox_test', {'n': n}, room='outbox-room')
+
+
+def test_only_committed_enqueues_are_kept():
+    app = _get_app()
+    # The tests below drive dispatch_outbox_batch() themselves
+    with mock.patch.object(outbox, '_started', True), app.app_context():
+        client = _listener(app)
+        backlog = outbox_backlog()
+        _enqueue(1, 2)
+        db.session.commit()
+        _enqueue(3)
+        db.session.rollback()
+        _enqueue(4)
+        db.session.flush()  # written, then rolled back
+        db.session.rollback()
+        assert [r.payload_json for r in SocketOutbox.query.order_by(SocketOutbox.id)] == ['{"n":1}', '{"n":2}']
+        assert outbox_backlog() == backlog + 2
+        assert get_outbox_stats()['pending'] == 2
+
+        assert dispatch_outbox_batch() == 2
+        assert _received(client) == [1, 2]
+        assert outbox_backlog() == backlog and get_outbox_stats()['pending'] == 0
+        assert dispatch_outbox_batch() == 0
+        client.disconnect()
+    print('   ✓ Only committed enqueues are stored and counted; a batch goes out in order')
+
+
+def test_fresh_foreign_claim_blocks_until_stale():
+    app = _get_app()
+    with mock.patch.object(outbox, '_started', True), app.app_context():
+        client = _listener(app)
+        _enqueue(10, 11, 12)
+        db.session.commit()
+        now = datetime.utcnow()
+        first_id = db.session.query(db.func.min(SocketOutbox.id)).scalar()
+        SocketOutbox.query.filter(SocketOutbox.id == first_id).update(
+            {SocketOutbox.claimed_by: FOREIGN_DISPATCHER, SocketOutbox.claimed_at: now})
+        db.session.commit()
+        assert dispatch_outbox_batch() == 0  # another process is delivering: wait for it
+        assert _received(client) == []
+
+        stale = now - timedelta(seconds=config.SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS + 1)
+        SocketOutbox.query.update({SocketOutbox.claimed_at: stale})
+        db.session.commit()
+        assert dispatch_outbox_batch() == 3
+        assert _received(client) == [10, 11, 12]
+        assert SocketOutbox.query.count() == 0
+        client.disconnect()
+    print('   ✓ A fresh foreign claim blocks dispatch; a stale one is taken over, in order')
+
+
+def test_rows_stay_with_their_writer_without_a_message_queue():
+    app = _get_app()
+    with mock.patch.object(outbox, '_started', True), app.app_context():
+        client = _listener(app)
+        with assert_max_queries(1) as statements:
+            assert dispatch_outbox_batch() == 0
+        assert not any(s.lstrip().upper().startswith('UPDATE') for s in statements), statements
+
+        # Written by another live worker: only its own clients can get the event
+        db.session.add(SocketOutbox(event='outbox_test', room='outbox-room', payload_json='{"n":40}',
+                                    origin=FOREIGN_DISPATCHER, created_at=datetime.utcnow()))
+        db.session.commit()
+        assert dispatch_outbox_batch() == 0
+        assert SocketOutbox.query.one().claimed_by is None
+
+        # With a message queue this process reaches that worker's clients too
+        with mock.patch.object(outbox, '_has_message_queue', lambda: True):
+            assert dispatch_outbox_batch() == 1
+        assert _received(client) == [40]
+        client.disconnect()
+    print('   ✓ Without a message queue only the writer claims its rows; idle polls do not write')
+
+
+def test_crash_between_emit_and_delete_redelivers():
+    app = _get_app()
+    with mock.patch.object(outbox, '_started', True), app.app_context():
+        client = _listener(app)
+        _enqueue(20, 21)
+        db.session.commit()
+        real_emit = socketio.emit
+        emitted = []
+
+        def emit_then_die(event_name, payload, room=None):
+            real_emit(event_name, payload, room=room)
+            emitted.append(event_name)
+            if len(emitted) == 2:
+                raise KeyboardInterrupt  # the process dies before deleting the rows
+
+        with mock.patch.object(socketio, 'emit', emit_then_die):
+            try:
+                dispatch_outbox_batch()
+            except KeyboardInterrupt:
+                pass
+        db.session.rollback()
+        assert _received(client) == [20, 21]
+        assert SocketOutbox.query.count() == 2
+
+        # A new process: the dead dispatcher's rows are left alone until they go stale
+        with mock.patch.object(outbox, 'DISPATCHER_ID', 'restarted-host:1:00000000'):
+            assert dispatch_outbox_batch() == 0
+            stale = datetime.utcnow() - timedelta(seconds=config.SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS + 1)
+            SocketOutbox.query.update({SocketOutbox.claimed_at: stale, SocketOutbox.created_at: stale})
+            db.session.commit()
+            assert dispatch_outbox_batch() == 2
+        assert _received(client) == [20, 21]  # delivered again: at-least-once
+        assert SocketOutbox.query.count() == 0
+        client.disconnect()
+    print('   ✓ Rows emitted by a dispatcher that died before deleting them are delivered again')
+
+
+def test_dispatcher_starts_with_the_first_request():
+    app = _get_app()
+    if getattr(socketio, 'async_mode', None) != 'eventlet' or socketio.server is None:
+        print('   - Skipped background dispatcher test (async_mode is not eventlet)')
+        return
+    import eventlet
+
+    assert not outbox._started
+    with app.app_context():
+        # Left behind by a process that died: this one never enqueues anything itself
+        stale = datetime.utcnow() - timedelta(seconds=config.SOCKET_OUTBOX_CLAIM_TIMEOUT_SECONDS + 1)
+        db.session.add(SocketOutbox(event='outbox_test', room='outbox-room', payload_json='{"n":30}',
+                                    origin=FOREIGN_DISPATCHER, created_at=stale))
+        db.session.commit()
+        assert outbox_backlog() == 0
+    app.test_client().get('/api/v1/auth/session')
+    assert outbox._started
+    client = _listener(app)
+    eventlet.sleep(0.2)
+    assert _received(client) == [30]
+    with app.app_context():
+        assert SocketOutbox.query.count() == 0
+    client.disconnect()
+    print('   ✓ The dispatcher starts with the first request and drains rows left by a dead process')
+
+
+if __name__ == '__main__':
+    print("Testing the Socket.IO outbox...")
+    test_only_committed_enqueues_are_kept()
+    test_fresh_foreign_claim_blocks_until_stale()
+    test_rows_stay_with_their_writer_without_a_message_queue()
+    test_crash_between_emit_and_delete_redelivers()
+    test_dispatcher_starts_with_the_first_request()
+    print("\nAll outbox tests passed.")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Password hashing worker pool
+# Checks that hashes made with older parameters are recognised by
+# needs_rehash() and upgraded on the next successful login, that under
+# eventlet a hash runs in a native thread while other greenlets keep running,
+# and that once PASSWORD_HASH_MAX_QUEUE requests are waiting new ones are
+# refused with PasswordHasherBusy, which login answers with 503 + Retry-After.
+# Also checks that every refused login checks one password hash, so a locked,
+# banned or unknown account cannot be told apart by timing.
+#
+#   python tools/test_password_hasher.py
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+from werkzeug.security import generate_password_hash
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db, socketio
+from app.functions import passwords
+from app.functions.passwords import (
+    PasswordHasherBusy, hash_password, verify_password, needs_rehash, get_hasher_stats
+)
+from app.models import User
+
+PASSWORD = 'Correct-Horse-9'
+
+
+def _get_app():
+    return get_app('passwords')
+
+
+def _login(client, username, password=PASSWORD):
+    return client.post('/api/v1/auth/login', json={'username': username, 'password': password},
+                       environ_base={'REMOTE_ADDR': '192.0.2.44'})
+
+
+def test_outdated_hash_is_upgraded_on_login():
+    app = _get_app()
+    legacy_hash = generate_password_hash(PASSWORD, 'pbkdf2:sha256:1000')
+    assert needs_rehash(legacy_hash)
+    current_hash = hash_password(PASSWORD)
+    assert not needs_rehash(current_hash) and verify_password(current_hash, PASSWORD)
+    assert not verify_password(current_hash, 'wrong') and not verify_password('', PASSWORD)
+
+    with app.app_context():
+        user = User(username='rehash-user', password=legacy_hash)
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    rehashed = get_hasher_stats()['rehashed']
+    assert _login(app.test_client(), 'rehash-user', 'wrong-password').status_code == 401
+    with app.app_context():
+        assert db.session.get(User, user_id).password == legacy_hash  # a failed login changes nothing
+    assert _login(app.test_client(), 'rehash-user').status_code == 200
+    with app.app_context():
+        upgraded = db.session.get(User, user_id).password
+    assert upgraded != legacy_hash and not needs_rehash(upgraded) and verify_password(upgraded, PASSWORD)
+    assert get_hasher_stats()['rehashed'] == rehashed + 1
+    assert _login(app.test_client(), 'rehash-user').status_code == 200  # and is not re-hashed again
+    assert get_hasher_stats()['rehashed'] == rehashed + 1
+    print('   ✓ Outdated hashes are upgraded on the next successful login')
+
+
+def test_queue_bound_and_hub_stays_free():
+    import eventlet
+    from eventlet.semaphore import Semaphore
+
+    _get_app()
+    if socketio.async_mode != 'eventlet':
+        print('   - Skipped worker pool test (async_mode is not eventlet)')
+        return
+    ticks = []
+    running = [True]
+
+    def ticker():
+        while running[0]:
+            ticks.append(time.monotonic())
+            eventlet.sleep(0.01)
+
+    def slow_hash():
+        try:
+            return passwords._run(time.sleep, 0.3)
+        except PasswordHasherBusy:
+            return 'busy'
+
+    # One worker and room for one waiting request
+    with mock.patch.object(passwords, '_green_slots', Semaphore(1)), \
+            mock.patch.object(passwords, 'PASSWORD_HASH_MAX_QUEUE', 1):
+        ticking = eventlet.spawn(ticker)
+        running_hash = eventlet.spawn(slow_hash)
+        eventlet.sleep(0.05)
+        waiting_hash = eventlet.spawn(slow_hash)
+        eventlet.sleep(0.05)
+        assert get_hasher_stats()['queued'] == 1
+        assert slow_hash() == 'busy'
+        assert running_hash.wait() is None and waiting_hash.wait() is None
+        running[0] = False
+        ticking.wait()
+    # Two 0.3s hashes ran back to back in a native thread while the ticker kept going
+    assert len(ticks) >= 30, len(ticks)
+    assert get_hasher_stats()['queued'] == 0
+    print('   ✓ Hashes run off the hub, one waiting request is queued and the next is refused')
+
+
+def test_login_answers_503_when_the_queue_is_full():
+    app = _get_app()
+    rejected = get_hasher_stats()['rejected']
+    with mock.patch.object(passwords, 'PASSWORD_HASH_MAX_QUEUE', 0):
+        response = _login(app.test_client(), 'rehash-user')
+    assert response.status_code == 503, response.status_code
+    assert response.headers['Retry-After'] == str(passwords.RETRY_AFTER_SECONDS)
+    assert response.get_json() == {'success': False, 'error': 'server is busy, try again shortly'}
+    assert get_hasher_stats()['rejected'] == rejected + 1
+    print('   ✓ A full hashing queue turns login into 503 with Retry-After')
+
+
+def test_refused_logins_check_one_hash():
+    app = _get_app()
+    with app.app_context():
+        db.session.add(User(username='locked-user', password=hash_password(PASSWORD),
+                            lockout_until=datetime.utcnow() + timedelta(minutes=5)))
+        db.session.add(User(username='banned-user', password=hash_password(PASSWORD), is_banned=True))
+        db.session.commit()
+    passwords.verify_dummy_password('warm-up')  # the dummy hash is made once per process
+    for username, status in (('locked-user', 429), ('banned-user', 403), ('nobody-here', 401)):
+        with mock.patch.object(passwords, 'check_password_hash', wraps=passwords.check_password_hash) as check:
+            assert _login(app.test_client(), username).status_code == status
+        assert check.call_count == 1, (username, check.call_count)
+    print('   ✓ Locked, banned and unknown accounts each cost one hash check')
+
+
+if __name__ == '__main__':
+    print("Testing password hashing...")
+    test_outdated_hash_is_upgraded_on_login()
+    test_queue_bound_and_hub_stays_free()
+    test_login_answers_503_when_the_queue_is_full()
+    test_refused_logins_check_one_hash()
+    print("\nAll password hashing tests passed.")
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Chunked purge jobs
+# Purges one user's messages from a room and deletes a whole room through the
+# background job runner with a small JOB_CHUNK_SIZE, killing each job after a
+# couple of chunks (as a restart would) and resuming it with
+# resume_unfinished_jobs(). Checks that read markers move back to the newest
+# surviving message, replies lose their reply_to_id, reaction counters still
+# match the reactions left, the room is tombstoned at once and gone with all
+# its rows at the end, and that nothing outside the purge is touched. Also
+# checks that a job claimed by another live worker is neither resumed nor run
+# here until its claim goes stale, that a worker resumes jobs with its
+# first request, and that a room ban with delete_messages queues the purge only
+# after the ban is committed.
+#
+#   python tools/test_purge_jobs.py
+
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import func
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db
+from app.functions import jobs
+from app.functions.purges import start_user_message_purge, start_room_deletion
+from app.functions.reactions import toggle_message_reaction
+from app.models import (
+    User, Room, Channel, Member, Role, MemberRole, Message, MessageReaction, MessageReactionCount,
+    ReadMessage, BackgroundJob, RoomBan
+)
+
+
+def _get_app():
+    return get_app('purges')
+
+
+def _run_interrupted(app, started, chunks):
+    # Run the started jobs, killing the worker after `chunks` committed chunks
+    calls = [0]
+
+    def dying_sleep(seconds=0):
+        calls[0] += 1
+        if calls[0] >= chunks:
+            raise KeyboardInterrupt
+
+    with mock.patch.object(jobs.socketio, 'sleep', dying_sleep):
+        for job_id in started:
+            try:
+                jobs._run_job(app, job_id)
+            except KeyboardInterrupt:
+                pass
+    del started[:]
+
+
+def _resume(app, started):
+    # What a worker does with its first request, then run what it restarted to completion
+    with app.app_context():
+        resumed = jobs.resume_unfinished_jobs()
+    for job_id in list(started):
+        jobs._run_job(app, job_id)
+    del started[:]
+    return resumed
+
+
+def _counters_match_reactions():
+    counters = {(m, e): c for m, e, c in db.session.query(
+        MessageReactionCount.message_id, MessageReactionCount.emoji, MessageReactionCount.count) if c}
+    reactions = {(m, e): c for m, e, c in db.session.query(
+        MessageReaction.message_id, MessageReaction.emoji, func.count(MessageReaction.id)
+    ).group_by(MessageReaction.message_id, MessageReaction.emoji)}
+    return counters == reactions
+
+
+def _seed_room(name, users, messages_per_user):
+    room = Room(name=name, type='server')
+    db.session.add(room)
+    db.session.flush()
+    channel = Channel(name='general', room_id=room.id)
+    db.session.add(channel)
+    role = Role(room_id=room.id, name='Mods', mention_tag='mods')
+    db.session.add(role)
+    db.session.flush()
+    for user in users:
+        db.session.add(Member(user_id=user.id, room_id=room.id))
+        db.session.add(MemberRole(user_id=user.id, room_id=room.id, role_id=role.id))
+    ids = []
+    for i in range(messages_per_user):
+        for user in users:
+            message = Message(content=f'{user.username} {i}', user_id=user.id, channel_id=channel.id,
+                              reply_to_id=ids[-1] if ids else None)
+            db.session.add(message)
+            db.session.flush()
+            ids.append(message.id)
+    for message_id in ids:
+        for user in users:
+            toggle_message_reaction(message_id, user.id, '👍')
+    db.session.commit()
+    return room.id, channel.id, ids
+
+
+def test_user_message_purge_resumes():
+    app = _get_app()
+    started = []
+    with mock.patch.object(jobs, '_start', started.append), \
+            mock.patch.object(jobs, 'JOB_CHUNK_SIZE', 2), \
+            mock.patch.object(jobs, 'JOB_CHUNK_PAUSE_SECONDS', 0):
+        with app.app_context():
+            spammer = User(username='purge-spammer', password='x')
+            reader = User(username='purge-reader', password='x')
+            db.session.add_all([spammer, reader])
+            db.session.commit()
+            room_id, channel_id, ids = _seed_room('Purge room', [reader, spammer], 5)
+            other_room_id, _, other_ids = _seed_room('Other room', [reader, spammer], 2)
+            spammer_id, reader_id = spammer.id, reader.id
+            # ids alternate reader, spammer; the reader has read up to the spammer's last message
+            db.session.add(ReadMessage(user_id=reader_id, channel_id=channel_id, last_read_message_id=ids[-1]))
+            db.session.commit()
+
+            job = start_user_message_purge(spammer_id, room_id, created_by_id=reader_id)
+            job_id = job.id
+            assert job.total == 5 and started == [job_id]
+
+        _run_interrupted(app, started, chunks=1)
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'running' and job.progress == 2, (job.status, job.progress)
+            assert _counters_match_reactions()
+
+        assert _resume(app, started) == 1
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'done' and job.progress == 5, (job.status, job.progress)
+            left = Message.query.filter_by(channel_id=channel_id).order_by(Message.id).all()
+            assert [m.user_id for m in left] == [reader_id] * 5
+            assert all(m.reply_to_id is None for m in left)  # each replied to a purged message
+            marker = ReadMessage.query.filter_by(user_id=reader_id, channel_id=channel_id).one()
+            assert marker.last_read_message_id == ids[-2]  # the reader's own last message
+            assert MessageReaction.query.filter(MessageReaction.message_id.in_(ids[1::2])).count() == 0
+            assert _counters_match_reactions()
+            assert Message.query.filter(Message.id.in_(other_ids)).count() == len(other_ids)
+            assert db.session.get(Room, other_room_id).deleted_at is None
+    print('   ✓ An interrupted message purge resumes; markers, replies and counters stay consistent')
+
+
+def test_room_deletion_resumes():
+    app = _get_app()
+    started = []
+    with mock.patch.object(jobs, '_start', started.append), \
+            mock.patch.object(jobs, 'JOB_CHUNK_SIZE', 3), \
+            mock.patch.object(jobs, 'JOB_CHUNK_PAUSE_SECONDS', 0):
+        with app.app_context():
+            users = [User(username=f'room-user-{i}', password='x') for i in range(3)]
+            db.session.add_all(users)
+            db.session.commit()
+            room_id, channel_id, ids = _seed_room('Doomed room', users, 4)
+            kept_room_id, kept_channel_id, kept_ids = _seed_room('Kept room', users, 2)
+            for user in users:
+                db.session.add(ReadMessage(user_id=user.id, channel_id=channel_id, last_read_message_id=ids[-1]))
+                db.session.add(ReadMessage(user_id=user.id, channel_id=kept_channel_id,
+                                           last_read_message_id=kept_ids[-1]))
+            db.session.commit()
+
+            job = start_room_deletion(db.session.get(Room, room_id), created_by_id=users[0].id)
+            job_id = job.id
+            room = db.session.get(Room, room_id)
+            assert room.deleted_at is not None and room.invite_token is None and not room.is_public
+
+        _run_interrupted(app, started, chunks=4)  # members, then part of the messages
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'running' and job.phase == 1, (job.status, job.phase)
+            assert Member.query.filter_by(room_id=room_id).count() == 0
+            left = Message.query.filter_by(channel_id=channel_id).count()
+            assert 0 < left < len(ids), left
+            assert _counters_match_reactions()
+            # Markers of a half-purged channel still point at a message that exists
+            for marker in ReadMessage.query.filter_by(channel_id=channel_id):
+                assert db.session.get(Message, marker.last_read_message_id) is not None
+
+        assert _resume(app, started) == 1
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'done', (job.status, job.error)
+            assert db.session.get(Room, room_id) is None
+            assert Channel.query.filter_by(room_id=room_id).count() == 0
+            assert Message.query.filter(Message.id.in_(ids)).count() == 0
+            assert ReadMessage.query.filter_by(channel_id=channel_id).count() == 0
+            assert MessageReactionCount.query.filter(MessageReactionCount.message_id.in_(ids)).count() == 0
+            assert Role.query.filter_by(room_id=room_id).count() == 0
+            assert MemberRole.query.filter_by(room_id=room_id).count() == 0
+            assert _counters_match_reactions()
+
+            assert Message.query.filter_by(channel_id=kept_channel_id).count() == len(kept_ids)
+            assert Member.query.filter_by(room_id=kept_room_id).count() == 3
+            assert MemberRole.query.filter_by(room_id=kept_room_id).count() == 3
+            markers = ReadMessage.query.filter_by(channel_id=kept_channel_id).all()
+            assert [m.last_read_message_id for m in markers] == [kept_ids[-1]] * 3
+    print('   ✓ An interrupted room deletion resumes and removes only that room')
+
+
+def test_claims_keep_one_worker_per_job():
+    app = _get_app()
+    started = []
+    with mock.patch.object(jobs, '_start', started.append), \
+            mock.patch.object(jobs, 'JOB_CHUNK_PAUSE_SECONDS', 0):
+        with app.app_context():
+            user = User(username='claimed-user', password='x')
+            db.session.add(user)
+            db.session.commit()
+            room_id, channel_id, ids = _seed_room('Claimed room', [user], 3)
+            job_id = start_user_message_purge(user.id, room_id).id
+            # Another worker picked the job up and is still making progress
+            job = db.session.get(BackgroundJob, job_id)
+            job.status, job.claimed_by, job.claimed_at = 'running', 'other-host:1:feedface', datetime.utcnow()
+            db.session.commit()
+            del started[:]
+
+        assert _resume(app, started) == 0
+        jobs._run_job(app, job_id)  # a stray start does not run it either
+        with app.app_context():
+            assert db.session.get(BackgroundJob, job_id).progress == 0
+            assert Message.query.filter_by(channel_id=channel_id).count() == 3
+
+            # That worker died: its claim stops moving and goes stale
+            job = db.session.get(BackgroundJob, job_id)
+            job.claimed_at = datetime.utcnow() - timedelta(seconds=jobs.JOB_CLAIM_TIMEOUT_SECONDS + 1)
+            db.session.commit()
+
+        # The first request of a worker resumes what no live worker holds
+        with mock.patch.object(jobs, '_resumed', False):
+            app.test_client().get('/api/v1/auth/session')
+        assert started == [job_id], started
+        for started_id in started:
+            jobs._run_job(app, started_id)
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            assert job.status == 'done' and job.claimed_by == jobs.WORKER_ID
+            assert Message.query.filter_by(channel_id=channel_id).count() == 0
+    print('   ✓ A live claim keeps other workers off a job; a stale one is resumed by the first request')
+
+
+def test_room_ban_commits_before_the_purge_starts():
+    app = _get_app()
+    seen_at_start = []
+
+    def record_start(job_id):
+        # What another connection sees when the job starts
+        with app.app_context():
+            seen_at_start.append((RoomBan.query.filter_by(user_id=target_id, room_id=room_id).count(),
+                                  Member.query.filter_by(user_id=target_id, room_id=room_id).count()))
+
+    with app.app_context():
+        admin = User(username='ban-admin', password='x', is_superuser=True)
+        target = User(username='ban-target', password='x')
+        db.session.add_all([admin, target])
+        db.session.commit()
+        admin_id, target_id = admin.id, target.id
+        room_id, channel_id, _ = _seed_room('Ban room', [target], 2)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin_id)
+        session['_fresh'] = True
+    with mock.patch.object(jobs, '_start', record_start):
+        response = client.post(f'/admin/user/{target_id}/ban',
+                               json={'room_id': room_id, 'delete_messages': True})
+    assert response.status_code == 200 and response.get_json()['job_id'], response.get_json()
+    assert seen_at_start == [(1, 0)], seen_at_start
+    print('   ✓ A room ban is committed before its message purge starts')
+
+
+if __name__ == '__main__':
+    print("Testing purge jobs...")
+    test_user_message_purge_resumes()
+    test_room_deletion_resumes()
+    test_claims_keep_one_worker_per_job()
+    test_room_ban_commits_before_the_purge_starts()
+    print("\nAll purge job tests passed.")
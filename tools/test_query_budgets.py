@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# Query budgets for the main API endpoints
+# Seeds a small dataset, then a larger one next to it, and for each calls the
+# main listing endpoints and the send_message socket event as a viewer who is
+# a member of every room of that dataset. Checks that:
+#   - no view goes over its @query_budget (the app runs with TESTING=True, so
+#     an exceeded budget raises QueryBudgetExceeded inside the request);
+#   - the number of SQL statements does not grow with the number of rooms,
+#     members, messages or reactions (no N+1 left behind).
+#
+#   python tools/test_query_budgets.py
+
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db, socketio
+from app.functions import assert_max_queries, query_budget, QueryBudgetExceeded
+from app.models import (
+    User, Room, Channel, Member, Message, MessageReaction, ReadMessage, Role, MemberRole,
+    RoleMentionPermission, FriendRequest
+)
+
+SMALL = {'prefix': 'small', 'rooms': 2, 'members': 3, 'messages': 5}
+LARGE = {'prefix': 'large', 'rooms': 12, 'members': 25, 'messages': 60}
+
+
+def _get_app():
+    return get_app('budget')
+
+
+def _seed(app, prefix, rooms, members, messages):
+    # One viewer who is a member of every room; returns ids used by the requests
+    with app.app_context():
+        viewer = User(username=f'{prefix}-viewer', password='x')
+        db.session.add(viewer)
+        users = [User(username=f'{prefix}-user{i}', password='x', avatar_url=f'/uploads/a{i}.png')
+                 for i in range(members)]
+        db.session.add_all(users)
+        db.session.flush()
+
+        room_ids, channel_ids = [], []
+        for r in range(rooms):
+            room = Room(name=f'{prefix}-room{r}', type='server', owner_id=users[0].id, is_public=True)
+            db.session.add(room)
+            db.session.flush()
+            channels = [Channel(name=f'c{n}', room_id=room.id) for n in range(2)]
+            db.session.add_all(channels)
+            db.session.add(Member(user_id=viewer.id, room_id=room.id, role='member'))
+            db.session.add_all(Member(user_id=u.id, room_id=room.id, role='owner' if i == 0 else 'member')
+                               for i, u in enumerate(users))
+            roles = [Role(room_id=room.id, name=f'role{n}', mention_tag=f'role{n}', permissions_json='["manage_channels"]')
+                     for n in range(3)]
+            db.session.add_all(roles)
+            db.session.flush()
+            db.session.add(MemberRole(user_id=viewer.id, room_id=room.id, role_id=roles[0].id))
+            db.session.add_all(RoleMentionPermission(room_id=room.id, source_role_id=roles[0].id, target_role_id=t.id)
+                               for t in roles[1:])
+            for n in range(messages):
+                author = users[n % len(users)]
+                msg = Message(content=f'message {n}', user_id=author.id, channel_id=channels[0].id)
+                db.session.add(msg)
+                db.session.flush()
+                db.session.add_all(MessageReaction(message_id=msg.id, user_id=u.id, emoji='👍') for u in users[:3])
+            for u in users[::2]:
+                db.session.add(ReadMessage(user_id=u.id, channel_id=channels[0].id, last_read_message_id=msg.id - 1))
+            room_ids.append(room.id)
+            channel_ids.append(channels[0].id)
+
+        dm = Room(name=f'{prefix}-dm', type='dm', owner_id=viewer.id)
+        db.session.add(dm)
+        db.session.flush()
+        db.session.add_all([Member(user_id=viewer.id, room_id=dm.id), Member(user_id=users[1].id, room_id=dm.id)])
+        for u in users[1:]:
+            db.session.add(FriendRequest(from_user_id=u.id, to_user_id=viewer.id))
+        db.session.commit()
+        return viewer.id, room_ids[-1], channel_ids[-1]
+
+
+def _measure(scale):
+    # {endpoint: number of SQL statements} as the viewer of a freshly seeded dataset
+    app = _get_app()
+    viewer_id, room_id, channel_id = _seed(app, **scale)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(viewer_id)
+        session['_fresh'] = True
+
+    endpoints = [
+        ('rooms', '/api/v1/rooms'),
+        ('accessible channels', '/channels/accessible'),
+        ('room members', f'/api/v1/room/{room_id}/members'),
+        ('room roles', f'/api/v1/room/{room_id}/roles'),
+        ('channel messages', f'/api/v1/channel/{channel_id}/messages?limit=50'),
+        ('friend requests', '/api/v1/friends/requests'),
+        ('server search', f"/api/v1/search/servers?q={scale['prefix']}"),
+    ]
+    counts = {}
+    with app.app_context():
+        client.get('/api/v1/user/me')  # warm the user cache so it is not counted once
+        for name, path in endpoints:
+            with assert_max_queries(1000, path) as statements:
+                response = client.get(path)
+            assert response.status_code == 200, f"{path} -> {response.status_code}"
+            counts[name] = len(statements)
+
+        socket_client = socketio.test_client(app, flask_test_client=client)
+        socket_client.emit('join', {'channel_id': channel_id})
+        socket_client.get_received()
+        with assert_max_queries(1000, 'send_message') as statements:
+            socket_client.emit('send_message', {'channel_id': channel_id, 'room_id': room_id, 'msg': 'hello'})
+        assert not [e for e in socket_client.get_received() if e['name'] == 'error'], 'send_message was rejected'
+        counts['socket send_message'] = len(statements)
+        socket_client.disconnect()
+    return counts
+
+
+def test_query_counts_independent_of_data_size():
+    small = _measure(SMALL)
+    large = _measure(LARGE)
+    for name in small:
+        print(f"  {name}: {small[name]} statements (small), {large[name]} (large)")
+    assert small['socket send_message'] > 0, 'send_message handler did not run'
+    grown = {name: (small[name], large[name]) for name in small if large[name] > small[name]}
+    assert not grown, f"statement count grows with data size: {grown}"
+
+
+def test_budget_exceeded_raises_in_testing():
+    @query_budget(1)
+    def chatty_view():
+        return [User.query.count() for _ in range(3)]
+
+    with _get_app().test_request_context('/chatty'):
+        try:
+            chatty_view()
+        except QueryBudgetExceeded as e:
+            assert e.limit == 1 and e.used == 3, str(e)
+        else:
+            raise AssertionError('QueryBudgetExceeded was not raised')
+    assert chatty_view.query_budget == 1
+
+
+if __name__ == '__main__':
+    print("Testing query budgets...")
+    test_budget_exceeded_raises_in_testing()
+    test_query_counts_independent_of_data_size()
+    print("\nQuery budget tests passed.")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+# Wire serialization
+# Checks that the fast JSON provider and WirePacket produce the same documents
+# as the stdlib encoders, that WireManager delivers multi-room and pre-encoded
+# (RawJSON) broadcasts once per client and encodes nothing for empty rooms, and
+# that grouped message_notification payloads still carry each recipient's own
+# unread count. Also checks that the outbox coalesces receive_message bursts
+# into receive_messages frames for ?batch=1 clients, in order, while other
+# clients get the single events. Finally, checks that dumps() writes dates
+# the same way with and without orjson, and that a python-socketio without the
+# internals WireManager overrides gets the stock manager, with the outbox
+# emitting decoded single events.
+#
+#   python tools/test_serialization.py
+
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from flask import Flask
+from socketio import packet as sio_packet
+from app.extensions import db, socketio
+from app.functions import outbox, serialization
+from app.functions.outbox import enqueue_emit, dispatch_outbox_batch
+from app.functions.serialization import (
+    FastJSONProvider, RawJSON, WirePacket, PACKETS_ENCODED, fast_json_enabled, msgpack_enabled
+)
+from app.models import User, Room, Channel, Member, Message, ReadMessage
+
+
+def _get_app():
+    return get_app('serialization')
+
+
+def _login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def test_fast_json_matches_stdlib():
+    if not fast_json_enabled():
+        print('   - orjson not installed, skipped')
+        return
+    app = Flask('serialization-test')
+    stdlib, fast = app.json, FastJSONProvider(app)
+    doc = {
+        'text': 'привет 👍 "quoted" \\ </script>',
+        'when': datetime(2024, 5, 1, 12, 30, 15),
+        'amount': Decimal('12.50'),
+        'uid': uuid.UUID(int=7),
+        'nested': [{'b': 1, 'a': None}, [True, 1.5], {5: 'int key'}],
+    }
+    assert json.loads(fast.dumps(doc)) == json.loads(stdlib.dumps(doc))
+    # orjson has no 64-bit overflow path: stdlib json takes over
+    assert json.loads(fast.dumps({'huge': 1 << 70})) == {'huge': 1 << 70}
+    with app.app_context():
+        body = fast.response(doc).get_data()
+    assert json.loads(body) == json.loads(stdlib.dumps(doc))
+    assert fast.loads(b'{"a": [1, 2]}') == {'a': [1, 2]}
+    print('   ✓ FastJSONProvider output matches the stdlib provider')
+
+
+def test_wire_packet_matches_stdlib_packet():
+    cases = [
+        dict(data=['receive_message', {'msg': 'привет', 'n': [1, 2, None]}]),
+        dict(data=['ev', {'x': 1}], namespace='/admin', id=12),
+        dict(data=['upload', {'blob': b'\x00\x01'}]),
+        dict(packet_type=sio_packet.ACK, data=[{'ok': True}], id=3),
+    ]
+    for case in cases:
+        expected = sio_packet.Packet(**case).encode()
+        encoded = WirePacket(**case).encode()
+        if isinstance(expected, list):
+            assert isinstance(encoded, list) and encoded[1:] == expected[1:], case
+            expected, encoded = expected[0], encoded[0]
+        decoded = sio_packet.Packet(encoded_packet=encoded)
+        reference = sio_packet.Packet(encoded_packet=expected)
+        assert (decoded.packet_type, decoded.namespace, decoded.id, decoded.data) == \
+            (reference.packet_type, reference.namespace, reference.id, reference.data), case
+    if msgpack_enabled():
+        pkt = WirePacket(data=['ev', {'x': 'ü', 'b': b'\x01'}], namespace='/', id=4)
+        decoded = WirePacket(encoded_packet=pkt.encode_msgpack())
+        assert (decoded.packet_type, decoded.data, decoded.id) == (sio_packet.EVENT, ['ev', {'x': 'ü', 'b': b'\x01'}], 4)
+    print('   ✓ WirePacket decodes to the same packets as the stdlib packet class')
+
+
+def test_manager_broadcasts():
+    app = _get_app()
+    with app.app_context():
+        client = socketio.test_client(app)
+        sid = socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/')
+        socketio.server.enter_room(sid, 'a')
+        socketio.server.enter_room(sid, 'b')
+        client.get_received()
+
+        socketio.emit('multi', {'n': 1}, room=['a', 'b'])
+        received = client.get_received()
+        assert [e['name'] for e in received] == ['multi'], received
+
+        socketio.emit('raw', RawJSON('{"id":5,"msg":"привет"}'), room='a')
+        received = client.get_received()
+        assert received == [{'name': 'raw', 'args': [{'id': 5, 'msg': 'привет'}], 'namespace': '/'}], received
+
+        encoded = dict(PACKETS_ENCODED._values)
+        socketio.emit('nobody', {'n': 1}, room='user_999999')
+        assert PACKETS_ENCODED._values == encoded, PACKETS_ENCODED._values
+        client.disconnect()
+    print('   ✓ Multi-room and RawJSON broadcasts are delivered once; empty rooms encode nothing')
+
+
+def test_notifications_keep_per_user_unread_counts():
+    app = _get_app()
+    with app.app_context():
+        users = [User(username=f'notify{i}', password='x') for i in range(3)]
+        db.session.add_all(users)
+        db.session.flush()
+        room = Room(name='notify-room', type='server', owner_id=users[0].id, is_public=True)
+        db.session.add(room)
+        db.session.flush()
+        channel = Channel(name='general', room_id=room.id)
+        db.session.add(channel)
+        db.session.add_all(Member(user_id=u.id, room_id=room.id, role='owner' if i == 0 else 'member')
+                           for i, u in enumerate(users))
+        db.session.flush()
+        messages = [Message(content=f'm{n}', user_id=users[0].id, channel_id=channel.id) for n in range(4)]
+        db.session.add_all(messages)
+        db.session.flush()
+        # users[1] has read up to the second message; users[2] has never read the channel
+        db.session.add(ReadMessage(user_id=users[1].id, channel_id=channel.id, last_read_message_id=messages[1].id))
+        db.session.commit()
+        ids = [u.id for u in users]
+        room_id, channel_id = room.id, channel.id
+
+    clients = []
+    for uid in ids:
+        http = app.test_client()
+        _login(http, uid)
+        clients.append(socketio.test_client(app, flask_test_client=http))
+    for c in clients:
+        c.get_received()
+    clients[0].emit('send_message', {'channel_id': channel_id, 'room_id': room_id, 'msg': 'hello'})
+    unread = {}
+    for uid, c in zip(ids[1:], clients[1:]):
+        notes = [e['args'][0] for e in c.get_received() if e['name'] == 'message_notification']
+        assert len(notes) == 1, notes
+        unread[uid] = notes[0]['unread_count']
+    assert unread == {ids[1]: 3, ids[2]: 5}, unread
+    for c in clients:
+        c.disconnect()
+    print('   ✓ Grouped message_notification payloads keep per-user unread counts')
+
+
+def test_outbox_batches_receive_messages():
+    app = _get_app()
+    with app.app_context():
+        while dispatch_outbox_batch():  # events left by earlier tests
+            pass
+        batched = socketio.test_client(app, query_string='batch=1')
+        single = socketio.test_client(app)
+        for client in (batched, single):
+            socketio.server.enter_room(socketio.server.manager.sid_from_eio_sid(client.eio_sid, '/'), 'burst')
+            client.get_received()
+
+        for n in (1, 2, 3):
+            enqueue_emit('receive_message', {'id': n, 'msg': f'm{n}'}, room='burst')
+        enqueue_emit('message_edited', {'message_id': 3, 'content': 'm3!'}, room='burst')
+        enqueue_emit('receive_message', {'id': 4, 'msg': 'm4'}, room='burst')
+        db.session.commit()
+        assert dispatch_outbox_batch() == 5
+
+        frames = [(e['name'], e['args'][0]) for e in batched.get_received()]
+        assert frames == [
+            ('receive_messages', {'messages': [{'id': 1, 'msg': 'm1'}, {'id': 2, 'msg': 'm2'}, {'id': 3, 'msg': 'm3'}]}),
+            ('message_edited', {'message_id': 3, 'content': 'm3!'}),
+            ('receive_message', {'id': 4, 'msg': 'm4'}),
+        ], frames
+        events = [(e['name'], e['args'][0].get('id')) for e in single.get_received()]
+        assert events == [('receive_message', 1), ('receive_message', 2), ('receive_message', 3),
+                          ('message_edited', None), ('receive_message', 4)], events
+        batched.disconnect()
+        single.disconnect()
+    print('   ✓ Outbox coalesces receive_message bursts for ?batch=1 clients, in order')
+
+
+def test_dumps_writes_dates_the_same_without_orjson():
+    when = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    doc = {'when': when, 'utc': when.replace(tzinfo=timezone.utc), 'day': when.date(), 'at': when.time(),
+           'whole': when.replace(microsecond=0), 'uid': uuid.UUID(int=7), 'amount': Decimal('12.50')}
+    with mock.patch.object(serialization, 'orjson', None):
+        stdlib = serialization.dumps(doc)
+    assert json.loads(stdlib)['when'] == '2024-05-01T12:30:15.250000', stdlib
+    if fast_json_enabled():
+        assert serialization.dumps(doc) == stdlib
+    print('   ✓ dumps() writes dates as ISO 8601 with and without orjson')
+
+
+def test_stock_socketio_fallback():
+    with mock.patch.object(socketio.server.__class__, '_send_eio_packet', None):
+        assert not serialization.wire_manager_supported()
+        assert serialization.init_app(Flask('fallback-test')) == {}
+    assert serialization.wire_manager_supported()
+
+    app = _get_app()
+    with app.app_context(), mock.patch.object(outbox, 'wire_manager_active', lambda: False):
+        while dispatch_outbox_batch():
+            pass
+        batched = socketio.test_client(app, query_string='batch=1')
+        socketio.server.enter_room(socketio.server.manager.sid_from_eio_sid(batched.eio_sid, '/'), 'stock')
+        batched.get_received()
+        for n in (1, 2):
+            enqueue_emit('receive_message', {'id': n}, room='stock')
+        db.session.commit()
+        with mock.patch.object(socketio, 'emit', wraps=socketio.emit) as emit:
+            assert dispatch_outbox_batch() == 2
+        assert [c.args[1] for c in emit.call_args_list] == [{'id': 1}, {'id': 2}]  # plain values, no batch
+        assert [(e['name'], e['args'][0]) for e in batched.get_received()] == \
+            [('receive_message', {'id': 1}), ('receive_message', {'id': 2})]
+        batched.disconnect()
+    print('   ✓ Without the socketio internals the stock manager gets plain single events')
+
+
+if __name__ == '__main__':
+    print("Testing wire serialization...")
+    test_fast_json_matches_stdlib()
+    test_wire_packet_matches_stdlib_packet()
+    test_manager_broadcasts()
+    test_notifications_keep_per_user_unread_counts()
+    test_outbox_batches_receive_messages()
+    test_dumps_writes_dates_the_same_without_orjson()
+    test_stock_socketio_fallback()
+    print("\nAll serialization tests passed.")
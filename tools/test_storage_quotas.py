@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+# Storage quotas and usage counters
+# Uploads files as a user (optionally charged to a room as well) and checks
+# that the storage_usage counters follow each upload and removal, that an
+# upload over the user or room quota is refused with 413 before it is charged
+# or left on disk, and that removing a file credits exactly its owners back.
+# Also checks that charging is atomic: two uploads that both passed the
+# advisory check cannot both be charged past the quota, a refused room charge
+# leaves the user's counter untouched, and a first charge for an owner does not
+# collide with a counter row created by another request. Finally, that
+# deleting a message credits its attachment back once no forwarded copy uses
+# it, and that room and account deletions settle the owner's stored_file rows
+# and drop its counter.
+#
+#   python tools/test_storage_quotas.py
+
+import io
+import os
+import sys
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import config
+from testapp import TMP_DIR, get_app
+from app.extensions import db
+from app.functions import storage, jobs
+from app.functions.purges import start_room_deletion, start_account_deletion
+from app.functions.storage import OWNER_USER, OWNER_ROOM
+from app.models import User, Room, Member, Channel, Message, StorageUsage, StoredFile
+
+
+def _get_app():
+    return get_app('quotas', UPLOAD_FOLDER=os.path.join(TMP_DIR.name, 'uploads'))
+
+
+def _login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def _usage(owner_type, owner_id):
+    row = StorageUsage.query.filter_by(owner_type=owner_type, owner_id=owner_id).first()
+    return (int(row.bytes_used), int(row.file_count)) if row else (0, 0)
+
+
+def _upload(client, size, name='notes.txt', room_id=None):
+    url = '/upload_file' + (f'?room_id={room_id}' if room_id else '')
+    return client.post(url, data={'file': (io.BytesIO(b'x' * size), name)}, content_type='multipart/form-data')
+
+
+def _seed():
+    app = _get_app()
+    with app.app_context():
+        user = User(username='quota-user', password='x')
+        room = Room(name='quota-room', type='server')
+        db.session.add_all([user, room])
+        db.session.flush()
+        db.session.add(Member(user_id=user.id, room_id=room.id, role='owner'))
+        db.session.commit()
+        return user.id, room.id
+
+
+def test_counters_follow_uploads_and_removals():
+    app = _get_app()
+    user_id, room_id = _seed()
+    client = app.test_client()
+    _login(client, user_id)
+
+    assert _upload(client, 1000).status_code == 200
+    assert _upload(client, 500, room_id=room_id).status_code == 200
+    with app.app_context():
+        assert _usage(OWNER_USER, user_id) == (1500, 2)
+        assert _usage(OWNER_ROOM, room_id) == (500, 1)
+
+    # The avatar is charged like any upload and credited back when it is deleted
+    response = client.post('/api/v1/user/avatar', data={'avatar': (io.BytesIO(b'y' * 300), 'me.txt')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    avatar_url = response.get_json()['avatar_url']
+    with app.app_context():
+        assert _usage(OWNER_USER, user_id) == (1800, 3)
+    assert client.post('/user/avatar/delete').status_code == 200
+    with app.app_context():
+        assert _usage(OWNER_USER, user_id) == (1500, 2)
+        assert _usage(OWNER_ROOM, room_id) == (500, 1)
+        assert StoredFile.query.filter_by(url=avatar_url).first() is None
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], avatar_url[len('/uploads/'):]))
+    print('   ✓ Usage counters follow uploads and removals')
+
+
+def test_uploads_over_quota_are_refused():
+    app = _get_app()
+    with app.app_context():
+        user_id = User.query.filter_by(username='quota-user').first().id
+        room_id = Room.query.filter_by(name='quota-room').first().id
+    client = app.test_client()
+    _login(client, user_id)
+    files_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'files')
+    saved = sorted(os.listdir(files_dir))
+
+    with mock.patch.object(storage, 'STORAGE_QUOTA_USER_BYTES', 2000), \
+            mock.patch.object(storage, 'STORAGE_QUOTA_ROOM_BYTES', 700):
+        with app.app_context():
+            assert storage.remaining_quota_bytes(user_id) == 500
+            assert storage.remaining_quota_bytes(user_id, room_id) == 200
+        response = _upload(client, 600)
+        assert response.status_code == 413 and response.get_json() == {'error': 'storage quota exceeded'}
+        response = _upload(client, 300, room_id=room_id)
+        assert response.status_code == 413 and response.get_json() == {'error': 'room storage quota exceeded'}
+        assert _upload(client, 200, room_id=room_id).status_code == 200  # fills the room exactly
+    with app.app_context():
+        assert _usage(OWNER_USER, user_id) == (1700, 3)
+        assert _usage(OWNER_ROOM, room_id) == (700, 2)
+    assert len(os.listdir(files_dir)) == len(saved) + 1  # refused uploads left nothing behind
+    print('   ✓ Uploads over the user or room quota are refused and not charged')
+
+
+def test_charges_are_conditional():
+    app = _get_app()
+    with app.app_context(), \
+            mock.patch.object(storage, 'STORAGE_QUOTA_USER_BYTES', 2000), \
+            mock.patch.object(storage, 'STORAGE_QUOTA_ROOM_BYTES', 500):
+        user = User(username='race-user', password='x')
+        room = Room(name='race-room', type='server')
+        db.session.add_all([user, room])
+        db.session.commit()
+        user_id, room_id = user.id, room.id
+
+        # Both requests read the counter before either charged it
+        assert storage.check_upload_quota(user_id, None, 1200) == (True, '')
+        assert storage.check_upload_quota(user_id, None, 1200) == (True, '')
+        assert storage.charge_upload('/uploads/files/race-1.bin', 1200, user_id) == (True, '')
+        assert storage.charge_upload('/uploads/files/race-2.bin', 1200, user_id) == (False, 'storage quota exceeded')
+        db.session.commit()
+        assert _usage(OWNER_USER, user_id) == (1200, 1)
+        assert StoredFile.query.filter_by(url='/uploads/files/race-2.bin').first() is None
+
+        # The user's share is not kept when the room refuses the upload
+        ok, error = storage.charge_upload('/uploads/files/race-3.bin', 400, user_id, room_id)
+        assert ok and _usage(OWNER_ROOM, room_id) == (400, 1)
+        ok, error = storage.charge_upload('/uploads/files/race-4.bin', 200, user_id, room_id)
+        assert (ok, error) == (False, 'room storage quota exceeded')
+        db.session.commit()
+        assert _usage(OWNER_USER, user_id) == (1600, 2) and _usage(OWNER_ROOM, room_id) == (400, 1)
+
+        # Another request created the counter row first: no unique constraint error
+        other_id = user_id + 1000
+        db.session.add(StorageUsage(owner_type=OWNER_USER, owner_id=other_id, bytes_used=0, file_count=0))
+        db.session.commit()
+        assert storage.charge_upload('/uploads/files/race-5.bin', 10, other_id) == (True, '')
+        db.session.commit()
+        assert _usage(OWNER_USER, other_id) == (10, 1)
+        assert StorageUsage.query.filter_by(owner_type=OWNER_USER, owner_id=other_id).count() == 1
+    print('   ✓ Charges are conditional updates: no overshoot, no partial charge, no counter collision')
+
+
+def _run_started_jobs(app, started):
+    for job_id in started:
+        jobs._run_job(app, job_id)
+    del started[:]
+
+
+def test_deletions_release_storage():
+    app = _get_app()
+    with app.app_context():
+        user = User(username='deleting-user', password='x')
+        friend = User(username='deleting-friend', password='x')
+        room = Room(name='deleting-room', type='server')
+        db.session.add_all([user, friend, room])
+        db.session.flush()
+        db.session.add(Member(user_id=user.id, room_id=room.id, role='owner'))
+        db.session.add(Member(user_id=friend.id, room_id=room.id, role='member'))
+        channel = Channel(name='general', room_id=room.id)
+        db.session.add(channel)
+        db.session.commit()
+        user_id, friend_id, room_id, channel_id = user.id, friend.id, room.id, channel.id
+
+    client = app.test_client()
+    _login(client, user_id)
+    attachment = _upload(client, 400, room_id=room_id).get_json()['url']
+    kept = _upload(client, 100).get_json()['url']
+    friend_client = app.test_client()
+    _login(friend_client, friend_id)
+    room_file = _upload(friend_client, 50, room_id=room_id).get_json()['url']
+    with app.app_context():
+        original = Message(content='file', user_id=user_id, channel_id=channel_id, file_url=attachment)
+        forwarded = Message(content='file', user_id=friend_id, channel_id=channel_id, file_url=attachment)
+        keeper = Message(content='file', user_id=user_id, channel_id=channel_id, file_url=room_file)
+        db.session.add_all([original, forwarded, keeper])
+        db.session.commit()
+        original_id, forwarded_id = original.id, forwarded.id
+        assert _usage(OWNER_USER, user_id) == (500, 2) and _usage(OWNER_ROOM, room_id) == (450, 2)
+
+    # The forwarded copy still uses the file: nothing is credited yet
+    assert client.post(f'/message/{original_id}/delete').status_code == 200
+    with app.app_context():
+        assert _usage(OWNER_USER, user_id) == (500, 2)
+    assert client.post(f'/message/{forwarded_id}/delete').status_code == 200
+    with app.app_context():
+        assert _usage(OWNER_USER, user_id) == (100, 1) and _usage(OWNER_ROOM, room_id) == (50, 1)
+        assert StoredFile.query.filter_by(url=attachment).first() is None
+
+    started = []
+    with mock.patch.object(jobs, '_start', started.append), \
+            mock.patch.object(jobs, 'JOB_CHUNK_PAUSE_SECONDS', 0):
+        with app.app_context():
+            start_room_deletion(db.session.get(Room, room_id))
+        _run_started_jobs(app, started)
+        with app.app_context():
+            assert StoredFile.query.filter_by(room_id=room_id).count() == 0
+            assert StorageUsage.query.filter_by(owner_type=OWNER_ROOM, owner_id=room_id).count() == 0
+            assert _usage(OWNER_USER, friend_id) == (0, 0)  # its only file went with the room's messages
+            assert _usage(OWNER_USER, user_id) == (100, 1)
+
+            start_account_deletion(db.session.get(User, user_id))
+        _run_started_jobs(app, started)
+        with app.app_context():
+            assert StoredFile.query.filter_by(url=kept).first() is None
+            assert StoredFile.query.filter_by(user_id=user_id).count() == 0
+            assert StorageUsage.query.filter_by(owner_type=OWNER_USER, owner_id=user_id).count() == 0
+    print('   ✓ Message, room and account deletions credit storage back and drop the counters')
+
+
+if __name__ == '__main__':
+    print("Testing storage quotas...")
+    test_counters_follow_uploads_and_removals()
+    test_uploads_over_quota_are_refused()
+    test_charges_are_conditional()
+    test_deletions_release_storage()
+    print("\nAll storage quota tests passed.")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Socket.IO transports and WebSocket compression
+# Checks that permessage-deflate negotiation caps the window bits, that
+# messages under SOCKET_COMPRESSION_THRESHOLD go out uncompressed (RSV1 clear)
+# while larger ones are compressed and still decode with a client-side
+# inflater across messages, that the zlib state estimates used for connection
+# memory accounting are close to what zlib actually allocates, and that each
+# transport policy maps to the right Engine.IO options.
+#
+#   python tools/test_transports.py
+
+import os
+import sys
+import tracemalloc
+import zlib
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app.functions import transports
+from app.functions.transports import (
+    TunedWebSocket, TunedWebSocketWSGI, deflate_state_bytes, inflate_state_bytes, server_options
+)
+
+
+class _FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+
+def _negotiate(offer):
+    wsgi = TunedWebSocketWSGI(lambda ws: None, mock.Mock(max_http_buffer_size=1_000_000))
+    return wsgi._negotiate_permessage_deflate(wsgi._parse_extension_header(offer))
+
+
+def _websocket(extensions):
+    return TunedWebSocket(_FakeSocket(), {}, extensions=extensions)
+
+
+def test_negotiation_caps_window_bits():
+    limit = transports.deflate_window_bits()
+    accepted = _negotiate('permessage-deflate; client_max_window_bits')
+    assert accepted['server_max_window_bits'] == limit, accepted
+    assert accepted['client_max_window_bits'] == limit, accepted
+    # A client that cannot take a client_max_window_bits answer does not get one
+    accepted = _negotiate('permessage-deflate')
+    assert accepted['server_max_window_bits'] == limit and 'client_max_window_bits' not in accepted, accepted
+    # A smaller window asked for by the client is kept
+    accepted = _negotiate('permessage-deflate; server_max_window_bits=9')
+    assert accepted['server_max_window_bits'] == 9, accepted
+    with mock.patch.object(transports, 'SOCKET_COMPRESSION', False):
+        assert _negotiate('permessage-deflate; client_max_window_bits') is None
+    print('   ✓ permessage-deflate negotiation caps the window bits')
+
+
+def test_threshold_and_round_trip():
+    window = transports.deflate_window_bits()
+    ws = _websocket({'permessage-deflate': {'server_max_window_bits': window, 'client_max_window_bits': window}})
+    inflater = zlib.decompressobj(-window)
+    small = '42["typing",{"user_id":7}]'
+    large = '42["receive_message",' + '{"msg":"' + 'привет hello ' * 80 + '"}]'
+    with mock.patch.object(transports, 'SOCKET_COMPRESSION_THRESHOLD', 256):
+        for message in (small, large, large, small):
+            frame = ws._pack_message(message)
+            compressed = bool(frame[0] & 0x40)
+            assert compressed == (len(message.encode()) >= 256), (message[:20], compressed)
+            payload = frame[2 + {126: 2, 127: 8}.get(frame[1] & 0x7f, 0):]
+            if compressed:
+                payload = inflater.decompress(payload + b'\x00\x00\xff\xff')
+            assert payload.decode() == message
+    assert len(ws._pack_message(large)) < len(large.encode()) // 4
+    usage = ws.memory_bytes()
+    assert usage == {'deflate': deflate_state_bytes(window, transports.deflate_mem_level())}, usage
+    assert _websocket({}).memory_bytes() == {}
+    print('   ✓ Small messages skip deflate; large ones compress and inflate across messages')
+
+
+def test_memory_estimates_match_zlib():
+    keep = []  # freeing an earlier pair would show up as a negative allocation
+    tracemalloc.start()
+    try:
+        for window_bits, mem_level in ((15, 8), (12, 5), (9, 1)):
+            before = tracemalloc.get_traced_memory()[0]
+            deflater = zlib.compressobj(6, zlib.DEFLATED, -window_bits, mem_level)
+            data = deflater.compress(b'x' * 100) + deflater.flush(zlib.Z_SYNC_FLUSH)
+            keep.append(deflater)
+            deflated = tracemalloc.get_traced_memory()[0]
+            inflater = zlib.decompressobj(-window_bits)
+            inflater.decompress(data)
+            keep.append(inflater)
+            inflated = tracemalloc.get_traced_memory()[0]
+            for measured, estimate in ((deflated - before, deflate_state_bytes(window_bits, mem_level)),
+                                       (inflated - deflated, inflate_state_bytes(window_bits))):
+                assert abs(measured - estimate) <= 1024 + estimate // 20, (window_bits, mem_level, measured, estimate)
+    finally:
+        tracemalloc.stop()
+    assert deflate_state_bytes(12, 5) * 5 < deflate_state_bytes(15, 8)
+    print('   ✓ zlib state estimates match measured allocations')
+
+
+def test_policy_server_options():
+    expected = {'any': ['polling', 'websocket'], 'upgrade': ['polling', 'websocket'], 'websocket': ['websocket'],
+                'bogus': ['polling', 'websocket']}
+    for policy, transport_list in expected.items():
+        with mock.patch.object(transports, 'SOCKET_TRANSPORT_POLICY', policy):
+            options = server_options()
+        assert options['transports'] == transport_list, (policy, options)
+    print('   ✓ Transport policies map to Engine.IO transports')
+
+
+if __name__ == '__main__':
+    print("Testing socket transports...")
+    test_negotiation_caps_window_bits()
+    test_threshold_and_round_trip()
+    test_memory_estimates_match_zlib()
+    test_policy_server_options()
+    print("\nAll transport tests passed.")
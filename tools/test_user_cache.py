@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Flask-Login identity cache
+# Checks that a cached user is served without touching the database, that
+# reading the password or writing through the proxy loads the real row, and
+# that any ORM update or delete of a User (including one made through the
+# proxy, and a soft delete) drops the snapshot so the next request sees the
+# change. Also checks that /api/v1/auth/session reflects a rename at once, and
+# that a full cache drops its least recently used snapshots.
+#
+#   python tools/test_user_cache.py
+
+import os
+import sys
+from datetime import datetime
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from testapp import get_app
+from app.extensions import db
+from app.functions import assert_max_queries, user_cache
+from app.functions.user_cache import CachedUser, load_cached_user, invalidate_cached_user, get_user_cache_stats
+from app.models import User
+
+
+def _get_app():
+    return get_app('user_cache')
+
+
+def _new_user(username):
+    user = User(username=username, password='stored-hash', presence_status='offline')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def test_hits_and_lazy_row():
+    app = _get_app()
+    with app.app_context():
+        user_id = _new_user('cache-user')
+        invalidate_cached_user(user_id)
+        db.session.remove()
+
+        misses = get_user_cache_stats()['misses']
+        first = load_cached_user(user_id)
+        assert isinstance(first, CachedUser) and get_user_cache_stats()['misses'] == misses + 1
+        with assert_max_queries(0) as statements:
+            second = load_cached_user(str(user_id))
+            assert second.username == 'cache-user' and second.get_id() == str(user_id)
+        assert statements == []
+        assert load_cached_user('not-a-number') is None and load_cached_user(999999) is None
+
+        with assert_max_queries(1):
+            assert second.password == 'stored-hash'  # never cached: loads the row once
+        assert second.presence_status == 'offline'
+    print('   ✓ Cached users are served without a query; the password loads the row')
+
+
+def test_updates_and_deletes_drop_the_snapshot():
+    app = _get_app()
+    with app.app_context():
+        user_id = User.query.filter_by(username='cache-user').one().id
+        load_cached_user(user_id)
+
+        # An ORM update anywhere drops the snapshot
+        db.session.get(User, user_id).presence_status = 'away'
+        db.session.commit()
+        db.session.remove()
+        assert load_cached_user(user_id).presence_status == 'away'
+
+        # So does a write through the proxy, the way handlers assign to current_user
+        proxy = load_cached_user(user_id)
+        proxy.presence_status = 'online'
+        db.session.commit()
+        db.session.remove()
+        assert load_cached_user(user_id).presence_status == 'online'
+
+        # A rolled-back change leaves the (still correct) snapshot alone
+        db.session.get(User, user_id).presence_status = 'hidden'
+        db.session.flush()
+        db.session.rollback()
+        db.session.remove()
+        assert load_cached_user(user_id).presence_status == 'online'
+
+        # Soft and hard deletes: the user can no longer be loaded
+        load_cached_user(user_id)
+        db.session.get(User, user_id).deleted_at = datetime.utcnow()
+        db.session.commit()
+        assert load_cached_user(user_id) is None
+
+        other_id = _new_user('cache-user-2')
+        assert load_cached_user(other_id) is not None
+        db.session.delete(db.session.get(User, other_id))
+        db.session.commit()
+        assert load_cached_user(other_id) is None
+    print('   ✓ Updates, proxy writes and deletes drop the cached snapshot')
+
+
+def test_session_endpoint_sees_a_rename():
+    app = _get_app()
+    with app.app_context():
+        user_id = _new_user('before-rename')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    assert client.get('/api/v1/auth/session').get_json()['user']['username'] == 'before-rename'
+    with app.app_context():
+        db.session.get(User, user_id).username = 'after-rename'
+        db.session.commit()
+    assert client.get('/api/v1/auth/session').get_json()['user']['username'] == 'after-rename'
+    print('   ✓ The next request sees a committed rename')
+
+
+def test_full_cache_drops_the_least_recently_used():
+    app = _get_app()
+    with app.app_context(), mock.patch.object(user_cache, 'MAX_CACHED_USERS', 3):
+        user_ids = [_new_user(f'lru-user-{n}') for n in range(5)]
+        user_cache._cache.clear()
+        for user_id in user_ids[:3]:
+            load_cached_user(user_id)
+        load_cached_user(user_ids[0])  # a hit: now the most recently used
+        load_cached_user(user_ids[3])
+        load_cached_user(user_ids[4])
+        assert list(user_cache._cache) == [user_ids[0], user_ids[3], user_ids[4]]
+        assert get_user_cache_stats()['size'] == 3
+    print('   ✓ A full cache stays at its cap by dropping the least recently used')
+
+
+if __name__ == '__main__':
+    print("Testing the user identity cache...")
+    test_hits_and_lazy_row()
+    test_updates_and_deletes_drop_the_snapshot()
+    test_session_endpoint_sees_a_rename()
+    test_full_cache_drops_the_least_recently_used()
+    print("\nAll user cache tests passed.")
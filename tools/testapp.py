@@ -0,0 +1,35 @@
+# Shared app factory for the tools/test_*.py scripts
+#
+#   from testapp import TMP_DIR, get_app
+#
+# Each script builds one app on a throwaway SQLite database (and whatever
+# other config it overrides) under TMP_DIR, which is removed at exit.
+
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import config
+from app import create_app
+
+TMP_DIR = tempfile.TemporaryDirectory()
+_app = None
+
+
+def get_app(name, **overrides):
+    # One app per process: Socket.IO handlers are only bound to the first app created
+    global _app
+    if _app is None:
+        values = {k: getattr(config, k) for k in dir(config) if k.isupper()}
+        db_path = os.path.join(TMP_DIR.name, f'{name}.db')
+        values['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path.replace('\\', '/')
+        values['SECRET_KEY'] = f'{name}-test'
+        values['TESTING'] = True
+        values.update(overrides)
+        _app = create_app(config=SimpleNamespace(**values))
+    return _app
@@ -0,0 +1,126 @@
+"""Reclaim files under uploads/ that are no longer referenced by the database.
+
+The GC scans the upload tree in bounded batches and persists its cursor, so it
+can be run from cron or left running with --loop.
+
+Usage:
+  python tools/upload_gc.py --dry-run
+  python tools/upload_gc.py --batch-size 200 --max-batches 10
+  python tools/upload_gc.py --loop --interval 30
+  python tools/upload_gc.py --db ./instance/thecomboxmsgr.db --uploads ./uploads
+"""
+
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import config as app_config
+from app import create_app
+
+
+def _sqlite_uri_from_path(db_path: str) -> str:
+    abs_db = os.path.abspath(db_path).replace('\\', '/')
+    # Windows absolute path: C:/...
+    if len(abs_db) > 2 and abs_db[1] == ':':
+        return f"sqlite:///{abs_db}"
+    # POSIX absolute path: /...
+    return f"sqlite:////{abs_db.lstrip('/')}"
+
+
+def _build_config(db_path):
+    values = {k: getattr(app_config, k) for k in dir(app_config) if k.isupper()}
+    if db_path:
+        values['SQLALCHEMY_DATABASE_URI'] = _sqlite_uri_from_path(db_path)
+    return SimpleNamespace(**values)
+
+
+def _format_bytes(n: int) -> str:
+    value = float(n)
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024 or unit == 'GiB':
+            return f"{value:.1f} {unit}" if unit != 'B' else f"{int(value)} B"
+        value /= 1024
+    return f"{n} B"
+
+
+def _dry_run(upload_folder, batch_size, min_age):
+    # Walk the whole tree with an in-memory cursor; persisted state is untouched
+    from app.functions.uploads_gc import run_gc_batch
+
+    cursor = ''
+    scanned = 0
+    orphaned = 0
+    orphaned_bytes = 0
+    while True:
+        report = run_gc_batch(upload_folder, batch_size=batch_size, dry_run=True,
+                              min_age_seconds=min_age, cursor=cursor)
+        scanned += report['scanned']
+        for item in report['orphaned']:
+            orphaned += 1
+            orphaned_bytes += item['bytes']
+            print(f"[UPLOAD GC] orphan {item['url']} ({_format_bytes(item['bytes'])})")
+        cursor = report['next_cursor']
+        if report['pass_completed']:
+            break
+    print(f"[UPLOAD GC] dry run: scanned {scanned} files, "
+          f"{orphaned} orphaned, {_format_bytes(orphaned_bytes)} reclaimable")
+
+
+def _collect(upload_folder, batch_size, min_age, max_batches, loop, interval):
+    from app.functions.uploads_gc import run_gc_batch, get_gc_stats
+
+    batches = 0
+    while True:
+        started = time.perf_counter()
+        report = run_gc_batch(upload_folder, batch_size=batch_size, dry_run=False,
+                              min_age_seconds=min_age)
+        batches += 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"[UPLOAD GC] batch {batches}: scanned {report['scanned']}, "
+              f"reclaimed {report['reclaimed_files']} files / {_format_bytes(report['reclaimed_bytes'])} "
+              f"in {elapsed_ms:.0f} ms (cursor: {report['next_cursor'] or '<end>'})")
+        if max_batches and batches >= max_batches:
+            break
+        if report['pass_completed']:
+            if not loop:
+                break
+            time.sleep(interval)
+        elif loop:
+            # Yield between batches so a continuous run never monopolises the DB
+            time.sleep(min(interval, 1.0))
+
+    stats = get_gc_stats()
+    print(f"[UPLOAD GC] totals: {stats['files_reclaimed']} files, "
+          f"{_format_bytes(stats['bytes_reclaimed'])} reclaimed over {stats['passes_completed']} full passes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reclaim orphaned BoxChat uploads.')
+    parser.add_argument('--db', help='Path to sqlite DB file')
+    parser.add_argument('--uploads', help='Path to uploads folder (default: <project>/uploads)')
+    parser.add_argument('--dry-run', action='store_true', help='Report orphans without deleting anything')
+    parser.add_argument('--batch-size', type=int, default=app_config.UPLOAD_GC_BATCH_SIZE)
+    parser.add_argument('--min-age', type=int, default=app_config.UPLOAD_GC_MIN_AGE_SECONDS,
+                        help='Skip files modified less than this many seconds ago')
+    parser.add_argument('--max-batches', type=int, default=0, help='Stop after N batches (0 = until end of pass)')
+    parser.add_argument('--loop', action='store_true', help='Keep running, starting a new pass after each one')
+    parser.add_argument('--interval', type=float, default=60.0, help='Seconds to sleep between passes with --loop')
+    args = parser.parse_args()
+
+    upload_folder = os.path.abspath(args.uploads or os.path.join(ROOT_DIR, 'uploads'))
+    app = create_app(config=_build_config(args.db), init_db=False)
+    with app.app_context():
+        if args.dry_run:
+            _dry_run(upload_folder, args.batch_size, args.min_age)
+        else:
+            _collect(upload_folder, args.batch_size, args.min_age, args.max_batches, args.loop, args.interval)
+
+
+if __name__ == '__main__':
+    main()